@@ -0,0 +1,144 @@
+"""
+AIMD 自适应并发限制：按模型各一个，放在 describe_image 发请求处，所有 vision 路由都经过它。
+
+智谱各模型（glm-4.6v 资源包 / glm-4v-flash 免费）实际可承受的并发随时段变化，静态的
+VISION_LLM_MAX_CONCURRENT 要么用不满、要么被限流。这里：
+  - 健康（成功且延迟不超过目标）时每攒够「当前上限」次成功就 +1（加性增）
+  - 遇到 429 / 5xx / 超时 / 延迟尖刺就乘以 backoff 系数（乘性减），冷却期内只减一次
+  - 上限始终夹在 [floor, ceiling] 之间
+"""
+import os
+import threading
+import time
+
+OK = 'ok'
+THROTTLED = 'throttled'  # 429 / 5xx / 超时：需要退让
+ERROR = 'error'          # 其它失败（参数错误、网络错误等）：不调整上限，只计数
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, initial, floor, ceiling, latency_target, backoff=0.7, cooldown=5.0):
+        """
+        :param initial: 初始并发上限
+        :param floor: 下限（退让不会低于它）
+        :param ceiling: 上限（增长不会超过它）
+        :param latency_target: 单次调用的健康延迟（秒），超过 1.5 倍视为尖刺并退让
+        :param backoff: 退让时上限乘的系数
+        :param cooldown: 两次退让的最短间隔（秒），避免同一波失败把上限压到底
+        """
+        self.name = name
+        self.floor = max(1, int(floor))
+        self.ceiling = max(self.floor, int(ceiling))
+        self.latency_target = float(latency_target)
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self._limit = float(min(self.ceiling, max(self.floor, initial)))
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._latency_ewma = None
+        self._counts = {OK: 0, THROTTLED: 0, ERROR: 0}
+        self._increases = 0
+        self._decreases = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, timeout):
+        """等到在途数低于当前上限后占一个名额；timeout 秒内等不到返回 False。"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    def release(self, outcome, latency):
+        """归还名额并按本次结果调整上限。latency 单位秒。"""
+        with self._cond:
+            self._in_flight -= 1
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+            if latency is not None:
+                self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            spike = latency is not None and latency > self.latency_target * 1.5
+            if outcome == THROTTLED or (outcome == OK and spike):
+                self._decrease()
+            elif outcome == OK and latency is not None and latency <= self.latency_target:
+                self._successes += 1
+                if self._successes >= int(self._limit):
+                    self._successes = 0
+                    if self._limit < self.ceiling:
+                        self._limit = min(self.ceiling, self._limit + 1)
+                        self._increases += 1
+            self._cond.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        self._successes = 0
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        new_limit = max(self.floor, int(self._limit * self.backoff))
+        if new_limit < self._limit:
+            self._limit = float(new_limit)
+            self._decreases += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': int(self._limit),
+                'floor': self.floor,
+                'ceiling': self.ceiling,
+                'in_flight': self._in_flight,
+                'latency_target_seconds': self.latency_target,
+                'latency_ewma_seconds': round(self._latency_ewma, 3) if self._latency_ewma is not None else None,
+                'ok': self._counts[OK],
+                'throttled': self._counts[THROTTLED],
+                'error': self._counts[ERROR],
+                'increases': self._increases,
+                'decreases': self._decreases,
+            }
+
+
+def _model_env(name, model, default):
+    """先读模型专属配置（如 VISION_AIMD_CEILING_GLM_4_6V），再读通用配置，最后用默认值。"""
+    suffix = ''.join(c if c.isalnum() else '_' for c in model).upper()
+    return os.getenv(f"{name}_{suffix}") or os.getenv(name) or default
+
+
+class LimiterRegistry:
+    """按模型名懒创建 AdaptiveLimiter。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def get(self, model):
+        lim = self._limiters.get(model)
+        if lim is not None:
+            return lim
+        with self._lock:
+            lim = self._limiters.get(model)
+            if lim is None:
+                floor = int(_model_env('VISION_AIMD_FLOOR', model, '1'))
+                ceiling = int(_model_env('VISION_AIMD_CEILING', model, '10'))
+                lim = AdaptiveLimiter(
+                    model,
+                    initial=int(_model_env('VISION_AIMD_INITIAL', model, str(max(floor, ceiling // 2)))),
+                    floor=floor,
+                    ceiling=ceiling,
+                    latency_target=float(_model_env('VISION_AIMD_LATENCY_TARGET', model, '30')),
+                    backoff=float(_model_env('VISION_AIMD_BACKOFF', model, '0.7')),
+                )
+                self._limiters[model] = lim
+            return lim
+
+    def stats(self):
+        with self._lock:
+            items = list(self._limiters.items())
+        return {model: lim.stats() for model, lim in items}
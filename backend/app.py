@@ -1,7 +1,7 @@
 """
 商品检查和修正系统 - Flask后端
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, has_request_context, stream_with_context
 from flask_cors import CORS
 import pymysql
 import json
@@ -11,10 +11,39 @@ from datetime import datetime
 import os
 import re
 import time
+import tempfile
 import threading
 import logging
 from dotenv import load_dotenv
 import copy
+import hmac
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from contextlib import contextmanager
+from reason_log import NegativeReasonLog
+from db_pool import ConnectionPool
+from query_stats import QueryStats
+from sampling_profiler import ProfilerBusy, SamplingProfiler, render_collapsed, top_functions
+from metrics import DependencyClassifier, Registry, add_request_hook, instrument_requests
+import tracing
+from vision_scheduler import VisionQueueRejected, VisionScheduler
+from vision_api import (
+    VISION_JPEG_QUALITY, VISION_KEEP_ORIGINAL_BYTES, VISION_RESIZE_MAX_PIXEL,
+    add_image_fetch_hook, get_image_cache_stats, get_limiter_stats,
+)
+from image_dedup import ContentHashIndex, PerceptualIndex
+from image_proxy import ImageProxy
+from disk_cache import DiskCache
+from single_flight import SingleFlight, SingleFlightTimeout
+from vision_jobs import JobRunner, JobStore, JobStoreUnavailable, job_view
+from prompt_registry import PromptRegistry
+from stream_intake import IntakeError, PreparedImage, StreamIntake, dump_prepared, load_prepared
+from vision_cache import VisionResultCache, image_identity, make_cache_key, normalize_url, url_hash
+from traffic_lanes import (
+    BATCH, INTERACTIVE, Lane, LaneClassifier, LaneRejected,
+    current_lane, parse_shares, reset_current_lane, set_current_lane, split_share,
+)
 
 load_dotenv()
 
@@ -42,9 +71,10 @@ DB_CONFIG = {
     'cursorclass': pymysql.cursors.DictCursor
 }
 
-# 外部 API 配置
-SAVE_API_URL = "https://gwfpod.com/api/collect/product/batch_update"
-INFRINGEMENT_API_URL = "https://gwfpod.com/api/collect/product/batch_infringement_detection"
+# 外部 API 配置（GWFPOD_API_BASE 可改指到压测用的假服务，见 loadtest/fake_services.py）
+GWFPOD_API_BASE = os.getenv('GWFPOD_API_BASE', 'https://gwfpod.com').rstrip('/')
+SAVE_API_URL = f"{GWFPOD_API_BASE}/api/collect/product/batch_update"
+INFRINGEMENT_API_URL = f"{GWFPOD_API_BASE}/api/collect/product/batch_infringement_detection"
 # 使用您抓包提供的新 Token
 DEFAULT_AUTH_TOKEN = "13bc0f9d096f277bcce36a25b274b74a0c7c6fe3"
 
@@ -54,14 +84,79 @@ DEFAULT_SPEC_IMAGE_URL = "https://img.kwcdn.com/product/20195053a14/c2ddafb8-2ee
 # OCRPlus 图片服务（按 URL 查 image_assets 标签）；原图标签唯一来源 image_assets/OCRPlus
 OCRPLUS_BASE_URL = os.getenv('OCRPLUS_BASE_URL', 'http://localhost:5002').rstrip('/')
 
-# 打标接口调用大模型的并发上限，与模型侧一致，避免工作流拆 items 时超过限制
+# ---------- 请求分道：人工审核（interactive）与 N8N 批量（batch）各有线程/DB/大模型份额 ----------
+# 以下名额均为单个 gunicorn worker 内的；批量道超出在途 + 排队上限即 429 + Retry-After，不挤占审核请求
+GUNICORN_WORKERS = max(1, int(os.getenv('GUNICORN_WORKERS', '1')))
+GUNICORN_THREADS = max(1, int(os.getenv('GUNICORN_THREADS', '8')))
+LANE_CLASSIFIER = LaneClassifier()
+LANES = {
+    INTERACTIVE: Lane(INTERACTIVE),
+    BATCH: Lane(
+        BATCH,
+        max_concurrent=int(os.getenv('BATCH_LANE_MAX_CONCURRENT') or max(1, GUNICORN_THREADS // 2)),
+        max_queue=int(os.getenv('BATCH_LANE_MAX_QUEUE') or max(1, GUNICORN_THREADS // 4)),
+        queue_timeout=float(os.getenv('BATCH_LANE_QUEUE_TIMEOUT', '5')),
+        retry_after=int(os.getenv('LANE_RETRY_AFTER', '10')),
+    ),
+}
+
+# 打标接口调用大模型的并发上限，与模型侧一致，避免工作流拆 items 时超过限制。
+# VISION_LLM_MAX_CONCURRENT 为所有 worker 合计，按 worker 数向下均分（合计不超过上限；worker 比名额多时每个仍留 1 个），
+# 再按道切份额（默认审核 3 成、批量 7 成），各道之和等于本 worker 的名额
 VISION_LLM_MAX_CONCURRENT = int(os.getenv('VISION_LLM_MAX_CONCURRENT', '10'))
-VISION_LLM_SEMAPHORE = threading.Semaphore(VISION_LLM_MAX_CONCURRENT)
+VISION_LLM_WORKER_CONCURRENT = max(1, VISION_LLM_MAX_CONCURRENT // GUNICORN_WORKERS)
+VISION_LANE_LIMITS = split_share(
+    VISION_LLM_WORKER_CONCURRENT,
+    parse_shares(os.getenv('VISION_LANE_SHARES'), {INTERACTIVE: 0.3, BATCH: 0.7}),
+)
+# 每条道一个调度器：有界等待队列 + 最长排队时间，超出即 429/503，不无限占线程
+VISION_SCHEDULERS = {
+    lane: VisionScheduler(
+        lane,
+        max_concurrent=n,
+        max_queue=int(os.getenv('VISION_QUEUE_MAX') or n * 2),
+        max_wait=float(os.getenv('VISION_QUEUE_MAX_WAIT', '30')),
+        retry_after=int(os.getenv('LANE_RETRY_AFTER', '10')),
+    )
+    for lane, n in VISION_LANE_LIMITS.items()
+    if n > 0
+}
+# 本 worker 名额少于道数时有道分不到名额，这些道与名额最多的道共用调度器，合计仍不超过上限
+_VISION_SHARED_LANE = max(VISION_LANE_LIMITS, key=VISION_LANE_LIMITS.get)
+
+
+def _vision_scheduler():
+    """当前请求所在道的大模型调度器；非请求上下文按 interactive 计。"""
+    return VISION_SCHEDULERS.get(current_lane() or INTERACTIVE) or VISION_SCHEDULERS[_VISION_SHARED_LANE]
+
+
+@contextmanager
+def _vision_slot():
+    """占一个大模型调用名额（with 使用），排队耗时累加到 g.vision_queue_wait_ms 供响应头使用。
+    进不去时抛 VisionQueueRejected，由路由转成 429/503。"""
+    with _vision_scheduler().slot() as wait_ms:
+        if has_request_context():
+            g.vision_queue_wait_ms = g.get('vision_queue_wait_ms', 0.0) + wait_ms
+        yield wait_ms
+
+
+def _vision_busy_response(e, wrap=None):
+    """VisionQueueRejected -> 429/503 + Retry-After。wrap 为 _vision_response 时同时带上建议超时头。"""
+    body = {'code': -1, 'message': str(e)}
+    if wrap is not None:
+        resp, status = wrap(body, e.status)
+    else:
+        resp, status = jsonify(body), e.status
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, status
 
 # 预审改进支撑系统（preview-lab）：审核行为反馈，可选；未配置 PREVIEW_LAB_URL 则不发送
 PREVIEW_LAB_URL = os.getenv('PREVIEW_LAB_URL', '').rstrip('/')
+# 规格图细分打标的提示词从 PREVIEW_LAB_BASE 拉（默认容器内地址，见 PROMPT_REGISTRY）
+PREVIEW_LAB_BASE = os.getenv('PREVIEW_LAB_BASE', 'http://preview-lab:5003').rstrip('/')
 
 
+@tracing.traced()
 def _notify_preview_lab_feedback(scene: str, goods_id: str, action: str, payload: dict = None, human_note: str = None):
     """审核行为发生后通知 preview-lab 记录一条反馈。失败只打日志，不影响主流程。"""
     if not PREVIEW_LAB_URL:
@@ -79,9 +174,170 @@ def _notify_preview_lab_feedback(scene: str, goods_id: str, action: str, payload
         log.warning("preview-lab feedback record error: %s", e)
 
 
+# ---------- Prometheus 指标（/metrics）：请求耗时由中间件、外部调用与 SQL 由包装层计时，路由里不用手写计时 ----------
+# 各 gunicorn worker 的计数写快照到 METRICS_DIR，抓取时合并（见 metrics.py）
+METRICS = Registry(
+    'goods_review',
+    directory=os.getenv('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'goods_review_metrics'),
+    flush_interval=float(os.getenv('METRICS_FLUSH_SECONDS', '5')),
+)
+HTTP_REQUEST_SECONDS = METRICS.histogram(
+    'http_request_duration_seconds', '请求耗时（流式响应计到开始返回为止）', ('route', 'method', 'status'),
+)
+HTTP_IN_FLIGHT = METRICS.gauge('http_requests_in_flight', '处理中的请求数')
+DEPENDENCY_SECONDS = METRICS.histogram(
+    'dependency_duration_seconds', '外部调用耗时（stream=True 计到收到响应头）', ('dependency', 'outcome'),
+)
+DB_QUERY_SECONDS = METRICS.histogram(
+    'db_query_duration_seconds', 'MySQL 单条 SQL 执行耗时（含取回结果）', ('operation', 'outcome'),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+_SQL_OPERATIONS = ('select', 'insert', 'update', 'delete', 'replace')
+
+
+def _observe_db_query(sql, args, seconds, error, cursor=None):
+    op = (sql or '').lstrip(' \t\r\n(').split(None, 1)[0].lower() if (sql or '').strip() else ''
+    op = op if op in _SQL_OPERATIONS else 'other'
+    DB_QUERY_SECONDS.observe(op, 'error' if error else 'ok', value=seconds)
+    # 参数不进 trace（可能含用户数据），语句只留前 300 字
+    tracing.record_span(f'db {op}', seconds, error, statement=' '.join(str(sql or '').split())[:300])
+    if QUERY_STATS is not None:
+        QUERY_STATS.observe(sql, args, seconds, error, cursor)
+
+
+def _dependency_classifier():
+    from vision_api import URL as GLM_URL
+    classifier = DependencyClassifier(default='other')
+    classifier.add(f"{OCRPLUS_BASE_URL}/api/image/labels/by-url", 'ocrplus_by_url')
+    classifier.add(OCRPLUS_BASE_URL, 'ocrplus')
+    classifier.add(GLM_URL, 'glm_describe')
+    classifier.add(SAVE_API_URL, 'upstream_save')
+    classifier.add(INFRINGEMENT_API_URL, 'infringement')
+    # 反馈（PREVIEW_LAB_URL）与提示词（PREVIEW_LAB_BASE）可能配成不同地址，都算 preview_lab
+    for base in (PREVIEW_LAB_URL, PREVIEW_LAB_BASE):
+        if base:
+            classifier.add(base, 'preview_lab')
+    return classifier
+
+
+instrument_requests(DEPENDENCY_SECONDS, _dependency_classifier())
+
+# ---------- 请求追踪（/api/debug/traces）：每条 SQL、每次外部调用与关键函数记 span，慢请求进本 worker 的环形缓冲 ----------
+# OCRPlus 与 preview-lab 是自家服务，调用时透传 X-Request-Id / traceparent，两边日志可按同一个 id 对上
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', '1') == '1'
+TRACER = tracing.TraceRecorder(
+    slow_ms=float(os.getenv('TRACE_SLOW_MS', '1000')),
+    sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0')),
+    buffer_size=int(os.getenv('TRACE_BUFFER_SIZE', '200')),
+    max_spans=int(os.getenv('TRACE_MAX_SPANS', '500')),
+    export=os.getenv('TRACE_EXPORT') or None,
+)
+_UNTRACED_PATHS = ('/metrics', '/api/debug/')
+# 按需采样分析（/api/debug/profile）：请求线程进出时登记路由，采样时据此过滤
+PROFILER = SamplingProfiler(max_seconds=float(os.getenv('PROFILE_MAX_SECONDS', '60')))
+if TRACE_ENABLED:
+    add_request_hook(tracing.request_hook(propagate=('ocrplus', 'ocrplus_by_url', 'preview_lab')))
+
+
+@app.before_request
+def _start_request_timer():
+    METRICS.ensure_flusher()
+    g.request_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    PROFILER.enter(route, request.path)
+    incoming_id = (request.headers.get('X-Request-Id') or '').strip()[:64]
+    g.request_id = incoming_id or None
+    if TRACE_ENABLED and not request.path.startswith(_UNTRACED_PATHS):
+        g.trace = TRACER.start(
+            f'{request.method} {route}', request_id=g.request_id,
+            force=request.headers.get('X-Trace') == '1', path=request.path,
+        )
+        g.request_id = g.trace[0].request_id
+
+
+@app.after_request
+def _observe_request(resp):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        HTTP_REQUEST_SECONDS.observe(route, request.method, resp.status_code, value=time.perf_counter() - started)
+    g.response_status = resp.status_code
+    if g.get('request_id'):
+        resp.headers['X-Request-Id'] = g.request_id
+    return resp
+
+
+@app.teardown_request
+def _finish_request_timer(exc=None):
+    if g.pop('request_started', None) is not None:
+        HTTP_IN_FLIGHT.dec()
+        PROFILER.leave()
+    trace = g.pop('trace', None)
+    if trace is not None:
+        status = 500 if exc is not None else g.get('response_status')
+        TRACER.finish(*trace, status=status)
+
+
+# SQL 指纹统计与慢查询 EXPLAIN 采样（/api/debug/queries）；EXPLAIN 在后台线程借池里的连接执行
+QUERY_STATS = QueryStats(
+    conn_factory=lambda: DB_POOL.connection(),
+    slow_ms=float(os.getenv('SLOW_QUERY_MS', '500')),
+    explain_interval=float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', '300')),
+) if os.getenv('QUERY_STATS_ENABLED', '1') == '1' else None
+
+# 每个进程一个连接池：默认按 gunicorn 线程数 + 2（后台落库线程等）配置，避免每次请求新建 TCP 连接
+# 批量道最多占池的 DB_POOL_BATCH_SHARE（默认一半，与审核道按 split_share 切分，池不小于 2 时审核道至少留 1 个），
+# 保证审核请求总能拿到连接
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or GUNICORN_THREADS + 2)
+_DB_POOL_BATCH_SHARE = min(1.0, max(0.0, float(os.getenv('DB_POOL_BATCH_SHARE', '0.5'))))
+DB_POOL_LANE_LIMITS = split_share(DB_POOL_SIZE, {INTERACTIVE: 1.0 - _DB_POOL_BATCH_SHARE, BATCH: _DB_POOL_BATCH_SHARE})
+DB_POOL = ConnectionPool(
+    DB_CONFIG,
+    max_size=DB_POOL_SIZE,
+    acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    lane_limits={BATCH: max(1, DB_POOL_LANE_LIMITS[BATCH])},
+    lane_getter=current_lane,
+    query_hook=_observe_db_query,
+)
+
+
+@app.before_request
+def _enter_traffic_lane():
+    """按路由/请求头/API Key 分道并占道内名额；批量道满时直接 429，不占用后续资源。"""
+    lane = LANE_CLASSIFIER.classify(request.path, request.headers)
+    g.traffic_lane = lane
+    g.traffic_lane_token = set_current_lane(lane)
+    try:
+        LANES[lane].enter()
+    except LaneRejected as e:
+        resp = jsonify({'code': 429, 'message': f'服务繁忙（{e}），请 {e.retry_after}s 后重试'})
+        resp.status_code = 429
+        resp.headers['Retry-After'] = str(e.retry_after)
+        return resp
+    g.traffic_lane_entered = True
+
+
+@app.teardown_request
+def _leave_traffic_lane(exc=None):
+    if g.pop('traffic_lane_entered', False):
+        LANES[g.traffic_lane].leave()
+    token = g.pop('traffic_lane_token', None)
+    if token is not None:
+        reset_current_lane(token)
+
+
+@app.after_request
+def _tag_traffic_lane(resp):
+    lane = g.get('traffic_lane')
+    if lane:
+        resp.headers['X-Traffic-Lane'] = lane
+    return resp
+
+
 def get_db_connection():
-    """获取数据库连接"""
-    return pymysql.connect(**DB_CONFIG)
+    """从连接池借一个数据库连接；用完 close() 即归还"""
+    return DB_POOL.connection()
 
 
 # ---------- 品类配置（读库，与 N8N 工作流共用） ----------
@@ -194,43 +450,31 @@ def _resolve_category_for_product_id(cursor, product_id, category_config_list=No
     return default_spec
 
 
+# 负向原因：缓冲批量落库 + 按维度的最近原因内存缓存（reason-history 读内存，每 NEGATIVE_REASON_REFRESH_SECONDS 秒
+# 增量合并库内新记录，其它 worker 写的原因随之可见）
+NEGATIVE_REASON_LOG = NegativeReasonLog(
+    get_db_connection,
+    flush_interval=float(os.getenv('NEGATIVE_REASON_FLUSH_INTERVAL', '2')),
+    refresh_seconds=float(os.getenv('NEGATIVE_REASON_REFRESH_SECONDS', '10')),
+)
+
+
 def _log_negative_reason(dimension: str, reason: str):
-    """负向操作原因落库，供历史标签查询。失败只打日志，不影响主流程。"""
-    if not reason or not isinstance(reason, str):
-        return
-    r = reason.strip()[:512]
-    if not r or dimension not in ('goods', 'carousel'):
-        return
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO negative_reason_log (dimension, reason) VALUES (%s, %s)",
-            (dimension, r),
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        if 'doesn\'t exist' not in str(e) and "doesn't exist" not in str(e):
-            log.warning("negative_reason_log insert failed: %s", e)
+    """负向操作原因落库，供历史标签查询。只入内存队列，由后台线程批量写库；失败只打日志，不影响主流程。"""
+    NEGATIVE_REASON_LOG.add(dimension, reason)
 
 
 # ---------- 图片原始标签：唯一来源 image_assets + OCRPlus，其它业务只消费、不做源 ----------
 # 设计图审核等只通过 OCRPlus 按 URL 拉标签，不依赖 lovart_design_tab_mapping.original_classify_reasons 作为源。
 def _normalize_url(url):
-    if not url or not isinstance(url, str):
-        return ""
-    s = url.strip().split("#")[0].split("?")[0].strip()
-    return s
+    return normalize_url(url)
 
 
 def _url_to_hash(url):
-    import hashlib
-    n = _normalize_url(url)
-    return hashlib.md5(n.encode("utf-8")).hexdigest() if n else ""
+    return url_hash(url)
 
 
+@tracing.traced()
 def _sync_goods_mapping(cursor, product_id, image_url_list):
     """将 image_goods_mapping 中该商品（原商品ID=product_id）的映射同步为当前轮播图列表。增/删图后调用。"""
     try:
@@ -335,6 +579,7 @@ def _enrich_design_original_classify_reasons(item, labels_map):
     item["original_classify_reasons"] = reasons
 
 
+@tracing.traced()
 def ensure_sku_dimensions(sku_list):
     """
     确保SKU列表中的每个SKU都有len、width、height字段
@@ -509,6 +754,7 @@ def _process_goods_row(row):
 
 
 
+@tracing.traced()
 def save_goods_to_external_api(goods_id):
     """
     将修改后的商品数据回存到新版软件的 API (JSON 格式)
@@ -619,8 +865,252 @@ def save_goods_to_external_api(goods_id):
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康检查"""
-    return jsonify({'status': 'ok', 'message': '服务运行正常'})
+    """健康检查（附带本进程连接池占用，便于排查卡顿）"""
+    return jsonify({
+        'status': 'ok',
+        'message': '服务运行正常',
+        'pid': os.getpid(),
+        'db_pool': DB_POOL.stats(),
+        'lanes': {name: lane.stats() for name, lane in LANES.items()},
+        'vision': {lane: sch.stats() for lane, sch in VISION_SCHEDULERS.items()},
+    })
+
+
+@app.route('/api/vision/scheduler', methods=['GET'])
+def vision_scheduler_stats():
+    """本 worker 各道大模型调度器的在途数、排队深度、排队耗时与拒绝次数，各模型当前的自适应并发上限，识图结果缓存命中率、同键请求合并次数，拉图磁盘缓存统计，本 worker 异步任务执行情况，近似图复用计数，以及大请求体流式接收统计。"""
+    return jsonify({
+        'code': 0,
+        'message': 'success',
+        'data': {
+            'pid': os.getpid(),
+            'lanes': {lane: sch.stats() for lane, sch in VISION_SCHEDULERS.items()},
+            'adaptive_limits': get_limiter_stats(),
+            'result_cache': VISION_RESULT_CACHE.stats(),
+            'coalescing': VISION_SINGLE_FLIGHT.stats(),
+            'image_fetch_cache': get_image_cache_stats(),
+            'jobs': VISION_JOB_RUNNER.stats(),
+            'dedup': PHASH_INDEX.stats(),
+            'intake': VISION_INTAKE.stats(),
+        },
+    })
+
+
+def _collect_runtime_metrics():
+    """抓取时从各组件已有的 stats() 取值：连接池、分道、大模型调度器队列、自适应并发、各级缓存命中。"""
+    out = []
+
+    def add(name, kind, help_text, labels, value):
+        out.append((name, kind, help_text, labels, value))
+
+    pool = DB_POOL.stats()
+    for state in ('in_use', 'idle'):
+        add('db_pool_connections', 'gauge', '连接池当前连接数', {'state': state}, pool[state])
+    add('db_pool_max_connections', 'gauge', '连接池上限（各 worker 合计）', {}, pool['max_size'])
+    add('db_pool_acquired_total', 'counter', '借出连接次数', {}, pool['acquired'])
+    add('db_pool_timeouts_total', 'counter', '等待空闲连接超时次数', {}, pool['timeouts'])
+    add('db_pool_wait_seconds_total', 'counter', '借连接的累计等待秒数', {}, pool['wait_seconds_total'])
+    add('db_pool_connections_created_total', 'counter', '新建 MySQL 连接次数', {}, pool['created'])
+    for name, lane in LANES.items():
+        st = lane.stats()
+        add('lane_in_flight', 'gauge', '各道在途请求数', {'lane': name}, st['in_flight'])
+        add('lane_waiting', 'gauge', '各道排队请求数', {'lane': name}, st['waiting'])
+        add('lane_rejected_total', 'counter', '各道因满载返回 429 的次数', {'lane': name}, st['rejected'])
+    for name, sch in VISION_SCHEDULERS.items():
+        st = sch.stats()
+        add('vision_queue_depth', 'gauge', '大模型调用排队数', {'lane': name}, st['queue_depth'])
+        add('vision_in_flight', 'gauge', '大模型调用在途数', {'lane': name}, st['in_flight'])
+        add('vision_max_concurrent', 'gauge', '大模型调用并发上限', {'lane': name}, st['max_concurrent'])
+        add('vision_admitted_total', 'counter', '进入大模型调用的次数', {'lane': name}, st['admitted'])
+        add('vision_queue_wait_seconds_total', 'counter', '大模型调用累计排队秒数', {'lane': name},
+            st['wait_ms_total'] / 1000.0)
+        for reason, key in (('queue_full', 'rejected_queue_full'), ('wait_timeout', 'rejected_wait_timeout')):
+            add('vision_rejected_total', 'counter', '大模型调用被拒次数', {'lane': name, 'reason': reason}, st[key])
+    for model, st in get_limiter_stats().items():
+        add('vision_adaptive_limit', 'gauge', '各模型当前自适应并发上限', {'model': model}, st['limit'])
+    add('vision_coalesced_total', 'counter', '同键识图请求合并次数', {}, VISION_SINGLE_FLIGHT.stats()['coalesced'])
+
+    caches = []
+    rc = VISION_RESULT_CACHE.stats()
+    caches.append(('vision_result', rc['hits_memory'] + rc['hits_db'], rc['misses']))
+    fc = get_image_cache_stats()
+    if fc:
+        caches.append(('image_fetch', fc['hits'], fc['misses']))
+    pc = IMAGE_PROXY.stats()
+    caches.append(('image_proxy', pc['cache_hits'] + pc['revalidated'] + pc['stale_served'], pc['misses']))
+    caches.append(('image_proxy_variant', pc['variant_hits'], pc['variant_generated'] + pc['variant_source_served']))
+    for cache, hits, misses in caches:
+        add('cache_hits_total', 'counter', '缓存命中次数', {'cache': cache}, hits)
+        add('cache_misses_total', 'counter', '缓存未命中次数', {'cache': cache}, misses)
+    return out
+
+
+METRICS.add_collector(_collect_runtime_metrics)
+
+
+def _add_cache_hit_ratio(merged):
+    """命中率在合并各 worker 之后按总数算（各 worker 比率不能直接相加）。"""
+    hits = merged.get('goods_review_cache_hits_total', {}).get('values', {})
+    misses = merged.get('goods_review_cache_misses_total', {}).get('values', {})
+    ratios = {}
+    for key, h in hits.items():
+        total = h + misses.get(key, 0)
+        ratios[key] = round(h / total, 4) if total else 0.0
+    if ratios:
+        merged['goods_review_cache_hit_ratio'] = {
+            'type': 'gauge', 'help': '缓存命中率（各 worker 合计，自进程启动起）', 'labels': ['cache'], 'values': ratios,
+        }
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 抓取端点：各 worker 合并后的请求耗时直方图（按路由 / 方法 / 状态码）、外部依赖与 SQL 耗时、
+    连接池、分道与大模型队列深度、缓存命中。配置了 METRICS_TOKEN 时须带 Authorization: Bearer <token>。"""
+    token = os.getenv('METRICS_TOKEN')
+    given = (request.headers.get('Authorization') or '').encode('utf-8')
+    if token and not hmac.compare_digest(given, f'Bearer {token}'.encode('utf-8')):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    body = METRICS.exposition(post_merge=_add_cache_hit_ratio)
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _admin_denied():
+    """诊断接口（trace、慢查询等会带出 SQL 与内部地址）须配置 ADMIN_TOKEN，并带 X-Admin-Token 或 Authorization: Bearer。
+    通过返回 None，否则返回错误响应。"""
+    token = os.getenv('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'code': 403, 'message': '未配置 ADMIN_TOKEN，诊断接口不可用'}), 403
+    given = request.headers.get('X-Admin-Token') or ''
+    auth = request.headers.get('Authorization') or ''
+    if auth.startswith('Bearer '):
+        given = given or auth[7:]
+    if not hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8')):
+        return jsonify({'code': 401, 'message': 'unauthorized'}), 401
+    return None
+
+
+@app.route('/api/debug/traces', methods=['GET'])
+def debug_traces():
+    """浏览本 worker 采样到的请求 trace（超过 TRACE_SLOW_MS、5xx、带 X-Trace: 1 或按 TRACE_SAMPLE_RATE 命中的请求）。
+    参数:
+      - id：trace_id 或 X-Request-Id，返回该条的全部 span（按开始时间排序，parent 指向父 span）
+      - 否则列最近的摘要：min_ms 只看不低于该耗时的，route 按「方法 路由」子串过滤，limit 默认 50
+    多 worker 时每个 worker 各自一份缓冲，找不到可重试几次或看 TRACE_EXPORT 导出的文件。需 ADMIN_TOKEN。"""
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    trace_id = (request.args.get('id') or '').strip()
+    if trace_id:
+        trace = TRACER.get(trace_id)
+        if trace is None:
+            return jsonify({'code': 404, 'message': f'本 worker（pid {os.getpid()}）缓冲中没有该 trace'}), 404
+        return jsonify({'code': 0, 'message': 'success', 'data': trace})
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        min_ms = float(request.args.get('min_ms', 0))
+    except ValueError:
+        return jsonify({'code': 400, 'message': 'limit / min_ms 须为数字'}), 400
+    traces = TRACER.list(limit=limit, min_ms=min_ms, name_contains=request.args.get('route') or None)
+    return jsonify({'code': 0, 'message': 'success', 'data': {
+        'pid': os.getpid(), 'enabled': TRACE_ENABLED, 'stats': TRACER.stats(), 'traces': traces,
+    }})
+
+
+@app.route('/api/debug/profile', methods=['GET'])
+def debug_profile():
+    """在本 worker 上跑一段采样分析（阻塞 seconds 秒后返回），看请求线程的 Python 时间花在哪，不用重启或挂调试器。
+    参数:
+      - seconds：采样时长，默认 10，最长 PROFILE_MAX_SECONDS；interval_ms：采样间隔，默认 10
+      - route：只采该路由的请求线程（如 /api/goods/list，与路由规则相同或为 path 前缀）
+      - threads：requests（默认，只采处理中的请求线程，栈根为路由）/ all（含后台线程，栈根为线程名）
+      - lines=1：帧名带行号
+      - format：collapsed（默认，text/plain 折叠栈，可直接喂 flamegraph.pl 或拖进 speedscope）/ json（热点函数排行 + 折叠栈）
+    统计的是墙钟时间，等库、等外部接口的时间也在内。多 worker 时只采到接这次请求的 worker（响应头 X-Profile-Pid）。需 ADMIN_TOKEN。"""
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval_ms', 10)) / 1000
+    except ValueError:
+        return jsonify({'code': 400, 'message': 'seconds / interval_ms 须为数字'}), 400
+    threads = request.args.get('threads', 'requests')
+    if threads not in ('requests', 'all'):
+        return jsonify({'code': 400, 'message': 'threads 须为 requests 或 all'}), 400
+    try:
+        stacks, meta = PROFILER.profile(
+            seconds, interval=interval, route=request.args.get('route') or None, threads=threads,
+            lines=request.args.get('lines') == '1',
+        )
+    except ProfilerBusy as e:
+        return jsonify({'code': 409, 'message': str(e)}), 409
+    if request.args.get('format') == 'json':
+        resp = jsonify({'code': 0, 'message': 'success', 'data': dict(
+            meta, top=top_functions(stacks), collapsed=render_collapsed(stacks),
+        )})
+    else:
+        resp = Response(render_collapsed(stacks), mimetype='text/plain')
+    resp.headers['X-Profile-Pid'] = str(meta['pid'])
+    resp.headers['X-Profile-Samples'] = str(meta['stacks'])
+    return resp
+
+
+_SERVER_DIGEST_SQL = """
+    SELECT DIGEST_TEXT AS fingerprint, COUNT_STAR AS count,
+           ROUND(SUM_TIMER_WAIT / 1e9, 1) AS total_ms, ROUND(AVG_TIMER_WAIT / 1e9, 2) AS avg_ms,
+           ROUND(MAX_TIMER_WAIT / 1e9, 2) AS max_ms, SUM_ROWS_EXAMINED AS rows_examined,
+           SUM_ROWS_SENT AS rows_returned, SUM_ROWS_AFFECTED AS rows_affected,
+           SUM_NO_INDEX_USED AS no_index_used, LAST_SEEN AS last_seen
+    FROM performance_schema.events_statements_summary_by_digest
+    WHERE SCHEMA_NAME = DATABASE()
+    ORDER BY SUM_TIMER_WAIT DESC
+    LIMIT %s
+"""
+
+
+@app.route('/api/debug/queries', methods=['GET', 'DELETE'])
+def debug_queries():
+    """本 worker 自启动以来的 SQL 指纹统计（字面量已去掉）：次数、总 / 平均 / p95 / 最大耗时、返回与影响行数，
+    慢查询（≥ SLOW_QUERY_MS）附最近一次 EXPLAIN 及其估计扫描行数。
+    参数:
+      - sort：total（默认）/ p95 / max / count / rows / errors / slow；limit 默认 20
+      - source=server：改查 MySQL performance_schema 按 digest 的汇总（全库所有客户端，含真实 rows_examined），
+        需要账号有 performance_schema 的读权限
+    DELETE 清空本 worker 的统计。多 worker 时每个 worker 各自一份。需 ADMIN_TOKEN。"""
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    if QUERY_STATS is None:
+        return jsonify({'code': 400, 'message': 'QUERY_STATS_ENABLED=0，未开启 SQL 统计'}), 400
+    if request.method == 'DELETE':
+        QUERY_STATS.reset()
+        return jsonify({'code': 0, 'message': 'success', 'data': {'pid': os.getpid()}})
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+    except ValueError:
+        return jsonify({'code': 400, 'message': 'limit 须为整数'}), 400
+    if request.args.get('source') == 'server':
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(_SERVER_DIGEST_SQL, (limit,))
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            return jsonify({'code': 500, 'message': f'读取 performance_schema 失败: {e}'}), 500
+        finally:
+            conn.close()
+        for row in rows:
+            for key, value in row.items():
+                if value is not None and not isinstance(value, (int, float, str)):
+                    row[key] = float(value) if key != 'last_seen' else str(value)
+        return jsonify({'code': 0, 'message': 'success', 'data': {'source': 'server', 'queries': rows}})
+    return jsonify({'code': 0, 'message': 'success', 'data': {
+        'pid': os.getpid(),
+        'stats': QUERY_STATS.stats(),
+        'queries': QUERY_STATS.top(sort=request.args.get('sort', 'total'), limit=limit),
+        'recent_slow': QUERY_STATS.recent_slow(limit=limit),
+    }})
 
 
 @app.route('/api/goods/statistics', methods=['GET'])
@@ -689,7 +1179,7 @@ def get_statistics():
 
 @app.route('/api/goods/reason-history', methods=['GET'])
 def get_reason_history():
-    """负向操作原因历史，按维度返回去重后的最近原因列表（供废弃/删图/badcase 弹窗标签用）"""
+    """负向操作原因历史，按维度返回去重后的最近原因列表（供废弃/删图/badcase 弹窗标签用）。读进程内缓存，不查库。"""
     try:
         dimension = (request.args.get('dimension') or '').strip()
         if dimension not in ('goods', 'carousel'):
@@ -698,27 +1188,7 @@ def get_reason_history():
             limit = min(int(request.args.get('limit', 20)), 50)
         except ValueError:
             limit = 20
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                """SELECT reason FROM negative_reason_log
-                   WHERE dimension = %s AND reason != ''
-                   GROUP BY reason
-                   ORDER BY MAX(created_at) DESC
-                   LIMIT %s""",
-                (dimension, limit),
-            )
-            rows = cursor.fetchall()
-            items = [r['reason'] for r in rows if r.get('reason')]
-        except pymysql.err.OperationalError as e:
-            if 'doesn\'t exist' in str(e) or "doesn't exist" in str(e):
-                items = []
-            else:
-                raise
-        finally:
-            cursor.close()
-            conn.close()
+        items = NEGATIVE_REASON_LOG.recent(dimension, limit)
         return jsonify({'code': 0, 'message': 'success', 'data': {'items': items}})
     except Exception as e:
         return jsonify({'code': -1, 'message': str(e)}), 500
@@ -891,6 +1361,9 @@ def get_goods_list():
             goods['category_is_multi_spec'] = is_multi_spec  # 规格数量：供列表/详情展示
             _process_goods_row(goods)
         t_db_category_ms = (time.perf_counter() - t_cat_start) * 1000
+        # 查库到此结束：调 OCRPlus（最长 15s）前先归还连接
+        cursor.close()
+        conn.close()
 
         # 优先从 OCRPlus 按 URL 拉标签，失败或空则用库内 carousel_labels
         all_urls = [u for g in goods_list for u in (g.get("image_list") or [])]
@@ -904,8 +1377,6 @@ def get_goods_list():
                 log.debug("列表页 OCRPlus 标签未返回，使用库内 carousel_labels（可能不是最新）")
         t_ocrplus_ms = (time.perf_counter() - t_ocr_start) * 1000
 
-        cursor.close()
-        conn.close()
         t_total_ms = (time.perf_counter() - t0) * 1000
         if t_total_ms > 800:
             log.info("[PERF] goods/list page=%s page_size=%s db_conn_ms=%.0f db_query_ms=%.0f db_category_ms=%.0f ocrplus_ms=%.0f total_ms=%.0f url_count=%s",
@@ -933,15 +1404,31 @@ VISION_DESCRIBE_RECOMMENDED_TIMEOUT_MS = 120000
 
 
 def _vision_response(data, status=200):
-    """统一给 /api/vision/describe 的响应加上建议超时头，便于 n8n 等客户端设置足够长的 Timeout。"""
+    """统一给 /api/vision/describe 的响应加上建议超时头，便于 n8n 等客户端设置足够长的 Timeout。
+    排过大模型调用队列时附 X-Queue-Wait-Ms（本请求累计排队毫秒数）；结果来自合并的同键调用时附 X-Vision-Coalesced: 1。"""
     resp = jsonify(data)
     resp.headers["X-Recommended-Timeout"] = str(VISION_DESCRIBE_RECOMMENDED_TIMEOUT_MS)
+    if has_request_context() and 'vision_queue_wait_ms' in g:
+        resp.headers["X-Queue-Wait-Ms"] = str(int(round(g.vision_queue_wait_ms)))
+    if has_request_context() and g.get('vision_coalesced'):
+        resp.headers["X-Vision-Coalesced"] = "1"
     return resp, status
 
 
+def _base64_data_url(value, mime):
+    """base64 字段 → data URL；流式接收时已是预处理好的 PreparedImage，原样返回。"""
+    if isinstance(value, PreparedImage):
+        return value
+    mime = (mime or 'image/png').strip()
+    if not mime.startswith('image/'):
+        mime = f"image/{mime}"
+    return f"data:{mime};base64,{str(value).strip()}"
+
+
 def _parse_vision_image_inputs(data):
     """从请求体解析出图片列表，每项为 URL 或 data:image/...;base64,...。
     支持混合传图：images 数组内每项可为 url 或 base64；也支持仅 image_base64_list / image_urls 等。
+    流式接收的图片（PreparedImage）原样保留，不再拼接或 strip，以免丢掉原图内容哈希。
     """
     # 0) 混合列表：images 中每项为 { "url": "..." } 或 { "base64": "...", "mime": "..." } 或直接字符串 URL/data URL
     images = data.get('images')
@@ -950,22 +1437,25 @@ def _parse_vision_image_inputs(data):
         for item in images:
             if item is None:
                 continue
+            if isinstance(item, PreparedImage):
+                out.append(item)
+                continue
             if isinstance(item, str):
                 s = item.strip()
                 if s.startswith(('http://', 'https://', 'data:image/')):
                     out.append(s)
                 continue
             if isinstance(item, dict):
+                if isinstance(item.get('url'), PreparedImage):
+                    out.append(item['url'])
+                    continue
                 if item.get('url'):
                     u = str(item['url']).strip()
                     if u.startswith(('http://', 'https://', 'data:image/')):
                         out.append(u)
                     continue
                 if item.get('base64'):
-                    mime = (item.get('mime') or 'image/png').strip()
-                    if not mime.startswith('image/'):
-                        mime = f"image/{mime}"
-                    out.append(f"data:{mime};base64,{str(item['base64']).strip()}")
+                    out.append(_base64_data_url(item['base64'], item.get('mime')))
         if out:
             return out
     # 1) 仅 base64 列表
@@ -974,20 +1464,14 @@ def _parse_vision_image_inputs(data):
         out = []
         for item in base64_list:
             if isinstance(item, str):
-                out.append(f"data:image/png;base64,{item.strip()}")
+                out.append(_base64_data_url(item, 'image/png'))
             elif isinstance(item, dict) and item.get('base64'):
-                mime = (item.get('mime') or 'image/png').strip()
-                if not mime.startswith('image/'):
-                    mime = f"image/{mime}"
-                out.append(f"data:{mime};base64,{item['base64'].strip()}")
+                out.append(_base64_data_url(item['base64'], item.get('mime')))
         if out:
             return out
     single_b64 = data.get('image_base64')
     if isinstance(single_b64, str) and single_b64.strip():
-        mime = (data.get('image_base64_mime') or 'image/png').strip()
-        if not mime.startswith('image/'):
-            mime = f"image/{mime}"
-        return [f"data:{mime};base64,{single_b64.strip()}"]
+        return [_base64_data_url(single_b64, data.get('image_base64_mime'))]
     # 2) 仅 URL 列表（N8N 等可能传 stringified 数组）
     urls = data.get('image_urls')
     if isinstance(urls, str) and urls.strip():
@@ -1000,7 +1484,10 @@ def _parse_vision_image_inputs(data):
     else:
         urls = []
     if not urls:
-        single = (data.get('image_url') or '').strip()
+        single = data.get('image_url')
+        if isinstance(single, PreparedImage):
+            return [single]
+        single = (single or '').strip()
         if single and single.startswith(('http://', 'https://', 'data:image/')):
             urls = [single]
     return urls
@@ -1036,19 +1523,36 @@ def _normalize_single_image_vision_content(content):
     return json.dumps(normalized, ensure_ascii=False)
 
 
-def _get_cached_vision_content(urls):
-    """若请求的图片均为 http(s) URL 且在 image_assets 中已有 labels，返回复用内容；否则返回 None。
-    缓存键即请求里的 URL，不另做「用哪个 URL」的判断：传什么就按什么查。
+def _all_http_urls(urls):
+    return bool(urls) and all((u or "").strip().startswith(("http://", "https://")) for u in urls)
+
+
+def _asset_label_hashes(urls, image_ids=None, content_map=None):
+    """可按 image_assets 复用标签时返回各图片的 url_hash 列表，否则 None。
+    http(s) URL 直接算 url_hash；base64 / data URL 按原图内容哈希查 image_content_hash 找到同一张图的 url_hash
+    （image_ids 为已算好的识图缓存标识，content_map 为调用方批量查好的 {内容哈希: url_hash}），有一张找不到即 None。
     """
     if not urls:
         return None
-    for u in urls:
-        s = (u or "").strip()
-        if not s.startswith(("http://", "https://")):
-            return None
-    hashes = [_url_to_hash(u) for u in urls]
-    if not all(hashes):
+    if _all_http_urls(urls):
+        hashes = [_url_to_hash(u) for u in urls]
+        return hashes if all(hashes) else None
+    if not CONTENT_INDEX.enabled:
         return None
+    image_ids = image_ids or [image_identity(u) for u in urls]
+    if not all(i.startswith(("u:", "c:")) for i in image_ids):
+        return None
+    if content_map is None:
+        content_map = CONTENT_INDEX.url_hashes_for([i[2:] for i in image_ids if i.startswith("c:")])
+    hashes = [i[2:] if i.startswith("u:") else content_map.get(i[2:]) for i in image_ids]
+    return hashes if all(hashes) else None
+
+
+def _lookup_asset_labels(hashes):
+    """一条 IN 查询取 image_assets 中已有的 labels，返回 {url_hash: labels}；查询失败返回空。"""
+    if not hashes:
+        return {}
+    hashes = list(dict.fromkeys(hashes))
     try:
         conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
@@ -1060,8 +1564,12 @@ def _get_cached_vision_content(urls):
         row_map = {row["url_hash"]: row.get("labels") for row in cursor.fetchall()}
         conn.close()
     except Exception:
-        return None
-    # 按请求顺序组装：每个 URL 都必须有标签才复用
+        return {}
+    return row_map
+
+
+def _assemble_asset_labels(hashes, row_map):
+    """按请求顺序组装复用内容：每个 URL 都必须有标签才复用，否则 None。"""
     ordered = []
     for h in hashes:
         if h not in row_map or row_map[h] is None:
@@ -1075,79 +1583,612 @@ def _get_cached_vision_content(urls):
     return json.dumps(ordered, ensure_ascii=False)
 
 
+def _get_cached_vision_content(urls, image_ids=None):
+    """若请求的图片在 image_assets 中均已有 labels，返回复用内容；否则返回 None。
+    缓存键即请求里的 URL，不另做「用哪个 URL」的判断：传什么就按什么查；base64 图片按原图内容哈希关联到 URL。
+    URL 精确查不到时再按感知哈希找近似的已打标图片（见 _near_duplicate_asset_labels，仅全为 URL 时）。
+    返回 (content, near_duplicate)。
+    """
+    hashes = _asset_label_hashes(urls, image_ids)
+    if hashes is None:
+        return None, False
+    row_map = _lookup_asset_labels(hashes)
+    content = _assemble_asset_labels(hashes, row_map)
+    if content is not None:
+        if not _all_http_urls(urls):
+            CONTENT_INDEX.count('label_reuses')
+        return content, False
+    if not _all_http_urls(urls):
+        return None, False
+    content = _near_duplicate_asset_labels(urls, hashes, row_map)
+    return content, content is not None
+
+
+# 近似重复图片复用标签：拉图时由后台线程记录 dHash（image_dhash 表），URL 查不到标签时找汉明距离不超过
+# VISION_DEDUP_MAX_DISTANCE 的已打标图片复用（默认 3；<0 只记录不复用）。需先执行 sql/add_image_dhash.sql
+PHASH_INDEX = PerceptualIndex(get_db_connection, max_distance=int(os.getenv('VISION_DEDUP_MAX_DISTANCE', '3')))
+add_image_fetch_hook(lambda url, data: PHASH_INDEX.observe(_url_to_hash(url), data))
+
+# 原图内容哈希 ↔ URL：拉图时记录图床原图字节的 sha256（image_content_hash 表），客户端传 base64 的同一张图
+# 可按内容哈希复用 image_assets 标签与按 URL 识过的识图结果（反之亦然）。需先执行 sql/add_image_content_hash.sql
+CONTENT_INDEX = ContentHashIndex(get_db_connection)
+add_image_fetch_hook(lambda url, raw: CONTENT_INDEX.observe(_url_to_hash(url), raw), raw=True)
+
+
+def _near_duplicate_asset_labels(urls, hashes, row_map):
+    """URL 精确查不到标签的图片按 dHash 找近似的已打标图片；每张都找到才复用，返回复用内容，否则 None。
+    没记录过哈希的图片在这里拉一次（经拉图磁盘缓存，随后真要调大模型时不会重复下载）；
+    须由客户端拉图的 URL（如 Lovart）服务端不拉，视为没有近似图。"""
+    if not PHASH_INDEX.enabled:
+        return None
+    from vision_api import _must_client_fetch, fetch_image_bytes
+    missing = [(u, h) for u, h in zip(urls, hashes) if row_map.get(h) is None]
+    known = PHASH_INDEX.hashes_for([h for _, h in missing])
+    filled = dict(row_map)
+    reuses = []
+    for u, h in missing:
+        if filled.get(h) is not None:
+            continue
+        value = known.get(h)
+        if value is None:
+            if _must_client_fetch(u):
+                return None
+            ok, data, _, _ = fetch_image_bytes(u)
+            if not ok:
+                return None
+            # 拉图回调已把这张图排进后台队列；这里当场要用，算一次并让后台跳过同一张
+            value = PHASH_INDEX.value_for(h, data)
+        match = PHASH_INDEX.nearest_labelled(value, exclude_url_hash=h)
+        if match is None:
+            return None
+        source_hash, labels, distance = match
+        filled[h] = labels
+        reuses.append((h, source_hash, distance))
+    content = _assemble_asset_labels(hashes, filled)
+    if content is not None:
+        for h, source_hash, distance in reuses:
+            PHASH_INDEX.record_reuse(h, source_hash, distance)
+    return content
+
+
+@app.route('/api/vision/dedup/report', methods=['GET'])
+def vision_dedup_report():
+    """近似图复用报表：近 days 天（默认 7）每天按感知哈希复用标签的次数（即省下的大模型调用）、距离分布与哈希覆盖数。"""
+    try:
+        days = max(1, min(int(request.args.get('days', 7)), 90))
+    except (TypeError, ValueError):
+        days = 7
+    try:
+        report = PHASH_INDEX.report(days)
+    except Exception as e:
+        return jsonify({'code': -1, 'message': f'查询失败（是否已执行 sql/add_image_dhash.sql）: {e}'}), 500
+    report['worker'] = dict(PHASH_INDEX.stats(), pid=os.getpid())
+    report['content_index'] = CONTENT_INDEX.stats()
+    return jsonify({'code': 0, 'message': 'success', 'data': report})
+
+
+# 识图结果缓存：按 (图片标识, 提示词, 模型, json_output) 区分，两级（进程内 LRU + vision_result_cache 表）
+VISION_RESULT_CACHE = VisionResultCache(
+    get_db_connection,
+    ttl_seconds=int(os.getenv('VISION_CACHE_TTL_SECONDS', str(30 * 86400))),
+    memory_items=int(os.getenv('VISION_CACHE_MEMORY_ITEMS', '2000')),
+    max_rows=int(os.getenv('VISION_CACHE_MAX_ROWS', '200000')),
+)
+
+
+# 大请求体（内含 base64 原图）流式接收：图片边读边解码进临时文件并预处理，不整块进内存
+VISION_INTAKE = StreamIntake(
+    min_stream_bytes=int(os.getenv('VISION_STREAM_INTAKE_MIN_KB', '1024')) * 1024,
+    spool_bytes=int(os.getenv('VISION_STREAM_SPOOL_KB', '1024')) * 1024,
+    decode_slots=int(os.getenv('VISION_STREAM_DECODE_SLOTS', '2')),
+    max_side=VISION_RESIZE_MAX_PIXEL,
+    quality=VISION_JPEG_QUALITY,
+    keep_bytes=VISION_KEEP_ORIGINAL_BYTES,
+)
+
+
+# 同一时刻完全相同的识图调用（同图同提示词同模型）只发一次，其余请求等这一次的结果
+VISION_SINGLE_FLIGHT = SingleFlight('vision')
+# follower 最多等多久：leader 排队（VISION_QUEUE_MAX_WAIT）+ 拉图与智谱调用
+VISION_COALESCE_MAX_WAIT = float(os.getenv('VISION_COALESCE_MAX_WAIT', '120'))
+
+
+def _vision_cache_key(urls, prompt, model, json_output):
+    """返回 (实际模型名, 各图标识, 识图结果缓存键)。"""
+    from vision_api import DEFAULT_MODEL
+    model = (model or '').strip() or DEFAULT_MODEL
+    image_ids = [image_identity(u) for u in urls]
+    return model, image_ids, make_cache_key(image_ids, prompt, model, json_output)
+
+
+def _alias_cache_keys(entries):
+    """识图结果缓存没命中的项按 image_content_hash 把图片标识换成对方（c: ↔ u:）再算一个键：同一张图按 URL 识过、
+    这次传 base64（或反过来）也能命中。entries 为 [((model, image_ids, key), prompt, json_output)]，一条查询，
+    返回 {key: 别名键}，没有对应的不在结果里。"""
+    aliases = CONTENT_INDEX.aliases([i for (_, image_ids, _), _, _ in entries for i in image_ids])
+    if not aliases:
+        return {}
+    out = {}
+    for (model, image_ids, key), prompt, json_output in entries:
+        alt = [aliases.get(i, i) for i in image_ids]
+        if alt != list(image_ids):
+            out[key] = make_cache_key(alt, prompt, model, json_output)
+    return out
+
+
+def _reuse_alias_result(cache_key, result, prompt, json_output):
+    """别名键命中的结果写回本键，下次直接命中。"""
+    model, image_ids, key = cache_key
+    CONTENT_INDEX.count('result_reuses')
+    VISION_RESULT_CACHE.put(key, result, model=model, prompt=prompt, json_output=json_output, image_ids=image_ids)
+
+
+def _describe_cached(urls, prompt, model=None, json_output=False, api_key=None, skip_cache=False, cache_key=None):
+    """带识图结果缓存调用 describe_image：命中直接返回；未命中时同键并发请求合并为一次调用，
+    leader 占一个大模型名额调用，成功则写缓存，其余请求不占名额等它的结果。
+    skip_cache=True 时不读缓存（强制重打标，或调用方已批量查过），成功结果仍写回覆盖旧值。
+    cache_key 为调用方已算好的 _vision_cache_key 结果，避免对大 base64 重复求哈希。
+    返回 (success, result, from_cache)；进不了大模型队列或等合并结果超时抛 VisionQueueRejected。
+    """
+    from vision_api import describe_image
+    cache_key = cache_key or _vision_cache_key(urls, prompt, model, json_output)
+    model, image_ids, key = cache_key
+    if not skip_cache:
+        hit = VISION_RESULT_CACHE.get(key)
+        if hit is not None:
+            return True, hit, True
+        alias = _alias_cache_keys([(cache_key, prompt, json_output)]).get(key)
+        hit = VISION_RESULT_CACHE.get(alias) if alias else None
+        if hit is not None:
+            _reuse_alias_result(cache_key, hit, prompt, json_output)
+            return True, hit, True
+
+    def call():
+        with _vision_slot() as wait_ms:
+            # 等模型自适应名额计入同一份排队预算：已在调度器排了多久，这里就少等多久
+            budget = _vision_scheduler().max_wait - wait_ms / 1000.0
+            success, result = describe_image(
+                urls, prompt=prompt, response_format_json=json_output, model=model, api_key=api_key,
+                acquire_timeout=budget,
+            )
+        if success:
+            VISION_RESULT_CACHE.put(key, result, model=model, prompt=prompt, json_output=json_output, image_ids=image_ids)
+        return success, result
+
+    try:
+        (success, result), coalesced = VISION_SINGLE_FLIGHT.do(key, call, VISION_COALESCE_MAX_WAIT)
+    except SingleFlightTimeout as e:
+        raise VisionQueueRejected(503, int(os.getenv('LANE_RETRY_AFTER', '10')), str(e))
+    if coalesced and has_request_context():
+        g.vision_coalesced = True
+    return success, result, False
+
+
 @app.route('/api/vision/describe', methods=['POST'])
 def vision_describe():
     """调用大模型对图片进行描述/判断。只接一个图片参数：你传什么 URL（或 base64），就按什么查缓存、拉图、打标。
     请求体（任选一种或混合）:
       - 混合：images 数组，每项为 { "url": "..." } 或 { "base64": "...", "mime": "image/png" } 或直接字符串 URL/data URL
       - 仅 URL：image_url 或 image_urls（传外部唯一标识 URL 可命中缓存，传本地/容器 URL 则查不到缓存会调模型）
-      - 仅 Base64：image_base64 或 image_base64_list（无法按 URL 查缓存，会调模型）
-      - prompt 可选；json_output 可选；skip_cache 可选（true 时跳过 image_assets 缓存，强制重新调模型，用于换了提示词后重打标）。
+      - 仅 Base64：image_base64 或 image_base64_list（按图片内容哈希查识图结果缓存；经 image_content_hash 关联到 URL 的，
+        与同一张图按 URL 请求共用 image_assets 标签和识图结果）
+      - prompt 可选；json_output 可选；skip_cache 可选（true 时跳过所有缓存，强制重新调模型，结果仍会写回缓存）。
+      - reuse_asset_labels 可选：true 时复用 image_assets 里的轮播图标签（轮播图打标工作流用）。不传时仅在未传 prompt
+        或 prompt 即轮播图打标提示词时复用，其它提示词只查按提示词区分的识图结果缓存，不会错命中轮播图标签。
       - model 可选：智谱模型名，如 glm-4.6v（资源包）、glm-4v-flash（免费）。不传用后端默认。可借此把不同工作流指定不同模型，分开占并发（如整理用 4.6v、出图用 4v-flash，各 10 并发）。
     拉图+智谱可能需 90s+，请将 HTTP 客户端 Timeout 设为至少 120 秒（响应头 X-Recommended-Timeout: 120000）。
+    大模型调用队列满时返回 429、排队超时返回 503（均带 Retry-After）；排过队的响应带 X-Queue-Wait-Ms。
+    异步：URL 带 ?async=1 或请求体 async=true（可带 callback_url）时立即返回 202 + job_id，结果见 /api/vision/jobs/<job_id>。
+    请求体不小于 VISION_STREAM_INTAKE_MIN_KB 时流式接收（见 stream_intake.py），base64 图片不整块进内存。
+    也可用 multipart/form-data 直接传图片二进制（客户端自己拉图的 lovart 等，省掉 base64 的 1/3 体积）：
+      - 文件分段名 image / images（可多个，按顺序），边收边算内容哈希，与同一张图传 base64 命中同一条识图结果缓存
+      - 其余参数作同名文本字段（prompt、json_output=true …），或整体放进 payload 字段（JSON，与上面的请求体相同）
     """
     try:
-        data = request.json or {}
-        urls = _parse_vision_image_inputs(data)
-        if not urls:
+        is_async = request.args.get('async') == '1'
+        if not is_async:
+            # 队列已满时在读取（可能很大的）请求体之前就拒绝
+            _vision_scheduler().check_admission()
+        data = VISION_INTAKE.read(request)
+        if is_async or data.get('async') is True:
+            return _submit_vision_job('describe', data)
+        return _vision_response(*_run_vision_describe(data))
+    except VisionQueueRejected as e:
+        return _vision_busy_response(e, _vision_response)
+    except IntakeError as e:
+        return _vision_response({'code': -1, 'message': str(e)}, e.status)
+    except Exception as e:
+        return _vision_response({'code': -1, 'message': str(e)}, 500)
+
+
+def _run_vision_describe(data):
+    """/api/vision/describe 的执行体（同步接口与异步任务共用），返回 (响应体, HTTP 状态码)。"""
+    urls = _parse_vision_image_inputs(data)
+    if not urls:
+        return {
+            'code': -1,
+            'message': '缺少图片：请传 image_url / image_urls 或 image_base64 / image_base64_list（后端无法访问外网时用 base64）'
+        }, 400
+
+    skip_cache = data.get('skip_cache') is True
+    # 统一：字面 \n（preview-lab 旧场景单行带转义）转为真实换行，与多行存法一致
+    raw_prompt = (data.get('prompt') or '').strip().replace('\\n', '\n')
+    reuse_asset_labels = data.get('reuse_asset_labels')
+    if reuse_asset_labels is None:
+        reuse_asset_labels = not raw_prompt or raw_prompt == CAROUSEL_LABEL_PROMPT
+    prompt = raw_prompt
+    if not prompt:
+        prompt = '请分别描述这几张图片的内容' if len(urls) > 1 else '请描述这张图片的内容'
+    json_output = data.get('json_output') is True
+    model = (data.get('model') or '').strip() or None
+    # 图片标识（base64 要对解码后字节求哈希）只算一次，查 image_assets 标签与识图结果缓存共用
+    cache_key = _vision_cache_key(urls, prompt, model, json_output)
+    # image_assets 轮播图标签只按图片查，不含 prompt，因此只在明确是轮播图打标时复用
+    cached, near_duplicate = (None, False) if (skip_cache or reuse_asset_labels is not True) \
+        else _get_cached_vision_content(urls, cache_key[1])
+    if cached is not None:
+        if len(urls) == 1:
+            cached = _normalize_single_image_vision_content(cached)
+        payload = {'content': cached, 'cached': True}
+        if near_duplicate:
+            payload['near_duplicate'] = True
+        return {'code': 0, 'message': 'success', 'data': payload}, 200
+
+    from vision_api import get_api_key
+    if not get_api_key():
+        return {'code': -1, 'message': '未配置 BIGMODEL_API_KEY'}, 503
+    success, result, from_cache = _describe_cached(
+        urls, prompt, model=model, json_output=json_output, skip_cache=skip_cache, cache_key=cache_key
+    )
+    if success:
+        if len(urls) == 1:
+            result = _normalize_single_image_vision_content(result)
+        payload = {'content': result}
+        if from_cache:
+            payload['cached'] = True
+        return {'code': 0, 'message': 'success', 'data': payload}, 200
+    return {'code': -1, 'message': str(result)}, 500
+
+
+# 批量识图单次最多条数
+VISION_BATCH_MAX_ITEMS = int(os.getenv('VISION_BATCH_MAX_ITEMS', '50'))
+
+
+def _vision_item_error(index, item_id, code, message, retry_after=None):
+    out = {'index': index, 'id': item_id, 'code': code, 'message': message}
+    if retry_after is not None:
+        out['retry_after'] = retry_after
+    return out
+
+
+def _vision_item_ok(index, item_id, urls, content, cached, near_duplicate=False):
+    if len(urls) == 1:
+        content = _normalize_single_image_vision_content(content)
+    data = {'content': content}
+    if cached:
+        data['cached'] = True
+    if near_duplicate:
+        data['near_duplicate'] = True
+    return {'index': index, 'id': item_id, 'code': 0, 'message': 'success', 'data': data}
+
+
+def _run_in_lane(lane, fn, *args):
+    """在空的上下文里带上请求所在的道执行（线程池线程不继承请求上下文，也不应共享 g）。"""
+    def run():
+        token = set_current_lane(lane)
+        try:
+            return fn(*args)
+        finally:
+            reset_current_lane(token)
+    return contextvars.Context().run(run)
+
+
+def _lane_task(lane, fn):
+    """提交到线程池的任务：在提交时绑定当前 trace（线程池线程拿不到请求的 contextvars），执行时再进道。"""
+    bound = tracing.bind(fn)
+
+    def task(*args):
+        return _run_in_lane(lane, bound, *args)
+    return task
+
+
+@app.route('/api/vision/describe-batch', methods=['POST'])
+def vision_describe_batch():
+    """批量识图：一次提交多条互相独立的 (图片, 提示词)，按完成先后以 NDJSON 流式返回每条结果。
+    请求体:
+      - items 必填：数组，每项与 /api/vision/describe 的请求体相同（image_url / images / image_base64 …、prompt、
+        json_output、model、skip_cache、reuse_asset_labels），可带 id 原样回传
+      - 顶层的 prompt / json_output / model / skip_cache / reuse_asset_labels 作为各项的默认值
+    处理：先一次批量查 image_assets 标签与识图结果缓存（各一条 IN 查询），命中的立即返回；未命中的在本道大模型
+    调度器下并发调用（单批并发不超过该道上限，不会自己挤爆队列），同图同提示词的并发请求仍会合并。
+    响应（application/x-ndjson，每行一个 JSON）:
+      - 每项一行：{ index, id, code, message, data: { content, cached? } }；失败时 code 非 0，排队被拒时带 retry_after
+      - 最后一行：{ done: true, total, succeeded, failed, cached }
+    单批最多 VISION_BATCH_MAX_ITEMS 条。请求整体层面的错误（参数不对、队列已满）仍按普通 JSON 返回。
+    multipart/form-data：payload 字段放上面的 JSON，各项用 "file": "<分段名>" / "files": [...] 引用同一请求里的
+    图片文件分段；不传 items 时每个 image / images 文件分段各算一项（共用顶层 prompt 等参数）。
+    """
+    try:
+        _vision_scheduler().check_admission()
+        data = VISION_INTAKE.read(request)
+        items = data.get('items')
+        if items is None and request.mimetype == 'multipart/form-data' and data.get('images'):
+            items = [{'images': [image]} for image in data['images']]
+        if not isinstance(items, list) or not items:
+            return _vision_response({'code': -1, 'message': '请传 items 数组'}, 400)
+        if len(items) > VISION_BATCH_MAX_ITEMS:
             return _vision_response({
-                'code': -1,
-                'message': '缺少图片：请传 image_url / image_urls 或 image_base64 / image_base64_list（后端无法访问外网时用 base64）'
+                'code': -1, 'message': f'items 最多 {VISION_BATCH_MAX_ITEMS} 条，当前 {len(items)} 条'
             }, 400)
+    except VisionQueueRejected as e:
+        return _vision_busy_response(e, _vision_response)
+    except IntakeError as e:
+        return _vision_response({'code': -1, 'message': str(e)}, e.status)
+    except Exception as e:
+        return _vision_response({'code': -1, 'message': str(e)}, 400)
+
+    defaults = {k: data.get(k) for k in ('prompt', 'json_output', 'model', 'skip_cache', 'reuse_asset_labels')}
+    results = {}   # index -> 已得到的结果行（缓存命中或参数错误）
+    pending = []   # (index, id, urls, prompt, json_output, model, skip_cache, cache_key)
+    asset_lookup = []  # (index, id, urls, hashes)
+    asset_candidates = []  # (index, id, urls, image_ids)：要查 image_assets 标签的项
+    for i, raw in enumerate(items):
+        item = dict(defaults)
+        if isinstance(raw, str):
+            raw = {'image_url': raw}
+        if not isinstance(raw, dict):
+            results[i] = _vision_item_error(i, None, -1, '每项应为对象或图片 URL 字符串')
+            continue
+        item.update({k: v for k, v in raw.items() if v is not None})
+        item_id = item.get('id')
+        urls = _parse_vision_image_inputs(item)
+        if not urls:
+            results[i] = _vision_item_error(i, item_id, -1, '缺少图片')
+            continue
+        skip_cache = item.get('skip_cache') is True
+        raw_prompt = (item.get('prompt') or '').strip().replace('\\n', '\n')
+        reuse_asset_labels = item.get('reuse_asset_labels')
+        if reuse_asset_labels is None:
+            reuse_asset_labels = not raw_prompt or raw_prompt == CAROUSEL_LABEL_PROMPT
+        prompt = raw_prompt or ('请分别描述这几张图片的内容' if len(urls) > 1 else '请描述这张图片的内容')
+        json_output = item.get('json_output') is True
+        model = (item.get('model') or '').strip() or None
+        key = _vision_cache_key(urls, prompt, model, json_output)
+        pending.append((i, item_id, urls, prompt, json_output, model, skip_cache, key))
+        if not skip_cache and reuse_asset_labels is True:
+            asset_candidates.append((i, item_id, urls, key[1]))
+
+    # base64 图片按内容哈希关联 URL（一条查询），之后与 URL 一样查 image_assets 标签
+    content_shas = [image_id[2:] for _, _, urls, ids in asset_candidates if not _all_http_urls(urls)
+                    for image_id in ids if image_id.startswith('c:')]
+    content_map = CONTENT_INDEX.url_hashes_for(content_shas) if content_shas else {}
+    for i, item_id, urls, ids in asset_candidates:
+        hashes = _asset_label_hashes(urls, ids, content_map)
+        if hashes:
+            asset_lookup.append((i, item_id, urls, hashes))
+
+    # 批量查缓存：image_assets 标签一条查询、识图结果缓存一条查询（没命中的再按 URL ↔ 内容哈希换标识查一次）
+    row_map = {}
+    asset_hashes = {i: hashes for i, _, _, hashes in asset_lookup}
+    if asset_lookup:
+        row_map = _lookup_asset_labels([h for _, _, _, hs in asset_lookup for h in hs])
+        for i, item_id, urls, hashes in asset_lookup:
+            content = _assemble_asset_labels(hashes, row_map)
+            if content is not None:
+                results[i] = _vision_item_ok(i, item_id, urls, content, True)
+                if not _all_http_urls(urls):
+                    CONTENT_INDEX.count('label_reuses')
+    lookup_keys = [p[7][2] for p in pending if p[0] not in results and not p[6]]
+    hits = VISION_RESULT_CACHE.get_many(lookup_keys) if lookup_keys else {}
+    alias_entries = [(p[7], p[3], p[4]) for p in pending if p[0] not in results and not p[6] and p[7][2] not in hits]
+    alias_keys = _alias_cache_keys(alias_entries) if alias_entries else {}
+    if alias_keys:
+        alias_hits = VISION_RESULT_CACHE.get_many(list(set(alias_keys.values())))
+        for cache_key, prompt, json_output in alias_entries:
+            alias = alias_keys.get(cache_key[2])
+            if alias in alias_hits:
+                hits[cache_key[2]] = alias_hits[alias]
+                _reuse_alias_result(cache_key, alias_hits[alias], prompt, json_output)
+    misses = []
+    for p in pending:
+        i, item_id, urls = p[0], p[1], p[2]
+        if i in results:
+            continue
+        if not p[6] and p[7][2] in hits:
+            results[i] = _vision_item_ok(i, item_id, urls, hits[p[7][2]], True)
+        else:
+            misses.append(p)
 
-        # 缓存键仅按 URL，不含 prompt；传 skip_cache=true 可强制重新打标（如换了提示词）
-        skip_cache = data.get('skip_cache') is True
-        cached = None if skip_cache else _get_cached_vision_content(urls)
-        if cached is not None:
-            if len(urls) == 1:
-                cached = _normalize_single_image_vision_content(cached)
-            return _vision_response({
-                'code': 0,
-                'message': 'success',
-                'data': {'content': cached, 'cached': True}
-            })
+    from vision_api import get_api_key
+    has_key = bool(get_api_key())
+    lane = current_lane()
+    scheduler = _vision_scheduler()
 
-        from vision_api import describe_image, get_api_key
-        if not get_api_key():
-            return _vision_response({'code': -1, 'message': '未配置 BIGMODEL_API_KEY'}, 503)
-        prompt = (data.get('prompt') or '').strip()
-        if not prompt:
-            prompt = '请分别描述这几张图片的内容' if len(urls) > 1 else '请描述这张图片的内容'
-        # 统一：字面 \n（preview-lab 旧场景单行带转义）转为真实换行，与多行存法一致
-        prompt = prompt.replace('\\n', '\n')
-        json_output = data.get('json_output') is True
-        model = (data.get('model') or '').strip() or None
-        with VISION_LLM_SEMAPHORE:
-            success, result = describe_image(urls, prompt=prompt, response_format_json=json_output, model=model)
+    def near_duplicate_one(p):
+        """两级缓存都没命中的轮播图打标项，先按感知哈希找近似的已打标图片（仅全为 URL 的项）。"""
+        i, item_id, urls = p[0], p[1], p[2]
+        if i not in asset_hashes or not _all_http_urls(urls):
+            return None
+        try:
+            content = _near_duplicate_asset_labels(urls, asset_hashes[i], row_map)
+        except Exception as e:
+            log.warning("近似图复用查询失败: %s", e)
+            return None
+        return None if content is None else _vision_item_ok(i, item_id, urls, content, True, near_duplicate=True)
+
+    def describe_one(p):
+        row = near_duplicate_one(p)
+        if row is not None:
+            return row
+        i, item_id, urls, prompt, json_output, model, _, key = p
+        try:
+            success, result, _ = _describe_cached(
+                urls, prompt, model=model, json_output=json_output, skip_cache=True, cache_key=key
+            )
+        except VisionQueueRejected as e:
+            return _vision_item_error(i, item_id, -1, str(e), e.retry_after)
+        except Exception as e:
+            return _vision_item_error(i, item_id, -1, str(e))
         if success:
-            if len(urls) == 1:
-                result = _normalize_single_image_vision_content(result)
-            return _vision_response({'code': 0, 'message': 'success', 'data': {'content': result}})
-        return _vision_response({'code': -1, 'message': str(result)}, 500)
-    except Exception as e:
-        return _vision_response({'code': -1, 'message': str(e)}, 500)
+            return _vision_item_ok(i, item_id, urls, result, False)
+        return _vision_item_error(i, item_id, -1, str(result))
 
+    def generate():
+        counts = {'total': len(items), 'succeeded': 0, 'failed': 0, 'cached': 0}
 
-# 规格图细分打标：从 preview-lab 拉提示词，固定地址
-PREVIEW_LAB_BASE = "http://preview-lab:5003"
+        def emit(row):
+            if row.get('code') == 0:
+                counts['succeeded'] += 1
+                if (row.get('data') or {}).get('cached'):
+                    counts['cached'] += 1
+            else:
+                counts['failed'] += 1
+            return json.dumps(row, ensure_ascii=False) + '\n'
+
+        for i in sorted(results):
+            yield emit(results[i])
+        if misses and not has_key:
+            for p in misses:
+                yield emit(near_duplicate_one(p) or _vision_item_error(p[0], p[1], -1, '未配置 BIGMODEL_API_KEY'))
+            misses.clear()
+        if misses:
+            # 单批并发不超过本道大模型并发上限，其余在本批内排队，不占调度器的等待队列
+            executor = ThreadPoolExecutor(max_workers=min(len(misses), scheduler.max_concurrent))
+            try:
+                futures = [executor.submit(_lane_task(lane, describe_one), p) for p in misses]
+                for fut in as_completed(futures):
+                    yield emit(fut.result())
+            finally:
+                # 客户端断开时不再发起尚未开始的调用
+                executor.shutdown(wait=False, cancel_futures=True)
+        yield json.dumps(dict(counts, done=True), ensure_ascii=False) + '\n'
+
+    resp = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    resp.headers['X-Recommended-Timeout'] = str(VISION_DESCRIBE_RECOMMENDED_TIMEOUT_MS)
+    # 让 nginx 等反向代理逐行转发，不攒满缓冲区再发
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+# 异步任务：任务类型 -> 对应同步接口（用于按同样规则判定所在的道）
+VISION_JOB_ROUTES = {
+    'describe': '/api/vision/describe',
+    'spec_sublabel': '/api/vision/spec-sublabel',
+    'ai_recommend': '/api/design/ai-recommend',
+}
+# 长轮询最长等待秒数
+VISION_JOB_MAX_WAIT = float(os.getenv('VISION_JOB_MAX_WAIT', '30'))
+VISION_JOB_RUNNER = JobRunner(
+    JobStore(get_db_connection),
+    {
+        # 请求体里的 PreparedImage 按 dump_prepared 存，执行前还原，缓存标识仍按原图内容哈希
+        'describe': lambda data: _run_vision_describe(load_prepared(data)),
+        'spec_sublabel': lambda data: _run_vision_spec_sublabel(load_prepared(data)),
+        'ai_recommend': lambda data: _run_ai_recommend(load_prepared(data)),
+    },
+    max_workers=int(os.getenv('VISION_JOB_WORKERS') or VISION_LLM_WORKER_CONCURRENT),
+    poll_interval=float(os.getenv('VISION_JOB_POLL_INTERVAL', '5')),
+    stale_seconds=int(os.getenv('VISION_JOB_STALE_SECONDS', '300')),
+    retry_exceptions=(VisionQueueRejected,),
+    lane_runner=_run_in_lane,
+    retention_days=int(os.getenv('VISION_JOB_RETENTION_DAYS', '7')),
+    callback_hosts=(os.getenv('VISION_JOB_CALLBACK_HOSTS') or '').split(','),
+)
 
 
-def _fetch_prompt_from_preview_lab(scene: str, timeout: int = 10):
-    """GET preview-lab 当前提示词，返回 content 字符串。失败返回 (None, error_msg)。"""
-    url = f"{PREVIEW_LAB_BASE}/api/prompt/current?scene={urllib.parse.quote(scene)}"
+def _submit_vision_job(kind, data):
+    """把请求体存成异步任务，立即返回 202 + job_id。callback_url 可选：完成后 POST 结果过去。"""
+    data = dict(data)
+    data.pop('async', None)
+    callback_url = (data.pop('callback_url', None) or '').strip() or None
+    if callback_url and not VISION_JOB_RUNNER.callback_allowed(callback_url):
+        return _vision_response(
+            {'code': -1, 'message': 'callback_url 须为 http(s) 地址，且域名在 VISION_JOB_CALLBACK_HOSTS 内'}, 400)
+    lane = LANE_CLASSIFIER.classify(VISION_JOB_ROUTES[kind], request.headers)
     try:
-        r = requests.get(url, timeout=timeout)
-        if r.status_code != 200:
-            return None, f"preview-lab HTTP {r.status_code}"
-        data = r.json() or {}
-        content = (data.get("data") or {}).get("content") or ""
-        if isinstance(content, str):
-            content = content.replace("\\n", "\n")
-        return (content, None)
-    except requests.RequestException as e:
-        return None, str(e)
-    except Exception as e:
-        return None, str(e)
+        job_id = VISION_JOB_RUNNER.submit(kind, dump_prepared(data), lane=lane, callback_url=callback_url)
+    except JobStoreUnavailable as e:
+        return _vision_response({'code': -1, 'message': str(e)}, 503)
+    resp, status = _vision_response({
+        'code': 0,
+        'message': 'accepted',
+        'data': {'job_id': job_id, 'kind': kind, 'status': 'queued', 'status_url': f'/api/vision/jobs/{job_id}'},
+    }, 202)
+    resp.headers['Location'] = f'/api/vision/jobs/{job_id}'
+    return resp, status
+
+
+@app.route('/api/vision/jobs', methods=['POST'])
+def vision_job_create():
+    """提交异步任务。请求体: kind（describe / spec_sublabel / ai_recommend）, payload（与对应同步接口的请求体相同）,
+    callback_url 可选。返回 202 + job_id；结果用 GET /api/vision/jobs/<job_id>（可 ?wait=秒 长轮询）或回调获取。"""
+    try:
+        data = VISION_INTAKE.read_json(request)
+    except IntakeError as e:
+        return _vision_response({'code': -1, 'message': str(e)}, e.status)
+    kind = (data.get('kind') or '').strip()
+    if kind not in VISION_JOB_ROUTES:
+        return _vision_response({'code': -1, 'message': f"kind 须为 {' / '.join(VISION_JOB_ROUTES)}"}, 400)
+    payload = data.get('payload')
+    if not isinstance(payload, dict):
+        return _vision_response({'code': -1, 'message': 'payload 须为对象'}, 400)
+    if data.get('callback_url'):
+        payload = dict(payload, callback_url=data['callback_url'])
+    return _submit_vision_job(kind, payload)
+
+
+@app.route('/api/vision/jobs/<job_id>', methods=['GET'])
+def vision_job_get(job_id):
+    """查询异步任务。?wait=N 时长轮询：最多等 N 秒（上限 VISION_JOB_MAX_WAIT）直到任务完成。
+    完成后 data.result 即同步接口的响应体，data.http_status 为同步接口会返回的状态码。"""
+    try:
+        wait = min(max(float(request.args.get('wait') or 0), 0.0), VISION_JOB_MAX_WAIT)
+    except ValueError:
+        wait = 0.0
+    try:
+        VISION_JOB_RUNNER.start()
+        row = VISION_JOB_RUNNER.wait(job_id, wait) if wait > 0 else VISION_JOB_RUNNER.get(job_id)
+    except JobStoreUnavailable as e:
+        return jsonify({'code': -1, 'message': str(e)}), 503
+    if not row:
+        return jsonify({'code': -1, 'message': '任务不存在'}), 404
+    return jsonify({'code': 0, 'message': 'success', 'data': job_view(row)})
+
+
+# 规格图细分打标：从 preview-lab 拉提示词（PREVIEW_LAB_BASE，默认容器内地址）。
+# 按场景缓存：SPEC_PROMPT_CACHE_TTL 秒内直接用（0 不缓存），过期先用旧内容、后台条件请求重验证；
+# preview-lab 不可用时继续用最后一次拉到的内容，最多 SPEC_PROMPT_MAX_STALE_SECONDS 秒（0 不限）
+PROMPT_REGISTRY = PromptRegistry(
+    PREVIEW_LAB_BASE,
+    ttl_seconds=float(os.getenv('SPEC_PROMPT_CACHE_TTL', '60')),
+    timeout=float(os.getenv('PREVIEW_LAB_TIMEOUT', '10')),
+    refresh_interval=float(os.getenv('SPEC_PROMPT_REFRESH_INTERVAL', '0')) or None,
+    max_stale_seconds=float(os.getenv('SPEC_PROMPT_MAX_STALE_SECONDS', str(7 * 86400))),
+    # 失效标记目录，各 gunicorn worker 共用（同 METRICS_DIR，同一容器内共享即可）
+    shared_dir=os.getenv('SPEC_PROMPT_INVALIDATION_DIR') or os.path.join(
+        tempfile.gettempdir(), 'goods_review_prompt_invalidations'),
+)
+
+
+def _fetch_prompt_from_preview_lab(scene: str):
+    """取 preview-lab 当前提示词（走 PROMPT_REGISTRY 缓存）。返回 (content, info, error_msg)，
+    info 为 {scene, version, age_seconds, validated_seconds_ago, stale}，失败时 content / info 为 None。"""
+    return PROMPT_REGISTRY.get(scene)
+
+
+@app.route('/api/vision/prompts/invalidate', methods=['POST'])
+def vision_prompts_invalidate():
+    """preview-lab 发布提示词后调用，丢弃缓存的提示词。请求体: scene（不传则全部）, version（可选，
+    缓存的就是该版本则保留）。接到请求的 worker 立即生效（dropped 为本 worker 丢弃的场景），
+    其余 worker 经 SPEC_PROMPT_INVALIDATION_DIR 下的失效标记约 1 秒内跟进。需 ADMIN_TOKEN（同诊断接口）。"""
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    data = request.json or {}
+    scene = (data.get('scene') or '').strip() or None
+    version = data.get('version')
+    dropped = PROMPT_REGISTRY.invalidate(scene, None if version in (None, '') else version)
+    return jsonify({'code': 0, 'message': 'success', 'data': {'dropped': dropped}})
 
 
 def _parse_json_from_vision_content(content):
@@ -1163,87 +2204,213 @@ def _parse_json_from_vision_content(content):
         return None
 
 
+# 投机模式：subtype 与 dimension 两轮并行调用，multi_spec 时丢弃 dimension 结果。
+# 单规格占多数的品类省掉一轮串行等待，代价是 multi_spec 时多占一次大模型名额。
+# 默认关闭；请求体 speculative=true/false 优先于 VISION_SPEC_SPECULATIVE。
+VISION_SPEC_SPECULATIVE = os.getenv('VISION_SPEC_SPECULATIVE', '0').strip().lower() in ('1', 'true', 'yes')
+
+
+def _as_flag(value, default):
+    """请求体里的开关：true / 1 / "true" / "1" / "yes" 为真，false / 0 / "false" / "0" / "no" / "" 为假，None 取 default。"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+class _SpecRoundStats:
+    """按 (品类, 模式) 统计 spec-sublabel 每轮耗时，供比较串行与投机模式哪个更快。"""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self._window = window
+        self._groups = {}
+
+    def record(self, category, mode, subtype_ms, dimension_ms, total_ms, spec_subtype, wasted):
+        with self._lock:
+            g = self._groups.setdefault((category, mode), {
+                'count': 0, 'single_spec': 0, 'speculative_wasted': 0,
+                'subtype_ms_sum': 0.0, 'dimension_ms_sum': 0.0, 'dimension_count': 0,
+                'total_ms_sum': 0.0, 'recent_total_ms': deque(maxlen=self._window),
+            })
+            g['count'] += 1
+            g['single_spec'] += 1 if spec_subtype == 'single_spec' else 0
+            g['speculative_wasted'] += 1 if wasted else 0
+            g['subtype_ms_sum'] += subtype_ms
+            if dimension_ms is not None:
+                g['dimension_ms_sum'] += dimension_ms
+                g['dimension_count'] += 1
+            g['total_ms_sum'] += total_ms
+            g['recent_total_ms'].append(total_ms)
+
+    def stats(self):
+        out = {}
+        with self._lock:
+            for (category, mode), g in self._groups.items():
+                recent = sorted(g['recent_total_ms'])
+                n = g['count']
+                out.setdefault(category, {})[mode] = {
+                    'count': n,
+                    'single_spec_ratio': round(g['single_spec'] / n, 3),
+                    'speculative_wasted': g['speculative_wasted'],
+                    'avg_subtype_ms': round(g['subtype_ms_sum'] / n, 1),
+                    'avg_dimension_ms': round(g['dimension_ms_sum'] / g['dimension_count'], 1) if g['dimension_count'] else None,
+                    'avg_total_ms': round(g['total_ms_sum'] / n, 1),
+                    'p50_total_ms': round(recent[len(recent) // 2], 1),
+                    'p95_total_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1),
+                }
+        return out
+
+
+SPEC_ROUND_STATS = _SpecRoundStats()
+
+
 @app.route('/api/vision/spec-sublabel', methods=['POST'])
 def vision_spec_sublabel():
     """规格图细分打标：对一张已确定为规格图的图片，内部最多两轮打标（subtype → 若 single_spec 再 dimension）。
-    请求体: image_url（必填）, scene_subtype（默认 spec_subtype）, scene_dimension（默认 spec_dimension）。
-    提示词从 preview-lab 按场景名拉取。返回 { spec_subtype, spec_dimensions }，不改写大模型原始维度内容。
+    请求体: image_url（必填）, scene_subtype（默认 spec_subtype）, scene_dimension（默认 spec_dimension）,
+    category（可选，品类 config_key，仅用于分品类统计耗时）, speculative（可选，true 时两轮并行，见 VISION_SPEC_SPECULATIVE）。
+    提示词从 preview-lab 按场景名拉取（本地缓存）。返回 { spec_subtype, spec_dimensions, mode, timing_ms, prompts }，不改写大模型原始维度内容；
+    prompts 为本次所用各轮提示词的 {scene, version, age_seconds, validated_seconds_ago, stale}。
+    异步：?async=1 或请求体 async=true 时立即返回 202 + job_id（同 /api/vision/describe）。
     """
     try:
         data = request.json or {}
-        image_url = (data.get("image_url") or "").strip()
-        if not image_url or not image_url.startswith(("http://", "https://", "data:image/")):
-            return _vision_response({
-                "code": -1,
-                "message": "请传 image_url（必填）"
-            }, 400)
-        scene_subtype = (data.get("scene_subtype") or "spec_subtype").strip() or "spec_subtype"
-        scene_dimension = (data.get("scene_dimension") or "spec_dimension").strip() or "spec_dimension"
-
-        from vision_api import describe_image, get_api_key
-        if not get_api_key():
-            return _vision_response({"code": -1, "message": "未配置 BIGMODEL_API_KEY"}, 503)
-
-        # 第一轮：subtype（不兜底，拉不到或为空直接报错，由工作流暴露）
-        prompt_subtype, err = _fetch_prompt_from_preview_lab(scene_subtype)
-        if err:
-            return _vision_response({"code": -1, "message": f"拉取 subtype 提示词失败: {err}"}, 502)
-        if not (prompt_subtype and str(prompt_subtype).strip()):
-            return _vision_response(
-                {"code": -1, "message": "拉取 subtype 提示词失败：未配置或内容为空，请在 preview-lab 配置 spec_subtype 场景"},
-                502,
-            )
-        with VISION_LLM_SEMAPHORE:
-            success, result = describe_image(
-                image_url,
-                prompt=prompt_subtype,
-                response_format_json=True,
-            )
-            if not success:
-                return _vision_response({
-                    "code": 0,
-                    "message": "success",
-                    "data": {"spec_subtype": None, "spec_dimensions": None, "error": str(result)},
-                })
-            obj = _parse_json_from_vision_content(result)
-            spec_subtype = "single_spec"
-            if obj and isinstance(obj.get("spec_subtype"), str):
-                if obj["spec_subtype"] in ("multi_spec", "single_spec"):
-                    spec_subtype = obj["spec_subtype"]
-
-            spec_dimensions = None
-            if spec_subtype == "single_spec":
-                prompt_dim, err = _fetch_prompt_from_preview_lab(scene_dimension)
-                if err:
-                    return _vision_response({
-                        "code": -1,
-                        "message": f"拉取 dimension 提示词失败: {err}",
-                    }, 502)
-                if not (prompt_dim and str(prompt_dim).strip()):
-                    return _vision_response({
-                        "code": -1,
-                        "message": "拉取 dimension 提示词失败：未配置或内容为空，请在 preview-lab 配置 spec_dimension 场景",
-                    }, 502)
-                success2, result2 = describe_image(
-                    image_url,
-                    prompt=prompt_dim,
-                    response_format_json=True,
-                )
-                if success2 and result2:
-                    dim_obj = _parse_json_from_vision_content(result2)
-                    # 只做包装：大模型返回的维度对象原样放入 spec_dimensions，不做单位换算或字段重写
-                    if dim_obj is not None and isinstance(dim_obj, dict):
-                        spec_dimensions = dim_obj
-
-        return _vision_response({
-            "code": 0,
-            "message": "success",
-            "data": {"spec_subtype": spec_subtype, "spec_dimensions": spec_dimensions},
-        })
+        if request.args.get('async') == '1' or data.get('async') is True:
+            return _submit_vision_job('spec_sublabel', data)
+        return _vision_response(*_run_vision_spec_sublabel(data))
+    except VisionQueueRejected as e:
+        return _vision_busy_response(e, _vision_response)
     except Exception as e:
         return _vision_response({"code": -1, "message": str(e)}, 500)
 
 
+@app.route('/api/vision/spec-sublabel/stats', methods=['GET'])
+def vision_spec_sublabel_stats():
+    """本 worker 的 spec-sublabel 分品类、分模式（sequential / speculative）耗时统计与提示词缓存情况。"""
+    return jsonify({
+        'code': 0,
+        'message': 'success',
+        'data': {'pid': os.getpid(), 'rounds': SPEC_ROUND_STATS.stats(), 'prompts': PROMPT_REGISTRY.stats()},
+    })
+
+
+def _spec_prompt(scene, label, prompt_infos):
+    """取一个场景的提示词，版本信息记入 prompt_infos[label]；拉不到或为空返回 (None, 错误响应)。"""
+    prompt, info, err = _fetch_prompt_from_preview_lab(scene)
+    if err:
+        return None, ({"code": -1, "message": f"拉取 {label} 提示词失败: {err}"}, 502)
+    if not (prompt and str(prompt).strip()):
+        return None, (
+            {"code": -1, "message": f"拉取 {label} 提示词失败：未配置或内容为空，请在 preview-lab 配置 {scene} 场景"},
+            502,
+        )
+    prompt_infos[label] = info
+    return prompt, None
+
+
+def _timed_describe(image_url, prompt):
+    t0 = time.perf_counter()
+    success, result, _ = _describe_cached([image_url], prompt, json_output=True)
+    return success, result, (time.perf_counter() - t0) * 1000
+
+
+def _run_vision_spec_sublabel(data):
+    """/api/vision/spec-sublabel 的执行体（同步接口与异步任务共用），返回 (响应体, HTTP 状态码)。"""
+    image_url = (data.get("image_url") or "").strip()
+    if not image_url or not image_url.startswith(("http://", "https://", "data:image/")):
+        return {"code": -1, "message": "请传 image_url（必填）"}, 400
+    scene_subtype = (data.get("scene_subtype") or "spec_subtype").strip() or "spec_subtype"
+    scene_dimension = (data.get("scene_dimension") or "spec_dimension").strip() or "spec_dimension"
+    category = (str(data.get("category") or "").strip() or "default")[:64]
+    speculative = _as_flag(data.get("speculative"), VISION_SPEC_SPECULATIVE)
+
+    from vision_api import get_api_key
+    if not get_api_key():
+        return {"code": -1, "message": "未配置 BIGMODEL_API_KEY"}, 503
+
+    # 第一轮：subtype（不兜底，拉不到或为空直接报错，由工作流暴露）
+    prompt_infos = {}
+    prompt_subtype, err_resp = _spec_prompt(scene_subtype, "subtype", prompt_infos)
+    if err_resp:
+        return err_resp
+    prompt_dim = None
+    if speculative:
+        # 投机模式下 dimension 提示词拉不到就退回串行，不因投机失败整单报错
+        prompt_dim, err_resp = _spec_prompt(scene_dimension, "dimension", prompt_infos)
+        speculative = prompt_dim is not None
+
+    t0 = time.perf_counter()
+    executor = dim_future = None
+    if speculative:
+        executor = ThreadPoolExecutor(max_workers=1)
+        dim_future = executor.submit(_lane_task(current_lane(), _timed_describe), image_url, prompt_dim)
+    try:
+        success, result, subtype_ms = _timed_describe(image_url, prompt_subtype)
+        if not success:
+            return {
+                "code": 0,
+                "message": "success",
+                "data": {"spec_subtype": None, "spec_dimensions": None, "error": str(result), "prompts": prompt_infos},
+            }, 200
+        obj = _parse_json_from_vision_content(result)
+        spec_subtype = "single_spec"
+        if obj and isinstance(obj.get("spec_subtype"), str):
+            if obj["spec_subtype"] in ("multi_spec", "single_spec"):
+                spec_subtype = obj["spec_subtype"]
+
+        spec_dimensions = None
+        dimension_ms = None
+        dim_outcome = None
+        if spec_subtype == "single_spec":
+            if dim_future is not None:
+                try:
+                    dim_outcome = dim_future.result()
+                except VisionQueueRejected:
+                    # 投机那一轮没排上队：subtype 已完成，按串行再调一次
+                    dim_outcome = None
+            if dim_outcome is None:
+                if prompt_dim is None:
+                    prompt_dim, err_resp = _spec_prompt(scene_dimension, "dimension", prompt_infos)
+                    if err_resp:
+                        return err_resp
+                dim_outcome = _timed_describe(image_url, prompt_dim)
+            success2, result2, dimension_ms = dim_outcome
+            if success2 and result2:
+                dim_obj = _parse_json_from_vision_content(result2)
+                # 只做包装：大模型返回的维度对象原样放入 spec_dimensions，不做单位换算或字段重写
+                if dim_obj is not None and isinstance(dim_obj, dict):
+                    spec_dimensions = dim_obj
+    finally:
+        if executor is not None:
+            # multi_spec 时不等投机调用结束；它跑完仍会写识图结果缓存
+            dim_future.cancel()
+            executor.shutdown(wait=False)
+
+    total_ms = (time.perf_counter() - t0) * 1000
+    mode = "speculative" if speculative else "sequential"
+    SPEC_ROUND_STATS.record(
+        category, mode, subtype_ms, dimension_ms, total_ms, spec_subtype,
+        wasted=speculative and spec_subtype == "multi_spec",
+    )
+    return {
+        "code": 0,
+        "message": "success",
+        "data": {
+            "spec_subtype": spec_subtype,
+            "spec_dimensions": spec_dimensions,
+            "mode": mode,
+            "timing_ms": {
+                "subtype": round(subtype_ms),
+                "dimension": round(dimension_ms) if dimension_ms is not None else None,
+                "total": round(total_ms),
+            },
+            "prompts": prompt_infos,
+        },
+    }, 200
+
+
 # 单页「按 URL 查图片现状」用：与 N8N 轮播图打标一致的 5 字段 prompt
 CAROUSEL_LABEL_PROMPT = (
     '这是一张商品轮播图，请打标签。字段含义：image_type 四选一——product_display=以商品主体或使用场景为主的图（平铺/手持/挂拍/模特展示等）；spec=以尺寸/规格/参数为主的图（尺寸表、规格表、含 cm/inch/尺码/重量/表格/多行数据的图，只要主要内容是规格信息即判 spec）；material=材质特写、细节放大；other=其他。product_complete=商品主体是否完整可见。shape 仅当 image_type 为 product_display 时有效：rectangular/circular/irregular/unknown，否则填 unknown。design_desc=一句话描述。quality_ok=是否清晰可用。拿不准时保守判断。严格只输出 JSON：{"image_type":"","product_complete":false,"shape":"","design_desc":"","quality_ok":false}'
@@ -1324,13 +2491,11 @@ def image_lookup_retag():
     if not url_hash:
         return jsonify({'code': -1, 'message': 'url 无效'}), 400
     try:
-        from vision_api import describe_image, get_api_key
+        from vision_api import get_api_key
         if not get_api_key():
             return jsonify({'code': -1, 'message': '未配置 BIGMODEL_API_KEY'}), 503
-        with VISION_LLM_SEMAPHORE:
-            success, result = describe_image(
-                [url], prompt=CAROUSEL_LABEL_PROMPT, response_format_json=True
-            )
+        # 重打标：不读缓存，新结果写回缓存
+        success, result, _ = _describe_cached([url], CAROUSEL_LABEL_PROMPT, json_output=True, skip_cache=True)
         if not success:
             return jsonify({'code': -1, 'message': str(result)}), 500
         result = _normalize_single_image_vision_content(result)
@@ -1340,6 +2505,8 @@ def image_lookup_retag():
         labels = json.loads(raw) if raw else {}
         if not isinstance(labels, dict):
             labels = {}
+    except VisionQueueRejected as e:
+        return _vision_busy_response(e)
     except Exception as e:
         return jsonify({'code': -1, 'message': str(e)}), 500
     if not OCRPLUS_BASE_URL:
@@ -1442,6 +2609,9 @@ def get_goods_detail(goods_id):
         # 处理JSON字段和补全main_image
         _process_goods_row(goods)
         t_db_category = (time.perf_counter() - t0) * 1000 - t_db_conn - t_db_query
+        # 查库到此结束：调 OCRPlus 前先归还连接
+        cursor.close()
+        conn.close()
 
         # 优先从 OCRPlus 按 URL 拉标签，失败或空则用库内 carousel_labels
         urls = goods.get("image_list") or []
@@ -1452,8 +2622,6 @@ def get_goods_detail(goods_id):
                 _enrich_goods_carousel_labels(goods, labels_map)
         t_ocrplus_ms = (time.perf_counter() - t_ocr_start) * 1000
 
-        cursor.close()
-        conn.close()
         t_total_ms = (time.perf_counter() - t0) * 1000
         if t_total_ms > 500:
             log.info("[PERF] goods/detail id=%s db_conn_ms=%.0f db_query_ms=%.0f db_category_ms=%.0f ocrplus_ms=%.0f total_ms=%.0f url_count=%s",
@@ -3000,6 +4168,10 @@ def get_pending_review():
             else:
                 item['design_check_results'] = item.get('design_check_results') if isinstance(item.get('design_check_results'), list) else []
         
+        # 查库到此结束：调 OCRPlus 前先归还连接
+        cursor.close()
+        conn.close()
+
         # 原图标签唯一来源：OCRPlus（读 image_assets），不读 lovart 表内 original_classify_reasons
         all_urls = [u for it in items for u in (it.get("original_images_urls") or [])]
         if all_urls:
@@ -3008,9 +4180,6 @@ def get_pending_review():
                 for it in items:
                     _enrich_design_original_classify_reasons(it, labels_map)
         
-        cursor.close()
-        conn.close()
-        
         return jsonify({
             'code': 0,
             'message': 'success',
@@ -3272,126 +4441,119 @@ def set_design_ai_recommend_prompt():
 
 @app.route('/api/design/ai-recommend', methods=['POST'])
 def design_ai_recommend():
-    """对一条记录执行 AI 推荐：未排除原图 + 未排除且通过基础检测的设计图，综合评分选最优或建议重新生成。"""
+    """对一条记录执行 AI 推荐：未排除原图 + 未排除且通过基础检测的设计图，综合评分选最优或建议重新生成。
+    异步：?async=1 或请求体 async=true（可带 callback_url）时立即返回 202 + job_id，结果见 /api/vision/jobs/<job_id>。"""
     try:
         data = request.json or {}
-        mapping_id = data.get('id')
-        if not mapping_id:
-            return jsonify({'code': -1, 'message': 'id 不能为空'}), 400
+        if request.args.get('async') == '1' or data.get('async') is True:
+            return _submit_vision_job('ai_recommend', data)
+        body, status = _run_ai_recommend(data)
+        return jsonify(body), status
+    except VisionQueueRejected as e:
+        return _vision_busy_response(e)
+    except Exception as e:
+        return jsonify({'code': -1, 'message': str(e)}), 500
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+
+def _json_list(raw):
+    """库内 JSON 数组字段 → list（字符串先解析，解析失败或非数组返回空列表）。"""
+    if raw and isinstance(raw, str):
         try:
+            raw = json.loads(raw) if raw.strip() else []
+        except Exception:
+            raw = []
+    return raw if isinstance(raw, list) else []
+
+
+def _ai_recommend_inputs(row):
+    """从 lovart_design_tab_mapping 一行算出 AI 推荐的输入：(未排除原图 URL 列表, [(设计图序号, URL)])。"""
+    # 未排除的原图 URL 列表
+    urls_raw = _json_list(row.get('original_images_urls'))
+    excluded_originals = _json_list(row.get('original_excluded_indices'))
+    original_urls = [u for i, u in enumerate(urls_raw) if u and i not in excluded_originals]
+
+    # 上传后的设计图 URL（N8N 写回，服务端可拉；优先用此拉图）
+    uploaded_url_map = {}
+    uploaded_raw = row.get('design_images_uploaded_urls')
+    uploaded_list = _json_list(uploaded_raw) if isinstance(uploaded_raw, str) else (uploaded_raw if isinstance(uploaded_raw, list) else [])
+    for x in uploaded_list:
+        if isinstance(x, dict) and x.get('url') and x.get('index') is not None:
+            uploaded_url_map[int(x['index'])] = str(x['url']).strip()
+
+    # 未排除且通过基础检测的设计图：(index, url)，url 优先用上传后的
+    design_list = []
+    dm = _json_list(row.get('design_images'))
+    if len(dm) > 0:
+        for i, item in enumerate(dm):
+            idx_1based = i + 1
+            url = item.get('url') if isinstance(item, dict) else (item if isinstance(item, str) else '')
+            url = uploaded_url_map.get(idx_1based) or url
+            if url:
+                design_list.append((idx_1based, url))
+    else:
+        for i in (1, 2, 3):
+            u = uploaded_url_map.get(i) or row.get(f'design_image_{i}_url')
+            if u:
+                design_list.append((i, u))
+    excluded_designs = _json_list(row.get('excluded_image_indices'))
+    check_results = _json_list(row.get('design_check_results'))
+    # 只保留：未排除 且 (有 design_check_results 时须 pass=True)
+    design_candidates = []
+    for idx_1based, url in design_list:
+        if idx_1based in excluded_designs:
+            continue
+        if len(check_results) > 0:
+            entry = next((r for r in check_results if r and int(r.get('index', -1)) == idx_1based), None)
+            if entry and entry.get('pass') is not True:
+                continue
+        design_candidates.append((idx_1based, url))
+    return original_urls, design_candidates
+
+
+def _load_ai_recommend_row(cursor, mapping_id, for_update=False):
+    """读 AI 推荐所需字段；兼容无 design_images_uploaded_urls 列。
+    for_update=True 时加行锁（SELECT ... FOR UPDATE），须在写回事务内调用，锁到 commit / rollback。"""
+    lock = ' FOR UPDATE' if for_update else ''
+    try:
+        cursor.execute(
+            """SELECT id, original_images_urls, original_excluded_indices,
+                      design_images, design_image_1_url, design_image_2_url, design_image_3_url,
+                      excluded_image_indices, design_check_results, design_images_uploaded_urls,
+                      ai_recommendation, ai_reason, updated_at
+               FROM lovart_design_tab_mapping WHERE id = %s""" + lock,
+            (mapping_id,)
+        )
+    except pymysql.err.OperationalError as e:
+        if 'Unknown column' in str(e) and 'design_images_uploaded_urls' in str(e):
             cursor.execute(
                 """SELECT id, original_images_urls, original_excluded_indices,
                           design_images, design_image_1_url, design_image_2_url, design_image_3_url,
-                          excluded_image_indices, design_check_results, design_images_uploaded_urls,
-                          ai_recommendation, ai_reason
-                   FROM lovart_design_tab_mapping WHERE id = %s""",
+                          excluded_image_indices, design_check_results,
+                          ai_recommendation, ai_reason, updated_at
+                   FROM lovart_design_tab_mapping WHERE id = %s""" + lock,
                 (mapping_id,)
             )
-        except pymysql.err.OperationalError as e:
-            if 'Unknown column' in str(e) and 'design_images_uploaded_urls' in str(e):
-                cursor.execute(
-                    """SELECT id, original_images_urls, original_excluded_indices,
-                              design_images, design_image_1_url, design_image_2_url, design_image_3_url,
-                              excluded_image_indices, design_check_results,
-                              ai_recommendation, ai_reason
-                       FROM lovart_design_tab_mapping WHERE id = %s""",
-                    (mapping_id,)
-                )
-            else:
-                raise
-        row = cursor.fetchone()
-        if not row:
-            cursor.close()
-            conn.close()
-            return jsonify({'code': -1, 'message': '未找到对应记录'}), 404
+        else:
+            raise
+    return cursor.fetchone()
 
-        # 未排除的原图 URL 列表
-        urls_raw = row.get('original_images_urls')
-        if urls_raw and isinstance(urls_raw, str):
-            try:
-                urls_raw = json.loads(urls_raw) if urls_raw.strip() else []
-            except Exception:
-                urls_raw = []
-        if not isinstance(urls_raw, list):
-            urls_raw = []
-        excluded_originals = row.get('original_excluded_indices')
-        if excluded_originals and isinstance(excluded_originals, str):
-            try:
-                excluded_originals = json.loads(excluded_originals) if excluded_originals.strip() else []
-            except Exception:
-                excluded_originals = []
-        if not isinstance(excluded_originals, list):
-            excluded_originals = []
-        original_urls = [u for i, u in enumerate(urls_raw) if u and i not in excluded_originals]
-        if not original_urls:
-            cursor.close()
-            conn.close()
-            return jsonify({'code': -1, 'message': '没有可用的商品原图（请先添加或取消排除）'}), 400
 
-        # 上传后的设计图 URL（N8N 写回，服务端可拉；优先用此拉图）
-        uploaded_url_map = {}
-        uploaded_raw = row.get('design_images_uploaded_urls')
-        if uploaded_raw and isinstance(uploaded_raw, str):
-            try:
-                uploaded_list = json.loads(uploaded_raw) if uploaded_raw.strip() else []
-            except Exception:
-                uploaded_list = []
-        else:
-            uploaded_list = uploaded_raw if isinstance(uploaded_raw, list) else []
-        for x in uploaded_list:
-            if isinstance(x, dict) and x.get('url') and x.get('index') is not None:
-                uploaded_url_map[int(x['index'])] = str(x['url']).strip()
-
-        # 未排除且通过基础检测的设计图：(index, url)，url 优先用上传后的
-        design_list = []
-        dm = row.get('design_images')
-        if dm and isinstance(dm, str):
-            try:
-                dm = json.loads(dm) if dm.strip() else []
-            except Exception:
-                dm = []
-        if isinstance(dm, list) and len(dm) > 0:
-            for i, item in enumerate(dm):
-                idx_1based = i + 1
-                url = item.get('url') if isinstance(item, dict) else (item if isinstance(item, str) else '')
-                url = uploaded_url_map.get(idx_1based) or url
-                if url:
-                    design_list.append((idx_1based, url))
-        else:
-            for i in (1, 2, 3):
-                u = uploaded_url_map.get(i) or row.get(f'design_image_{i}_url')
-                if u:
-                    design_list.append((i, u))
-        excluded_designs = row.get('excluded_image_indices') or []
-        if isinstance(excluded_designs, str):
-            try:
-                excluded_designs = json.loads(excluded_designs) if excluded_designs.strip() else []
-            except Exception:
-                excluded_designs = []
-        check_results = row.get('design_check_results')
-        if check_results and isinstance(check_results, str):
-            try:
-                check_results = json.loads(check_results) if check_results.strip() else []
-            except Exception:
-                check_results = []
-        # 只保留：未排除 且 (有 design_check_results 时须 pass=True)
-        design_candidates = []
-        for idx_1based, url in design_list:
-            if idx_1based in excluded_designs:
-                continue
-            if isinstance(check_results, list) and len(check_results) > 0:
-                entry = next((r for r in check_results if r and int(r.get('index', -1)) == idx_1based), None)
-                if entry and entry.get('pass') is not True:
-                    continue
-            design_candidates.append((idx_1based, url))
+def _run_ai_recommend(data):
+    """/api/design/ai-recommend 的执行体（同步接口与异步任务共用），返回 (响应体, HTTP 状态码)。
+    读库 → 归还连接 → 调大模型（可能 60s+）→ 重新取连接 → 加锁重读后写回：大模型调用期间不占 DB 连接。
+    写回事务内 SELECT ... FOR UPDATE 重读该行，参与推荐的图片（_ai_recommend_inputs）与调用时不同则返回 409，
+    不用过时结果覆盖；不依赖只精确到秒的 updated_at。"""
+    mapping_id = data.get('id')
+    if not mapping_id:
+        return {'code': -1, 'message': 'id 不能为空'}, 400
 
-        if not design_candidates:
-            cursor.close()
-            conn.close()
-            return jsonify({'code': -1, 'message': '没有可用的设计图（请先取消排除或完成基础检测）'}), 400
+    # ---------- 1. 读库：记录 + 配置，读完即归还连接 ----------
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        row = _load_ai_recommend_row(cursor, mapping_id)
+        if not row:
+            return {'code': -1, 'message': '未找到对应记录'}, 404
 
         # 加载配置：提示词、API Key、阈值（配置表优先，缺省用环境变量）
         def _get_config(key: str, default: str = "") -> str:
@@ -3404,73 +4566,84 @@ def design_ai_recommend():
                 return default
 
         prompt_tpl = _get_config(DESIGN_AI_RECOMMEND_PROMPT_KEY, DEFAULT_AI_RECOMMEND_PROMPT)
-        prompt_tpl = prompt_tpl.replace('{{original_count}}', str(len(original_urls)))
-        prompt_tpl = prompt_tpl.replace('{{design_count}}', str(len(design_candidates)))
-
         api_key = _get_config('bigmodel_api_key', '').strip() or os.getenv('BIGMODEL_API_KEY') or os.getenv('GLM_API_KEY') or ''
-        if not api_key:
-            cursor.close()
-            conn.close()
-            return jsonify({'code': -1, 'message': '未配置 BIGMODEL_API_KEY（配置表或环境变量）'}), 503
-
         threshold_str = _get_config('design_ai_recommend_threshold', '').strip() or os.getenv('AI_RECOMMEND_THRESHOLD', '0.6')
-        try:
-            threshold = float(threshold_str)
-        except (TypeError, ValueError):
-            threshold = 0.6
+        cursor.close()
+    finally:
+        conn.close()
 
-        # 图片顺序：先原图，再设计图（按 index 1,2,3）
-        image_urls = list(original_urls) + [u for _, u in sorted(design_candidates, key=lambda x: x[0])]
+    original_urls, design_candidates = _ai_recommend_inputs(row)
+    if not original_urls:
+        return {'code': -1, 'message': '没有可用的商品原图（请先添加或取消排除）'}, 400
+    if not design_candidates:
+        return {'code': -1, 'message': '没有可用的设计图（请先取消排除或完成基础检测）'}, 400
+    if not api_key:
+        return {'code': -1, 'message': '未配置 BIGMODEL_API_KEY（配置表或环境变量）'}, 503
 
-        from vision_api import describe_image
-        with VISION_LLM_SEMAPHORE:
-            success, result = describe_image(image_urls, prompt=prompt_tpl, response_format_json=True, api_key=api_key)
-        if not success:
-            cursor.close()
-            conn.close()
-            return jsonify({'code': -1, 'message': str(result)}), 500
+    prompt_tpl = prompt_tpl.replace('{{original_count}}', str(len(original_urls)))
+    prompt_tpl = prompt_tpl.replace('{{design_count}}', str(len(design_candidates)))
+    try:
+        threshold = float(threshold_str)
+    except (TypeError, ValueError):
+        threshold = 0.6
 
-        try:
-            if isinstance(result, str):
-                out = json.loads(result)
-            else:
-                out = result
-        except Exception as e:
-            cursor.close()
-            conn.close()
-            return jsonify({'code': -1, 'message': f'模型输出非 JSON: {result[:200]}'}), 500
-
-        scores = out.get('scores') or []
-        best_index = out.get('best_index')
-        overall_reason = (out.get('overall_reason') or '').strip()
-        need_regenerate = out.get('need_regenerate') is True
-        prompt_suggestion = (out.get('prompt_suggestion') or '').strip() or None
-
-        max_score = 0.0
-        if isinstance(scores, list):
-            for s in scores:
-                if isinstance(s, dict) and 'score' in s:
-                    try:
-                        max_score = max(max_score, float(s.get('score', 0)))
-                    except (TypeError, ValueError):
-                        pass
-        if not need_regenerate and max_score < threshold:
-            need_regenerate = True
-            if not prompt_suggestion:
-                prompt_suggestion = f'最高还原度 {max_score:.2f} 低于阈值 {threshold}，建议重新生成并明确风格要求。'
-
-        # 写回 DB（兼容无 ai_prompt_suggestion 列）
-        if need_regenerate:
-            ai_rec = None
-            ai_reason_val = None
-            ai_prompt_val = prompt_suggestion
-        else:
-            ai_rec = int(best_index) if best_index is not None else None
-            if ai_rec and ai_rec not in [r[0] for r in design_candidates]:
-                ai_rec = design_candidates[0][0] if design_candidates else None
-            ai_reason_val = overall_reason or None
-            ai_prompt_val = None
+    # 图片顺序：先原图，再设计图（按 index 1,2,3）
+    image_urls = list(original_urls) + [u for _, u in sorted(design_candidates, key=lambda x: x[0])]
+
+    # ---------- 2. 调大模型（不持有 DB 连接） ----------
+    success, result, _ = _describe_cached(image_urls, prompt_tpl, json_output=True, api_key=api_key)
+    if not success:
+        return {'code': -1, 'message': str(result)}, 500
 
+    try:
+        if isinstance(result, str):
+            out = json.loads(result)
+        else:
+            out = result
+    except Exception as e:
+        return {'code': -1, 'message': f'模型输出非 JSON: {result[:200]}'}, 500
+
+    scores = out.get('scores') or []
+    best_index = out.get('best_index')
+    overall_reason = (out.get('overall_reason') or '').strip()
+    need_regenerate = out.get('need_regenerate') is True
+    prompt_suggestion = (out.get('prompt_suggestion') or '').strip() or None
+
+    max_score = 0.0
+    if isinstance(scores, list):
+        for s in scores:
+            if isinstance(s, dict) and 'score' in s:
+                try:
+                    max_score = max(max_score, float(s.get('score', 0)))
+                except (TypeError, ValueError):
+                    pass
+    if not need_regenerate and max_score < threshold:
+        need_regenerate = True
+        if not prompt_suggestion:
+            prompt_suggestion = f'最高还原度 {max_score:.2f} 低于阈值 {threshold}，建议重新生成并明确风格要求。'
+
+    if need_regenerate:
+        ai_rec = None
+        ai_reason_val = None
+        ai_prompt_val = prompt_suggestion
+    else:
+        ai_rec = int(best_index) if best_index is not None else None
+        if ai_rec and ai_rec not in [r[0] for r in design_candidates]:
+            ai_rec = design_candidates[0][0] if design_candidates else None
+        ai_reason_val = overall_reason or None
+        ai_prompt_val = None
+
+    # ---------- 3. 重新取连接，加行锁重读并比对输入后写回（兼容无 ai_prompt_suggestion 列） ----------
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        current = _load_ai_recommend_row(cursor, mapping_id, for_update=True)
+        if not current:
+            conn.rollback()
+            return {'code': -1, 'message': '记录在 AI 推荐期间已被删除'}, 404
+        if _ai_recommend_inputs(current) != (original_urls, design_candidates):
+            conn.rollback()
+            return {'code': -1, 'message': '记录在 AI 推荐期间已被修改（原图或设计图有变化），请重新执行 AI 推荐'}, 409
         try:
             cursor.execute(
                 """UPDATE lovart_design_tab_mapping
@@ -3491,20 +4664,19 @@ def design_ai_recommend():
                 raise
         conn.commit()
         cursor.close()
+    finally:
         conn.close()
 
-        return jsonify({
-            'code': 0,
-            'message': 'success',
-            'data': {
-                'recommended_index': ai_rec,
-                'ai_reason': ai_reason_val,
-                'need_regenerate': need_regenerate,
-                'prompt_suggestion': ai_prompt_val or prompt_suggestion
-            }
-        })
-    except Exception as e:
-        return jsonify({'code': -1, 'message': str(e)}), 500
+    return {
+        'code': 0,
+        'message': 'success',
+        'data': {
+            'recommended_index': ai_rec,
+            'ai_reason': ai_reason_val,
+            'need_regenerate': need_regenerate,
+            'prompt_suggestion': ai_prompt_val or prompt_suggestion
+        }
+    }, 200
 
 
 @app.route('/api/design/reset-design-check', methods=['POST'])
@@ -4225,9 +5397,30 @@ def get_generating_list():
         }), 500
 
 
+# 图片代理：流式转发 + 本地磁盘缓存（多个 worker 共用目录）+ 条件请求 / Range，见 image_proxy.py
+IMAGE_PROXY_CACHE_MAX_MB = int(os.getenv('IMAGE_PROXY_CACHE_MAX_MB', '1024'))
+IMAGE_PROXY = ImageProxy(
+    DiskCache(
+        os.getenv('IMAGE_PROXY_CACHE_DIR', '/tmp/goods_review_proxy_cache'),
+        IMAGE_PROXY_CACHE_MAX_MB * 1024 * 1024, name='image-proxy-cache',
+    ) if IMAGE_PROXY_CACHE_MAX_MB > 0 else None,
+    # 只允许代理特定域名的图片（安全考虑）
+    allowed_domains=['lovart.ai', 'a.lovart.ai', 'img.kwcdn.com'],
+    fresh_seconds=int(os.getenv('IMAGE_PROXY_FRESH_SECONDS', str(7 * 86400))),
+    timeout=int(os.getenv('IMAGE_PROXY_TIMEOUT', '10')),
+    pool_size=int(os.getenv('GUNICORN_THREADS', '8')) * 2,
+)
+
+
 @app.route('/api/image/proxy', methods=['GET'])
 def proxy_image():
-    """图片代理接口，用于绕过防盗链限制（特别是移动端）"""
+    """图片代理接口，用于绕过防盗链限制（特别是移动端）。
+    流式转发不整张进内存；同一图片走本地磁盘缓存，支持 If-None-Match / If-Modified-Since（304）与 Range（206）。
+    可选参数：
+      w: 缩略图宽度（取到固定档位），q: 质量 30~90（默认 75）；带任一参数时按 Accept 返回 AVIF / WebP / JPEG 缩略图，
+         每种只生成一次并长期缓存（Cache-Control immutable）
+      info=1: 返回原图 {width, height, mime, size}，列表用缩略图时取原图尺寸
+    """
     try:
         image_url = request.args.get('url')
         if not image_url:
@@ -4235,43 +5428,29 @@ def proxy_image():
                 'code': -1,
                 'message': 'url参数不能为空'
             }), 400
-        
-        # 只允许代理特定域名的图片（安全考虑）
-        allowed_domains = ['lovart.ai', 'a.lovart.ai', 'img.kwcdn.com']
-        parsed_url = urllib.parse.urlparse(image_url)
-        if not any(parsed_url.netloc.endswith(domain) for domain in allowed_domains):
+        if not IMAGE_PROXY.allowed(image_url):
             return jsonify({
                 'code': -1,
                 'message': '不允许代理该域名的图片'
             }), 403
-        
-        # 设置请求头，模拟浏览器请求
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Referer': 'https://www.lovart.ai/',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8'
-        }
-        
-        # 请求图片
-        response = requests.get(image_url, headers=headers, timeout=10, stream=True)
-        response.raise_for_status()
-        
-        # 返回图片内容
-        from flask import Response
-        return Response(
-            response.content,
-            mimetype=response.headers.get('Content-Type', 'image/jpeg'),
-            headers={
-                'Cache-Control': 'public, max-age=86400',
-                'Access-Control-Allow-Origin': '*'
-            }
+        try:
+            width = int(request.args.get('w') or 0)
+            quality = int(request.args.get('q') or 0)
+        except ValueError:
+            return jsonify({
+                'code': -1,
+                'message': 'w、q 参数必须为整数'
+            }), 400
+        if width < 0 or quality < 0:
+            return jsonify({
+                'code': -1,
+                'message': 'w、q 参数不能为负数'
+            }), 400
+        return IMAGE_PROXY.respond(
+            image_url, range_requested=bool(request.headers.get('Range')),
+            width=width or None, quality=quality or None, accept=request.headers.get('Accept', ''),
+            info=request.args.get('info') in ('1', 'true'),
         )
-    except requests.exceptions.RequestException as e:
-        return jsonify({
-            'code': -1,
-            'message': f'图片加载失败: {str(e)}'
-        }), 500
     except Exception as e:
         return jsonify({
             'code': -1,
@@ -4279,5 +5458,13 @@ def proxy_image():
         }), 500
 
 
+@app.route('/api/image/proxy/stats', methods=['GET'])
+def proxy_image_stats():
+    """本 worker 图片代理的缓存命中、重验证、304 / 206 次数、转发字节数与缩略图生成 / 命中 / 省下的字节数。"""
+    return jsonify({'code': 0, 'message': 'success', 'data': dict(IMAGE_PROXY.stats(), pid=os.getpid())})
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # 仅本地开发用；生产由 gunicorn 启动：gunicorn -c gunicorn.conf.py app:app
+    VISION_JOB_RUNNER.start()
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG', '1') == '1', threaded=True)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+回填 image_content_hash：给 image_assets 里的图片算原图字节的 sha256，关联到 url_hash（先执行 sql/add_image_content_hash.sql）。
+
+客户端传 base64 的识图请求（Lovart / N8N）按解码后字节的 sha256 找 image_assets 里同一张图的标签；
+新拉的图在拉图时自动记录，存量图片用本脚本回填。图片优先读本地 full_path（即 OCRPlus 下载的原图字节，
+与客户端自己拉到的一致），否则按 url 下载。默认只回填已有标签的图片，--all 回填全部。可重复执行，已关联的跳过。
+
+示例：
+  python backfill_image_content_hash.py --limit 5000 --workers 8
+  python backfill_image_content_hash.py --all --dry-run
+"""
+import argparse
+import hashlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+
+from backfill_image_dhash import DB_CONFIG, load_image
+
+
+def compute(row, timeout):
+    data, err = load_image(row, timeout)
+    if data is None:
+        return row['url_hash'], None, None, err
+    return row['url_hash'], hashlib.sha256(data).hexdigest(), len(data), None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--all', action='store_true', help='回填全部图片（默认只回填已有标签的）')
+    ap.add_argument('--limit', type=int, default=0, help='最多处理多少张，0 不限')
+    ap.add_argument('--batch', type=int, default=200, help='每批从库里取多少行')
+    ap.add_argument('--workers', type=int, default=8, help='并发下载 / 计算数')
+    ap.add_argument('--timeout', type=int, default=15, help='下载超时（秒）')
+    ap.add_argument('--dry-run', action='store_true', help='只计算不写库')
+    args = ap.parse_args()
+
+    conn = pymysql.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    labelled = '' if args.all else 'AND a.labels IS NOT NULL'
+    last_id = 0
+    done = failed = 0
+    t0 = time.time()
+    executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        while True:
+            size = args.batch if not args.limit else min(args.batch, args.limit - done - failed)
+            if size <= 0:
+                break
+            cur.execute(
+                f"""SELECT a.id, a.url, a.url_hash, a.full_path
+                    FROM image_assets a LEFT JOIN image_content_hash c ON c.url_hash = a.url_hash
+                    WHERE a.id > %s AND c.url_hash IS NULL AND a.url_hash IS NOT NULL {labelled}
+                    ORDER BY a.id LIMIT %s""",
+                (last_id, size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            values = []
+            for url_hash, sha, nbytes, err in executor.map(lambda r: compute(r, args.timeout), rows):
+                if sha is None:
+                    failed += 1
+                    print(f'  跳过 {url_hash}: {err}', file=sys.stderr)
+                    continue
+                values.append((sha, url_hash, nbytes))
+            if values and not args.dry_run:
+                cur.executemany(
+                    "INSERT IGNORE INTO image_content_hash (content_sha256, url_hash, byte_size) VALUES (%s, %s, %s)",
+                    values,
+                )
+                conn.commit()
+            done += len(values)
+            print(f'已处理到 id={last_id}：写入 {done}，失败 {failed}，{time.time() - t0:.0f}s')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        cur.close()
+        conn.close()
+    print(f'完成：{"（dry-run，未写库）" if args.dry_run else ""}写入 {done}，失败 {failed}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+回填 image_dhash：给 image_assets 里还没有感知哈希的图片算 dHash（先执行 sql/add_image_dhash.sql）。
+
+图片优先读本地 full_path（与 OCRPlus 同机部署时可用），否则按 url 下载。默认只回填已有标签的图片
+（它们是近似复用的来源），--all 回填全部。可重复执行，已有哈希的跳过。
+
+示例：
+  python backfill_image_dhash.py --limit 5000 --workers 8
+  python backfill_image_dhash.py --all --dry-run
+  python backfill_image_dhash.py --report --days 30
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+import requests
+
+from image_dedup import PerceptualIndex, bands, dhash
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', '101.33.241.82'),
+    'port': int(os.getenv('DB_PORT', 3307)),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv('DB_PASSWORD', 'root'),
+    'database': os.getenv('DB_NAME', 'temu_baodan'),
+    'charset': 'utf8mb4',
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+FETCH_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    ),
+}
+
+
+def load_image(row, timeout):
+    path = row.get('full_path')
+    if path and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read(), None
+    url = (row.get('url') or '').strip()
+    if not url.startswith(('http://', 'https://')):
+        return None, '无本地文件且 url 不可下载'
+    try:
+        r = requests.get(url, headers=FETCH_HEADERS, timeout=timeout)
+    except requests.RequestException as e:
+        return None, str(e)
+    if r.status_code != 200 or not r.content:
+        return None, f'HTTP {r.status_code}'
+    return r.content, None
+
+
+def compute(row, timeout):
+    data, err = load_image(row, timeout)
+    if data is None:
+        return row['url_hash'], None, None, None, err
+    value, w, h = dhash(data)
+    if value is None:
+        return row['url_hash'], None, None, None, '图片解码失败'
+    return row['url_hash'], value, w, h, None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--all', action='store_true', help='回填全部图片（默认只回填已有标签的）')
+    ap.add_argument('--limit', type=int, default=0, help='最多处理多少张，0 不限')
+    ap.add_argument('--batch', type=int, default=200, help='每批从库里取多少行')
+    ap.add_argument('--workers', type=int, default=8, help='并发下载 / 计算数')
+    ap.add_argument('--timeout', type=int, default=15, help='下载超时（秒）')
+    ap.add_argument('--dry-run', action='store_true', help='只计算不写库')
+    ap.add_argument('--report', action='store_true', help='不回填，只输出近似复用报表')
+    ap.add_argument('--days', type=int, default=7, help='--report 统计近几天')
+    args = ap.parse_args()
+
+    if args.report:
+        report = PerceptualIndex(lambda: pymysql.connect(**DB_CONFIG)).report(args.days)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    conn = pymysql.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    labelled = '' if args.all else 'AND a.labels IS NOT NULL'
+    last_id = 0
+    done = failed = 0
+    t0 = time.time()
+    executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        while True:
+            size = args.batch if not args.limit else min(args.batch, args.limit - done - failed)
+            if size <= 0:
+                break
+            cur.execute(
+                f"""SELECT a.id, a.url, a.url_hash, a.full_path
+                    FROM image_assets a LEFT JOIN image_dhash d ON d.url_hash = a.url_hash
+                    WHERE a.id > %s AND d.url_hash IS NULL AND a.url_hash IS NOT NULL {labelled}
+                    ORDER BY a.id LIMIT %s""",
+                (last_id, size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            values = []
+            for url_hash, value, w, h, err in executor.map(lambda r: compute(r, args.timeout), rows):
+                if value is None:
+                    failed += 1
+                    print(f'  跳过 {url_hash}: {err}', file=sys.stderr)
+                    continue
+                values.append((url_hash, value, *bands(value), w, h))
+            if values and not args.dry_run:
+                cur.executemany(
+                    """INSERT INTO image_dhash (url_hash, dhash, band0, band1, band2, band3, width, height)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                       ON DUPLICATE KEY UPDATE dhash = VALUES(dhash), band0 = VALUES(band0), band1 = VALUES(band1),
+                           band2 = VALUES(band2), band3 = VALUES(band3), width = VALUES(width), height = VALUES(height)""",
+                    values,
+                )
+                conn.commit()
+            done += len(values)
+            print(f'已处理到 id={last_id}：写入 {done}，失败 {failed}，{time.time() - t0:.0f}s')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        cur.close()
+        conn.close()
+    print(f'完成：{"（dry-run，未写库）" if args.dry_run else ""}写入 {done}，失败 {failed}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
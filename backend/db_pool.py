@@ -0,0 +1,230 @@
+"""
+进程内 MySQL 连接池（PyMySQL）。
+
+get_db_connection() 返回的连接对业务代码透明：cursor/commit/rollback 原样可用，
+close() 不真正断开，而是回滚未提交事务后归还池中。忘记 close 的连接在对象回收时也会归还。
+多 worker（gunicorn）下每个进程各有一个池，按 pid 区分，fork 后不复用父进程的连接。
+可按「道」（见 traffic_lanes）限制份额：如批量道最多占池中若干连接，其余留给人工审核。
+传了 query_hook 时，借出连接的 cursor 每次 execute / executemany 后回调 query_hook(sql, args, 秒数, 异常或 None, 原始 cursor)，
+供指标与慢查询统计使用（cursor 用来取 rowcount、mogrify），业务代码不用改。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+import pymysql
+
+log = logging.getLogger(__name__)
+
+
+class PoolTimeout(pymysql.err.OperationalError):
+    """等待空闲连接超时（池已满）。"""
+
+
+class TimedCursor:
+    """cursor 的薄包装：execute / executemany 计时后回调 hook，其余属性透传。"""
+
+    def __init__(self, raw, hook):
+        self._raw = raw
+        self._hook = hook
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._raw.close()
+
+    def _timed(self, fn, query, args):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return fn(query, args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            try:
+                self._hook(query, args, time.perf_counter() - t0, error, self._raw)
+            except Exception as e:
+                log.warning("db query hook failed: %s", e)
+
+    def execute(self, query, args=None):
+        return self._timed(self._raw.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self._raw.executemany, query, args)
+
+
+class PooledConnection:
+    """对 pymysql 连接的薄包装：close() 归还池，其余属性透传。"""
+
+    def __init__(self, pool, raw, lane_slot=None):
+        self._pool = pool
+        self._raw = raw
+        self._lane_slot = lane_slot
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        raw = self._raw.cursor(*args, **kwargs)
+        hook = self._pool.query_hook
+        return TimedCursor(raw, hook) if hook is not None else raw
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._lane_slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, config, max_size=8, acquire_timeout=10.0, max_idle_seconds=300.0,
+                 lane_limits=None, lane_getter=None, query_hook=None):
+        """
+        :param config: pymysql.connect 的参数
+        :param max_size: 单进程最多同时借出的连接数
+        :param acquire_timeout: 池满时等待空闲连接的秒数，超时抛 PoolTimeout
+        :param max_idle_seconds: 空闲超过该时长的连接借出前先 ping，失败则重建
+        :param lane_limits: {道名: 最多同时借出数}，未列出的道只受 max_size 限制
+        :param lane_getter: 无参函数，返回当前请求所在的道（如 traffic_lanes.current_lane）
+        :param query_hook: fn(sql, args, seconds, error, cursor)，每条 SQL 执行后回调；None 不计时
+        """
+        self._config = config
+        self.max_size = max(1, int(max_size))
+        self.acquire_timeout = acquire_timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.lane_limits = {k: max(1, min(int(v), self.max_size)) for k, v in (lane_limits or {}).items()}
+        self._lane_getter = lane_getter
+        self.query_hook = query_hook
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lane_slots = {k: threading.BoundedSemaphore(v) for k, v in self.lane_limits.items()}
+        self._in_use = 0
+        self._created = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._wait_seconds = 0.0
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def connection(self, timeout=None):
+        """借出一个连接；池满时最多等待 timeout（默认 acquire_timeout）秒。"""
+        self._check_pid()
+        wait = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + wait
+        lane = self._lane_getter() if self._lane_getter else None
+        lane_slot = self._lane_slots.get(lane)
+        if lane_slot is not None and not lane_slot.acquire(timeout=wait):
+            self._count_timeout(wait)
+            raise PoolTimeout(2013, f"数据库连接池 {lane} 份额已满（{self.lane_limits[lane]}），等待 {wait:g}s 超时")
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            if lane_slot is not None:
+                lane_slot.release()
+            self._count_timeout(wait)
+            raise PoolTimeout(2013, f"数据库连接池已满（{self.max_size}），等待 {wait:g}s 超时")
+        waited = wait - max(0.0, deadline - time.monotonic())
+        try:
+            raw = self._take_idle()
+            if raw is None:
+                raw = pymysql.connect(**self._config)
+                with self._lock:
+                    self._created += 1
+        except Exception:
+            self._slots.release()
+            if lane_slot is not None:
+                lane_slot.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            self._wait_seconds += waited
+        return PooledConnection(self, raw, lane_slot)
+
+    def _count_timeout(self, wait):
+        with self._lock:
+            self._timeouts += 1
+            self._wait_seconds += wait
+
+    def _take_idle(self):
+        while True:
+            try:
+                raw, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - idle_since < self.max_idle_seconds:
+                return raw
+            try:
+                raw.ping(reconnect=False)
+                return raw
+            except Exception:
+                self._discard(raw)
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _release(self, raw, lane_slot=None):
+        if self._pid != os.getpid():
+            return
+        healthy = bool(getattr(raw, "open", False))
+        if healthy:
+            try:
+                # 与直接 close 语义一致：未提交的修改不生效
+                raw.rollback()
+            except Exception:
+                healthy = False
+        if healthy:
+            self._idle.put((raw, time.monotonic()))
+        else:
+            self._discard(raw)
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+        if lane_slot is not None:
+            lane_slot.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "created": self._created,
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": round(self._wait_seconds, 3),
+                "lane_limits": dict(self.lane_limits),
+            }
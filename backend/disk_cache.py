@@ -0,0 +1,367 @@
+"""
+本地磁盘缓存（内容寻址）：按键（如规范化 URL）索引，数据按内容 sha256 存一份。
+
+目录结构：
+  <root>/blobs/ab/<sha256>       数据文件，多个键内容相同时共用一份
+  <root>/index/cd/<sha256(key)>  元数据 JSON：sha256、mime、size、etag、last_modified、fresh_until 等
+写入先落临时文件再 os.replace，多个 gunicorn worker 共用同一目录也不会读到半截文件。
+读取时更新数据文件的 mtime 作为 LRU 依据；总大小超过上限时由后台线程按 mtime 从旧到新删到低水位。
+索引指向的数据文件被淘汰后，下次 get 时顺带删掉索引；进程在写入中途退出留下的 .tmp-* 文件与没有数据文件的索引
+由同一后台线程每轮扫描时清理，不会游离在大小统计之外。
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_CHUNK = 64 * 1024
+
+
+def _sha256_hex(s):
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path, data):
+    d = os.path.dirname(path)
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class DiskCache:
+    def __init__(self, root, max_bytes, low_water=0.9, scan_interval=300.0, name="disk-cache", tmp_max_age=3600.0):
+        """
+        :param root: 缓存目录，不存在时自动创建
+        :param max_bytes: 数据文件总大小上限（字节）
+        :param low_water: 超限淘汰时删到 max_bytes * low_water 为止
+        :param scan_interval: 后台线程定期全量扫描的间隔（秒），用于统计其它 worker 写入的大小
+        :param tmp_max_age: .tmp-* 文件超过这么多秒没写入视为写入者已退出，扫描时删除
+        """
+        self.root = root
+        self.name = name
+        self.max_bytes = int(max_bytes)
+        self.low_water = low_water
+        self.scan_interval = scan_interval
+        self.tmp_max_age = tmp_max_age
+        self._lock = threading.Lock()
+        self._approx_bytes = None  # 首次扫描前未知
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._counters = {
+            "hits": 0, "misses": 0, "puts": 0, "revalidated": 0,
+            "evicted_files": 0, "evicted_bytes": 0, "errors": 0,
+            "stale_tmp_removed": 0, "orphan_index_removed": 0,
+        }
+
+    # ---------- 路径 ----------
+    def _blob_path(self, sha):
+        return os.path.join(self.root, "blobs", sha[:2], sha)
+
+    def _index_path(self, key):
+        h = _sha256_hex(key)
+        return os.path.join(self.root, "index", h[:2], h)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    # ---------- 读取 ----------
+    def get(self, key):
+        """返回元数据 dict（含 path 指向数据文件），没有或数据已被淘汰返回 None。不判断新鲜度。"""
+        ipath = self._index_path(key)
+        try:
+            with open(ipath, "rb") as f:
+                meta = json.loads(f.read().decode("utf-8"))
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except (OSError, ValueError) as e:
+            log.warning("%s 读索引失败 %s: %s", self.name, ipath, e)
+            self._count("misses")
+            return None
+        path = self._blob_path(meta.get("sha256") or "")
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            try:
+                os.unlink(ipath)
+            except OSError:
+                pass
+            self._count("misses")
+            return None
+        except OSError:
+            pass
+        meta["path"] = path
+        meta["fresh"] = meta.get("fresh_until", 0) > time.time()
+        self._count("hits")
+        return meta
+
+    def read(self, meta):
+        """读出 get() 返回条目的全部数据；文件已被淘汰时返回 None。"""
+        try:
+            with open(meta["path"], "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    # ---------- 写入 ----------
+    def put(self, key, data, mime, max_age, etag=None, last_modified=None, extra=None):
+        """写入一条：数据按内容寻址（已存在则不重复写），再原子替换索引。返回元数据 dict。"""
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha)
+        added = 0
+        if not os.path.exists(path):
+            _atomic_write(path, data)
+            added = len(data)
+        return self._write_index(key, sha, len(data), mime, max_age, etag, last_modified, extra, added)
+
+    def put_stream(self, key, chunks, mime, max_age, etag=None, last_modified=None, extra=None):
+        """边读 chunks 边写临时文件并算 sha256，写完再按内容寻址落位；适合大文件不整块进内存。"""
+        writer = self.open_writer(key)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit(mime, max_age, etag=etag, last_modified=last_modified, extra=extra)
+
+    def open_writer(self, key):
+        """逐块写入一条（边下载边转发给客户端时用）：write(chunk) 若干次后 commit(...) 落位，中途放弃调 abort()。"""
+        return _BlobWriter(self, key)
+
+    def _write_index(self, key, sha, size, mime, max_age, etag, last_modified, extra, added):
+        now = time.time()
+        meta = {
+            "key": key,
+            "sha256": sha,
+            "size": size,
+            "mime": mime,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": now,
+            "fresh_until": now + max_age,
+        }
+        if extra:
+            meta["extra"] = extra
+        _atomic_write(self._index_path(key), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        self._count("puts")
+        over = False
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes += added
+                over = self._approx_bytes > self.max_bytes
+        self._ensure_thread()
+        if over:
+            self._wakeup.set()
+        meta["path"] = self._blob_path(sha)
+        meta["fresh"] = True
+        return meta
+
+    def refresh(self, meta, max_age, etag=None, last_modified=None):
+        """条件请求返回 304 后延长新鲜期（可顺带更新 etag / last_modified）。"""
+        stored = {k: v for k, v in meta.items() if k not in ("path", "fresh")}
+        stored["fresh_until"] = time.time() + max_age
+        if etag:
+            stored["etag"] = etag
+        if last_modified:
+            stored["last_modified"] = last_modified
+        try:
+            _atomic_write(self._index_path(meta["key"]), json.dumps(stored, ensure_ascii=False).encode("utf-8"))
+        except OSError as e:
+            log.warning("%s 刷新索引失败: %s", self.name, e)
+        self._count("revalidated")
+        stored["path"] = meta["path"]
+        stored["fresh"] = True
+        return stored
+
+    # ---------- 淘汰 ----------
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-evictor", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.evict()
+            except Exception as e:
+                self._count("errors")
+                log.warning("%s 淘汰失败: %s", self.name, e)
+            self._wakeup.wait(self.scan_interval)
+            self._wakeup.clear()
+
+    def _remove_stale_tmp(self, p, st, now):
+        """写入中途退出留下的临时文件：超过 tmp_max_age 没写入就删，返回是否已删。"""
+        if now - st.st_mtime <= self.tmp_max_age:
+            return False
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+        self._count("stale_tmp_removed")
+        return True
+
+    def evict(self):
+        """扫描数据文件；总大小超过上限时按 mtime 从旧到新删到低水位，再清理残留临时文件与孤立索引。
+        返回删除后的总大小（含仍在写入的临时文件）。"""
+        started = time.time()
+        files = []
+        tmp_bytes = 0
+        blobs = os.path.join(self.root, "blobs")
+        for dirpath, _, names in os.walk(blobs):
+            for n in names:
+                p = os.path.join(dirpath, n)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                if n.startswith(".tmp-"):
+                    if not self._remove_stale_tmp(p, st, started):
+                        tmp_bytes += st.st_size
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+        total = sum(f[1] for f in files)
+        if total > self.max_bytes:
+            target = int(self.max_bytes * self.low_water)
+            files.sort()
+            removed_files = removed_bytes = 0
+            for i, (_, size, p) in enumerate(files):
+                if total <= target:
+                    files = files[i:]
+                    break
+                try:
+                    os.unlink(p)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed_files += 1
+                removed_bytes += size
+            else:
+                files = []
+            with self._lock:
+                self._counters["evicted_files"] += removed_files
+                self._counters["evicted_bytes"] += removed_bytes
+        self._sweep_index({os.path.basename(p) for _, _, p in files}, started)
+        total += tmp_bytes
+        with self._lock:
+            self._approx_bytes = total
+        return total
+
+    def _sweep_index(self, live_shas, started):
+        """删掉数据文件已不在的索引和残留临时文件。扫描开始后才写的索引跳过（其数据文件可能不在本轮列表里）。"""
+        for dirpath, _, names in os.walk(os.path.join(self.root, "index")):
+            for n in names:
+                p = os.path.join(dirpath, n)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                if n.startswith(".tmp-"):
+                    self._remove_stale_tmp(p, st, started)
+                    continue
+                if st.st_mtime >= started:
+                    continue
+                try:
+                    with open(p, "rb") as f:
+                        sha = json.loads(f.read().decode("utf-8")).get("sha256") or ""
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError):
+                    sha = ""
+                if sha in live_shas:
+                    continue
+                try:
+                    os.unlink(p)
+                except FileNotFoundError:
+                    continue
+                self._count("orphan_index_removed")
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c["approx_bytes"] = self._approx_bytes
+        c["max_bytes"] = self.max_bytes
+        lookups = c["hits"] + c["misses"]
+        c["hit_ratio"] = round(c["hits"] / lookups, 4) if lookups else 0.0
+        return c
+
+
+class _BlobWriter:
+    """DiskCache.open_writer 返回的写入器：写临时文件并增量算 sha256，commit 时按内容寻址落位并写索引。"""
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self.key = key
+        tmp_dir = os.path.join(cache.root, "blobs")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=tmp_dir, prefix=".tmp-")
+        self._f = os.fdopen(fd, "wb")
+        self._h = hashlib.sha256()
+        self.size = 0
+        self._done = False
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        self._h.update(chunk)
+        self._f.write(chunk)
+        self.size += len(chunk)
+
+    def abort(self):
+        if self._done:
+            return
+        self._done = True
+        try:
+            self._f.close()
+        finally:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+
+    def commit(self, mime, max_age, etag=None, last_modified=None, extra=None):
+        """返回元数据 dict（同 DiskCache.put）。"""
+        if self._done:
+            raise ValueError("writer already closed")
+        self._done = True
+        try:
+            self._f.close()
+            sha = self._h.hexdigest()
+            path = self._cache._blob_path(sha)
+            added = 0
+            if os.path.exists(path):
+                os.unlink(self._tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(self._tmp, path)
+                added = self.size
+        except BaseException:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+            raise
+        return self._cache._write_index(self.key, sha, self.size, mime, max_age, etag, last_modified, extra, added)
@@ -0,0 +1,52 @@
+"""
+gunicorn 生产配置：gunicorn -c gunicorn.conf.py app:app
+
+多进程 + 多线程（gthread）：智谱/回存等慢调用只占一个线程，不会像 app.run 单进程那样堵住审核请求。
+容器只有 1 核，默认 2 worker × 8 线程；慢调用多时优先加线程（I/O 等待为主），而不是加进程。
+每个 worker 自带一个 DB 连接池（见 db_pool.py），MySQL 总连接数约为 workers × DB_POOL_SIZE。
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# app.py 按 worker/线程数切分连接池、大模型并发与分道名额，预加载前写回环境变量保证两边一致
+os.environ["GUNICORN_WORKERS"] = str(workers)
+os.environ["GUNICORN_THREADS"] = str(threads)
+
+# 拉图 30s + 智谱 60s，/api/vision/describe 建议客户端超时 120s；worker 超时需更长，避免慢请求被误杀
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+# 收到 SIGTERM 后给在途请求（含慢调用）的收尾时间
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# 预加载应用：worker fork 共享只读内存、启动更快；连接池与后台线程按 pid 懒加载，fork 后各自重建
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# 定期重启 worker，防止长期运行的内存增长（大 base64 请求）
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+access_log_format = '%(h)s "%(r)s" %(s)s %(b)s %(M)sms'
+
+
+def post_fork(server, worker):
+    """worker 启动后即开始取异步任务，接手重启前遗留在 vision_jobs 里的任务。"""
+    try:
+        from app import VISION_JOB_RUNNER
+        VISION_JOB_RUNNER.start()
+    except Exception as e:
+        server.log.warning("start vision job runner failed: %s", e)
+
+
+def worker_exit(server, worker):
+    """worker 退出前把缓冲中的负向原因落库（atexit 在 gunicorn worker 中不一定执行）。"""
+    try:
+        from app import NEGATIVE_REASON_LOG
+        NEGATIVE_REASON_LOG.flush()
+    except Exception as e:
+        server.log.warning("flush negative_reason_log on worker exit failed: %s", e)
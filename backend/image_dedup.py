@@ -0,0 +1,493 @@
+"""
+近似重复图片识别：dHash 感知哈希 + 汉明距离，按像素而不是 URL 判断「是不是同一张图」。
+
+同一张商品图常挂在不同 CDN 域名、路径或处理参数下，url_hash 各不相同，image_assets 里查不到标签就会再调一次大模型。
+拉图时顺手算 dHash 存进 image_dhash 表（按 url_hash），识图请求在 URL 精确查不到标签时，
+找汉明距离不超过 max_distance 的已打标图片复用其标签，每次复用记一条 image_dhash_reuse 供统计省下的调用。
+
+dHash：灰度缩到 9x8，每行相邻像素比较得 64 位；对缩放、重新压缩、轻微调色不敏感。
+查询用 4 段 16 位分段索引：距离 <= 3 时两图至少一段相同（鸽巢原理），只扫分段命中的行；更大的距离退化为全表比较。
+
+ContentHashIndex 是精确版：原图字节的 sha256 ↔ url_hash（image_content_hash 表）。客户端自己拉图后传 base64 的请求
+（Lovart / N8N）没有 URL，按内容哈希找到 image_assets 里同一张图的标签，或找到同一张图按 URL 识过的识图结果。
+
+拉图回调（observe）只把图片放进有界队列，由每个索引各自的后台线程算哈希并批量写库，不占请求线程；队列满时丢弃（只是少记一条）。
+"""
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+HASH_BITS = 64
+BANDS = 4
+_BAND_BITS = HASH_BITS // BANDS
+
+
+def dhash(data, size=8):
+    """图片字节 → (64 位 dHash 整数, 宽, 高)；解码失败返回 (None, None, None)。"""
+    if Image is None or not data:
+        return None, None, None
+    try:
+        img = Image.open(io.BytesIO(data))
+        w, h = img.size
+        if img.format == "JPEG":
+            img.draft("L", (size * 8, size * 8))
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            # 透明图铺白底，避免透明区域按黑色参与比较
+            img = img.convert("RGBA")
+            bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            bg.alpha_composite(img)
+            img = bg
+        img = img.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+        px = list(img.getdata())
+    except Exception:
+        return None, None, None
+    value = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (1 if px[base + col] > px[base + col + 1] else 0)
+    return value, w, h
+
+
+class _BackgroundWriter:
+    """有界队列 + 单个后台线程，把攒到的条目整批交给 handle_batch(items)；线程按 pid 懒启动。"""
+
+    def __init__(self, name, handle_batch, max_queue=32, max_batch=100):
+        self.name = name
+        self._handle_batch = handle_batch
+        self._max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+
+    def submit(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        self._ensure_thread()
+        return True
+
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._handle_batch(batch)
+            except Exception as e:
+                log.warning("%s 批量处理失败（%s 条）: %s", self.name, len(batch), e)
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "dropped": self.dropped}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def bands(value):
+    """64 位哈希拆成 4 段 16 位（高位在前）。"""
+    mask = (1 << _BAND_BITS) - 1
+    return [(value >> (_BAND_BITS * (BANDS - 1 - i))) & mask for i in range(BANDS)]
+
+
+class PerceptualIndex:
+    def __init__(self, conn_factory, max_distance=3):
+        """
+        :param conn_factory: 无参函数，返回 pymysql 连接（DictCursor）
+        :param max_distance: 视为同一张图的最大汉明距离；< 0 关闭近似复用（仍记录哈希）
+        """
+        self._conn_factory = conn_factory
+        self.max_distance = int(max_distance)
+        self._lock = threading.Lock()
+        self._db_enabled = True
+        self._counters = {"recorded": 0, "lookups": 0, "reused": 0, "no_match": 0, "errors": 0}
+        # 本进程最近算过（或已排队写库）的哈希：url_hash -> dhash，同一次拉图不重复解码、不重复写库
+        self._known = OrderedDict()
+        self._known_max = 4096
+        self._writer = _BackgroundWriter("image-dhash-writer", self._write_batch)
+
+    @property
+    def enabled(self):
+        return self._db_enabled and self.max_distance >= 0
+
+    def _remember(self, url_hash, value):
+        with self._lock:
+            self._known[url_hash] = value
+            self._known.move_to_end(url_hash)
+            while len(self._known) > self._known_max:
+                self._known.popitem(last=False)
+
+    def _known_value(self, url_hash):
+        with self._lock:
+            return self._known.get(url_hash)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _handle_error(self, what, e):
+        if "doesn't exist" in str(e):
+            if self._db_enabled:
+                log.warning("image_dhash 表不可用，近似图复用关闭（请执行 sql/add_image_dhash.sql）: %s", e)
+            self._db_enabled = False
+        else:
+            self._count("errors")
+            log.warning("image_dhash %s failed: %s", what, e)
+
+    def record(self, url_hash, value, width=None, height=None):
+        """写入（或覆盖）一张图的哈希。"""
+        if url_hash and value is not None:
+            self._record_rows([(url_hash, value, width, height)])
+
+    def _record_rows(self, rows):
+        if not self._db_enabled or not rows:
+            return
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    """INSERT INTO image_dhash (url_hash, dhash, band0, band1, band2, band3, width, height)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                       ON DUPLICATE KEY UPDATE dhash = VALUES(dhash), band0 = VALUES(band0), band1 = VALUES(band1),
+                           band2 = VALUES(band2), band3 = VALUES(band3), width = VALUES(width), height = VALUES(height)""",
+                    [(h, v, *bands(v), w, ht) for h, v, w, ht in rows],
+                )
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+            self._count("recorded", len(rows))
+        except Exception as e:
+            self._handle_error("record", e)
+
+    def observe(self, url_hash, data):
+        """拉图回调：把图片放进后台队列，由后台线程解码算哈希并批量写库；本进程已算过的直接跳过。"""
+        if not self._db_enabled or not url_hash or not data or self._known_value(url_hash) is not None:
+            return
+        self._writer.submit((url_hash, data, None, None, None))
+
+    def value_for(self, url_hash, data):
+        """
+        当场要用哈希时（近似图查找）：本进程算过的直接返回，否则同步算一次并排队写库；
+        同一次拉图已进队列的那份在后台会被跳过，不重复解码、不重复写库。返回哈希（失败为 None）。
+        """
+        value = self._known_value(url_hash)
+        if value is not None:
+            return value
+        value, w, h = dhash(data)
+        if value is not None:
+            self._remember(url_hash, value)
+            self._writer.submit((url_hash, None, value, w, h))
+        return value
+
+    def _write_batch(self, items):
+        rows = {}
+        for url_hash, data, value, w, h in items:
+            if value is None:
+                if self._known_value(url_hash) is not None:
+                    continue
+                value, w, h = dhash(data)
+                if value is None:
+                    continue
+                self._remember(url_hash, value)
+            rows[url_hash] = (url_hash, value, w, h)
+        self._record_rows(list(rows.values()))
+
+    def hashes_for(self, url_hashes):
+        """一条 IN 查询取已记录的哈希，返回 {url_hash: dhash}。"""
+        url_hashes = [h for h in dict.fromkeys(url_hashes) if h]
+        if not url_hashes or not self._db_enabled:
+            return {}
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                placeholders = ",".join(["%s"] * len(url_hashes))
+                cursor.execute(
+                    f"SELECT url_hash, dhash FROM image_dhash WHERE url_hash IN ({placeholders})", url_hashes
+                )
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            self._handle_error("hashes_for", e)
+            return {}
+        return {r["url_hash"]: int(r["dhash"]) for r in rows}
+
+    def nearest_labelled(self, value, exclude_url_hash=None):
+        """
+        找汉明距离不超过 max_distance、且 image_assets 里已有标签的最近图片。
+        :return: (url_hash, labels, distance) 或 None
+        """
+        if not self.enabled or value is None:
+            return None
+        self._count("lookups")
+        where, params = "", [value]
+        if self.max_distance < BANDS:
+            where = "(" + " OR ".join(f"d.band{i} = %s" for i in range(BANDS)) + ") AND "
+            params.extend(bands(value))
+        params.extend([value, self.max_distance, exclude_url_hash or ""])
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""SELECT d.url_hash, a.labels, BIT_COUNT(d.dhash ^ %s) AS distance
+                        FROM image_dhash d JOIN image_assets a ON a.url_hash = d.url_hash
+                        WHERE {where}BIT_COUNT(d.dhash ^ %s) <= %s AND d.url_hash <> %s AND a.labels IS NOT NULL
+                        ORDER BY distance LIMIT 1""",
+                    params,
+                )
+                row = cursor.fetchone()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            self._handle_error("nearest_labelled", e)
+            return None
+        if not row:
+            self._count("no_match")
+            return None
+        return row["url_hash"], row["labels"], int(row["distance"])
+
+    def record_reuse(self, url_hash, source_url_hash, distance):
+        """记一次近似复用（即省下一次大模型调用）。"""
+        self._count("reused")
+        if not self._db_enabled:
+            return
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO image_dhash_reuse (url_hash, source_url_hash, distance) VALUES (%s, %s, %s)",
+                    (url_hash, source_url_hash, distance),
+                )
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            self._handle_error("record_reuse", e)
+
+    def report(self, days=7):
+        """近 days 天按日统计近似复用次数（= 省下的大模型调用）与距离分布，以及哈希覆盖情况。"""
+        conn = self._conn_factory()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT DATE(created_at) AS day, COUNT(*) AS saved_calls,
+                          COUNT(DISTINCT source_url_hash) AS source_images, AVG(distance) AS avg_distance
+                   FROM image_dhash_reuse WHERE created_at >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
+                   GROUP BY DATE(created_at) ORDER BY day""",
+                (int(days),),
+            )
+            by_day = [
+                {"day": str(r["day"]), "saved_calls": int(r["saved_calls"]), "source_images": int(r["source_images"]),
+                 "avg_distance": round(float(r["avg_distance"] or 0), 2)}
+                for r in cursor.fetchall()
+            ]
+            cursor.execute(
+                """SELECT distance, COUNT(*) AS cnt FROM image_dhash_reuse
+                   WHERE created_at >= DATE_SUB(CURDATE(), INTERVAL %s DAY) GROUP BY distance ORDER BY distance""",
+                (int(days),),
+            )
+            by_distance = {int(r["distance"]): int(r["cnt"]) for r in cursor.fetchall()}
+            cursor.execute("SELECT COUNT(*) AS cnt FROM image_dhash")
+            hashed = int((cursor.fetchone() or {}).get("cnt") or 0)
+            cursor.execute("SELECT COUNT(*) AS cnt FROM image_assets WHERE labels IS NOT NULL")
+            labelled = int((cursor.fetchone() or {}).get("cnt") or 0)
+            cursor.close()
+        finally:
+            conn.close()
+        return {
+            "days": int(days),
+            "saved_calls": sum(d["saved_calls"] for d in by_day),
+            "by_day": by_day,
+            "by_distance": by_distance,
+            "hashed_images": hashed,
+            "labelled_assets": labelled,
+            "max_distance": self.max_distance,
+        }
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c["max_distance"] = self.max_distance
+        c["db_enabled"] = self._db_enabled
+        c["writer"] = self._writer.stats()
+        return c
+
+
+class ContentHashIndex:
+    def __init__(self, conn_factory):
+        """
+        原图字节 sha256 ↔ url_hash 的对应（image_content_hash 表）：精确同一张图，不论是按 URL 拉的还是客户端传的 base64。
+        :param conn_factory: 无参函数，返回 pymysql 连接（DictCursor）
+        """
+        self._conn_factory = conn_factory
+        self._lock = threading.Lock()
+        self._db_enabled = True
+        self._counters = {"linked": 0, "lookups": 0, "label_reuses": 0, "result_reuses": 0, "errors": 0}
+        self._writer = _BackgroundWriter("image-content-hash-writer", self._write_batch)
+
+    @property
+    def enabled(self):
+        return self._db_enabled
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _handle_error(self, what, e):
+        if "doesn't exist" in str(e):
+            if self._db_enabled:
+                log.warning("image_content_hash 表不可用，base64 图片按内容关联 URL 关闭（请执行 sql/add_image_content_hash.sql）: %s", e)
+            self._db_enabled = False
+        else:
+            self.count("errors")
+            log.warning("image_content_hash %s failed: %s", what, e)
+
+    def _query(self, what, sql, params):
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            self._handle_error(what, e)
+            return []
+        return rows
+
+    def link(self, content_sha256, url_hash, size=None):
+        """记录一条对应（已有则忽略）。"""
+        if content_sha256 and url_hash:
+            self._link_rows([(content_sha256, url_hash, size)])
+
+    def _link_rows(self, rows):
+        if not self._db_enabled or not rows:
+            return
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "INSERT IGNORE INTO image_content_hash (content_sha256, url_hash, byte_size) VALUES (%s, %s, %s)",
+                    rows,
+                )
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+            self.count("linked", len(rows))
+        except Exception as e:
+            self._handle_error("link", e)
+
+    def observe(self, url_hash, raw):
+        """拉图回调（原图字节，预处理前）：放进后台队列，由后台线程算 sha256 并批量记录。"""
+        if self._db_enabled and url_hash and raw:
+            self._writer.submit((url_hash, raw))
+
+    def _write_batch(self, items):
+        rows = {}
+        for url_hash, raw in items:
+            rows[(hashlib.sha256(raw).hexdigest(), url_hash)] = len(raw)
+        self._link_rows([(sha, url_hash, size) for (sha, url_hash), size in rows.items()])
+
+    def url_hashes_for(self, content_hashes):
+        """
+        一条查询取各内容哈希对应的 url_hash，已在 image_assets 打过标签的优先。
+        :return: {content_sha256: url_hash}
+        """
+        content_hashes = [h for h in dict.fromkeys(content_hashes) if h]
+        if not content_hashes or not self._db_enabled:
+            return {}
+        self.count("lookups")
+        placeholders = ",".join(["%s"] * len(content_hashes))
+        rows = self._query(
+            "url_hashes_for",
+            f"""SELECT c.content_sha256, c.url_hash, a.labels IS NOT NULL AS labelled
+                FROM image_content_hash c LEFT JOIN image_assets a ON a.url_hash = c.url_hash
+                WHERE c.content_sha256 IN ({placeholders})""",
+            content_hashes,
+        )
+        out, labelled = {}, set()
+        for r in rows:
+            h = r["content_sha256"]
+            if h not in out or (r["labelled"] and h not in labelled):
+                out[h] = r["url_hash"]
+                if r["labelled"]:
+                    labelled.add(h)
+        return out
+
+    def aliases(self, image_ids):
+        """
+        识图结果缓存的图片标识互换：'c:<sha256>' → 'u:<url_hash>'，'u:<url_hash>' → 'c:<sha256>'（各取一条）。
+        同一张图先按 URL 识过、再以 base64 传来（或反过来）时，可按对方的标识查到结果。
+        :return: {原标识: 对应标识}，查不到的不在结果里
+        """
+        shas = [i[2:] for i in image_ids if i.startswith("c:")]
+        urls = [i[2:] for i in image_ids if i.startswith("u:")]
+        if not (shas or urls) or not self._db_enabled:
+            return {}
+        self.count("lookups")
+        where, params = [], []
+        if shas:
+            where.append(f"content_sha256 IN ({','.join(['%s'] * len(shas))})")
+            params.extend(shas)
+        if urls:
+            where.append(f"url_hash IN ({','.join(['%s'] * len(urls))})")
+            params.extend(urls)
+        rows = self._query(
+            "aliases", f"SELECT content_sha256, url_hash FROM image_content_hash WHERE {' OR '.join(where)}", params,
+        )
+        out = {}
+        for r in rows:
+            out.setdefault("c:" + r["content_sha256"], "u:" + r["url_hash"])
+            out.setdefault("u:" + r["url_hash"], "c:" + r["content_sha256"])
+        return {i: out[i] for i in image_ids if i in out}
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c["db_enabled"] = self._db_enabled
+        c["writer"] = self._writer.stats()
+        return c
@@ -0,0 +1,155 @@
+"""
+送大模型前的图片预处理：解码时就缩小，长边压到上限，只重新编码一次。
+
+智谱视觉模型实际只看约 1024px，原图（常见 1500~4000px 的 PNG/JPEG）整张传过去只会拖慢上传与推理。
+  - JPEG 用 draft 模式让解码器直接按 1/2、1/4、1/8 的 DCT 缩放解码，不先解出全尺寸像素
+  - 其它格式用 thumbnail 的 reducing_gap（先整数倍 reduce 再精细缩放）
+  - 透明图铺白底后统一编码为 JPEG；已经够小的 JPEG/PNG 原样返回，不做无谓的重编码
+全程处理原始字节，base64 只在最后拼 data URL 时编码一次。
+"""
+import base64
+import binascii
+import io
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 只解码这么多 base64 字符即可读出常见图片头里的宽高
+_PROBE_B64_CHARS = 64 * 1024
+
+
+def sniff_mime(data):
+    """按文件头判断 MIME；认不出返回 None。"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+def _target_size(w, h, max_side):
+    if max(w, h) <= max_side:
+        return w, h
+    ratio = max_side / max(w, h)
+    return max(1, int(w * ratio)), max(1, int(h * ratio))
+
+
+def _to_rgb(img):
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        bg.paste(img, mask=img.getchannel("A"))
+        return bg
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def prepare_image(data, max_side=1024, quality=85, keep_bytes=300 * 1024):
+    """
+    把图片字节处理成适合送模型的大小。
+    :param max_side: 长边上限（像素）
+    :param quality: 重新编码的 JPEG 质量
+    :param keep_bytes: 不超过长边上限、且不大于该字节数的 JPEG/PNG 原样返回
+    :return: (bytes, mime)；无法解码且不是模型支持的格式时返回 (None, None)
+    """
+    mime = sniff_mime(data)
+    if Image is None:
+        return (data, mime) if mime in ("image/jpeg", "image/png") else (None, None)
+    try:
+        img = Image.open(io.BytesIO(data))
+        w, h = img.size
+        if mime in ("image/jpeg", "image/png") and max(w, h) <= max_side and len(data) <= keep_bytes:
+            return data, mime
+        tw, th = _target_size(w, h, max_side)
+        if img.format == "JPEG":
+            img.draft("RGB", (tw, th))
+        img.thumbnail((tw, th), reducing_gap=2.0)
+        img = _to_rgb(img)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        out = buf.getvalue()
+    except Exception:
+        return (data, mime) if mime in ("image/jpeg", "image/png") else (None, None)
+    # 尺寸本就合规时，重编码反而更大就用原图
+    if mime in ("image/jpeg", "image/png") and max(w, h) <= max_side and len(out) >= len(data):
+        return data, mime
+    return out, "image/jpeg"
+
+
+def prepare_image_file(f, size, max_side=1024, quality=85, keep_bytes=300 * 1024):
+    """
+    prepare_image 的文件版（流式接收、已落到临时文件的大图用）：Pillow 按需从文件读，不把原图整块读进内存；
+    只有原样返回时才读出全部字节（正常情况下不超过 keep_bytes；解码失败回退原图时例外，与内存版一致）。
+    :param f: 可 seek 的二进制文件对象
+    :param size: 文件字节数
+    :return: (bytes, mime)；同 prepare_image，处理失败时 JPEG/PNG 原样返回，其余返回 (None, None)
+    """
+    f.seek(0)
+    mime = sniff_mime(f.read(16))
+    f.seek(0)
+    if Image is None:
+        return (f.read(), mime) if mime in ("image/jpeg", "image/png") else (None, None)
+    try:
+        img = Image.open(f)
+        w, h = img.size
+        if mime in ("image/jpeg", "image/png") and max(w, h) <= max_side and size <= keep_bytes:
+            f.seek(0)
+            return f.read(), mime
+        tw, th = _target_size(w, h, max_side)
+        if img.format == "JPEG":
+            img.draft("RGB", (tw, th))
+        img.thumbnail((tw, th), reducing_gap=2.0)
+        img = _to_rgb(img)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        out = buf.getvalue()
+    except Exception:
+        if mime in ("image/jpeg", "image/png"):
+            f.seek(0)
+            return f.read(), mime
+        return None, None
+    if mime in ("image/jpeg", "image/png") and max(w, h) <= max_side and len(out) >= size:
+        f.seek(0)
+        return f.read(), mime
+    return out, "image/jpeg"
+
+
+def _probe_data_url(b64):
+    """只解码 base64 开头一段读出 (宽, 高)；读不出返回 None。"""
+    head = b64[:_PROBE_B64_CHARS]
+    head = head[:len(head) - len(head) % 4]
+    try:
+        raw = base64.b64decode(head)
+        return Image.open(io.BytesIO(raw)).size
+    except Exception:
+        return None
+
+
+def prepare_data_url(data_url, max_side=1024, quality=85, keep_bytes=300 * 1024):
+    """
+    data:image/...;base64,... 版本：尺寸与大小都合规时不解码整张、原串返回；否则解码一次、预处理、编码一次。
+    处理失败时返回原串。
+    """
+    if not data_url or not data_url.startswith("data:image/") or ";base64," not in data_url:
+        return data_url
+    header, _, b64 = data_url.partition(",")
+    approx_bytes = len(b64) * 3 // 4
+    if Image is not None and approx_bytes <= keep_bytes and ("jpeg" in header or "jpg" in header or "png" in header):
+        size = _probe_data_url(b64)
+        if size and max(size) <= max_side:
+            return data_url
+    try:
+        raw = base64.b64decode(b64)
+    except (binascii.Error, ValueError):
+        return data_url
+    out, mime = prepare_image(raw, max_side=max_side, quality=quality, keep_bytes=keep_bytes)
+    if out is None or out is raw:
+        return data_url
+    return f"data:{mime};base64,{base64.b64encode(out).decode('ascii')}"
@@ -0,0 +1,485 @@
+"""
+/api/image/proxy 的实现：流式转发 + 本地磁盘缓存 + 条件请求 + Range。
+
+  - 上游走复用连接的 requests.Session（连接池按 worker 建，fork 后重建），边收边发给客户端，不整张进内存
+  - 边转发边写入 DiskCache（按完整 URL 区分，含 x-oss-process 等处理参数）；完整收完才落位，客户端中途断开则丢弃
+  - 缓存新鲜期内不再请求上游；过期后带 If-None-Match / If-Modified-Since 重验证，上游不可达时用过期副本
+  - 对客户端：ETag 为内容 sha256（强校验），If-None-Match / If-Modified-Since 命中回 304，Range 回 206（由 send_file 处理）
+  - 带 w / q 参数时返回缩略图：宽度取到固定档位，按 Accept 选 AVIF / WebP / JPEG，每个（原图内容, 宽, 质量, 格式）
+    只生成一次存进同一个 DiskCache（键含原图 sha256，原图换了自然是新键），之后直接发文件；
+    响应带 Cache-Control immutable + Vary: Accept，浏览器 / CDN 一年内不再回源
+"""
+import io
+import logging
+import os
+import threading
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+import requests
+from flask import Response, jsonify, send_file, stream_with_context
+from requests.adapters import HTTPAdapter
+
+from single_flight import SingleFlight, SingleFlightTimeout
+
+try:
+    from PIL import Image, features as pil_features
+except ImportError:
+    Image = None
+    pil_features = None
+
+log = logging.getLogger(__name__)
+
+_CHUNK = 64 * 1024
+
+UPSTREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Referer': 'https://www.lovart.ai/',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8'
+}
+
+
+# 缩略图宽度档位：请求宽度向上取到最近一档，避免任意宽度把缓存撑爆
+VARIANT_WIDTHS = (120, 240, 360, 480, 640, 800, 1080, 1440)
+VARIANT_DEFAULT_QUALITY = 75
+VARIANT_MIN_QUALITY = 30
+VARIANT_MAX_QUALITY = 90
+# 缩略图 URL 里带的是原图地址，原图在这些图床上按上传生成唯一路径，内容不会原地替换
+VARIANT_MAX_AGE = 365 * 86400
+_VARIANT_MIMES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+# 任何浏览器都能显示、可以不看 Accept 直接回给客户端的原图格式
+_UNIVERSAL_MIMES = ("image/jpeg", "image/png", "image/gif")
+
+
+def variant_width(width):
+    """请求宽度 → 档位宽度；超过最大档按最大档。"""
+    for w in VARIANT_WIDTHS:
+        if width <= w:
+            return w
+    return VARIANT_WIDTHS[-1]
+
+
+def variant_quality(quality):
+    if not quality:
+        return VARIANT_DEFAULT_QUALITY
+    return max(VARIANT_MIN_QUALITY, min(VARIANT_MAX_QUALITY, int(quality)))
+
+
+def _accepts(accept, mime):
+    """Accept 里显式列出 mime 且 q 不为 0。"""
+    for part in (accept or "").lower().split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if fields[0] != mime:
+            continue
+        for f in fields[1:]:
+            if f.startswith("q="):
+                try:
+                    return float(f[2:]) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def _encoder_available(fmt):
+    if Image is None:
+        return False
+    if fmt == "jpeg":
+        return True
+    try:
+        return bool(pil_features.check(fmt))
+    except Exception:
+        return False
+
+
+def negotiate_format(accept):
+    """按 Accept 选缩略图格式：AVIF > WebP > JPEG（本机 Pillow 不支持的编码跳过）。"""
+    for fmt in ("avif", "webp"):
+        if _accepts(accept, _VARIANT_MIMES[fmt]) and _encoder_available(fmt):
+            return fmt
+    return "jpeg"
+
+
+def encode_variant(path, width, quality, fmt):
+    """
+    读原图文件缩到 width 宽（不放大）并按 fmt 编码。
+    :return: (bytes, 原图宽, 原图高)；解码失败抛 OSError / ValueError
+    """
+    with Image.open(path) as img:
+        src_w, src_h = img.size
+        if img.format == "JPEG":
+            # JPEG 按 1/2、1/4、1/8 直接解码到接近目标尺寸，大图省大部分解码时间
+            img.draft("RGB", (width, max(1, src_h * width // max(1, src_w))))
+        img.seek(0)
+        img.load()
+        if src_w > width:
+            img.thumbnail((width, max(1, round(src_h * width / src_w))), Image.Resampling.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if fmt == "jpeg":
+            if has_alpha:
+                # JPEG 无透明通道：铺白底，避免透明区域变黑
+                img = img.convert("RGBA")
+                bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
+                bg.alpha_composite(img)
+                img = bg
+            img = img.convert("RGB")
+        else:
+            img = img.convert("RGBA" if has_alpha else "RGB")
+        out = io.BytesIO()
+        if fmt == "avif":
+            img.save(out, "AVIF", quality=quality, speed=8)
+        elif fmt == "webp":
+            img.save(out, "WEBP", quality=quality, method=4)
+        else:
+            img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue(), src_w, src_h
+
+
+def proxy_cache_key(url):
+    """缓存键：scheme / host 小写、去掉 #fragment；查询串保留（图床处理参数不同即不同图）。"""
+    p = urllib.parse.urlsplit(url.strip())
+    return urllib.parse.urlunsplit((p.scheme.lower(), p.netloc.lower(), p.path, p.query, ""))
+
+
+def _http_date(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ImageProxy:
+    def __init__(self, cache, allowed_domains, fresh_seconds=86400, timeout=10, pool_size=16,
+                 max_object_bytes=20 * 1024 * 1024, client_max_age=86400):
+        """
+        :param cache: DiskCache 实例；None 时只做流式转发
+        :param allowed_domains: 允许代理的域名（后缀匹配）
+        :param fresh_seconds: 缓存新鲜期，期内不请求上游
+        :param timeout: 上游连接 / 读超时（秒）
+        :param pool_size: 每个上游主机保持的连接数（不少于 gunicorn 线程数）
+        :param max_object_bytes: 超过此大小的图片只转发不缓存
+        :param client_max_age: 给浏览器的 Cache-Control max-age
+        """
+        self.cache = cache
+        self.allowed_domains = tuple(allowed_domains)
+        self.fresh_seconds = fresh_seconds
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_object_bytes = max_object_bytes
+        self.client_max_age = client_max_age
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._variant_flight = SingleFlight("image-variant")
+        self._counters = {
+            "cache_hits": 0, "revalidated": 0, "stale_served": 0, "misses": 0,
+            "not_modified": 0, "partial": 0, "upstream_errors": 0, "bytes_streamed": 0,
+            "variant_hits": 0, "variant_generated": 0, "variant_source_served": 0, "variant_errors": 0,
+            "variant_bytes_saved": 0,
+        }
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _get_session(self):
+        # gunicorn preload 后 fork 出的 worker 不应共用父进程的连接，按 pid 判断是否需要（重新）建
+        pid = os.getpid()
+        if self._session is not None and self._pid == pid:
+            return self._session
+        with self._lock:
+            if self._session is None or self._pid != pid:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.pool_size)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                s.headers.update(UPSTREAM_HEADERS)
+                self._session = s
+                self._pid = pid
+        return self._session
+
+    def allowed(self, url):
+        netloc = urllib.parse.urlparse(url).netloc
+        return any(netloc.endswith(domain) for domain in self.allowed_domains)
+
+    # ---------- 从缓存回应 ----------
+    def _send_cached(self, meta):
+        """用 send_file 回应缓存文件（处理 If-None-Match / If-Modified-Since / Range）；文件已被淘汰返回 None。"""
+        last_modified = _http_date(meta.get("last_modified")) or meta.get("stored_at")
+        try:
+            resp = send_file(
+                meta["path"], mimetype=meta.get("mime") or "image/jpeg", conditional=True,
+                etag=meta["sha256"][:32], last_modified=last_modified, max_age=self.client_max_age,
+            )
+        except FileNotFoundError:
+            return None
+        if resp.status_code == 304:
+            self._count("not_modified")
+        elif resp.status_code == 206:
+            self._count("partial")
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        return resp
+
+    # ---------- 上游 ----------
+    def _upstream(self, url, meta=None):
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return self._get_session().get(url, headers=headers, timeout=self.timeout, stream=True)
+
+    def _store_full(self, key, upstream):
+        """把上游响应完整写入缓存（需要 Range 而缓存里还没有时用），返回元数据。"""
+        writer = self.cache.open_writer(key)
+        try:
+            for chunk in upstream.iter_content(_CHUNK):
+                writer.write(chunk)
+                if writer.size > self.max_object_bytes:
+                    writer.abort()
+                    return None
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            upstream.close()
+        return writer.commit(
+            upstream.headers.get("Content-Type", "image/jpeg"), self.fresh_seconds,
+            etag=upstream.headers.get("ETag"), last_modified=upstream.headers.get("Last-Modified"),
+        )
+
+    def _stream_through(self, key, upstream):
+        """边从上游读边发给客户端，同时写缓存；收完整才落位。"""
+        mime = upstream.headers.get("Content-Type", "image/jpeg")
+        length = upstream.headers.get("Content-Length")
+        encoded = upstream.headers.get("Content-Encoding") not in (None, "", "identity")
+        cacheable = self.cache is not None and not (length and int(length) > self.max_object_bytes) \
+            and "no-store" not in (upstream.headers.get("Cache-Control") or "").lower()
+
+        def generate():
+            # 在生成器里才建临时文件：响应从未开始迭代时不会留下残留
+            writer = self.cache.open_writer(key) if cacheable else None
+            sent = 0
+            complete = False
+            try:
+                for chunk in upstream.iter_content(_CHUNK):
+                    if writer is not None:
+                        if writer.size + len(chunk) > self.max_object_bytes:
+                            # 没有 Content-Length 的超大图：放弃缓存，继续转发
+                            writer.abort()
+                            writer = None
+                        else:
+                            writer.write(chunk)
+                    sent += len(chunk)
+                    yield chunk
+                complete = True
+            except requests.RequestException as e:
+                self._count("upstream_errors")
+                log.warning("图片代理上游中断 %s: %s", key, e)
+            finally:
+                upstream.close()
+                self._count("bytes_streamed", sent)
+                if writer is not None:
+                    if complete:
+                        try:
+                            writer.commit(
+                                mime, self.fresh_seconds,
+                                etag=upstream.headers.get("ETag"),
+                                last_modified=upstream.headers.get("Last-Modified"),
+                            )
+                        except (OSError, ValueError):
+                            pass
+                    else:
+                        # 客户端断开或上游中断：不缓存半截文件
+                        writer.abort()
+
+        resp = Response(stream_with_context(generate()), mimetype=mime)
+        # requests 已解压 gzip 等编码，长度只在未编码时可信
+        if length and not encoded:
+            resp.headers["Content-Length"] = length
+        resp.headers["Cache-Control"] = f"public, max-age={self.client_max_age}"
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        resp.headers["Accept-Ranges"] = "bytes"
+        return resp
+
+    def _error(self, message, status):
+        return jsonify({'code': -1, 'message': message}), status
+
+    # ---------- 原图 ----------
+    def _resolve(self, url, need_file=False):
+        """
+        定位原图：缓存新鲜直接用；过期先条件请求重验证；没有则请求上游。
+        :param need_file: True 时未命中也先完整写入缓存再返回（Range 切片、生成缩略图需要完整文件）
+        :return: (meta, upstream, error_response) 三者只有一个非 None；upstream 为待流式转发的上游响应
+        """
+        key = proxy_cache_key(url)
+        meta = self.cache.get(key) if self.cache else None
+        if meta and meta["fresh"]:
+            if os.path.exists(meta["path"]):
+                self._count("cache_hits")
+                return meta, None, None
+            meta = None
+        try:
+            upstream = self._upstream(url, meta)
+        except requests.RequestException as e:
+            self._count("upstream_errors")
+            if meta and os.path.exists(meta["path"]):
+                log.warning("图片代理上游不可达（%s），使用过期缓存: %s", e, url)
+                self._count("stale_served")
+                return meta, None, None
+            return None, None, self._error(f'图片加载失败: {str(e)}', 500)
+
+        if upstream.status_code == 304 and meta:
+            upstream.close()
+            self.cache.refresh(
+                meta, self.fresh_seconds,
+                etag=upstream.headers.get("ETag"), last_modified=upstream.headers.get("Last-Modified"),
+            )
+            if os.path.exists(meta["path"]):
+                self._count("revalidated")
+                return meta, None, None
+            upstream = self._upstream(url)
+        if upstream.status_code != 200:
+            upstream.close()
+            self._count("upstream_errors")
+            if meta and os.path.exists(meta["path"]):
+                self._count("stale_served")
+                return meta, None, None
+            return None, None, self._error(f'图片加载失败: 上游 HTTP {upstream.status_code}', 500)
+
+        self._count("misses")
+        if need_file and self.cache is not None:
+            stored = self._store_full(key, upstream)
+            if stored is not None:
+                return stored, None, None
+            # 超过缓存上限：只能整张流式返回
+            upstream = self._upstream(url)
+        return None, upstream, None
+
+    # ---------- 入口 ----------
+    def respond(self, url, range_requested=False, width=None, quality=None, accept="", info=False):
+        """
+        返回 Flask 响应。
+        :param range_requested: True 时保证从缓存文件回应（先完整拉取）以便按 Range 切片
+        :param width: 缩略图宽度（向上取到 VARIANT_WIDTHS 中的档位）；width / quality 都不传时原样转发原图
+        :param quality: 缩略图编码质量（VARIANT_MIN_QUALITY~VARIANT_MAX_QUALITY）
+        :param accept: 客户端 Accept 头，用于选择 AVIF / WebP / JPEG
+        :param info: True 时不返回图片，返回原图 {width, height, mime, size}（缩略图页面显示原图尺寸用）
+        """
+        if (width or quality or info) and self.cache is not None and Image is not None:
+            return self._respond_variant(url, width, quality, accept, info=info)
+        meta, upstream, error = self._resolve(url, need_file=range_requested)
+        if error is not None:
+            return error
+        if meta is not None:
+            resp = self._send_cached(meta)
+            if resp is not None:
+                return resp
+            # 刚判断过存在、发送前被淘汰：退回上游流式转发
+            meta, upstream, error = self._resolve(url)
+            if error is not None:
+                return error
+            if meta is not None:
+                return self._send_cached(meta) or self._error('图片加载失败: 缓存文件被淘汰', 500)
+        return self._stream_through(proxy_cache_key(url), upstream)
+
+    # ---------- 缩略图 ----------
+    def _variant(self, source, width, quality, fmt):
+        """取（或生成一次）缩略图条目；返回 meta，原图本身更合适时返回 source。"""
+        key = f"variant:{source['sha256']}:w{width}:q{quality}:{fmt}"
+        meta = self.cache.get(key)
+        if meta is not None:
+            self._count("variant_hits")
+            return meta
+
+        def generate():
+            # 同一缩略图并发请求只解码 / 编码一次；leader 写完后 follower 直接读缓存
+            existing = self.cache.get(key)
+            if existing is not None:
+                return existing
+            data, src_w, src_h = encode_variant(source["path"], width, quality, fmt)
+            extra = {"source_sha256": source["sha256"], "source_width": src_w, "source_height": src_h,
+                     "source_size": source["size"]}
+            if len(data) >= source["size"] and (source.get("mime") or "").split(";")[0] in _UNIVERSAL_MIMES:
+                # 编出来反而更大（原图已是小图）：只记个指向原图的空条目，以后直接发原图
+                extra["use_source"] = True
+                data = b""
+            self._count("variant_generated")
+            return self.cache.put(key, data, _VARIANT_MIMES[fmt], VARIANT_MAX_AGE, extra=extra)
+
+        meta, _ = self._variant_flight.do(key, generate, self.timeout * 3)
+        return meta
+
+    def _send_variant(self, meta, source):
+        extra = meta.get("extra") or {}
+        target = source if extra.get("use_source") else meta
+        if target is source:
+            self._count("variant_source_served")
+        try:
+            resp = send_file(
+                target["path"], mimetype=target.get("mime") or "image/jpeg", conditional=True,
+                etag=target["sha256"][:32], max_age=VARIANT_MAX_AGE,
+            )
+        except FileNotFoundError:
+            return None
+        if resp.status_code == 304:
+            self._count("not_modified")
+        elif resp.status_code == 200:
+            self._count("variant_bytes_saved", max(0, (extra.get("source_size") or source["size"]) - target["size"]))
+        resp.headers["Cache-Control"] = f"public, max-age={VARIANT_MAX_AGE}, immutable"
+        resp.headers["Vary"] = "Accept"
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        resp.headers["Access-Control-Expose-Headers"] = "X-Original-Width, X-Original-Height"
+        if extra.get("source_width"):
+            resp.headers["X-Original-Width"] = str(extra["source_width"])
+            resp.headers["X-Original-Height"] = str(extra["source_height"])
+        return resp
+
+    def _respond_info(self, source):
+        try:
+            # 只读文件头拿尺寸，不解码像素
+            with Image.open(source["path"]) as img:
+                width, height = img.size
+        except Exception as e:
+            return self._error(f'图片解析失败: {e}', 500)
+        resp = jsonify({'code': 0, 'message': 'success', 'data': {
+            'width': width, 'height': height, 'mime': source.get("mime"), 'size': source["size"],
+        }})
+        resp.headers["Cache-Control"] = f"public, max-age={VARIANT_MAX_AGE}, immutable"
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        return resp
+
+    def _respond_variant(self, url, width, quality, accept, info=False):
+        source, upstream, error = self._resolve(url, need_file=True)
+        if error is not None:
+            return error
+        if source is None:
+            # 原图超过缓存上限：不做缩略图，原样转发
+            return self._stream_through(proxy_cache_key(url), upstream)
+        if info:
+            return self._respond_info(source)
+        width = variant_width(int(width)) if width else VARIANT_WIDTHS[-1]
+        try:
+            meta = self._variant(source, width, variant_quality(quality), negotiate_format(accept))
+        except SingleFlightTimeout:
+            meta = None
+        except Exception as e:
+            self._count("variant_errors")
+            log.warning("缩略图生成失败 %s: %s", url, e)
+            meta = None
+        resp = self._send_variant(meta, source) if meta is not None else None
+        if resp is None:
+            # 解码失败、文件被淘汰等：退回原图，不影响展示
+            return self._send_cached(source) or self._error('图片加载失败: 缓存文件被淘汰', 500)
+        return resp
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c["variant_flight"] = self._variant_flight.stats()
+        c["cache"] = self.cache.stats() if self.cache else None
+        return c
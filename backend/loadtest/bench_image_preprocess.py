@@ -0,0 +1,151 @@
+"""
+基准：送模型前图片预处理，旧流程 vs image_prep 新流程。
+
+旧流程（改动前 vision_api 的做法）：
+  拉到的字节 → WebP 才转 PNG → base64 → data URL 超过 4MB 时再 base64 解码 → 全尺寸解码 → LANCZOS 缩图 → JPEG → base64
+新流程：
+  拉到的字节 → prepare_image（JPEG draft / reduce 解码时缩小，长边上限，只编码一次）→ base64
+
+对每张图统计 CPU 耗时与送给智谱的 data URL 大小，按格式分组输出均值与 p95。
+样本可用 --corpus 指定目录（jpg/jpeg/png/webp），不传则生成一组合成图（不同尺寸、格式、透明度）。
+
+示例：
+  python loadtest/bench_image_preprocess.py
+  python loadtest/bench_image_preprocess.py --corpus /opt/images/sample --repeat 3 --max-side 1024
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from image_prep import prepare_image, sniff_mime  # noqa: E402
+
+LEGACY_MAX_DATA_URL_BYTES = 4 * 1024 * 1024
+LEGACY_MAX_PIXEL = 1024
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, int(round(p / 100.0 * len(s) + 0.5)) - 1))
+    return s[k]
+
+
+def legacy_pipeline(data):
+    """复刻改动前的 _fetch_image_as_base64 + _shrink_large_data_url。"""
+    mime = sniff_mime(data)
+    if mime == "image/webp":
+        img = Image.open(io.BytesIO(data))
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        data, mime = buf.getvalue(), "image/png"
+    data_url = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+    if len(data_url) <= LEGACY_MAX_DATA_URL_BYTES:
+        return data_url
+    raw = base64.b64decode(data_url.split(",", 1)[1])
+    img = Image.open(io.BytesIO(raw))
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    w, h = img.size
+    if w > LEGACY_MAX_PIXEL or h > LEGACY_MAX_PIXEL:
+        ratio = min(LEGACY_MAX_PIXEL / w, LEGACY_MAX_PIXEL / h)
+        img = img.resize((int(w * ratio), int(h * ratio)), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return f"data:image/jpeg;base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+
+
+def new_pipeline(data, max_side, quality, keep_bytes):
+    out, mime = prepare_image(data, max_side=max_side, quality=quality, keep_bytes=keep_bytes)
+    if out is None:
+        return None
+    return f"data:{mime};base64,{base64.b64encode(out).decode('ascii')}"
+
+
+def synthetic_corpus():
+    """合成样本：商品图常见的尺寸与格式组合。"""
+    specs = [
+        ("JPEG", (4000, 3000), "RGB"), ("JPEG", (3000, 3000), "RGB"), ("JPEG", (1600, 1600), "RGB"),
+        ("JPEG", (800, 800), "RGB"), ("PNG", (2000, 2000), "RGBA"), ("PNG", (1500, 1500), "RGB"),
+        ("PNG", (600, 600), "RGB"), ("WEBP", (1500, 1500), "RGB"), ("WEBP", (800, 800), "RGBA"),
+    ]
+    out = []
+    for fmt, size, mode in specs:
+        img = Image.effect_mandelbrot(size, (-2.0, -1.5, 1.0, 1.5), 80).convert(mode)
+        noise = Image.effect_noise(size, 40).convert(mode)
+        img = Image.blend(img, noise, 0.3)
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, **({"quality": 92} if fmt == "JPEG" else {}))
+        out.append((f"{fmt.lower()}_{size[0]}x{size[1]}_{mode}", buf.getvalue()))
+    return out
+
+
+def load_corpus(path):
+    out = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with open(os.path.join(path, name), "rb") as f:
+                out.append((name, f.read()))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", help="样本图片目录；不传用合成样本")
+    ap.add_argument("--repeat", type=int, default=3, help="每张图每个流程跑几次（取每次耗时）")
+    ap.add_argument("--max-side", type=int, default=1024)
+    ap.add_argument("--quality", type=int, default=85)
+    ap.add_argument("--keep-bytes", type=int, default=300 * 1024)
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    if not corpus:
+        print("样本为空")
+        return 1
+    groups = {}
+    total_in = total_legacy = total_new = 0
+    for name, data in corpus:
+        fmt = (sniff_mime(data) or "unknown").split("/")[-1]
+        g = groups.setdefault(fmt, {"legacy_ms": [], "new_ms": [], "legacy_bytes": 0, "new_bytes": 0, "n": 0})
+        g["n"] += 1
+        legacy_out = new_out = None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            legacy_out = legacy_pipeline(data)
+            g["legacy_ms"].append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            new_out = new_pipeline(data, args.max_side, args.quality, args.keep_bytes)
+            g["new_ms"].append((time.perf_counter() - t0) * 1000)
+        g["legacy_bytes"] += len(legacy_out)
+        g["new_bytes"] += len(new_out or "")
+        total_in += len(data)
+        total_legacy += len(legacy_out)
+        total_new += len(new_out or "")
+        print(f"{name:<36} 原图 {len(data) / 1024:8.0f}KB  旧 data URL {len(legacy_out) / 1024:8.0f}KB  "
+              f"新 {len(new_out or '') / 1024:8.0f}KB")
+
+    print()
+    print(f"{'格式':<8}{'张数':>6}{'旧 ms 均值':>12}{'旧 p95':>10}{'新 ms 均值':>12}{'新 p95':>10}{'旧 KB':>10}{'新 KB':>10}")
+    for fmt, g in sorted(groups.items()):
+        print(f"{fmt:<8}{g['n']:>6}"
+              f"{statistics.mean(g['legacy_ms']):>12.1f}{percentile(g['legacy_ms'], 95):>10.1f}"
+              f"{statistics.mean(g['new_ms']):>12.1f}{percentile(g['new_ms'], 95):>10.1f}"
+              f"{g['legacy_bytes'] / 1024:>10.0f}{g['new_bytes'] / 1024:>10.0f}")
+    print()
+    print(f"原图合计 {total_in / 1024 / 1024:.1f}MB，送模型 data URL：旧 {total_legacy / 1024 / 1024:.1f}MB → "
+          f"新 {total_new / 1024 / 1024:.1f}MB（{(1 - total_new / total_legacy) * 100:.0f}% 减少）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
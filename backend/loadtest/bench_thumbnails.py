@@ -0,0 +1,205 @@
+"""
+基准：20 条商品的列表页，原图直出 vs /api/image/proxy 缩略图（w 档位 + Accept 协商 AVIF/WebP/JPEG）。
+
+本地起一个假图床（合成商品图或 --corpus 目录）和一个只挂 ImageProxy 的 Flask 服务，按浏览器的方式
+（每页 --per-page 张、--connections 个并发连接）拉一整页，统计：
+  - 传输字节数
+  - 服务端耗时：冷（首次生成该格式缩略图；第一种格式还含拉原图）与热（缩略图已在磁盘缓存）
+  - 估算首屏渲染时间：按 --mbps 带宽、--rtt 往返时延把字节折算成下载时间，再加浏览器解码（本机实测解码耗时）
+
+示例：
+  python loadtest/bench_thumbnails.py
+  python loadtest/bench_thumbnails.py --corpus /opt/images/sample --width 200 --mbps 5 --rtt 80
+"""
+import argparse
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from flask import Flask, request  # noqa: E402
+from PIL import Image  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from disk_cache import DiskCache  # noqa: E402
+from image_proxy import ImageProxy  # noqa: E402
+
+ACCEPTS = {
+    "avif": "image/avif,image/webp,image/apng,image/*,*/*;q=0.8",
+    "webp": "image/webp,image/apng,image/*,*/*;q=0.8",
+    "jpeg": "image/apng,image/*,*/*;q=0.8",
+}
+
+
+def synthetic_corpus(n):
+    """合成商品图：常见尺寸的 JPEG / PNG，细节量接近实拍（分形 + 噪声）。"""
+    sizes = [(1500, 1500), (2000, 2000), (1200, 1600), (800, 800), (3000, 3000)]
+    out = []
+    for i in range(n):
+        size = sizes[i % len(sizes)]
+        img = Image.effect_mandelbrot(size, (-2.0 + i * 0.01, -1.5, 1.0, 1.5), 60).convert("RGB")
+        img = Image.blend(img, Image.effect_noise(size, 25).convert("RGB"), 0.15)
+        buf = io.BytesIO()
+        if i % 4 == 3:
+            img.save(buf, format="PNG")
+            out.append((f"item{i}.png", buf.getvalue(), "image/png"))
+        else:
+            img.save(buf, format="JPEG", quality=90)
+            out.append((f"item{i}.jpg", buf.getvalue(), "image/jpeg"))
+    return out
+
+
+def load_corpus(path, n):
+    out = []
+    for name in sorted(os.listdir(path)):
+        lower = name.lower()
+        if lower.endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with open(os.path.join(path, name), "rb") as f:
+                mime = "image/png" if lower.endswith(".png") else "image/webp" if lower.endswith(".webp") else "image/jpeg"
+                out.append((name, f.read(), mime))
+    return [out[i % len(out)] for i in range(n)] if out else []
+
+
+def start_origin(corpus):
+    files = {f"/{name}": (data, mime) for name, data, mime in corpus}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data, mime = files.get(self.path.split("?")[0], (None, None))
+            if data is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", mime)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", f'"{hash(data) & 0xffffffff:x}"')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_port}"
+
+
+def start_proxy(cache_dir):
+    app = Flask(__name__)
+    proxy = ImageProxy(DiskCache(cache_dir, 2 * 1024 * 1024 * 1024, name="bench-proxy-cache"), ["127.0.0.1"])
+
+    @app.route("/api/image/proxy")
+    def proxy_image():
+        return proxy.respond(
+            request.args["url"], range_requested=bool(request.headers.get("Range")),
+            width=int(request.args.get("w") or 0) or None, quality=int(request.args.get("q") or 0) or None,
+            accept=request.headers.get("Accept", ""),
+        )
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    srv = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_port}", proxy
+
+
+def decode_ms(data):
+    t0 = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+    return (time.perf_counter() - t0) * 1000
+
+
+def fetch_page(session, urls, accept, connections):
+    """像浏览器一样并发拉一页；返回 [(字节, 服务端耗时 ms, 解码耗时 ms, mime)] 与整页墙钟耗时。"""
+    def one(url):
+        t0 = time.perf_counter()
+        r = session.get(url, headers={"Accept": accept}, timeout=60)
+        elapsed = (time.perf_counter() - t0) * 1000
+        r.raise_for_status()
+        return len(r.content), elapsed, decode_ms(r.content), r.headers.get("Content-Type", "")
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as ex:
+        results = list(ex.map(one, urls))
+    return results, (time.perf_counter() - t0) * 1000
+
+
+def modeled_render_ms(results, mbps, rtt_ms, connections):
+    """
+    估算首屏渲染：字节按共享带宽下载，每 connections 张为一轮多一个 RTT；解码按 connections 路并行。
+    不含 HTML / JS 本身，只比较图片部分。
+    """
+    total_bytes = sum(r[0] for r in results)
+    rounds = -(-len(results) // connections)
+    transfer = total_bytes * 8 / (mbps * 1_000_000) * 1000
+    decode = sum(r[2] for r in results) / connections
+    return rtt_ms * rounds + transfer + decode
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", help="样本图片目录；不传用合成样本")
+    ap.add_argument("--per-page", type=int, default=20, help="每页商品数")
+    ap.add_argument("--width", type=int, default=200, help="列表缩略图 CSS 宽度（请求 w 取 2 倍，模拟高分屏）")
+    ap.add_argument("--quality", type=int, default=0, help="缩略图质量，0 用服务端默认")
+    ap.add_argument("--connections", type=int, default=6, help="浏览器对同一主机的并发连接数")
+    ap.add_argument("--mbps", type=float, default=10.0, help="估算用的下行带宽（Mbit/s）")
+    ap.add_argument("--rtt", type=float, default=50.0, help="估算用的往返时延（ms）")
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus, args.per_page) if args.corpus else synthetic_corpus(args.per_page)
+    if not corpus:
+        print("样本为空")
+        return 1
+    origin_srv, origin = start_origin(corpus)
+    cache_dir = tempfile.mkdtemp(prefix="bench_thumb_")
+    proxy_srv, proxy_base, proxy = start_proxy(cache_dir)
+    session = requests.Session()
+    try:
+        source_urls = [f"{origin}/{name}" for name, _, _ in corpus]
+        rows = []
+        results, wall = fetch_page(session, source_urls, ACCEPTS["webp"], args.connections)
+        rows.append(("原图直出", results, wall, None))
+        for fmt in ("avif", "webp", "jpeg"):
+            q = f"&q={args.quality}" if args.quality else ""
+            urls = [f"{proxy_base}/api/image/proxy?url={urllib.parse.quote(u, safe='')}&w={args.width * 2}{q}"
+                    for u in source_urls]
+            cold, cold_wall = fetch_page(session, urls, ACCEPTS[fmt], args.connections)
+            warm, warm_wall = fetch_page(session, urls, ACCEPTS[fmt], args.connections)
+            mime = warm[0][3] if warm else ""
+            rows.append((f"缩略图 Accept={fmt}（实得 {mime}）", warm, warm_wall, cold_wall))
+
+        base_bytes = sum(r[0] for r in rows[0][1])
+        print(f"列表页 {len(corpus)} 张，缩略图 w={args.width * 2}，估算网络 {args.mbps:g}Mbit/s RTT {args.rtt:g}ms，"
+              f"{args.connections} 并发连接\n")
+        print(f"{'方案':<36}{'页字节 KB':>12}{'较原图':>8}{'单图 p50 ms':>12}{'整页热 ms':>11}{'整页冷 ms':>11}{'估算渲染 ms':>13}")
+        for name, results, wall, cold_wall in rows:
+            total = sum(r[0] for r in results)
+            p50 = statistics.median(r[1] for r in results)
+            cold = f"{cold_wall:>11.0f}" if cold_wall is not None else f"{'-':>11}"
+            print(f"{name:<36}{total / 1024:>12.0f}{total / base_bytes * 100:>7.0f}%{p50:>12.1f}{wall:>11.0f}{cold}"
+                  f"{modeled_render_ms(results, args.mbps, args.rtt, args.connections):>13.0f}")
+        print()
+        stats = proxy.stats()
+        print(f"代理：缩略图生成 {stats['variant_generated']} 次，命中 {stats['variant_hits']} 次，"
+              f"回原图 {stats['variant_source_served']} 次，失败 {stats['variant_errors']} 次，"
+              f"拉原图 {stats['misses']} 次")
+    finally:
+        proxy_srv.shutdown()
+        origin_srv.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+压测用的本地假依赖：OCRPlus、智谱 GLM（chat completions）、gwfpod（batch_update / 侵权检测）、preview-lab、图床。
+
+每个依赖一个端口（默认从 --port-base 起依次排开），可分别配置延迟与故障注入，压测时不碰任何线上服务：
+  ocrplus    POST /api/image/labels/by-url 按 URL 返回确定性的假标签（同一 URL 每次相同）；POST /api/image/labels 直接成功
+  glm        POST /chat/completions 返回 choices[0].message.content（JSON，含 spec_subtype / 尺寸 / 描述等常见字段）
+  gwfpod     POST /api/collect/product/batch_update 与 /batch_infringement_detection 返回 code=0
+  previewlab POST /api/feedback/record；GET /api/prompt/current?scene=… 返回固定提示词（带 ETag，支持 304）
+  images     GET /img/<任意>.jpg 返回按路径生成的商品图（同一路径内容固定，首次生成后缓存在内存）
+每个端口的 GET /__stats 返回该依赖收到的请求数、注入的故障数与延迟分布。
+
+延迟：--latency 依赖=中位数ms[:p99ms]，按对数正态分布抽样（不写 p99 时取中位数的 3 倍）。
+故障：--errors 依赖=比例:类型，类型为 HTTP 状态码（如 429 / 500 / 503）、hang（挂起 --hang-seconds 秒后才返回，
+      模拟超时）或 reset（直接断开连接）。可重复传、逗号分隔。
+
+启动后被测服务用以下环境变量指过来（replay_traffic.py --with-fakes 会自动设置）：
+  OCRPLUS_BASE_URL=http://127.0.0.1:5901  BIGMODEL_API_URL=http://127.0.0.1:5902/chat/completions
+  GWFPOD_API_BASE=http://127.0.0.1:5903   PREVIEW_LAB_URL=PREVIEW_LAB_BASE=http://127.0.0.1:5904
+seed_loadtest_db.py 生成的图片 URL 指向 images 端口（默认 http://127.0.0.1:5905）。
+
+示例：
+  python loadtest/fake_services.py
+  python loadtest/fake_services.py --latency glm=2500:9000,ocrplus=80:400,gwfpod=600 --errors glm=0.03:429,gwfpod=0.01:hang
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVICES = ("ocrplus", "glm", "gwfpod", "previewlab", "images")
+
+DEFAULT_LATENCY_MS = {
+    "ocrplus": (60.0, 300.0),
+    "glm": (2500.0, 9000.0),
+    "gwfpod": (400.0, 2000.0),
+    "previewlab": (20.0, 100.0),
+    "images": (30.0, 200.0),
+}
+
+_SUBTYPES = ("single_spec", "multi_spec", "size_chart", "material")
+_SCENE_PROMPTS = {
+    "spec_subtype": "判断这张规格图的类型，返回 JSON：{\"spec_subtype\": single_spec|multi_spec|size_chart|material}",
+    "spec_dimension": "读出图中标注的尺寸，返回 JSON：{\"length\": 数字, \"width\": 数字, \"unit\": \"cm\"}",
+}
+
+
+class Behaviour:
+    """单个依赖的延迟与故障配置，以及收到的请求统计。"""
+
+    def __init__(self, name, median_ms, p99_ms, error_rate=0.0, error_kind=None, hang_seconds=35.0):
+        self.name = name
+        self.median_ms = max(0.0, median_ms)
+        self.p99_ms = max(self.median_ms, p99_ms)
+        self.error_rate = error_rate
+        self.error_kind = error_kind
+        self.hang_seconds = hang_seconds
+        # 对数正态：中位数 = e^mu，p99 = e^(mu + 2.326 sigma)
+        self._mu = math.log(self.median_ms) if self.median_ms > 0 else None
+        self._sigma = (math.log(self.p99_ms / self.median_ms) / 2.326) if self.median_ms > 0 and self.p99_ms > self.median_ms else 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.injected = {}
+        self.paths = {}
+
+    def delay(self):
+        if self._mu is None:
+            return 0.0
+        return random.lognormvariate(self._mu, self._sigma) / 1000.0 if self._sigma else self.median_ms / 1000.0
+
+    def pick_fault(self):
+        if self.error_kind and random.random() < self.error_rate:
+            return self.error_kind
+        return None
+
+    def count(self, path, fault):
+        with self._lock:
+            self.requests += 1
+            self.paths[path] = self.paths.get(path, 0) + 1
+            if fault:
+                self.injected[fault] = self.injected.get(fault, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "service": self.name,
+                "requests": self.requests,
+                "paths": dict(self.paths),
+                "injected": dict(self.injected),
+                "latency_ms": {"median": self.median_ms, "p99": self.p99_ms},
+                "error": {"rate": self.error_rate, "kind": self.error_kind},
+            }
+
+
+# ---------- 各依赖的响应 ----------
+def _labels_for(url):
+    h = hashlib.md5(url.encode("utf-8")).digest()
+    return {
+        "is_main_image": h[0] % 5 == 0,
+        "product_complete": h[1] % 10 != 0,
+        "has_text": h[2] % 3 == 0,
+        "first_image_reason": "主体完整、背景干净" if h[3] % 2 else "主体偏小",
+        "design_desc": f"假标签 {h.hex()[:8]}",
+    }
+
+
+def _url_hash(url):
+    n = (url or "").strip().split("#")[0].split("?")[0].strip()
+    return hashlib.md5(n.encode("utf-8")).hexdigest() if n else ""
+
+
+def ocrplus_response(method, path, body):
+    if method == "POST" and path == "/api/image/labels/by-url":
+        urls = [u for u in (body or {}).get("urls") or [] if u]
+        data = {_url_hash(u): {"url": u, "labels": _labels_for(u)} for u in urls}
+        if len(urls) == 1:
+            data = {"url": urls[0], "labels": _labels_for(urls[0])}
+        return 200, {"code": 200, "message": "success", "data": data}
+    if method == "POST" and path.startswith("/api/image/labels"):
+        return 200, {"code": 200, "message": "success", "data": {"saved": True}}
+    return 404, {"code": 404, "message": "not found"}
+
+
+def glm_response(method, path, body):
+    if method != "POST" or not path.endswith("/chat/completions"):
+        return 404, {"error": {"code": "404", "message": "not found"}}
+    prompt = ""
+    for m in (body or {}).get("messages") or []:
+        content = m.get("content")
+        if isinstance(content, list):
+            prompt += " ".join(str(c.get("text") or "") for c in content if isinstance(c, dict))
+        elif isinstance(content, str):
+            prompt += content
+    h = hashlib.md5(prompt.encode("utf-8")).digest()
+    content = {
+        "spec_subtype": _SUBTYPES[h[0] % len(_SUBTYPES)],
+        "length": 100 + h[1] % 100, "width": 50 + h[2] % 100, "height": 1 + h[3] % 10, "unit": "cm",
+        "is_main_image": bool(h[4] % 2), "product_complete": True,
+        "description": "压测假回复：一件放在浅色背景上的商品",
+    }
+    return 200, {
+        "id": f"fake-{h.hex()[:12]}", "model": (body or {}).get("model") or "glm-4.6v",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)}}],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": 80, "total_tokens": 1280},
+    }
+
+
+def gwfpod_response(method, path, body):
+    if method == "POST" and path == "/api/collect/product/batch_update":
+        n = len((body or {}).get("products") or [])
+        return 200, {"code": 0, "msg": "success", "data": {"updated": n}}
+    if method == "POST" and path == "/api/collect/product/batch_infringement_detection":
+        return 200, {"code": 0, "msg": "success", "data": {"submitted": len((body or {}).get("ids") or [])}}
+    return 404, {"code": 404, "msg": "not found"}
+
+
+def previewlab_response(method, path, body, query=None):
+    if method == "POST" and path == "/api/feedback/record":
+        return 200, {"code": 0, "message": "success"}
+    if method == "GET" and path == "/api/prompt/current":
+        scene = (query or {}).get("scene", [""])[0]
+        content = _SCENE_PROMPTS.get(scene, f"压测提示词 scene={scene}")
+        return 200, {"code": 0, "data": {"scene": scene, "content": content, "version": "loadtest-1"}}
+    return 404, {"code": 404, "message": "not found"}
+
+
+class ImageStore:
+    """按路径生成固定内容的商品图（纯色背景 + 色块），生成一次后缓存。"""
+
+    def __init__(self, side=800, max_items=2000):
+        self.side = side
+        self.max_items = max_items
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            data = self._cache.get(path)
+        if data is not None:
+            return data
+        from PIL import Image, ImageDraw
+
+        h = hashlib.md5(path.encode("utf-8")).digest()
+        img = Image.new("RGB", (self.side, self.side), (230 + h[0] % 25, 230 + h[1] % 25, 230 + h[2] % 25))
+        draw = ImageDraw.Draw(img)
+        for i in range(4):
+            x0, y0 = h[3 + i] * self.side // 400, h[7 + i] * self.side // 400
+            draw.rectangle([x0, y0, x0 + self.side // 3, y0 + self.side // 4], fill=(h[i], h[i + 4], h[i + 8]))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        data = buf.getvalue()
+        with self._lock:
+            if len(self._cache) >= self.max_items:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[path] = data
+        return data
+
+
+# ---------- HTTP 服务 ----------
+def _make_handler(name, behaviour, images):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                return json.loads(raw) if raw else None
+            except ValueError:
+                return None
+
+        def _send(self, status, payload, content_type="application/json", extra_headers=None):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (extra_headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, method):
+            parsed = urllib.parse.urlsplit(self.path)
+            path = parsed.path
+            if path == "/__stats":
+                return self._send(200, behaviour.stats())
+            body = self._read_json() if method == "POST" else None
+            fault = behaviour.pick_fault()
+            behaviour.count(path, fault)
+            if fault == "reset":
+                self.close_connection = True
+                try:
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+            time.sleep(behaviour.hang_seconds if fault == "hang" else behaviour.delay())
+            if fault and fault.isdigit():
+                headers = {"Retry-After": "1"} if fault == "429" else None
+                return self._send(int(fault), {"code": int(fault), "message": "injected fault",
+                                               "error": {"code": fault, "message": "injected fault"}},
+                                  extra_headers=headers)
+            if name == "images":
+                if method != "GET" or not path.startswith("/img/"):
+                    return self._send(404, {"message": "not found"})
+                return self._send(200, images.get(path), content_type="image/jpeg",
+                                  extra_headers={"Cache-Control": "max-age=86400"})
+            if name == "ocrplus":
+                status, payload = ocrplus_response(method, path, body)
+            elif name == "glm":
+                status, payload = glm_response(method, path, body)
+            elif name == "gwfpod":
+                status, payload = gwfpod_response(method, path, body)
+            else:
+                status, payload = previewlab_response(method, path, body, urllib.parse.parse_qs(parsed.query))
+                if status == 200 and path == "/api/prompt/current":
+                    etag = '"' + hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16] + '"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    return self._send(status, payload, extra_headers={"ETag": etag})
+            self._send(status, payload)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def parse_pairs(spec, kind):
+    """解析 "glm=2500:9000,ocrplus=80" 形式的参数。"""
+    out = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in SERVICES:
+            raise ValueError(f"未知依赖 {name!r}（可选 {', '.join(SERVICES)}）")
+        first, _, second = value.partition(":")
+        if kind == "latency":
+            median = float(first)
+            out[name] = (median, float(second) if second else median * 3)
+        else:
+            second = second.strip().lower() or "500"
+            if not (second.isdigit() or second in ("hang", "reset")):
+                raise ValueError(f"{name} 的故障类型须为 HTTP 状态码、hang 或 reset")
+            out[name] = (float(first), second)
+    return out
+
+
+def start_fakes(host="127.0.0.1", port_base=5901, latency=None, errors=None, hang_seconds=35.0):
+    """在后台线程启动全部假依赖，返回 {依赖名: {"url", "server", "behaviour"}}。"""
+    latency = dict(DEFAULT_LATENCY_MS, **(latency or {}))
+    errors = errors or {}
+    images = ImageStore()
+    started = {}
+    for i, name in enumerate(SERVICES):
+        median, p99 = latency[name]
+        rate, kind = errors.get(name, (0.0, None))
+        behaviour = Behaviour(name, median, p99, rate, kind, hang_seconds)
+        srv = _Server((host, port_base + i if port_base else 0), _make_handler(name, behaviour, images))
+        threading.Thread(target=srv.serve_forever, name=f"fake-{name}", daemon=True).start()
+        started[name] = {"url": f"http://{host}:{srv.server_port}", "server": srv, "behaviour": behaviour}
+    return started
+
+
+def app_env(fakes):
+    """把被测服务指向假依赖的环境变量。"""
+    return {
+        "OCRPLUS_BASE_URL": fakes["ocrplus"]["url"],
+        "BIGMODEL_API_URL": fakes["glm"]["url"] + "/chat/completions",
+        "BIGMODEL_API_KEY": "loadtest",
+        "GWFPOD_API_BASE": fakes["gwfpod"]["url"],
+        "PREVIEW_LAB_URL": fakes["previewlab"]["url"],
+        "PREVIEW_LAB_BASE": fakes["previewlab"]["url"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port-base", type=int, default=5901, help="ocrplus / glm / gwfpod / previewlab / images 依次占用")
+    ap.add_argument("--latency", default="", help="如 glm=2500:9000,ocrplus=80:400（中位数ms:p99ms）")
+    ap.add_argument("--errors", default="", help="如 glm=0.03:429,gwfpod=0.01:hang,ocrplus=0.01:reset")
+    ap.add_argument("--hang-seconds", type=float, default=35.0)
+    args = ap.parse_args()
+    try:
+        fakes = start_fakes(args.host, args.port_base, parse_pairs(args.latency, "latency"),
+                            parse_pairs(args.errors, "errors"), args.hang_seconds)
+    except ValueError as e:
+        print(e)
+        return 2
+    for name, info in fakes.items():
+        b = info["behaviour"]
+        fault = f"，故障 {b.error_rate:.1%} {b.error_kind}" if b.error_kind else ""
+        print(f"{name:<10} {info['url']}  延迟中位数 {b.median_ms:g}ms / p99 {b.p99_ms:g}ms{fault}")
+    print("\n被测服务环境变量：")
+    for k, v in app_env(fakes).items():
+        print(f"  {k}={v}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+内存上限测试：10 个并发的 40MB base64 识图请求（/api/vision/describe），看后端进程峰值内存。
+
+子进程里起真实的 app（werkzeug 多线程服务），智谱接口指到子进程内的假服务（立即返回固定回复），
+数据库指到不可达地址（缓存读写失败即跳过）。本进程作为客户端：同一份请求体被 --concurrency 个线程同时发送，
+结束后读子进程 /proc/<pid>/status 的 VmHWM（峰值 RSS），减去发请求前的 VmRSS 即这批请求的内存增量。
+
+  --mode stream    大请求体走 stream_intake 流式接收（默认）
+  --mode buffered  关掉流式接收（VISION_STREAM_INTAKE_MIN_KB 设到极大），即改动前 request.json 整块解析的行为
+  --compare        两种模式各跑一次并对比
+超过 --ceiling-mb 时以非 0 退出（只对 stream 模式判断），可放进 CI / 发布前检查。仅支持 Linux（读 /proc）。
+
+示例：
+  python loadtest/intake_memory_ceiling.py
+  python loadtest/intake_memory_ceiling.py --compare --body-mb 40 --concurrency 10 --ceiling-mb 400
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import requests  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status_kb(pid, field):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+# ---------- 子进程：被测服务 ----------
+def _start_fake_model():
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            body = json.dumps({"choices": [{"message": {"content": "{\"ok\": true}"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{srv.server_port}/chat/completions"
+
+
+def serve(port):
+    import logging
+
+    from werkzeug.serving import make_server
+
+    import vision_api
+    vision_api.URL = _start_fake_model()
+    import app as app_module
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    srv = make_server("127.0.0.1", port, app_module.app, threaded=True)
+    srv.serve_forever()
+
+
+# ---------- 本进程：客户端 ----------
+def make_body(body_mb):
+    """生成 base64 后约 body_mb MB 的请求体：噪声 PNG（压不小，解码最耗内存）。"""
+    from PIL import Image
+
+    target = body_mb * 1024 * 1024 * 3 // 4
+    side = int((target / 3) ** 0.5)
+    for _ in range(3):
+        buf = io.BytesIO()
+        Image.effect_noise((side, side), 80).convert("RGB").save(buf, format="PNG", compress_level=1)
+        size = buf.tell()
+        if abs(size - target) < target * 0.05:
+            break
+        # PNG 压缩率随内容变化：按面积比例再试
+        side = int(side * (target / size) ** 0.5)
+    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
+    body = json.dumps({
+        "image_base64": b64, "image_base64_mime": "image/png",
+        "prompt": "内存上限测试", "skip_cache": True, "reuse_asset_labels": False,
+    }).encode("utf-8")
+    return body, side
+
+
+def run_mode(mode, body, concurrency, timeout):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "BIGMODEL_API_KEY": "memory-ceiling-test",
+        "DB_HOST": "127.0.0.1", "DB_PORT": "1",
+        "VISION_CACHE_MEMORY_ITEMS": "0",
+        # 并发上限放开到不排队，测的是同时在手的请求体
+        "GUNICORN_WORKERS": "1",
+        "BATCH_LANE_MAX_CONCURRENT": str(concurrency),
+        "BATCH_LANE_MAX_QUEUE": str(concurrency),
+        "VISION_LLM_MAX_CONCURRENT": str(concurrency * 4),
+        "VISION_QUEUE_MAX": str(concurrency * 4),
+        "VISION_STREAM_INTAKE_MIN_KB": "1024" if mode == "stream" else str(1 << 30),
+    })
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                requests.get(f"{base}/api/vision/scheduler", timeout=2)
+                break
+            except requests.RequestException:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError(f"被测服务未启动: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+                time.sleep(0.3)
+        baseline_kb = _proc_status_kb(proc.pid, "VmRSS")
+
+        def one(_):
+            t0 = time.perf_counter()
+            r = requests.post(f"{base}/api/vision/describe", data=body, timeout=timeout,
+                              headers={"Content-Type": "application/json"})
+            return r.status_code, (time.perf_counter() - t0) * 1000, r.text[:200]
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            results = list(ex.map(one, range(concurrency)))
+        wall = (time.perf_counter() - t0) * 1000
+        peak_kb = _proc_status_kb(proc.pid, "VmHWM")
+        stats = requests.get(f"{base}/api/vision/scheduler", timeout=5).json()["data"].get("intake")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {
+        "mode": mode,
+        "baseline_mb": baseline_kb / 1024,
+        "peak_mb": peak_kb / 1024,
+        "delta_mb": (peak_kb - baseline_kb) / 1024,
+        "wall_ms": wall,
+        "statuses": [r[0] for r in results],
+        "latency_ms": sorted(r[1] for r in results),
+        "sample_error": next((r[2] for r in results if r[0] != 200), None),
+        "intake": stats,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    ap.add_argument("--mode", choices=("stream", "buffered"), default="stream")
+    ap.add_argument("--compare", action="store_true", help="stream 与 buffered 各跑一次")
+    ap.add_argument("--body-mb", type=int, default=40, help="单个请求体大小（MB，需小于 MAX_CONTENT_LENGTH 50MB）")
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--ceiling-mb", type=float, default=400.0, help="stream 模式峰值内存增量上限（MB）")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    args = ap.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return 0
+    if not os.path.exists("/proc/self/status"):
+        print("需要 Linux /proc 读取进程内存")
+        return 2
+
+    body, side = make_body(args.body_mb)
+    print(f"请求体 {len(body) / 1024 / 1024:.1f}MB（{side}x{side} 噪声 PNG），并发 {args.concurrency}\n")
+    modes = ("stream", "buffered") if args.compare else (args.mode,)
+    failed = False
+    for mode in modes:
+        r = run_mode(mode, body, args.concurrency, args.timeout)
+        ok = all(s == 200 for s in r["statuses"])
+        lat = r["latency_ms"]
+        print(f"[{mode}] 启动后 RSS {r['baseline_mb']:.0f}MB，峰值 {r['peak_mb']:.0f}MB，增量 {r['delta_mb']:.0f}MB；"
+              f"整批 {r['wall_ms']:.0f}ms，单请求 p50 {lat[len(lat) // 2]:.0f}ms / max {lat[-1]:.0f}ms；"
+              f"状态码 {sorted(set(r['statuses']))}")
+        if not ok:
+            print(f"  失败示例: {r['sample_error']}")
+            failed = True
+        if r["intake"]:
+            print(f"  intake: {json.dumps(r['intake'], ensure_ascii=False)}")
+        if mode == "stream" and r["delta_mb"] > args.ceiling_mb:
+            print(f"  超过上限 {args.ceiling_mb:g}MB")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
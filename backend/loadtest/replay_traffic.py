@@ -0,0 +1,486 @@
+"""
+按审核员与 N8N 的流量配比回放请求，报告各路由吞吐与 p50/p95/p99。配合 seed_loadtest_db.py（造数）与
+fake_services.py（假依赖），整套压测不碰线上库和任何外部服务。
+
+两类虚拟用户并发跑 --duration 秒（前 --warmup 秒不计入统计）：
+  reviewer  审核页：列表 / 统计 / 详情为主，夹杂通过、废弃、保存、待上传与设计待审；每步间隔按 --reviewer-think 秒的指数分布
+  n8n       工作流：识图（单张 / 批量 / 规格细分）与 update-main-fields 回写；间隔 --n8n-think 秒
+通过 / 废弃 / 保存会改数据：从压测库里待审核的商品中取，用完后这几步改为看详情；重跑前用 seed_loadtest_db.py --reset 重造。
+
+被测服务二选一：
+  --target http://127.0.0.1:5000   已经起好的服务（须自己把 DB_* 与依赖地址指到压测库 / 假依赖）
+  --spawn                          由本脚本按 gunicorn.conf.py 起一个 gunicorn（DB_* 指向 --db-*，外部依赖一律指向假服务）
+--with-fakes 在本进程内启动 fake_services.py 的全部假依赖（--spawn 时总会启动），可用 --fake-latency / --fake-errors 配延迟与故障。
+
+安全：通过 / 保存会调 gwfpod batch_update 与侵权检测，压测库的 api_id 若打到线上会覆盖真实商品。
+  --spawn 起的服务 OCRPlus / GLM / gwfpod / preview-lab 地址必须全是本机，否则拒绝启动；
+  --target 时本脚本看不到被测服务的配置，带写操作（通过 / 废弃 / 保存 / update-main-fields）的回放须加 --deps-are-fake
+  确认依赖已指向假服务，或加 --read-only 只回放只读请求。
+
+示例：
+  python loadtest/seed_loadtest_db.py --port 3317 --reset
+  python loadtest/replay_traffic.py --spawn --with-fakes --reviewers 20 --n8n 6 --duration 120
+  python loadtest/replay_traffic.py --spawn --with-fakes --fake-latency glm=4000:15000 --fake-errors glm=0.05:429 --json out.json
+  python loadtest/replay_traffic.py --target http://127.0.0.1:8080 --reviewers 40 --n8n 0 --read-only
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+
+import pymysql
+import requests
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(LOADTEST_DIR)
+sys.path.insert(0, LOADTEST_DIR)
+
+ADMIN_TOKEN = "loadtest-admin"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, int(round(p / 100.0 * len(s) + 0.5)) - 1))
+    return s[k]
+
+
+# ---------- 压测数据 ----------
+class IdPools:
+    """从压测库取回放要用的 id / URL；会改数据的动作从 pending 里逐个取，不重复。"""
+
+    def __init__(self, args, rng):
+        conn = pymysql.connect(host=args.db_host, port=args.db_port, user=args.db_user, password=args.db_password,
+                               database=args.db_name, charset="utf8mb4", cursorclass=pymysql.cursors.DictCursor)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, api_id, carousel_pic_urls FROM temu_goods_v2 ORDER BY RAND() LIMIT %s",
+                            (args.pool_size,))
+                rows = cur.fetchall()
+                cur.execute("""SELECT id FROM temu_goods_v2
+                               WHERE process_status = 2 AND review_status = 0 AND is_publish = 0
+                               ORDER BY RAND() LIMIT %s""", (args.pool_size,))
+                pending = [r["id"] for r in cur.fetchall()]
+        finally:
+            conn.close()
+        if not rows:
+            raise RuntimeError(f"{args.db_name}.temu_goods_v2 没有数据，先跑 seed_loadtest_db.py")
+        self.goods_ids = [r["id"] for r in rows]
+        self.api_ids = [r["api_id"] for r in rows if r["api_id"] is not None]
+        self.image_urls = []
+        for r in rows:
+            try:
+                self.image_urls.extend(json.loads(r["carousel_pic_urls"] or "[]"))
+            except ValueError:
+                pass
+        rng.shuffle(pending)
+        self._pending = pending
+        self._lock = threading.Lock()
+
+    def take_pending(self):
+        with self._lock:
+            return self._pending.pop() if self._pending else None
+
+    def pending_left(self):
+        with self._lock:
+            return len(self._pending)
+
+
+# ---------- 场景 ----------
+# 每步：(权重, 函数)；函数返回 (方法, 统计用路由名, path, json 体)
+def _goods_list(pools, rng):
+    status = rng.choice(("process_status=2&review_status=0", "process_status=2&review_status=1",
+                         "process_status=2&review_status=2", "process_status=1"))
+    page = 1 if rng.random() < 0.7 else rng.randint(2, 20)
+    return "GET", "GET /api/goods/list", f"/api/goods/list?page={page}&page_size=20&{status}", None
+
+
+def _goods_detail(pools, rng):
+    gid = rng.choice(pools.goods_ids)
+    return "GET", "GET /api/goods/detail/<id>", f"/api/goods/detail/{gid}", None
+
+
+def _statistics(pools, rng):
+    return "GET", "GET /api/goods/statistics", "/api/goods/statistics", None
+
+
+def _first_pending_upload(pools, rng):
+    return "GET", "GET /api/goods/first-pending-upload", "/api/goods/first-pending-upload", None
+
+
+def _design_pending(pools, rng):
+    return "GET", "GET /api/design/pending-review", f"/api/design/pending-review?page={rng.randint(1, 3)}&limit=20", None
+
+
+def _mutating(path, body_fn):
+    def step(pools, rng):
+        gid = pools.take_pending()
+        if gid is None:
+            return _goods_detail(pools, rng)
+        return "POST", f"POST {path}", path, body_fn(gid, rng)
+    return step
+
+
+_approve = _mutating("/api/goods/approve", lambda gid, rng: {"id": gid})
+_discard = _mutating("/api/goods/discard", lambda gid, rng: {"id": gid, "note": rng.choice(("主体不完整", "有水印", None))})
+_save = _mutating("/api/goods/save", lambda gid, rng: {"id": gid})
+
+
+def _vision_describe(pools, rng):
+    body = {"image_url": rng.choice(pools.image_urls), "prompt": "判断这张图是否为商品主图，返回 JSON"}
+    return "POST", "POST /api/vision/describe", "/api/vision/describe", body
+
+
+def _vision_describe_batch(pools, rng):
+    items = [{"image_url": u, "prompt": "判断这张图是否为商品主图，返回 JSON"}
+             for u in rng.sample(pools.image_urls, min(4, len(pools.image_urls)))]
+    return "POST", "POST /api/vision/describe-batch", "/api/vision/describe-batch", {"items": items}
+
+
+def _vision_spec_sublabel(pools, rng):
+    body = {"image_url": rng.choice(pools.image_urls), "category": rng.choice(("blanket", "pillow", "doormat"))}
+    return "POST", "POST /api/vision/spec-sublabel", "/api/vision/spec-sublabel", body
+
+
+def _update_main_fields(pools, rng):
+    body = {"api_id": rng.choice(pools.api_ids), "process_status": 2,
+            "preprocess_tags": rng.choice(([], ["快速通道"], ["尺寸关键词命中"]))}
+    return "POST", "POST /api/goods/update-main-fields", "/api/goods/update-main-fields", body
+
+
+# 会写库或调 gwfpod 的步骤；--read-only 时去掉
+MUTATING_STEPS = frozenset((_approve, _discard, _save, _update_main_fields))
+
+SCENARIOS = {
+    "reviewer": (
+        (30, _goods_list), (30, _goods_detail), (10, _statistics), (8, _approve), (4, _discard), (3, _save),
+        (5, _first_pending_upload), (10, _design_pending),
+    ),
+    "n8n": (
+        (40, _vision_describe), (10, _vision_describe_batch), (20, _vision_spec_sublabel), (30, _update_main_fields),
+    ),
+}
+
+
+# ---------- 回放 ----------
+class Recorder:
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)   # (场景, 路由) -> [ms]
+        self.statuses = defaultdict(Counter)
+
+    def add(self, scenario, route, status, ms, at):
+        if at < self.measure_from:
+            return
+        with self._lock:
+            self.samples[(scenario, route)].append(ms)
+            self.statuses[(scenario, route)][status] += 1
+
+
+def scenario_steps(scenario, read_only=False):
+    return tuple(s for s in SCENARIOS[scenario] if not (read_only and s[1] in MUTATING_STEPS))
+
+
+def virtual_user(scenario, base, pools, recorder, deadline, think, timeout, headers, seed, read_only=False):
+    rng = random.Random(seed)
+    steps = scenario_steps(scenario, read_only)
+    if not steps:
+        return
+    weights = [w for w, _ in steps]
+    session = requests.Session()
+    session.headers.update(headers)
+    # 错开起步，避免所有用户同一时刻打第一枪
+    time.sleep(rng.uniform(0, think or 0.1))
+    while time.monotonic() < deadline:
+        step = rng.choices(steps, weights)[0][1]
+        method, route, path, body = step(pools, rng)
+        t0 = time.perf_counter()
+        try:
+            r = session.request(method, base + path, json=body, timeout=timeout)
+            status = r.status_code
+        except requests.RequestException as e:
+            status = f"error:{type(e).__name__}"
+        recorder.add(scenario, route, status, (time.perf_counter() - t0) * 1000, time.monotonic())
+        if think:
+            time.sleep(min(rng.expovariate(1.0 / think), think * 5))
+
+
+def _is_error(status):
+    return not isinstance(status, int) or status >= 500
+
+
+def build_report(recorder, seconds):
+    routes = []
+    for (scenario, route), vals in sorted(recorder.samples.items()):
+        statuses = recorder.statuses[(scenario, route)]
+        errors = sum(n for s, n in statuses.items() if _is_error(s))
+        routes.append({
+            "scenario": scenario,
+            "route": route,
+            "count": len(vals),
+            "rps": round(len(vals) / seconds, 2) if seconds else 0.0,
+            "error_pct": round(errors * 100 / len(vals), 2) if vals else 0.0,
+            "p50_ms": round(percentile(vals, 50), 1),
+            "p95_ms": round(percentile(vals, 95), 1),
+            "p99_ms": round(percentile(vals, 99), 1),
+            "max_ms": round(max(vals), 1) if vals else 0.0,
+            "statuses": {str(s): n for s, n in statuses.most_common()},
+        })
+    totals = {}
+    for scenario in SCENARIOS:
+        vals = [v for (sc, _), vs in recorder.samples.items() if sc == scenario for v in vs]
+        if not vals:
+            continue
+        errors = sum(n for (sc, _), st in recorder.statuses.items() if sc == scenario
+                     for s, n in st.items() if _is_error(s))
+        totals[scenario] = {
+            "count": len(vals), "rps": round(len(vals) / seconds, 2) if seconds else 0.0,
+            "error_pct": round(errors * 100 / len(vals), 2),
+            "p50_ms": round(percentile(vals, 50), 1), "p95_ms": round(percentile(vals, 95), 1),
+            "p99_ms": round(percentile(vals, 99), 1),
+        }
+    return {"seconds": round(seconds, 1), "routes": routes, "totals": totals}
+
+
+def print_report(report):
+    print(f"\n== 统计区间 {report['seconds']}s ==")
+    # 中文表头按显示宽度（每字占两格）对齐
+    head = f"  {'路由':<42}{'次数':>5}{'rps':>8}{'错误%':>5}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}  状态码"
+    for scenario in SCENARIOS:
+        rows = [r for r in report["routes"] if r["scenario"] == scenario]
+        if not rows:
+            continue
+        t = report["totals"][scenario]
+        print(f"\n[{scenario}] 共 {t['count']} 次，{t['rps']} rps，错误 {t['error_pct']}%，"
+              f"p50 {t['p50_ms']:.0f}ms / p95 {t['p95_ms']:.0f}ms / p99 {t['p99_ms']:.0f}ms")
+        print(head)
+        for r in rows:
+            statuses = " ".join(f"{s}×{n}" for s, n in r["statuses"].items())
+            print(f"  {r['route']:<44}{r['count']:>7}{r['rps']:>8.2f}{r['error_pct']:>7.1f}{r['p50_ms']:>8.0f}"
+                  f"{r['p95_ms']:>8.0f}{r['p99_ms']:>8.0f}{r['max_ms']:>8.0f}  {statuses}")
+
+
+# ---------- 被测服务 ----------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# 被测服务访问外部依赖用的环境变量，--spawn 时必须全部指向本机
+DEPENDENCY_ENV = ("OCRPLUS_BASE_URL", "BIGMODEL_API_URL", "GWFPOD_API_BASE", "PREVIEW_LAB_URL", "PREVIEW_LAB_BASE")
+_LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def non_loopback_dependencies(env):
+    """返回没有指向本机的依赖变量 {名: 值}；未设置的也算（多数会回退到线上默认地址）。"""
+    bad = {}
+    for name in DEPENDENCY_ENV:
+        value = env.get(name) or ""
+        host = urllib.parse.urlsplit(value).hostname
+        if host not in _LOOPBACK_HOSTS:
+            bad[name] = value or "(未设置)"
+    return bad
+
+
+def spawn_app(args, extra_env):
+    port = args.spawn_port or _free_port()
+    env = dict(os.environ)
+    env.update({
+        "DB_HOST": args.db_host, "DB_PORT": str(args.db_port), "DB_USER": args.db_user,
+        "DB_PASSWORD": args.db_password, "DB_NAME": args.db_name,
+        "GUNICORN_BIND": f"127.0.0.1:{port}", "ADMIN_TOKEN": ADMIN_TOKEN,
+    })
+    env.update(extra_env)
+    bad = non_loopback_dependencies(env)
+    if bad:
+        raise RuntimeError("拒绝启动：以下依赖未指向本机，压测会打到线上 " + " ".join(f"{k}={v}" for k, v in bad.items()))
+    if args.workers:
+        env["GUNICORN_WORKERS"] = str(args.workers)
+    if args.threads:
+        env["GUNICORN_THREADS"] = str(args.threads)
+    log = open(args.app_log, "ab") if args.app_log else subprocess.DEVNULL
+    proc = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "app:app"], cwd=BACKEND_DIR, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.spawn_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn 启动失败（退出码 {proc.returncode}），加 --app-log 看日志")
+        try:
+            requests.get(base + "/metrics", timeout=2)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError(f"gunicorn {args.spawn_timeout}s 内未就绪")
+
+
+def stop_app(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def fetch_fake_stats(fakes):
+    out = {}
+    for name, info in fakes.items():
+        try:
+            out[name] = requests.get(info["url"] + "/__stats", timeout=5).json()
+        except (requests.RequestException, ValueError) as e:
+            out[name] = {"error": str(e)}
+    return out
+
+
+def fetch_app_snapshot(base, headers):
+    """压测结束后顺手取一次服务端视角：最耗时的 SQL 指纹（需要 ADMIN_TOKEN）。"""
+    try:
+        r = requests.get(base + "/api/debug/queries?sort=total&limit=10", headers=headers, timeout=10)
+        if r.status_code == 200:
+            return r.json()
+    except (requests.RequestException, ValueError):
+        pass
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = ap.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target", help="已启动的被测服务地址")
+    target.add_argument("--spawn", action="store_true", help="自动起 gunicorn")
+    ap.add_argument("--with-fakes", action="store_true", help="本进程内启动假依赖（--spawn 时总会启动）")
+    ap.add_argument("--read-only", action="store_true", help="只回放只读请求，不做通过 / 废弃 / 保存 / 回写")
+    ap.add_argument("--deps-are-fake", action="store_true",
+                    help="--target 时确认被测服务的 OCRPlus / GLM / gwfpod / preview-lab 已指向假服务，允许回放写操作")
+    ap.add_argument("--fake-port-base", type=int, default=5901)
+    ap.add_argument("--fake-latency", default="", help="同 fake_services.py --latency")
+    ap.add_argument("--fake-errors", default="", help="同 fake_services.py --errors")
+    ap.add_argument("--db-host", default="127.0.0.1")
+    ap.add_argument("--db-port", type=int, default=3317)
+    ap.add_argument("--db-user", default="root")
+    ap.add_argument("--db-password", default="root")
+    ap.add_argument("--db-name", default="temu_baodan_loadtest")
+    ap.add_argument("--pool-size", type=int, default=5000, help="从库里取多少商品 id 做回放")
+    ap.add_argument("--reviewers", type=int, default=10, help="审核员虚拟用户数")
+    ap.add_argument("--n8n", type=int, default=4, help="N8N 并发数")
+    ap.add_argument("--reviewer-think", type=float, default=1.0, help="审核员两步之间平均间隔（秒）")
+    ap.add_argument("--n8n-think", type=float, default=0.2, help="N8N 两次调用之间平均间隔（秒）")
+    ap.add_argument("--n8n-api-key", default="", help="N8N 请求带的 X-Api-Key（验证按 Key 分道时用）")
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--warmup", type=float, default=5.0, help="开头多少秒不计入统计")
+    ap.add_argument("--timeout", type=float, default=120.0, help="单请求超时（秒）")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=0, help="--spawn 时覆盖 GUNICORN_WORKERS")
+    ap.add_argument("--threads", type=int, default=0, help="--spawn 时覆盖 GUNICORN_THREADS")
+    ap.add_argument("--spawn-port", type=int, default=0)
+    ap.add_argument("--spawn-timeout", type=float, default=60.0)
+    ap.add_argument("--app-log", default="", help="--spawn 时 gunicorn 输出写到该文件")
+    ap.add_argument("--admin-token", default="", help="--target 时用于取 /api/debug/queries（--spawn 自动设置）")
+    ap.add_argument("--json", default="", help="结果另存为 JSON 文件")
+    args = ap.parse_args()
+    if args.spawn:
+        args.with_fakes = True
+    mutating = not args.read_only and (args.reviewers > 0 or args.n8n > 0)
+    if args.target and mutating and not args.deps_are_fake:
+        print("!! 拒绝回放：--target 模式下本脚本无法确认被测服务的外部依赖已指向假服务。\n"
+              "!! 通过 / 保存会调 gwfpod batch_update 与侵权检测，若被测服务连的是线上 gwfpod，会覆盖真实商品。\n"
+              f"!! 确认 {', '.join(DEPENDENCY_ENV)} 都指向本机假服务后加 --deps-are-fake，或加 --read-only 只回放只读请求。")
+        return 2
+
+    rng = random.Random(args.seed)
+    try:
+        pools = IdPools(args, rng)
+    except (pymysql.err.MySQLError, RuntimeError) as e:
+        print(f"读取压测库失败：{e}")
+        return 2
+    print(f"压测库：{len(pools.goods_ids)} 个商品、{pools.pending_left()} 个待审核可用于通过 / 废弃、"
+          f"{len(pools.image_urls)} 张图")
+
+    fakes = {}
+    env = {}
+    if args.with_fakes:
+        from fake_services import app_env, parse_pairs, start_fakes
+        try:
+            fakes = start_fakes(port_base=args.fake_port_base, latency=parse_pairs(args.fake_latency, "latency"),
+                                errors=parse_pairs(args.fake_errors, "errors"))
+        except (ValueError, OSError) as e:
+            print(f"启动假依赖失败：{e}")
+            return 2
+        env = app_env(fakes)
+        if args.target:
+            print("假依赖已启动，被测服务需自行配置：" + " ".join(f"{k}={v}" for k, v in env.items()))
+
+    proc = None
+    if args.spawn:
+        try:
+            proc, base = spawn_app(args, env)
+        except RuntimeError as e:
+            print(e)
+            return 2
+        admin_token = ADMIN_TOKEN
+        print(f"gunicorn 已启动：{base}（pid {proc.pid}）")
+    else:
+        base = args.target.rstrip("/")
+        admin_token = args.admin_token
+
+    start = time.monotonic()
+    deadline = start + args.warmup + args.duration
+    recorder = Recorder(measure_from=start + args.warmup)
+    n8n_headers = {"X-Api-Key": args.n8n_api_key} if args.n8n_api_key else {}
+    users = [("reviewer", args.reviewer_think, {})] * args.reviewers + [("n8n", args.n8n_think, n8n_headers)] * args.n8n
+    threads = []
+    for i, (scenario, think, headers) in enumerate(users):
+        t = threading.Thread(target=virtual_user, daemon=True, name=f"{scenario}-{i}",
+                             args=(scenario, base, pools, recorder, deadline, think, args.timeout, headers,
+                                   args.seed * 1000 + i, args.read_only))
+        t.start()
+        threads.append(t)
+    if args.target and mutating:
+        print("!! 注意：--target 回放包含写操作，依赖已由 --deps-are-fake 确认指向假服务")
+    print(f"回放中：{args.reviewers} 个审核员 + {args.n8n} 路 N8N{'（只读）' if args.read_only else ''}，预热 {args.warmup:g}s + 统计 {args.duration:g}s")
+    try:
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()) + args.timeout)
+    except KeyboardInterrupt:
+        print("\n已中断，输出已采到的部分")
+    measured = min(time.monotonic(), deadline) - recorder.measure_from
+
+    report = build_report(recorder, max(0.0, measured))
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("db_password", "admin_token")}
+    report["pending_left"] = pools.pending_left()
+    print_report(report)
+    if fakes:
+        report["fakes"] = fetch_fake_stats(fakes)
+        print("\n假依赖：")
+        for name, st in report["fakes"].items():
+            print(f"  {name:<10} {json.dumps(st, ensure_ascii=False)[:200]}")
+    if admin_token:
+        snapshot = fetch_app_snapshot(base, {"X-Admin-Token": admin_token})
+        if snapshot:
+            report["queries"] = snapshot
+            print("\n服务端耗时最多的 SQL 指纹（单个 worker）：")
+            for q in (snapshot.get("data") or {}).get("queries") or []:
+                print(f"  {q['total_ms']:>10.0f}ms  n={q['count']:<6} p95={q['p95_ms']:.0f}ms  "
+                      f"{q['fingerprint'][:100]}")
+    if proc is not None:
+        stop_app(proc)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
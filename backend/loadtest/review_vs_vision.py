@@ -0,0 +1,151 @@
+"""
+压测：打满 /api/vision/describe 的同时，审核页接口的 p95 延迟是否保持。
+
+分两段跑：先只压审核接口得到基线，再在 vision 并发打满的情况下压同样的审核接口，
+对比两段的 p50/p95；「压测期 p95 > 基线 p95 × --max-ratio 且超过 --min-p95-ms」即判失败（退出码 1）。
+
+示例：
+  python loadtest/review_vs_vision.py --base http://127.0.0.1:5000
+  python loadtest/review_vs_vision.py --base http://127.0.0.1:8080 --vision-concurrency 30 --duration 60 \\
+      --image-url "https://img.kwcdn.com/product/xxx.jpg" --goods-id 123
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, int(round(p / 100.0 * len(s) + 0.5)) - 1))
+    return s[k]
+
+
+def review_paths(goods_id):
+    paths = [
+        "/api/goods/list?page=1&page_size=20&review_status=0&process_status=2",
+        "/api/goods/statistics",
+        "/api/goods/reason-history?dimension=goods",
+    ]
+    if goods_id:
+        paths.append(f"/api/goods/detail/{goods_id}")
+    return paths
+
+
+def run_review_load(base, paths, duration, concurrency, timeout):
+    """并发轮询审核接口 duration 秒，返回 {path: [耗时ms...]} 与错误数。"""
+    results = {p: [] for p in paths}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(offset):
+        session = requests.Session()
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                r = session.get(base + path, timeout=timeout)
+                ok = r.status_code < 500
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                if ok:
+                    results[path].append(elapsed)
+                else:
+                    errors[0] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        for n in range(concurrency):
+            ex.submit(worker, n)
+    return results, errors[0]
+
+
+def start_vision_load(base, concurrency, image_url, stop_event, timeout):
+    """后台持续打 /api/vision/describe（skip_cache，确保每次都占模型并发）。"""
+    counters = {"sent": 0, "ok": 0, "rejected": 0, "failed": 0}
+    lock = threading.Lock()
+    body = {
+        "image_url": image_url,
+        "prompt": "请用一句话描述这张图片",
+        "skip_cache": True,
+    }
+
+    def worker():
+        session = requests.Session()
+        while not stop_event.is_set():
+            try:
+                r = session.post(base + "/api/vision/describe", json=body, timeout=timeout)
+                key = "ok" if r.status_code == 200 else ("rejected" if r.status_code in (429, 503) else "failed")
+            except requests.RequestException:
+                key = "failed"
+            with lock:
+                counters["sent"] += 1
+                counters[key] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    return threads, counters
+
+
+def summarize(title, results, errors):
+    print(f"\n== {title} ==")
+    all_ms = []
+    for path, vals in results.items():
+        all_ms.extend(vals)
+        if vals:
+            print(f"  {path:<70} n={len(vals):<5} p50={percentile(vals, 50):7.0f}ms  p95={percentile(vals, 95):7.0f}ms")
+        else:
+            print(f"  {path:<70} n=0")
+    p95 = percentile(all_ms, 95)
+    print(f"  全部: n={len(all_ms)} errors={errors} p50={percentile(all_ms, 50):.0f}ms p95={p95:.0f}ms"
+          f" mean={statistics.mean(all_ms) if all_ms else 0:.0f}ms")
+    return p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description="审核接口在 vision 满载下的延迟压测")
+    parser.add_argument("--base", default="http://127.0.0.1:5000", help="后端地址（不带 /api）")
+    parser.add_argument("--duration", type=int, default=30, help="每段压测秒数")
+    parser.add_argument("--review-concurrency", type=int, default=4, help="模拟审核人员并发数")
+    parser.add_argument("--vision-concurrency", type=int, default=20, help="vision/describe 并发数（应 ≥ 模型并发上限）")
+    parser.add_argument("--image-url", default="https://img.kwcdn.com/product/20195053a14/c2ddafb8-2eee-497c-9c81-c45254e903bf_800x800.png")
+    parser.add_argument("--goods-id", type=int, default=0, help="压 /api/goods/detail/<id> 用的商品主键，0 则不压详情")
+    parser.add_argument("--max-ratio", type=float, default=2.0, help="允许压测期 p95 相对基线的最大倍数")
+    parser.add_argument("--min-p95-ms", type=float, default=300.0, help="p95 低于该值时不判失败（避免基线极小时倍数失真）")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+    base = args.base.rstrip("/")
+    paths = review_paths(args.goods_id)
+
+    print(f"基线：只压审核接口 {args.duration}s，并发 {args.review_concurrency}")
+    base_results, base_errors = run_review_load(base, paths, args.duration, args.review_concurrency, args.timeout)
+    base_p95 = summarize("基线", base_results, base_errors)
+
+    print(f"\n压测：vision 并发 {args.vision_concurrency} 打满，同时压审核接口 {args.duration}s")
+    stop = threading.Event()
+    threads, counters = start_vision_load(base, args.vision_concurrency, args.image_url, stop, 180)
+    time.sleep(3)  # 先让 vision 请求占满
+    load_results, load_errors = run_review_load(base, paths, args.duration, args.review_concurrency, args.timeout)
+    stop.set()
+    load_p95 = summarize("vision 满载", load_results, load_errors)
+    print(f"  vision 请求: {counters}")
+
+    limit = max(base_p95 * args.max_ratio, args.min_p95_ms)
+    passed = load_p95 <= limit and load_errors == 0
+    print(f"\n结论：基线 p95={base_p95:.0f}ms，满载 p95={load_p95:.0f}ms，上限 {limit:.0f}ms -> {'PASS' if passed else 'FAIL'}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+压测库造数：在本地 MySQL 里建表并灌入接近线上量级的 temu_goods_v2、access_logs、image_assets、image_goods_mapping、
+lovart_design_tab_mapping 与品类配置，供 replay_traffic.py 压测用。
+
+本地起一个 MySQL 即可（不要指向线上库）：
+  docker run -d --name goods-review-loadtest-db -p 3317:3306 \\
+      -e MYSQL_ROOT_PASSWORD=root -e MYSQL_DATABASE=temu_baodan_loadtest mysql:8.0
+
+表结构：
+  - temu_goods_v2 / access_logs / image_assets / image_goods_mapping / lovart_design_tab_mapping / goods_review_config
+    的建表语句仓库里没有（线上由采集软件与 OCRPlus 建），这里按 app.py 实际读写的列重建，索引只建查询条件里用到的；
+    要验证某个索引改动，造数后直接 ALTER 再压一遍对比
+  - 其余表执行仓库 sql/ 下的建表 / 加列脚本（重复执行时「表已存在 / 列已存在」忽略）
+数据分布：process_status 约 1 成在预处理、其余已处理；已处理中待审核 / 已通过 / 已废弃约 4:4:2，已通过的 3 成已发布；
+少量侵权疑似；每个商品若干条 access_logs（带品类关键词）、5~8 张轮播图，约 --labelled 比例的图在 image_assets 有标签。
+图片 URL 指向 fake_services.py 的图床（--image-base），识图压测时由假图床出图。
+
+安全：只接受库名以 _loadtest 结尾、主机为本机的目标，除非显式 --allow-any-target；--reset 会先清空上述表。
+
+示例：
+  python loadtest/seed_loadtest_db.py --port 3317 --reset
+  python loadtest/seed_loadtest_db.py --port 3317 --goods 200000 --designs 20000 --reset
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymysql  # noqa: E402
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "sql")
+# 仓库里已有的建表 / 加列脚本（按依赖顺序）
+REPO_MIGRATIONS = (
+    "create_category_config.sql",
+    "add_is_multi_spec_to_category_config.sql",
+    "add_vision_result_cache.sql",
+    "add_vision_jobs.sql",
+    "add_negative_reason_log.sql",
+    "add_label_badcase.sql",
+    "add_image_dhash.sql",
+    "add_image_content_hash.sql",
+)
+# 重复执行可忽略的错误：表已存在、列已存在、索引已存在
+_IGNORABLE_ERRORS = (1050, 1060, 1061)
+
+BASE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS temu_goods_v2 (
+      id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+      api_id BIGINT NULL,
+      master_user_id VARCHAR(64) NULL,
+      product_id BIGINT NULL,
+      product_name VARCHAR(512) NULL,
+      carousel_pic_urls JSON NULL,
+      carousel_labels JSON NULL,
+      preprocess_tags JSON NULL,
+      preprocess_mode VARCHAR(20) NULL,
+      replaced_3rd_image_url VARCHAR(1024) NULL,
+      replaced_spec_image_url VARCHAR(1024) NULL,
+      sku_list JSON NULL,
+      sku_specs JSON NULL,
+      origin_product_url VARCHAR(1024) NULL,
+      group_id BIGINT NULL,
+      ref_product_template_id BIGINT NULL,
+      ref_product_size_template_id BIGINT NULL,
+      extcode VARCHAR(128) NULL,
+      create_by VARCHAR(64) NULL,
+      create_dept_id BIGINT NULL,
+      malls JSON NULL,
+      product_template JSON NULL,
+      product_size_template JSON NULL,
+      group_data JSON NULL,
+      sale_count INT NOT NULL DEFAULT 0,
+      is_publish TINYINT NOT NULL DEFAULT 0,
+      process_status TINYINT NOT NULL DEFAULT 0,
+      review_status TINYINT NOT NULL DEFAULT 0,
+      infringement_status TINYINT NULL,
+      create_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      update_time DATETIME NULL,
+      KEY idx_api_id (api_id),
+      KEY idx_product_id (product_id),
+      KEY idx_status_time (is_publish, process_status, review_status, create_time)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS access_logs (
+      id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+      goods_id BIGINT NOT NULL,
+      product_category VARCHAR(255) NULL,
+      access_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      KEY idx_goods_time (goods_id, access_time)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS image_assets (
+      id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+      url VARCHAR(1024) NOT NULL,
+      url_hash CHAR(32) NOT NULL,
+      image_path VARCHAR(512) NULL,
+      full_path VARCHAR(1024) NULL,
+      labels JSON NULL,
+      label_source VARCHAR(32) NULL,
+      created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      updated_at DATETIME NULL,
+      UNIQUE KEY uk_url_hash (url_hash)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS image_goods_mapping (
+      url_hash CHAR(32) NOT NULL,
+      original_goods_id BIGINT NOT NULL,
+      PRIMARY KEY (url_hash, original_goods_id),
+      KEY idx_goods (original_goods_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lovart_design_tab_mapping (
+      id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+      tab_id VARCHAR(128) NOT NULL,
+      tab_url VARCHAR(1024) NULL,
+      tab_title VARCHAR(512) NULL,
+      product_id VARCHAR(64) NULL,
+      product_name VARCHAR(512) NULL,
+      category VARCHAR(64) NULL,
+      original_image_url VARCHAR(1024) NULL,
+      original_images_urls JSON NULL,
+      original_excluded_indices JSON NULL,
+      original_referable_indices JSON NULL,
+      original_classify_reasons JSON NULL,
+      design_images JSON NULL,
+      design_images_uploaded_urls JSON NULL,
+      excluded_image_indices JSON NULL,
+      design_discard_reasons JSON NULL,
+      design_check_results JSON NULL,
+      design_image_1_url VARCHAR(1024) NULL,
+      design_image_1_title VARCHAR(255) NULL,
+      design_image_2_url VARCHAR(1024) NULL,
+      design_image_2_title VARCHAR(255) NULL,
+      design_image_3_url VARCHAR(1024) NULL,
+      design_image_3_title VARCHAR(255) NULL,
+      ai_recommendation VARCHAR(64) NULL,
+      ai_reason TEXT NULL,
+      ai_prompt_suggestion TEXT NULL,
+      status VARCHAR(32) NOT NULL DEFAULT 'generating',
+      selected_image_index INT NULL,
+      selected_image_url VARCHAR(1024) NULL,
+      created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      updated_at DATETIME NULL,
+      completed_at DATETIME NULL,
+      approved_at DATETIME NULL,
+      UNIQUE KEY uk_tab_id (tab_id),
+      KEY idx_status (status)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS goods_review_config (
+      ckey VARCHAR(128) NOT NULL PRIMARY KEY,
+      cvalue MEDIUMTEXT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+)
+SEEDED_TABLES = ("temu_goods_v2", "access_logs", "image_assets", "image_goods_mapping", "lovart_design_tab_mapping",
+                 "image_content_hash", "image_dhash", "image_dhash_reuse", "vision_result_cache", "vision_jobs",
+                 "negative_reason_log", "label_badcase")
+
+# 品类：(config_key, 展示名, 关键词, 规格图位, 多规格)
+CATEGORIES = (
+    ("blanket", "毛毯", ["毯子", "盖毯", "毛毯"], 2, 0),
+    ("pillow", "抱枕", ["抱枕", "靠垫", "枕套"], 2, 1),
+    ("tapestry", "挂毯", ["挂毯", "挂布", "背景布"], 3, 0),
+    ("doormat", "地垫", ["地垫", "门垫", "脚垫"], 2, 1),
+    ("shower_curtain", "浴帘", ["浴帘"], 3, 0),
+)
+_OTHER_CATEGORIES = ("家居日用>收纳", "服饰配件>帽子", "")
+_WORDS = ("复古", "北欧", "卡通", "法兰绒", "加厚", "印花", "简约", "ins风", "圣诞", "万圣节", "动漫", "风景", "花卉", "几何")
+
+
+def _url_hash(url):
+    n = (url or "").strip().split("#")[0].split("?")[0].strip()
+    return hashlib.md5(n.encode("utf-8")).hexdigest() if n else ""
+
+
+def connect(args, database=True):
+    return pymysql.connect(
+        host=args.host, port=args.port, user=args.user, password=args.password,
+        database=args.database if database else None, charset="utf8mb4", autocommit=False,
+    )
+
+
+def check_target(args):
+    if args.allow_any_target:
+        return None
+    if args.host not in ("127.0.0.1", "localhost", "::1") and not args.host.startswith("172."):
+        return f"目标主机 {args.host} 不是本机；确认不是线上库后加 --allow-any-target"
+    if not args.database.endswith("_loadtest"):
+        return f"库名 {args.database} 不以 _loadtest 结尾；确认不是线上库后加 --allow-any-target"
+    return None
+
+
+def _split_sql(text):
+    lines = [ln for ln in text.splitlines() if not ln.strip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+
+def create_schema(conn):
+    with conn.cursor() as cur:
+        for ddl in BASE_TABLES:
+            cur.execute(ddl)
+        for name in REPO_MIGRATIONS:
+            with open(os.path.join(SQL_DIR, name), encoding="utf-8") as f:
+                for stmt in _split_sql(f.read()):
+                    try:
+                        cur.execute(stmt)
+                    except pymysql.err.MySQLError as e:
+                        if e.args and e.args[0] in _IGNORABLE_ERRORS:
+                            continue
+                        raise
+    conn.commit()
+
+
+def reset_tables(conn):
+    with conn.cursor() as cur:
+        for table in SEEDED_TABLES:
+            cur.execute(f"TRUNCATE TABLE {table}")
+    conn.commit()
+
+
+def seed_categories(conn, image_base):
+    with conn.cursor() as cur:
+        for i, (key, name, keywords, spec_idx, multi) in enumerate(CATEGORIES):
+            cur.execute(
+                """INSERT INTO goods_review_category_config
+                   (config_key, display_name, keywords, spec_image_index, spec_image_url, template_name,
+                    ref_product_template_id, is_multi_spec, sort_order)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                   ON DUPLICATE KEY UPDATE keywords = VALUES(keywords), spec_image_url = VALUES(spec_image_url)""",
+                (key, name, json.dumps(keywords, ensure_ascii=False), spec_idx, f"{image_base}/img/spec/{key}.jpg",
+                 f"{name}采集模板", 50 + i, multi, i),
+            )
+    conn.commit()
+
+
+def _insert_many(conn, sql, rows, batch):
+    with conn.cursor() as cur:
+        for i in range(0, len(rows), batch):
+            cur.executemany(sql, rows[i:i + batch])
+    conn.commit()
+
+
+def _goods_status(rng):
+    r = rng.random()
+    if r < 0.1:
+        return 0 if r < 0.05 else 1, 0, 0, None
+    r = rng.random()
+    review = 0 if r < 0.4 else (1 if r < 0.8 else 2)
+    publish = 1 if review == 1 and rng.random() < 0.3 else 0
+    infringement = rng.choice((2, 3)) if rng.random() < 0.03 else (1 if rng.random() < 0.3 else None)
+    return 2, review, publish, infringement
+
+
+def seed_goods(conn, args, rng):
+    """按块生成商品及其 access_logs / image_assets / image_goods_mapping，避免一次把全部行放进内存。"""
+    now = datetime.now()
+    chunk = args.batch
+    label_sources = ("ocrplus", "glm", "manual")
+    totals = {"temu_goods_v2": 0, "access_logs": 0, "image_assets": 0, "image_goods_mapping": 0}
+    for start in range(0, args.goods, chunk):
+        goods_rows, log_rows, asset_rows, mapping_rows = [], [], [], []
+        for n in range(start, min(start + chunk, args.goods)):
+            product_id = 600000000 + n
+            cat = CATEGORIES[n % len(CATEGORIES)] if rng.random() < 0.9 else None
+            title = f"{rng.choice(_WORDS)}{rng.choice(_WORDS)}{cat[1] if cat else '杂货'} {n}"
+            images = [f"{args.image_base}/img/{product_id}_{k}.jpg" for k in range(rng.randint(5, 8))]
+            labels = []
+            for k, url in enumerate(images):
+                h = _url_hash(url)
+                mapping_rows.append((h, product_id))
+                lab = None
+                if rng.random() < args.labelled:
+                    lab = {"is_main_image": k == 0, "product_complete": rng.random() > 0.1,
+                           "first_image_reason": "主体完整", "design_desc": f"{title} 第 {k + 1} 张"}
+                    asset_rows.append((url, h, f"/data/images/{h[:2]}/{h}.jpg", json.dumps(lab, ensure_ascii=False),
+                                       rng.choice(label_sources)))
+                labels.append(lab)
+            skus = [{"productSkuId": product_id * 10 + s, "pic_url": images[min(2, len(images) - 1)],
+                     "volumeLen": 0, "volumeWidth": 0, "volumeHeight": 0, "weightValue": 0,
+                     "supplierPrice": round(rng.uniform(20, 200), 2), "3001": f"{100 + 30 * s}x{150 + 30 * s}cm"}
+                    for s in range(rng.randint(1, 4))]
+            process, review, publish, infringement = _goods_status(rng)
+            created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))
+            goods_rows.append((
+                9000000 + n, f"user{n % 40}", product_id, title,
+                json.dumps(images, ensure_ascii=False), json.dumps(labels, ensure_ascii=False),
+                json.dumps(["has_text"] if rng.random() < 0.2 else [], ensure_ascii=False),
+                json.dumps(skus, ensure_ascii=False), json.dumps([{"specName": "尺寸"}], ensure_ascii=False),
+                f"https://www.temu.com/goods.html?goods_id={product_id}", f"EXT{product_id}",
+                rng.randint(0, 5000), publish, process, review, infringement, created, created,
+            ))
+            for _ in range(args.logs_per_goods):
+                if cat and rng.random() < 0.85:
+                    category = f"家居纺织>{rng.choice(cat[2])}"
+                else:
+                    category = rng.choice(_OTHER_CATEGORIES)
+                log_rows.append((product_id, category, created + timedelta(minutes=rng.randint(0, 600))))
+        _insert_many(conn, """INSERT INTO temu_goods_v2
+            (api_id, master_user_id, product_id, product_name, carousel_pic_urls, carousel_labels, preprocess_tags,
+             sku_list, sku_specs, origin_product_url, extcode, sale_count, is_publish, process_status, review_status,
+             infringement_status, create_time, update_time)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""", goods_rows, args.batch)
+        _insert_many(conn, "INSERT INTO access_logs (goods_id, product_category, access_time) VALUES (%s, %s, %s)",
+                     log_rows, args.batch)
+        _insert_many(conn, """INSERT IGNORE INTO image_assets (url, url_hash, image_path, labels, label_source)
+            VALUES (%s, %s, %s, %s, %s)""", asset_rows, args.batch)
+        _insert_many(conn, "INSERT IGNORE INTO image_goods_mapping (url_hash, original_goods_id) VALUES (%s, %s)",
+                     mapping_rows, args.batch)
+        totals["temu_goods_v2"] += len(goods_rows)
+        totals["access_logs"] += len(log_rows)
+        totals["image_assets"] += len(asset_rows)
+        totals["image_goods_mapping"] += len(mapping_rows)
+        print(f"  商品 {totals['temu_goods_v2']}/{args.goods}", end="\r", flush=True)
+    print()
+    return totals
+
+
+def seed_designs(conn, args, rng):
+    now = datetime.now()
+    statuses = ("generating", "ai_selected", "tab_closed", "completed", "approved", "failed")
+    weights = (0.15, 0.25, 0.1, 0.3, 0.15, 0.05)
+    rows = []
+    for n in range(args.designs):
+        product_id = 600000000 + rng.randrange(max(1, args.goods))
+        originals = [f"{args.image_base}/img/{product_id}_{k}.jpg" for k in range(rng.randint(1, 4))]
+        designs = [f"{args.image_base}/img/design/{n}_{k}.jpg" for k in range(rng.randint(0, 6))]
+        status = rng.choices(statuses, weights)[0]
+        created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        completed = created + timedelta(minutes=rng.randint(5, 120)) if status in ("completed", "approved") else None
+        rows.append((
+            f"loadtest-tab-{n}", f"https://www.lovart.ai/canvas/{n}", f"设计 {n}", str(product_id), f"商品 {product_id}",
+            CATEGORIES[n % len(CATEGORIES)][0], originals[0], json.dumps(originals), json.dumps(designs),
+            json.dumps([]), designs[0] if designs else None, designs[1] if len(designs) > 1 else None,
+            designs[2] if len(designs) > 2 else None, status, created, created, completed,
+        ))
+    _insert_many(conn, """INSERT INTO lovart_design_tab_mapping
+        (tab_id, tab_url, tab_title, product_id, product_name, category, original_image_url, original_images_urls,
+         design_images, excluded_image_indices, design_image_1_url, design_image_2_url, design_image_3_url, status,
+         created_at, updated_at, completed_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""", rows, args.batch)
+    return len(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=os.getenv("DB_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("DB_PORT", "3317")))
+    ap.add_argument("--user", default=os.getenv("DB_USER", "root"))
+    ap.add_argument("--password", default=os.getenv("DB_PASSWORD", "root"))
+    ap.add_argument("--database", default="temu_baodan_loadtest")
+    ap.add_argument("--goods", type=int, default=50000, help="商品数")
+    ap.add_argument("--logs-per-goods", type=int, default=4, help="每个商品的 access_logs 条数")
+    ap.add_argument("--labelled", type=float, default=0.8, help="轮播图在 image_assets 有标签的比例")
+    ap.add_argument("--designs", type=int, default=5000, help="lovart_design_tab_mapping 行数")
+    ap.add_argument("--image-base", default="http://127.0.0.1:5905", help="fake_services.py 图床地址")
+    ap.add_argument("--batch", type=int, default=2000, help="executemany 每批行数")
+    ap.add_argument("--seed", type=int, default=20260101)
+    ap.add_argument("--reset", action="store_true", help="造数前清空相关表")
+    ap.add_argument("--allow-any-target", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    problem = check_target(args)
+    if problem:
+        print(problem)
+        return 2
+    args.image_base = args.image_base.rstrip("/")
+    rng = random.Random(args.seed)
+
+    server = connect(args, database=False)
+    with server.cursor() as cur:
+        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}` DEFAULT CHARACTER SET utf8mb4")
+    server.close()
+
+    conn = connect(args)
+    t0 = time.perf_counter()
+    create_schema(conn)
+    if args.reset:
+        reset_tables(conn)
+    seed_categories(conn, args.image_base)
+    print(f"建表完成，开始造数（{args.goods} 个商品、{args.designs} 条设计）")
+    totals = seed_goods(conn, args, rng)
+    totals["lovart_design_tab_mapping"] = seed_designs(conn, args, rng)
+    with conn.cursor() as cur:
+        for table in totals:
+            cur.execute(f"ANALYZE TABLE {table}")
+            cur.fetchall()
+    conn.close()
+    print(f"完成，用时 {time.perf_counter() - t0:.1f}s")
+    for table, n in totals.items():
+        print(f"  {table:<28} {n}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Prometheus 指标（文本格式 0.0.4），不依赖 prometheus_client。
+
+  - Registry：计数器 / 仪表 / 直方图，按标签值分组，线程安全；add_collector 注册抓取时才取值的指标（连接池、队列深度等）
+  - 多 worker：gunicorn 每个 worker 各自计数，抓取只会打到其中一个。各 worker 定期（flush_interval 秒）把自己的快照写到
+    <directory>/<master pid>/<pid>.json，/metrics 由接到请求的 worker 先写一份最新快照，再合并同一 master 下所有存活 worker
+    的快照：计数器、直方图、仪表都按标签相加（在途数、队列深度、连接数相加即全进程合计）；已退出的 worker 的快照删除，
+    其计数随之消失，Prometheus 的 rate() 会按计数器重置处理
+  - instrument_requests：包一层 requests.Session.send，按 URL 前缀把每次外部调用归到依赖名下计时，业务代码不用改；
+    add_request_hook 可在同一处挂额外的前后回调（如追踪 span、透传请求头）
+"""
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# 请求 / 外部调用耗时的默认分桶（秒）：覆盖审核接口的几十毫秒到识图的一两分钟
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    def __init__(self, registry, name, help_text, kind, labels):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self._lock = registry._lock
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} 需要标签 {self.label_names}，收到 {labels}")
+        return tuple(str(v) for v in labels)
+
+
+class Counter(_Metric):
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    def __init__(self, registry, name, help_text, labels, buckets):
+        super().__init__(registry, name, help_text, HISTOGRAM, labels)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                # 各桶为非累计计数，最后一格是 +Inf；再加 sum、count
+                h = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+
+class Registry:
+    def __init__(self, namespace="", directory=None, flush_interval=5.0):
+        """
+        :param namespace: 指标名前缀（如 goods_review）
+        :param directory: 多 worker 快照目录；None 时只导出本进程
+        :param flush_interval: 各 worker 写快照的间隔秒数
+        """
+        self.namespace = namespace
+        self.directory = directory
+        self.flush_interval = max(1.0, float(flush_interval))
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._pid = None
+        self._flusher = None
+
+    def _full_name(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(self, self._full_name(name), help_text, COUNTER, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(self, self._full_name(name), help_text, GAUGE, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, self._full_name(name), help_text, labels, buckets))
+
+    def add_collector(self, fn):
+        """
+        fn() 在抓取 / 写快照时调用，返回 [(名字, 类型, 说明, {标签: 值}, 数值)]；名字不含前缀，类型为 counter 或 gauge。
+        用于本来就有 stats() 的组件（连接池、调度器、缓存），避免在它们内部再埋点。
+        """
+        self._collectors.append(fn)
+
+    # ---------- 快照 ----------
+    def snapshot(self):
+        """本进程所有指标的可序列化快照：{名字: {type, help, labels, buckets?, values: [[标签值], 值]}}。"""
+        out = {}
+        with self._lock:
+            for m in self._metrics.values():
+                entry = {"type": m.kind, "help": m.help, "labels": list(m.label_names),
+                         "values": [[list(k), list(v) if isinstance(v, list) else v] for k, v in m._values.items()]}
+                if m.kind == HISTOGRAM:
+                    entry["buckets"] = list(m.buckets)
+                out[m.name] = entry
+        for fn in self._collectors:
+            try:
+                samples = fn() or ()
+            except Exception as e:
+                log.warning("metrics collector failed: %s", e)
+                continue
+            for name, kind, help_text, labels, value in samples:
+                if value is None:
+                    continue
+                full = self._full_name(name)
+                entry = out.setdefault(full, {"type": kind, "help": help_text, "labels": list(labels), "values": []})
+                entry["values"].append([[str(v) for v in labels.values()], value])
+        return out
+
+    def _snapshot_dir(self):
+        # 同一 gunicorn master 下的 worker 共用一个子目录；master 重启后旧目录不再被读到
+        return os.path.join(self.directory, str(os.getppid()))
+
+    def _write_snapshot(self, snap=None):
+        path_dir = self._snapshot_dir()
+        os.makedirs(path_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"pid": os.getpid(), "time": time.time(), "metrics": snap or self.snapshot()}, f)
+            os.replace(tmp, os.path.join(path_dir, f"{os.getpid()}.json"))
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._write_snapshot()
+            except Exception as e:
+                log.warning("metrics snapshot write failed: %s", e)
+
+    def ensure_flusher(self):
+        """按 pid 懒启动写快照线程（fork 后的 worker 各自启动）；请求中间件每次调用，开销只是一次比较。"""
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def _worker_snapshots(self):
+        """本 worker 的最新快照 + 同一 master 下其它存活 worker 的快照。"""
+        own = self.snapshot()
+        if self.directory is None:
+            return [own]
+        self.ensure_flusher()
+        try:
+            self._write_snapshot(own)
+        except Exception as e:
+            log.warning("metrics snapshot write failed: %s", e)
+        snapshots = [own]
+        path_dir = self._snapshot_dir()
+        for fname in os.listdir(path_dir):
+            if not fname.endswith(".json") or fname == f"{os.getpid()}.json":
+                continue
+            path = os.path.join(path_dir, fname)
+            try:
+                pid = int(fname[:-5])
+                os.kill(pid, 0)
+            except (ValueError, ProcessLookupError):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f)["metrics"])
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("metrics snapshot read failed %s: %s", path, e)
+        return snapshots
+
+    # ---------- 导出 ----------
+    @staticmethod
+    def merge(snapshots):
+        """多个快照按指标名 + 标签值相加；直方图分桶不同（改过代码的新旧 worker 并存）时以先出现的为准，其余跳过。"""
+        merged = {}
+        for snap in snapshots:
+            for name, entry in snap.items():
+                m = merged.get(name)
+                if m is None:
+                    m = merged[name] = {k: v for k, v in entry.items() if k != "values"}
+                    m["values"] = {}
+                elif m["type"] != entry["type"] or m.get("buckets") != entry.get("buckets"):
+                    continue
+                for labels, value in entry["values"]:
+                    key = tuple(labels)
+                    if m["type"] == HISTOGRAM:
+                        cur = m["values"].get(key)
+                        m["values"][key] = list(value) if cur is None else [a + b for a, b in zip(cur, value)]
+                    else:
+                        m["values"][key] = m["values"].get(key, 0) + value
+        return merged
+
+    @staticmethod
+    def render(merged):
+        lines = []
+        for name in sorted(merged):
+            m = merged[name]
+            lines.append(f"# HELP {name} {m['help']}")
+            lines.append(f"# TYPE {name} {m['type']}")
+            names = m["labels"]
+            for key in sorted(m["values"]):
+                value = m["values"][key]
+                if m["type"] != HISTOGRAM:
+                    lines.append(f"{name}{_format_labels(names, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, n in zip(list(m["buckets"]) + [float("inf")], value[:-2]):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(names, key, ('le', _format_value(float(bound))))} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_format_labels(names, key)} {_format_value(float(value[-2]))}")
+                lines.append(f"{name}_count{_format_labels(names, key)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def exposition(self, post_merge=None):
+        """/metrics 响应体：合并所有 worker 后渲染。post_merge(merged) 可在合并后补充派生指标（如命中率）。"""
+        merged = self.merge(self._worker_snapshots())
+        if post_merge is not None:
+            post_merge(merged)
+        return self.render(merged)
+
+
+# ---------- 外部调用计时 ----------
+_requests_lock = threading.Lock()
+_requests_state = threading.local()
+_request_hooks = []
+
+
+def add_request_hook(fn):
+    """
+    外部调用前后回调：发送前调用 fn(prepared_request, dependency)，可改请求头；
+    返回 None 或 finish(response_or_None, error_or_None, seconds)，调用结束后回调。需配合 instrument_requests 生效。
+    """
+    _request_hooks.append(fn)
+
+
+def _start_request_hooks(request, dependency):
+    finishers = []
+    for fn in _request_hooks:
+        try:
+            finish = fn(request, dependency)
+        except Exception as e:
+            log.warning("request hook failed: %s", e)
+            continue
+        if finish is not None:
+            finishers.append(finish)
+    return finishers
+
+
+def _finish_request_hooks(finishers, resp, error, seconds):
+    # 反序结束，与开始时的嵌套顺序对应
+    for finish in reversed(finishers):
+        try:
+            finish(resp, error, seconds)
+        except Exception as e:
+            log.warning("request hook failed: %s", e)
+
+
+def instrument_requests(histogram, classify):
+    """
+    给 requests.Session.send 包一层计时（requests.get/post 内部也走它），只包一次。
+    :param histogram: 标签为 (dependency, outcome) 的直方图；outcome 为 ok / http_error（5xx）/ exception
+    :param classify: fn(url) -> 依赖名
+    stream=True 的调用计到收到响应头为止；重定向在同一次调用内跟随，只计外层一次。
+    """
+    import requests
+
+    with _requests_lock:
+        if getattr(requests.Session.send, "_metrics_wrapped", False):
+            return
+        original = requests.Session.send
+
+        def send(self, request, **kwargs):
+            if getattr(_requests_state, "active", False):
+                return original(self, request, **kwargs)
+            dependency = classify(request.url)
+            _requests_state.active = True
+            finishers = _start_request_hooks(request, dependency) if _request_hooks else ()
+            t0 = time.perf_counter()
+            try:
+                resp = original(self, request, **kwargs)
+            except Exception as e:
+                seconds = time.perf_counter() - t0
+                histogram.observe(dependency, "exception", value=seconds)
+                _finish_request_hooks(finishers, None, e, seconds)
+                raise
+            finally:
+                _requests_state.active = False
+            seconds = time.perf_counter() - t0
+            histogram.observe(dependency, "http_error" if resp.status_code >= 500 else "ok", value=seconds)
+            _finish_request_hooks(finishers, resp, None, seconds)
+            return resp
+
+        send._metrics_wrapped = True
+        requests.Session.send = send
+
+
+class DependencyClassifier:
+    """按 URL 前缀把外部调用归到依赖名；最长前缀优先，都不匹配归为 default。"""
+
+    def __init__(self, default="other"):
+        self.default = default
+        self._rules = []
+
+    def add(self, prefix, name):
+        prefix = (prefix or "").strip()
+        if prefix:
+            self._rules.append((prefix, name))
+            self._rules.sort(key=lambda r: len(r[0]), reverse=True)
+        return self
+
+    def __call__(self, url):
+        for prefix, name in self._rules:
+            if url.startswith(prefix):
+                return name
+        return self.default
@@ -0,0 +1,319 @@
+"""
+preview-lab 提示词注册表：按场景名在进程内缓存 GET /api/prompt/current 的结果，让 preview-lab 不在识图请求的关键路径上。
+
+  - 新鲜期（ttl_seconds）内直接返回缓存
+  - 过期后照样先返回旧内容（stale-while-revalidate），同时唤醒后台刷新线程
+  - 后台线程每 refresh_interval 秒对已知场景做条件请求（If-None-Match / If-Modified-Since）；
+    preview-lab 不支持条件请求时比较返回的版本号 / 内容，没变只续期
+  - preview-lab 慢或重启时继续用最后一次拉到的内容，超过 max_stale_seconds 才视为不可用
+  - 只有从未拉到过的场景才在请求线程里同步拉取
+
+preview-lab 发布新版本后可调 invalidate(scene, version) 使缓存失效：带 version 时只有缓存的版本与之不同才丢弃，
+不带则直接丢弃；下次取用时重新拉取。版本号取响应 data 里的 version（没有则退化为 id / updated_at，再没有用内容哈希）。
+配置了 shared_dir 时失效同时写一个标记文件（每个场景一个，全部失效另用一个），其余 gunicorn worker 在 get 时
+最多每 check_interval 秒扫一次目录，把验证时间早于标记的缓存条目丢弃。
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import requests
+
+log = logging.getLogger(__name__)
+
+
+def _content_version(data, content):
+    for k in ("version", "id", "updated_at"):
+        v = data.get(k)
+        if v not in (None, ""):
+            return str(v)
+    return "sha:" + hashlib.sha256((content or "").encode("utf-8")).hexdigest()[:12] if content else None
+
+
+class PromptRegistry:
+    def __init__(self, base_url, ttl_seconds=60.0, timeout=10, refresh_interval=None, max_stale_seconds=7 * 86400,
+                 name="prompt-registry", shared_dir=None, check_interval=1.0):
+        """
+        :param base_url: preview-lab 地址，如 http://preview-lab:5003
+        :param ttl_seconds: 新鲜期；<=0 时不缓存，每次都请求 preview-lab
+        :param timeout: 请求 preview-lab 的超时（秒）
+        :param refresh_interval: 后台重验证间隔（秒），默认取 ttl_seconds
+        :param max_stale_seconds: preview-lab 不可用时旧内容最多再用多久（距上次验证成功）；0 表示不限
+        :param shared_dir: 跨 worker 的失效标记目录；None 时 invalidate 只作用于本进程
+        :param check_interval: 扫描失效标记的最短间隔（秒）
+        """
+        self.base_url = (base_url or "").rstrip("/")
+        self.ttl_seconds = float(ttl_seconds)
+        self.timeout = timeout
+        self.refresh_interval = float(refresh_interval) if refresh_interval else max(self.ttl_seconds, 5.0)
+        self.max_stale_seconds = float(max_stale_seconds)
+        self.name = name
+        self.shared_dir = shared_dir
+        self.check_interval = float(check_interval)
+        self._lock = threading.Lock()
+        # 标记文件名 -> 上次处理时的 mtime_ns；_next_check 为下次扫描目录的时间
+        self._marker_seen = {}
+        self._next_check = 0.0
+        # scene -> {"content", "version", "etag", "last_modified", "validated_at", "changed_at", "last_error"}
+        self._entries = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._counters = {
+            "hits": 0, "stale_served": 0, "fetches": 0, "not_modified": 0, "unchanged": 0, "updated": 0,
+            "fetch_errors": 0, "invalidations": 0, "shared_invalidations": 0,
+        }
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    # ---------- 拉取 ----------
+    def _fetch(self, scene, entry=None):
+        """
+        请求 preview-lab；有缓存条目时带条件请求头。
+        :return: (result, error)。result 为 None 表示 304 未修改，否则为 {"content", "version", "etag", "last_modified"}
+        """
+        url = f"{self.base_url}/api/prompt/current?scene={urllib.parse.quote(scene)}"
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        self._count("fetches")
+        try:
+            r = requests.get(url, headers=headers, timeout=self.timeout)
+            if r.status_code == 304 and entry:
+                return None, None
+            if r.status_code != 200:
+                return None, f"preview-lab HTTP {r.status_code}"
+            data = (r.json() or {}).get("data") or {}
+            content = data.get("content") or ""
+            if isinstance(content, str):
+                # 字面 \n（旧场景单行带转义）转为真实换行
+                content = content.replace("\\n", "\n")
+            return {
+                "content": content,
+                "version": _content_version(data, content if isinstance(content, str) else str(content)),
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }, None
+        except Exception as e:
+            return None, str(e)
+
+    def _revalidate(self, scene):
+        """重验证一个场景并更新缓存；返回 error（成功为 None）。"""
+        with self._lock:
+            entry = self._entries.get(scene)
+            entry = dict(entry) if entry else None
+        result, err = self._fetch(scene, entry)
+        now = time.time()
+        if err:
+            self._count("fetch_errors")
+            with self._lock:
+                if scene in self._entries:
+                    self._entries[scene]["last_error"] = err
+            return err
+        with self._lock:
+            current = self._entries.get(scene)
+            if result is None:
+                self._counters["not_modified"] += 1
+                if current:
+                    current["validated_at"] = now
+                    current["last_error"] = None
+                return None
+            content = result["content"]
+            if not (content and str(content).strip()):
+                # 场景内容被清空：丢弃缓存，下次取用时同步拉取并由调用方按内容为空报错
+                if current is None:
+                    return None
+                self._entries.pop(scene, None)
+                self._counters["updated"] += 1
+                return None
+            if current and current["version"] == result["version"] and current["content"] == content:
+                self._counters["unchanged"] += 1
+                current.update(etag=result["etag"], last_modified=result["last_modified"], validated_at=now,
+                               last_error=None)
+                return None
+            if current:
+                self._counters["updated"] += 1
+                log.info("preview-lab 提示词已更新 scene=%s version %s → %s", scene, current["version"], result["version"])
+            self._entries[scene] = dict(result, validated_at=now, changed_at=now, last_error=None)
+        return None
+
+    # ---------- 后台刷新 ----------
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-refresher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+            with self._lock:
+                scenes = list(self._entries)
+            for scene in scenes:
+                try:
+                    self._revalidate(scene)
+                except Exception as e:
+                    log.warning("%s 刷新 %s 失败: %s", self.name, scene, e)
+
+    # ---------- 跨 worker 失效标记 ----------
+    def _marker_name(self, scene):
+        if scene is None:
+            return "_all.json"
+        return "scene-" + hashlib.sha256(scene.encode("utf-8")).hexdigest()[:16] + ".json"
+
+    def _write_marker(self, scene, version):
+        """先写临时文件再 os.replace，其余 worker 不会读到半截内容。失败只记日志，本进程的失效照常生效。"""
+        try:
+            os.makedirs(self.shared_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.shared_dir, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"scene": scene, "version": None if version is None else str(version),
+                               "at": time.time()}, f)
+                os.replace(tmp, os.path.join(self.shared_dir, self._marker_name(scene)))
+            except Exception:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+        except Exception as e:
+            log.warning("%s 写失效标记失败: %s", self.name, e)
+
+    def _apply_markers(self, now):
+        """按 check_interval 节流扫描标记目录；新出现或更新过的标记，丢弃验证时间早于它的缓存条目。"""
+        if not self.shared_dir or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            entries = [e for e in os.scandir(self.shared_dir) if e.name.endswith(".json") and e.is_file()]
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            log.warning("%s 扫描失效标记失败: %s", self.name, e)
+            return
+        for e in entries:
+            try:
+                mtime = e.stat().st_mtime_ns
+            except OSError:
+                continue
+            if self._marker_seen.get(e.name) == mtime:
+                continue
+            try:
+                with open(e.path, encoding="utf-8") as f:
+                    marker = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._marker_seen[e.name] = mtime
+            scene, version, at = marker.get("scene"), marker.get("version"), float(marker.get("at") or 0)
+            with self._lock:
+                scenes = [scene] if scene is not None else list(self._entries)
+                for s in scenes:
+                    entry = self._entries.get(s)
+                    if entry is None or entry["validated_at"] >= at:
+                        continue
+                    if version is not None and entry["version"] == version:
+                        continue
+                    del self._entries[s]
+                    self._counters["shared_invalidations"] += 1
+
+    # ---------- 对外 ----------
+    def _info(self, scene, entry, now, stale):
+        return {
+            "scene": scene,
+            "version": entry["version"],
+            "age_seconds": round(now - entry["changed_at"], 1),
+            "validated_seconds_ago": round(now - entry["validated_at"], 1),
+            "stale": stale,
+        }
+
+    def get(self, scene):
+        """
+        取场景当前提示词。
+        :return: (content, info, error)。成功时 error 为 None，info 为
+                 {scene, version, age_seconds（该版本已生效多久）, validated_seconds_ago, stale（是否超出新鲜期）}
+        """
+        if self.ttl_seconds > 0:
+            self._ensure_thread()
+            now = time.time()
+            self._apply_markers(now)
+            with self._lock:
+                entry = self._entries.get(scene)
+                if entry:
+                    since = now - entry["validated_at"]
+                    if since <= self.ttl_seconds:
+                        self._counters["hits"] += 1
+                        return entry["content"], self._info(scene, entry, now, False), None
+                    if self.max_stale_seconds <= 0 or since <= self.max_stale_seconds:
+                        # 过期：先用旧内容，让后台线程去重验证
+                        self._counters["stale_served"] += 1
+                        self._wakeup.set()
+                        return entry["content"], self._info(scene, entry, now, True), None
+            err = self._revalidate(scene)
+            now = time.time()
+            with self._lock:
+                entry = self._entries.get(scene)
+                if entry and not err:
+                    return entry["content"], self._info(scene, entry, now, False), None
+            if err:
+                return None, None, err
+            # 拉取成功但内容为空：不缓存，原样交给调用方判断
+            return "", None, None
+        result, err = self._fetch(scene)
+        if err:
+            self._count("fetch_errors")
+            return None, None, err
+        return result["content"], {
+            "scene": scene, "version": result["version"], "age_seconds": None, "validated_seconds_ago": 0.0,
+            "stale": False,
+        }, None
+
+    def invalidate(self, scene=None, version=None):
+        """丢弃缓存。scene 为 None 时全部丢弃；带 version 时仅当缓存版本与之不同才丢弃。返回本进程丢弃的场景列表。
+        配置了 shared_dir 时同时写失效标记，其余 worker 最迟 check_interval 秒后跟进。"""
+        if self.shared_dir:
+            self._write_marker(scene, version)
+        with self._lock:
+            scenes = [scene] if scene is not None else list(self._entries)
+            dropped = []
+            for s in scenes:
+                entry = self._entries.get(s)
+                if entry is None:
+                    continue
+                if version is not None and entry["version"] == str(version):
+                    continue
+                del self._entries[s]
+                dropped.append(s)
+            self._counters["invalidations"] += len(dropped)
+        return dropped
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            c = dict(self._counters)
+            c["base_url"] = self.base_url
+            c["ttl_seconds"] = self.ttl_seconds
+            c["refresh_interval"] = self.refresh_interval
+            c["shared_dir"] = self.shared_dir
+            c["scenes"] = {
+                s: dict(self._info(s, e, now, now - e["validated_at"] > self.ttl_seconds), last_error=e["last_error"])
+                for s, e in self._entries.items()
+            }
+        return c
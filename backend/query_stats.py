@@ -0,0 +1,283 @@
+"""
+SQL 指纹统计与慢查询采样（挂在 db_pool 的 query_hook 上，业务代码不用改）。
+
+  - 指纹：去掉注释与字面量（字符串、数字、%s 占位符都换成 ?），IN (?, ?, …) 与多组 VALUES 折叠成一组，空白压成一个空格；
+    同一条 f-string 拼出的 SQL 不管带什么值都归到同一指纹
+  - 每个指纹累计：次数、出错次数、总 / 最大耗时、p95（对数分桶估计，自进程启动起）、返回行数（SELECT）与影响行数（DML）
+  - 超过 slow_ms 的语句进慢查询记录；同一指纹每 explain_interval 秒最多取一次 EXPLAIN，由后台线程借 conn_factory 的连接执行，
+    不占请求线程。EXPLAIN 的 rows 合计记为该指纹的「估计扫描行数」。日志只打指纹与 EXPLAIN，不打参数值
+  - 每个 worker 各自统计；指纹数超过 max_fingerprints 后新指纹归入 <other>
+"""
+import bisect
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# 耗时分桶（秒）：0.1ms 起每档 ×1.25，到约 2 分钟，p95 取所在桶上界，误差不超过 25%
+_BUCKETS = tuple(0.0001 * 1.25 ** i for i in range(64))
+_OTHER = "<other>"
+_EXPLAINABLE = ("select", "update", "delete")
+
+_COMMENT_RE = re.compile(r"/\*.*?\*/|(?:--|#)[^\n]*", re.S)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s")
+_NUMBER_RE = re.compile(r"\b0x[0-9a-fA-F]+\b|(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_RE = re.compile(r"(VALUES\s*)(\((?:[^()]|\([^()]*\))*\))(?:\s*,\s*\((?:[^()]|\([^()]*\))*\))+", re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """把 SQL 归一成指纹：字面量换成 ?，列表折叠，空白压缩，关键字大小写保持原样。"""
+    s = _COMMENT_RE.sub(" ", str(sql or ""))
+    s = _STRING_RE.sub("?", s)
+    s = _PARAM_RE.sub("?", s)
+    s = _NUMBER_RE.sub("?", s)
+    s = _LIST_RE.sub("(?+)", s)
+    s = _VALUES_RE.sub(r"\1\2 /* ,… */", s)
+    return _SPACE_RE.sub(" ", s).strip()
+
+
+def _operation(sql):
+    head = str(sql or "").lstrip(" \t\r\n(").split(None, 1)
+    return head[0].lower() if head else ""
+
+
+class _Entry:
+    __slots__ = ("count", "errors", "total", "max", "buckets", "rows_returned", "rows_affected",
+                 "slow", "rows_examined_est", "last_explain", "last_explain_at", "last_seen")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(_BUCKETS) + 1)
+        self.rows_returned = 0
+        self.rows_affected = 0
+        self.slow = 0
+        self.rows_examined_est = None
+        self.last_explain = None
+        self.last_explain_at = 0.0
+        self.last_seen = 0.0
+
+    def p95(self):
+        if not self.count:
+            return 0.0
+        rank = self.count * 0.95
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return _BUCKETS[i] if i < len(_BUCKETS) else self.max
+        return self.max
+
+
+class QueryStats:
+    def __init__(self, conn_factory=None, slow_ms=500.0, explain_interval=300.0, max_fingerprints=2000,
+                 recent_slow=100):
+        """
+        :param conn_factory: 无参函数，返回执行 EXPLAIN 用的连接；None 不取 EXPLAIN
+        :param slow_ms: 单条耗时不低于此值记为慢查询
+        :param explain_interval: 同一指纹两次 EXPLAIN 的最短间隔（秒）
+        :param max_fingerprints: 单进程最多区分的指纹数
+        :param recent_slow: 保留最近慢查询的条数
+        """
+        self._conn_factory = conn_factory
+        self.slow_ms = float(slow_ms)
+        self.explain_interval = float(explain_interval)
+        self.max_fingerprints = int(max_fingerprints)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._recent = deque(maxlen=max(1, int(recent_slow)))
+        self._explain_queue = queue.Queue(maxsize=16)
+        self._thread = None
+        self._pid = None
+        self._started = time.time()
+        self._counters = {"observed": 0, "explained": 0, "explain_dropped": 0, "explain_errors": 0}
+
+    # ---------- 采集（query_hook） ----------
+    def observe(self, sql, args, seconds, error=None, cursor=None):
+        if threading.current_thread() is self._thread:
+            return  # EXPLAIN 线程自己的语句不计
+        fp = fingerprint(sql)
+        op = _operation(sql)
+        rowcount = getattr(cursor, "rowcount", -1) if cursor is not None and error is None else -1
+        slow = seconds * 1000 >= self.slow_ms
+        with self._lock:
+            self._counters["observed"] += 1
+            entry = self._entries.get(fp)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    fp = _OTHER
+                entry = self._entries.setdefault(fp, _Entry())
+            entry.count += 1
+            entry.total += seconds
+            entry.max = max(entry.max, seconds)
+            entry.buckets[bisect.bisect_left(_BUCKETS, seconds)] += 1
+            entry.last_seen = time.time()
+            if error is not None:
+                entry.errors += 1
+            elif rowcount is not None and rowcount >= 0:
+                if op == "select":
+                    entry.rows_returned += rowcount
+                else:
+                    entry.rows_affected += rowcount
+            if not slow:
+                return
+            entry.slow += 1
+            self._recent.append({
+                "at": round(time.time(), 3), "fingerprint": fp, "ms": round(seconds * 1000, 2),
+                "rows": rowcount, "error": f"{type(error).__name__}: {error}"[:200] if error is not None else None,
+            })
+            want_explain = (
+                self._conn_factory is not None and error is None and op in _EXPLAINABLE and fp != _OTHER
+                and not _is_many(args)
+            )
+            if want_explain and time.time() - entry.last_explain_at >= self.explain_interval:
+                entry.last_explain_at = time.time()
+            else:
+                want_explain = False
+        if want_explain:
+            self._submit_explain(fp, sql, args, seconds, cursor)
+        else:
+            log.warning("slow query %.0fms: %s", seconds * 1000, fp[:500])
+
+    def _submit_explain(self, fp, sql, args, seconds, cursor):
+        try:
+            statement = cursor.mogrify(sql, args) if cursor is not None and args is not None else str(sql)
+        except Exception:
+            statement = None
+        if statement is None:
+            log.warning("slow query %.0fms: %s", seconds * 1000, fp[:500])
+            return
+        try:
+            self._explain_queue.put_nowait((fp, statement, seconds))
+        except queue.Full:
+            with self._lock:
+                self._counters["explain_dropped"] += 1
+            log.warning("slow query %.0fms: %s", seconds * 1000, fp[:500])
+            return
+        self._ensure_thread()
+
+    # ---------- EXPLAIN 后台线程 ----------
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            fp, statement, seconds = self._explain_queue.get()
+            try:
+                plan = self._explain(statement)
+            except Exception as e:
+                with self._lock:
+                    self._counters["explain_errors"] += 1
+                log.warning("slow query %.0fms: %s (EXPLAIN 失败: %s)", seconds * 1000, fp[:500], e)
+                continue
+            examined = sum(int(row.get("rows") or 0) for row in plan)
+            with self._lock:
+                self._counters["explained"] += 1
+                entry = self._entries.get(fp)
+                if entry is not None:
+                    entry.last_explain = plan
+                    entry.rows_examined_est = examined
+            log.warning("slow query %.0fms: %s\n  EXPLAIN: %s", seconds * 1000, fp[:500],
+                        "; ".join(_format_plan_row(row) for row in plan))
+
+    def _explain(self, statement):
+        conn = self._conn_factory()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("EXPLAIN " + statement)
+                columns = [d[0] for d in cursor.description or ()]
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+        plan = []
+        for row in rows:
+            plan.append(dict(row) if isinstance(row, dict) else dict(zip(columns, row)))
+        return plan
+
+    # ---------- 查询 ----------
+    def top(self, sort="total", limit=20):
+        """按 total / p95 / max / count / rows / errors / slow 排序的前 limit 个指纹。"""
+        with self._lock:
+            items = [(fp, e, e.p95()) for fp, e in self._entries.items()]
+        keys = {
+            "total": lambda x: x[1].total,
+            "p95": lambda x: x[2],
+            "max": lambda x: x[1].max,
+            "count": lambda x: x[1].count,
+            "rows": lambda x: x[1].rows_returned + x[1].rows_affected,
+            "errors": lambda x: x[1].errors,
+            "slow": lambda x: x[1].slow,
+        }
+        items.sort(key=keys.get(sort, keys["total"]), reverse=True)
+        out = []
+        for fp, e, p95 in items[:limit]:
+            out.append({
+                "fingerprint": fp,
+                "count": e.count,
+                "errors": e.errors,
+                "slow": e.slow,
+                "total_ms": round(e.total * 1000, 1),
+                "avg_ms": round(e.total * 1000 / e.count, 2) if e.count else 0.0,
+                "p95_ms": round(p95 * 1000, 2),
+                "max_ms": round(e.max * 1000, 2),
+                "rows_returned": e.rows_returned,
+                "rows_affected": e.rows_affected,
+                "rows_examined_est": e.rows_examined_est,
+                "explain": e.last_explain,
+                "last_seen": round(e.last_seen, 3),
+            })
+        return out
+
+    def recent_slow(self, limit=50):
+        with self._lock:
+            items = list(self._recent)
+        return items[::-1][:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._recent.clear()
+            self._started = time.time()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+            out["fingerprints"] = len(self._entries)
+            out["explain_queue"] = self._explain_queue.qsize()
+        out["slow_ms"] = self.slow_ms
+        out["since"] = round(self._started, 3)
+        return out
+
+
+def _is_many(args):
+    # executemany 的参数是「参数组」的序列，EXPLAIN 不了
+    return isinstance(args, (list, tuple)) and bool(args) and isinstance(args[0], (list, tuple, dict))
+
+
+def _format_plan_row(row):
+    parts = [f"{k}={row[k]}" for k in ("table", "type", "key", "rows", "filtered", "Extra") if row.get(k) is not None]
+    return " ".join(parts)
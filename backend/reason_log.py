@@ -0,0 +1,196 @@
+"""
+负向操作原因（negative_reason_log）缓冲写入 + 最近原因内存缓存。
+
+废弃/删图/badcase 时只把原因放进内存队列并立即更新该维度的「最近原因」缓存，
+后台线程按固定间隔用 executemany 批量落库；/api/goods/reason-history 读内存，
+每个进程第一次读某维度时查库预热，之后每 refresh_seconds 秒最多查一次库，补上该时间点之后的记录
+（其它 gunicorn worker 写的原因由此在本 worker 出现）。
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+DIMENSIONS = ('goods', 'carousel')
+
+
+def _is_missing_table_error(e):
+    return "doesn't exist" in str(e)
+
+
+class NegativeReasonLog:
+    """按维度缓存最近原因，并把新原因缓冲后批量写入 negative_reason_log。"""
+
+    def __init__(self, conn_factory, flush_interval=2.0, max_batch=200, cache_size=50, max_pending=2000,
+                 refresh_seconds=10.0):
+        """
+        :param conn_factory: 无参函数，返回 pymysql 连接（如 app.get_db_connection）
+        :param flush_interval: 后台批量落库间隔（秒）
+        :param max_batch: 单次 executemany 最多写入条数
+        :param cache_size: 每个维度缓存的去重原因条数上限（reason-history 的 limit 最大 50）
+        :param max_pending: 落库失败时最多保留的待写条数，超出丢弃最旧的并打日志
+        :param refresh_seconds: 读取时距上次查库超过此秒数则增量查库合并（0 每次都查）
+        """
+        self._conn_factory = conn_factory
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._cache_size = cache_size
+        self._max_pending = max_pending
+        self._refresh_seconds = max(0.0, float(refresh_seconds))
+        self._lock = threading.Lock()
+        self._pending = []
+        # dimension -> OrderedDict(reason -> 最近一次时间)，末尾为最新
+        self._recent = {d: OrderedDict() for d in DIMENSIONS}
+        # dimension -> 下次查库的 monotonic 时间；dimension -> 已合并的库内最新 created_at（增量查询起点）
+        self._next_refresh = {}
+        self._watermark = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    # ---------- 写入 ----------
+    def add(self, dimension, reason):
+        """登记一条原因：立即更新内存缓存，落库由后台线程批量完成。"""
+        if not reason or not isinstance(reason, str):
+            return
+        r = reason.strip()[:512]
+        if not r or dimension not in DIMENSIONS:
+            return
+        now = datetime.now()
+        with self._lock:
+            self._touch(dimension, r, now)
+            self._pending.append((dimension, r, now))
+            if len(self._pending) > self._max_pending:
+                dropped = len(self._pending) - self._max_pending
+                del self._pending[:dropped]
+                log.warning("negative_reason_log 待写队列已满，丢弃最旧 %s 条", dropped)
+            if len(self._pending) >= self._max_batch:
+                self._wakeup.set()
+        self._ensure_thread()
+
+    def _touch(self, dimension, reason, ts):
+        cache = self._recent[dimension]
+        cache.pop(reason, None)
+        cache[reason] = ts
+        while len(cache) > self._cache_size:
+            cache.popitem(last=False)
+
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name="negative-reason-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning("negative_reason_log flush error: %s", e)
+
+    def flush(self):
+        """把待写原因批量写库。失败时放回队列等下一轮（表不存在则直接丢弃，与原逻辑一致）。"""
+        while True:
+            with self._lock:
+                batch = self._pending[:self._max_batch]
+                del self._pending[:len(batch)]
+            if not batch:
+                return
+            try:
+                conn = self._conn_factory()
+                try:
+                    cursor = conn.cursor()
+                    cursor.executemany(
+                        "INSERT INTO negative_reason_log (dimension, reason, created_at) VALUES (%s, %s, %s)",
+                        batch,
+                    )
+                    conn.commit()
+                    cursor.close()
+                finally:
+                    conn.close()
+            except Exception as e:
+                if _is_missing_table_error(e):
+                    continue
+                log.warning("negative_reason_log batch insert failed (%s 条，稍后重试): %s", len(batch), e)
+                with self._lock:
+                    self._pending[:0] = batch
+                return
+
+    # ---------- 读取 ----------
+    def recent(self, dimension, limit=20):
+        """返回该维度去重后的最近原因（新在前）。首次读取时从库预热，之后按 refresh_seconds 增量合并库内新记录。"""
+        if dimension not in DIMENSIONS:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            first = dimension not in self._next_refresh
+            due = first or now >= self._next_refresh[dimension]
+            if due:
+                # 先占住这一轮，并发读取直接用内存，不重复查库
+                self._next_refresh[dimension] = now + self._refresh_seconds
+        if due:
+            try:
+                self._warm(dimension)
+            except Exception as e:
+                if first:
+                    with self._lock:
+                        self._next_refresh.pop(dimension, None)
+                    raise
+                log.warning("negative_reason_log 刷新 %s 失败，先用内存中的原因: %s", dimension, e)
+        with self._lock:
+            items = list(reversed(self._recent[dimension].keys()))
+        return items[:max(0, limit)]
+
+    def _warm(self, dimension):
+        with self._lock:
+            since = self._watermark.get(dimension)
+        rows = []
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                # 增量时用 >=：created_at 只到秒，同一秒里其它 worker 晚到的记录也能补上（重复的按原因去重）
+                cursor.execute(
+                    f"""SELECT reason, MAX(created_at) AS last_at FROM negative_reason_log
+                       WHERE dimension = %s AND reason != ''{' AND created_at >= %s' if since else ''}
+                       GROUP BY reason
+                       ORDER BY last_at DESC
+                       LIMIT %s""",
+                    (dimension, since, self._cache_size) if since else (dimension, self._cache_size),
+                )
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            if not _is_missing_table_error(e):
+                raise
+        with self._lock:
+            # 按时间合并库内记录与本进程缓存（本进程刚写、尚未落库的原因也在缓存里），同一原因取较新的时间
+            merged = dict(self._recent[dimension])
+            for r in rows:
+                reason, ts = (r.get('reason'), r.get('last_at')) if isinstance(r, dict) else (r[0], r[1])
+                if not reason or ts is None:
+                    continue
+                if reason not in merged or merged[reason] < ts:
+                    merged[reason] = ts
+                if since is None or ts > since:
+                    since = ts
+            ordered = OrderedDict(sorted(merged.items(), key=lambda kv: kv[1])[-self._cache_size:])
+            self._recent[dimension] = ordered
+            if since is not None:
+                self._watermark[dimension] = since
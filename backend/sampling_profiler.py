@@ -0,0 +1,151 @@
+"""
+按需采样分析器：线上卡顿时不重启、不挂调试器，看 Python 时间花在哪。
+
+  - 采样线程每 interval 秒用 sys._current_frames() 取一次所有线程的调用栈，累计成 flamegraph 的折叠格式
+    （「根;帧;帧 次数」，flamegraph.pl / speedscope / py-spy 的可视化都能直接读）
+  - 统计的是墙钟时间：线程在等 MySQL、等 OCRPlus 时栈停在对应的读 socket 处，一样会被采到，正好看出卡在哪个依赖
+  - 请求线程由 enter(route, path) / leave() 登记当前路由；默认只采正在处理请求的线程，栈根是路由名，
+    可按路由过滤；threads="all" 时采全部线程（含后台落库、识图任务线程），栈根是线程名
+  - 每个 worker 同时只跑一个采样；不采样时只有请求进出时的一次字典赋值
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class ProfilerBusy(RuntimeError):
+    """本 worker 已有采样在进行。"""
+
+
+class SamplingProfiler:
+    def __init__(self, max_seconds=60.0, min_interval=0.001):
+        """
+        :param max_seconds: 单次采样最长秒数（采样期间调用方的请求线程一直占着）
+        :param min_interval: 采样间隔下限（秒），太密会和业务线程抢 GIL
+        """
+        self.max_seconds = float(max_seconds)
+        self.min_interval = float(min_interval)
+        self._active = {}  # 线程 id -> (路由, path)
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._last = None
+
+    # ---------- 请求登记 ----------
+    def enter(self, route, path=None):
+        self._active[threading.get_ident()] = (route, path or route)
+
+    def leave(self):
+        self._active.pop(threading.get_ident(), None)
+
+    # ---------- 采样 ----------
+    def profile(self, seconds, interval=0.01, route=None, threads="requests", lines=False):
+        """
+        阻塞采样 seconds 秒，返回 (Counter{折叠栈: 次数}, 元信息)。
+        :param route: 只采该路由的请求线程（与路由规则相同，或请求 path 以它开头）
+        :param threads: "requests" 只采正在处理请求的线程；"all" 采全部线程
+        :param lines: 帧名带行号（更细，但同一函数会按行拆开）
+        """
+        seconds = max(0.1, min(float(seconds), self.max_seconds))
+        interval = max(self.min_interval, float(interval))
+        if not self._run_lock.acquire(blocking=False):
+            raise ProfilerBusy("本 worker 正在采样，请稍后再试")
+        try:
+            stacks = Counter()
+            skip = {threading.get_ident()}
+            names = {}
+            samples = 0
+            started = time.perf_counter()
+            deadline = started + seconds
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                frames = sys._current_frames()
+                active = dict(self._active)
+                for ident, frame in frames.items():
+                    if ident in skip:
+                        continue
+                    req = active.get(ident)
+                    if threads != "all" and req is None:
+                        continue
+                    if route and (req is None or not (req[0] == route or req[1].startswith(route))):
+                        continue
+                    if req is not None:
+                        root = req[0]
+                    else:
+                        if ident not in names:
+                            names = {t.ident: t.name for t in threading.enumerate()}
+                        root = "thread:" + names.get(ident, str(ident))
+                    stacks[_collapse(root, frame, lines)] += 1
+                samples += 1
+                del frames
+                time.sleep(max(0.0, interval - (time.perf_counter() - now)))
+            meta = {
+                "pid": os.getpid(),
+                "seconds": round(time.perf_counter() - started, 3),
+                "interval_ms": round(interval * 1000, 3),
+                "ticks": samples,
+                "stacks": sum(stacks.values()),
+                "route": route,
+                "threads": threads,
+            }
+        finally:
+            self._run_lock.release()
+        with self._lock:
+            self._runs += 1
+            self._last = meta
+        return stacks, meta
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._run_lock.locked(),
+                "runs": self._runs,
+                "last": self._last,
+                "active_requests": len(self._active),
+            }
+
+
+def _frame_label(frame, lines):
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    where = os.path.basename(code.co_filename)
+    if lines:
+        where = f"{where}:{frame.f_lineno}"
+    return f"{name} ({where})".replace(";", ":")
+
+
+def _collapse(root, frame, lines):
+    parts = []
+    while frame is not None:
+        parts.append(_frame_label(frame, lines))
+        frame = frame.f_back
+    parts.append(str(root).replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(parts))
+
+
+def render_collapsed(stacks):
+    """折叠格式文本：每行「栈 次数」，按次数从多到少。"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_functions(stacks, limit=30):
+    """按自身（栈顶）与累计（出现在栈中）采样数统计的热点函数。"""
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for f in set(frames):
+            total[f] += count
+    all_samples = sum(stacks.values()) or 1
+    return [
+        {"function": f, "self": n, "self_pct": round(n * 100 / all_samples, 2),
+         "total": total[f], "total_pct": round(total[f] * 100 / all_samples, 2)}
+        for f, n in own.most_common(limit)
+    ]
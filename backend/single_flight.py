@@ -0,0 +1,78 @@
+"""
+进程内请求合并（single-flight）：同一个键同时只发一次调用。
+
+N8N 扇出、审核员重试经常同时发出完全相同的识图请求（同图同提示词）。第一个到的请求（leader）真正
+调用大模型，其余同键请求（follower）不占大模型名额，只等 leader 的结果，各自按自己的截止时间放弃。
+leader 抛异常时 follower 收到同一个异常。
+"""
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    """follower 在自己的截止时间内没等到 leader 的结果。"""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._leaders = 0
+        self._coalesced = 0
+        self._follower_timeouts = 0
+        self._max_waiters = 0
+
+    def do(self, key, fn, timeout):
+        """同键只执行一次 fn()；返回 (结果, 是否为合并等待所得)。follower 超过 timeout 秒抛 SingleFlightTimeout。"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self._coalesced += 1
+                self._max_waiters = max(self._max_waiters, call.waiters)
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self._follower_timeouts += 1
+            raise SingleFlightTimeout(f"等待相同请求的结果超过 {timeout:g}s")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight_keys': len(self._calls),
+                'leaders': self._leaders,
+                'coalesced': self._coalesced,
+                'follower_timeouts': self._follower_timeouts,
+                'max_waiters': self._max_waiters,
+            }
@@ -0,0 +1,590 @@
+"""
+识图请求体的流式接收：大 JSON 请求体（内含几十 MB 的 base64 图片）不整块读进内存。
+
+request.json 会先读出整个请求体，再解析出同样大的 base64 字符串，之后拼 data URL、解码、重编码又各一份，
+一个 40MB 的请求要占好几百 MB。这里直接从 WSGI 输入流按块读：
+  - 普通字段照常解析（单个字符串超过 max_text_bytes 视为请求错误）
+  - 图片字段（image_base64 / image_base64_list / images[].base64 / data:image/ 开头的 url 等）的字符串边读边
+    base64 解码，写入 SpooledTemporaryFile（小图留内存，大图落临时文件），同时增量算 sha256
+  - 读完后逐张从文件预处理成送模型的小图（image_prep.prepare_image_file），原图字节不进内存；
+    大图解码占内存，同时解码的张数受 decode_slots 限制
+
+图片字段最终替换为 PreparedImage：即预处理后的 data URL 字符串，附带原图内容的 sha256（content_sha256），
+识图结果缓存的图片标识仍按原图计算，与整块解析时命中同一条缓存。
+
+multipart/form-data 请求体（read_form）：图片以二进制文件分段上传，省掉 base64 的 1/3 体积和大字符串解析。
+文件分段同样边收边算 sha256、写 SpooledTemporaryFile，收完逐张预处理成 PreparedImage：
+  - 名为 image / images 的分段按上传顺序进顶层 images
+  - 其它名字的分段由 JSON 里的 "file": "<分段名>" / "files": [...] 引用（顶层或 items[] 每项），进该对象的 images
+  - payload 字段可放与 JSON 请求体相同的对象（批量时的 items 等）；其余文本字段按同名参数合并，payload 优先
+"""
+import base64
+import binascii
+import hashlib
+import json
+import re
+import tempfile
+import threading
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.formparser import FormDataParser
+
+from image_prep import prepare_image_file
+
+_CHUNK = 64 * 1024
+_WS = b" \t\r\n"
+_B64_DROP = b" \t\r\n"
+# base64 里合法出现的 JSON 转义：\/（部分编码器转义斜杠）、换行等空白；\uXXXX 单独处理
+_B64_ESCAPES = ((b"\\/", b"/"), (b"\\n", b""), (b"\\r", b""), (b"\\t", b""))
+_UNICODE_ESCAPE = re.compile(rb"\\u([0-9a-fA-F]{4})")
+
+# 这些键的字符串本身就是 base64（不带 data: 前缀）
+_RAW_B64_KEYS = ("image_base64", "base64")
+# 这些键 / 数组的字符串以 data:image/ 开头时按图片接收，否则（URL 等）按普通字符串
+_DATA_URL_KEYS = ("images", "image_url", "image_urls", "url")
+# 批量 / 异步任务的请求体外层
+_WRAPPER_KEYS = ("items", "payload")
+
+# multipart：这些名字的文件分段进顶层 images；这些文本字段按布尔值解析
+_DEFAULT_UPLOAD_FIELDS = ("image", "images", "image[]", "images[]")
+_FORM_BOOL_FIELDS = ("json_output", "skip_cache", "reuse_asset_labels", "async")
+
+
+class IntakeError(Exception):
+    """请求体不合法或超限；status 为建议的 HTTP 状态码。"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class PreparedImage(str):
+    """预处理后的 data URL；content_sha256 为客户端原图字节的 sha256，original_bytes 为原图大小。"""
+
+    content_sha256 = None
+    original_bytes = 0
+
+
+# 异步任务把请求体存成 JSON，PreparedImage 存成带原图哈希的对象，取出时还原，缓存标识与同步请求一致
+_PREPARED_KEY = "__prepared_image__"
+
+
+def dump_prepared(obj):
+    """把请求体里的 PreparedImage 换成可 JSON 序列化的 {__prepared_image__, content_sha256, original_bytes}。"""
+    if isinstance(obj, PreparedImage):
+        return {_PREPARED_KEY: str(obj), "content_sha256": obj.content_sha256, "original_bytes": obj.original_bytes}
+    if isinstance(obj, dict):
+        return {k: dump_prepared(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [dump_prepared(v) for v in obj]
+    return obj
+
+
+def load_prepared(obj):
+    """dump_prepared 的逆操作：还原 PreparedImage（带 content_sha256）。"""
+    if isinstance(obj, dict):
+        if _PREPARED_KEY in obj:
+            item = PreparedImage(obj[_PREPARED_KEY])
+            item.content_sha256 = obj.get("content_sha256")
+            item.original_bytes = obj.get("original_bytes") or 0
+            return item
+        return {k: load_prepared(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [load_prepared(v) for v in obj]
+    return obj
+
+
+def _strip_wrappers(path):
+    while path and path[0] in _WRAPPER_KEYS:
+        path = path[2:] if len(path) > 1 and isinstance(path[1], int) else path[1:]
+    return path
+
+
+def _image_field(path):
+    """
+    按 JSON 路径判断字符串值是不是图片字段。
+    :return: "b64"（整串是 base64）、"data"（data:image/ 开头才是图片）或 None
+    """
+    if len(path) == 2 and path[0] == "items" and isinstance(path[1], int):
+        # describe-batch 的 items 允许直接是图片字符串
+        return "data"
+    path = _strip_wrappers(path)
+    keys = [k for k in path if isinstance(k, str)]
+    if not keys:
+        return None
+    last = keys[-1]
+    if last in _RAW_B64_KEYS or (last == "image_base64_list" and isinstance(path[-1], int)):
+        return "b64"
+    if last in _DATA_URL_KEYS and (keys[0] in ("images", "image_url", "image_urls")):
+        return "data"
+    return None
+
+
+def _form_value(key, values):
+    if key == "image_urls":
+        return values
+    value = values[-1]
+    if key in _FORM_BOOL_FIELDS:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return value
+
+
+def _attach_uploads(obj, uploads, used):
+    """把 obj 里 file / files 引用的文件分段接到 obj["images"] 后面。"""
+    names = obj.pop("files", None)
+    single = obj.pop("file", None)
+    names = [names] if isinstance(names, str) else list(names) if isinstance(names, list) else []
+    if isinstance(single, str):
+        names.insert(0, single)
+    if not names:
+        return
+    images = obj.get("images") if isinstance(obj.get("images"), list) else []
+    for name in names:
+        if name not in uploads:
+            raise IntakeError(f"引用的文件分段不存在: {name}")
+        images.extend(uploads[name])
+        used.add(name)
+    obj["images"] = images
+
+
+def _find_special(buf, start, end=None):
+    """下一个 '"' 或 '\\' 的位置，没有返回 -1（两次 bytes.find 比正则快得多）。"""
+    end = len(buf) if end is None else end
+    q = buf.find(b'"', start, end)
+    b = buf.find(b"\\", start, end if q < 0 else q)
+    return b if b >= 0 else q
+
+
+def _unescape_u(m):
+    c = int(m.group(1), 16)
+    if c > 0x7f:
+        raise IntakeError("图片 base64 不合法：含非 ASCII 转义")
+    return bytes((c,))
+
+
+class _SpooledImage:
+    def __init__(self, spool_bytes):
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self.sha = hashlib.sha256()
+        self.size = 0
+        self.mime = None
+        self._pending = b""
+
+    def feed(self, b64):
+        """追加一段 base64 字符（可含空白）；按 4 字符对齐解码写入。"""
+        b64 = self._pending + b64.translate(None, _B64_DROP)
+        cut = len(b64) - len(b64) % 4
+        self._pending = b64[cut:]
+        if cut:
+            try:
+                raw = binascii.a2b_base64(b64[:cut])
+            except binascii.Error as e:
+                raise IntakeError(f"图片 base64 不合法: {e}")
+            self.write(raw)
+
+    def write(self, raw):
+        """追加原始字节（multipart 文件分段直接写这里，werkzeug 把它当作上传文件的容器）。"""
+        self.sha.update(raw)
+        self.file.write(raw)
+        self.size += len(raw)
+        return len(raw)
+
+    def seek(self, pos, whence=0):
+        return self.file.seek(pos, whence)
+
+    def finish(self):
+        if self._pending.strip(b"="):
+            # 缺了补位的尾巴：按补齐 '=' 解码（与 base64.b64decode 的宽松行为一致）
+            pad = self._pending + b"=" * (-len(self._pending) % 4)
+            try:
+                raw = binascii.a2b_base64(pad)
+            except binascii.Error as e:
+                raise IntakeError(f"图片 base64 不合法: {e}")
+            self.write(raw)
+        self._pending = b""
+
+    def close(self):
+        self.file.close()
+
+
+class _Parser:
+    def __init__(self, stream, length, spool_bytes, max_text_bytes):
+        self.stream = stream
+        self.remaining = length
+        self.buf = b""
+        self.pos = 0
+        self.spool_bytes = spool_bytes
+        self.max_text_bytes = max_text_bytes
+        self.images = []  # [(容器, 键, _SpooledImage)]，读完后再统一预处理替换
+
+    # ---------- 读流 ----------
+    def _fill(self):
+        if self.remaining is not None and self.remaining <= 0:
+            return False
+        n = _CHUNK if self.remaining is None else min(_CHUNK, self.remaining)
+        chunk = self.stream.read(n)
+        if not chunk:
+            if self.remaining:
+                raise IntakeError("请求体不完整")
+            self.remaining = 0
+            return False
+        if self.remaining is not None:
+            self.remaining -= len(chunk)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while self.pos >= len(self.buf):
+            if not self._fill():
+                return b""
+        return self.buf[self.pos:self.pos + 1]
+
+    def _next(self):
+        c = self._peek()
+        if not c:
+            raise IntakeError("请求体 JSON 不完整")
+        self.pos += 1
+        return c
+
+    def _skip_ws(self):
+        while True:
+            c = self._peek()
+            if not c or c not in _WS:
+                return c
+            self.pos += 1
+
+    def _expect(self, ch):
+        if self._skip_ws() != ch:
+            raise IntakeError(f"请求体 JSON 格式错误：期望 {ch.decode()}")
+        self.pos += 1
+
+    # ---------- 解析 ----------
+    def parse(self):
+        value = self._value(())
+        if self._skip_ws():
+            raise IntakeError("请求体 JSON 之后有多余内容")
+        return value
+
+    def _value(self, path, container=None, key=None):
+        c = self._skip_ws()
+        if c == b"{":
+            self.pos += 1
+            return self._object(path)
+        if c == b"[":
+            self.pos += 1
+            return self._array(path)
+        if c == b'"':
+            self.pos += 1
+            kind = _image_field(path) if container is not None else None
+            if kind:
+                return self._image_string(kind, container, key)
+            return self._string()
+        if not c:
+            raise IntakeError("请求体 JSON 不完整")
+        return self._literal()
+
+    def _object(self, path):
+        out = {}
+        if self._skip_ws() == b"}":
+            self.pos += 1
+            return out
+        while True:
+            self._expect(b'"')
+            k = self._string()
+            self._expect(b":")
+            out[k] = self._value(path + (k,), out, k)
+            c = self._skip_ws()
+            self.pos += 1
+            if c == b"}":
+                return out
+            if not c:
+                raise IntakeError("请求体 JSON 不完整")
+            if c != b",":
+                raise IntakeError("请求体 JSON 格式错误：对象缺少逗号")
+
+    def _array(self, path):
+        out = []
+        if self._skip_ws() == b"]":
+            self.pos += 1
+            return out
+        while True:
+            out.append(None)
+            out[-1] = self._value(path + (len(out) - 1,), out, len(out) - 1)
+            c = self._skip_ws()
+            self.pos += 1
+            if c == b"]":
+                return out
+            if not c:
+                raise IntakeError("请求体 JSON 不完整")
+            if c != b",":
+                raise IntakeError("请求体 JSON 格式错误：数组缺少逗号")
+
+    def _literal(self):
+        token = b""
+        while True:
+            if self.pos >= len(self.buf) and not self._fill():
+                break
+            c = self.buf[self.pos:self.pos + 1]
+            if c in b",]}" or c in _WS:
+                break
+            token += c
+            self.pos += 1
+            if len(token) > 64:
+                raise IntakeError("请求体 JSON 格式错误：非法字面量")
+        try:
+            return json.loads(token)
+        except ValueError:
+            raise IntakeError(f"请求体 JSON 格式错误：非法字面量 {token[:20]!r}")
+
+    def _string(self, prefix=b""):
+        """普通字符串：收集原始字节（含转义）到结尾引号，再交给 json 解码。prefix 为已读出的开头（原始字节）。"""
+        parts = [prefix]
+        total = len(prefix)
+        while True:
+            i = _find_special(self.buf, self.pos)
+            if i < 0:
+                parts.append(self.buf[self.pos:])
+                total += len(self.buf) - self.pos
+                self.pos = len(self.buf)
+                if total > self.max_text_bytes:
+                    raise IntakeError(f"请求体中文本字段超过 {self.max_text_bytes // 1024}KB", 413)
+                if not self._fill():
+                    raise IntakeError("请求体 JSON 不完整")
+                continue
+            parts.append(self.buf[self.pos:i])
+            total += i - self.pos
+            self.pos = i + 1
+            if self.buf[i:i + 1] == b'"':
+                break
+            parts.append(b"\\" + self._next())
+        raw = b"".join(parts)
+        try:
+            return json.loads(b'"' + raw + b'"')
+        except ValueError:
+            raise IntakeError("请求体 JSON 格式错误：字符串不合法")
+
+    def _image_string(self, kind, container, key):
+        """图片字段：读开头判断形态；是图片则其余部分边读边解码进临时文件，否则按普通字符串。"""
+        raw, head = self._read_head(256)
+        mime = None
+        if kind == "data" or head.startswith(b"data:"):
+            # base64 字段误传了完整 data URL 时同样去掉头部
+            if not head.startswith(b"data:image/") or b"," not in head:
+                return self._string(raw)
+            header, _, head = head.partition(b",")
+            if b";base64" not in header:
+                return self._string(raw)
+            mime = header[5:].split(b";")[0].decode("ascii", "replace")
+        blob = _SpooledImage(self.spool_bytes)
+        blob.mime = mime
+        try:
+            blob.feed(head)
+            self._stream_b64(blob)
+            blob.finish()
+        except BaseException:
+            blob.close()
+            raise
+        self.images.append((container, key, blob))
+        return None
+
+    def _read_head(self, limit):
+        """
+        读出字符串开头至多 limit 字节（data URL 头部 / URL 前缀），遇到结尾引号或 \\/ 以外的转义前停下。
+        :return: (原始字节, 解开 \\/ 后的字节)；有些 JSON 编码器把 / 转义成 \\/（如 data:image\\/png）
+        """
+        raw = head = b""
+        while len(raw) < limit:
+            if self.pos >= len(self.buf) and not self._fill():
+                raise IntakeError("请求体 JSON 不完整")
+            end = min(len(self.buf), self.pos + limit - len(raw))
+            i = _find_special(self.buf, self.pos, end)
+            stop = i if i >= 0 else end
+            raw += self.buf[self.pos:stop]
+            head += self.buf[self.pos:stop]
+            self.pos = stop
+            if i < 0:
+                continue
+            if self.buf[i:i + 2] == b"\\/":
+                raw += b"\\/"
+                head += b"/"
+                self.pos = i + 2
+                continue
+            break
+        return raw, head
+
+    def _stream_b64(self, blob):
+        """读到结尾引号，整段整段地解转义后交给 blob 解码（逐个处理转义在斜杠被转义时太慢）。"""
+        while True:
+            q = self.buf.find(b'"', self.pos)
+            end = q if q >= 0 else len(self.buf)
+            if q < 0:
+                # 块尾可能截断了一个转义（最长 \\uXXXX 6 字节）：留到下一块再处理
+                tail = self.buf.rfind(b"\\", max(self.pos, end - 5), end)
+                if tail >= 0:
+                    end = tail
+            elif q > self.pos and self.buf[q - 1:q] == b"\\":
+                raise IntakeError("图片 base64 不合法：含转义引号")
+            seg = self.buf[self.pos:end]
+            if b"\\" in seg:
+                for old, new in _B64_ESCAPES:
+                    seg = seg.replace(old, new)
+                if b"\\" in seg:
+                    seg = _UNICODE_ESCAPE.sub(_unescape_u, seg)
+                    if b"\\" in seg:
+                        raise IntakeError("请求体 JSON 格式错误：图片 base64 含非法转义")
+            blob.feed(seg)
+            self.pos = end
+            if q >= 0:
+                self.pos = q + 1
+                return
+            if not self._fill():
+                raise IntakeError("请求体 JSON 不完整")
+
+
+class StreamIntake:
+    def __init__(self, min_stream_bytes=1024 * 1024, spool_bytes=1024 * 1024, max_text_bytes=2 * 1024 * 1024,
+                 decode_slots=2, max_side=1024, quality=85, keep_bytes=300 * 1024):
+        """
+        :param min_stream_bytes: Content-Length 不小于此值的 JSON 请求体走流式解析，更小的照常 request.get_json()
+        :param spool_bytes: 单张图片解码后超过此大小即落临时文件
+        :param max_text_bytes: 非图片字段单个字符串的上限
+        :param decode_slots: 本进程同时预处理（解码大图）的张数
+        :param max_side / quality / keep_bytes: 预处理参数，与 vision_api 送模型前的一致
+        """
+        self.min_stream_bytes = min_stream_bytes
+        self.spool_bytes = spool_bytes
+        self.max_text_bytes = max_text_bytes
+        self.max_side = max_side
+        self.quality = quality
+        self.keep_bytes = keep_bytes
+        self._slots = threading.BoundedSemaphore(max(1, decode_slots))
+        self._lock = threading.Lock()
+        self._counters = {"streamed_requests": 0, "buffered_requests": 0, "multipart_requests": 0, "images": 0,
+                          "image_bytes": 0, "prepared_bytes": 0, "spilled_to_disk": 0, "errors": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _prepare(self, blob, name=None):
+        self._count("images")
+        self._count("image_bytes", blob.size)
+        if blob.size > self.spool_bytes:
+            self._count("spilled_to_disk")
+        with self._slots:
+            out, mime = prepare_image_file(
+                blob.file, blob.size, max_side=self.max_side, quality=self.quality, keep_bytes=self.keep_bytes,
+            )
+        if out is None:
+            raise IntakeError(f"图片{f' {name} ' if name else ''}无法解码（支持 jpg / png / webp / gif）")
+        item = PreparedImage(f"data:{mime};base64,{base64.b64encode(out).decode('ascii')}")
+        item.content_sha256 = blob.sha.hexdigest()
+        item.original_bytes = blob.size
+        self._count("prepared_bytes", len(item))
+        return item
+
+    def read(self, request):
+        """按 Content-Type 读识图请求体：multipart/form-data 走 read_form，其余走 read_json。"""
+        if request.mimetype == "multipart/form-data":
+            return self.read_form(request)
+        return self.read_json(request)
+
+    def read_json(self, request):
+        """
+        读 JSON 请求体：小请求体（或非 JSON）照常 request.json，大的流式解析。
+        :return: 解析结果（非对象时返回 {}）
+        :raises IntakeError: 流式解析失败或超限
+        """
+        length = request.content_length
+        if not request.is_json or length is None or length < self.min_stream_bytes:
+            self._count("buffered_requests")
+            data = request.json
+            return data if isinstance(data, dict) else {}
+        self._count("streamed_requests")
+        parser = _Parser(request.stream, length, self.spool_bytes, self.max_text_bytes)
+        try:
+            data = parser.parse()
+            for container, key, blob in parser.images:
+                container[key] = self._prepare(blob)
+        except IntakeError:
+            self._count("errors")
+            raise
+        finally:
+            for _, _, blob in parser.images:
+                blob.close()
+        return data if isinstance(data, dict) else {}
+
+    def read_form(self, request):
+        """
+        读 multipart/form-data 请求体：文件分段不经 base64，边收边算 sha256、写临时文件，收完逐张预处理。
+        分段与参数的对应见模块说明；空文件分段（未选文件的表单控件）忽略。
+        :return: 与 JSON 请求体同构的 dict，图片为 PreparedImage
+        :raises IntakeError: 表单不合法、超限、引用了不存在的分段或图片无法解码
+        """
+        self._count("multipart_requests")
+        blobs = []
+
+        def stream_factory(total_content_length, content_type, filename, content_length=None):
+            blob = _SpooledImage(self.spool_bytes)
+            blobs.append(blob)
+            return blob
+
+        parser = FormDataParser(
+            stream_factory, max_form_memory_size=self.max_text_bytes,
+            max_content_length=request.max_content_length, silent=False,
+            max_form_parts=request.max_form_parts,
+        )
+        try:
+            try:
+                _, form, files = parser.parse(
+                    request.stream, request.mimetype, request.content_length, request.mimetype_params,
+                )
+            except HTTPException as e:
+                raise IntakeError(f"表单不合法: {e.description}", e.code or 400)
+            except ValueError as e:
+                raise IntakeError(f"表单不合法: {e}")
+            data = {}
+            if form.get("payload"):
+                try:
+                    data = json.loads(form["payload"])
+                except ValueError as e:
+                    raise IntakeError(f"payload 不是合法 JSON: {e}")
+                if not isinstance(data, dict):
+                    raise IntakeError("payload 应为 JSON 对象")
+            for key in form:
+                name = key.removesuffix("[]")
+                if key != "payload" and name not in data:
+                    data[name] = _form_value(name, form.getlist(key))
+            uploads = {}
+            for name, storage in files.items(multi=True):
+                blob = storage.stream
+                if not blob.size:
+                    continue
+                uploads.setdefault(name, []).append(self._prepare(blob, storage.filename or name))
+            used = set()
+            _attach_uploads(data, uploads, used)
+            for item in data.get("items") or []:
+                if isinstance(item, dict):
+                    _attach_uploads(item, uploads, used)
+            defaults = [img for name in _DEFAULT_UPLOAD_FIELDS if name not in used for img in uploads.get(name, ())]
+            if defaults:
+                images = data.get("images") if isinstance(data.get("images"), list) else []
+                data["images"] = images + defaults
+            stray = [name for name in uploads if name not in used and name not in _DEFAULT_UPLOAD_FIELDS]
+            if stray:
+                raise IntakeError(f"文件分段未被引用: {', '.join(stray)}（用 image / images 或在 JSON 里写 file / files）")
+        except IntakeError:
+            self._count("errors")
+            raise
+        finally:
+            for blob in blobs:
+                blob.close()
+        return data
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+        c["min_stream_bytes"] = self.min_stream_bytes
+        c["spool_bytes"] = self.spool_bytes
+        return c
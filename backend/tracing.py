@@ -0,0 +1,328 @@
+"""
+轻量请求追踪：一次请求一条 trace，内部的 SQL、外部 HTTP 调用与标了 @traced 的函数各记一个 span（按调用关系嵌套）。
+
+  - 当前 trace / span 放在 contextvars 里，同一线程内自动嵌套；线程池里执行的任务用 bind() 带过去
+  - 请求结束时，耗时超过 slow_ms、5xx、请求头带 X-Trace: 1 或按 sample_rate 随机命中的 trace 进本 worker 的环形缓冲，
+    其余丢弃（span 只是几个字段的 dict，不采样的请求开销很小）
+  - 采样到的 trace 可选导出为 OTLP/JSON（每行一个 ExportTraceServiceRequest）到 stdout 或文件，不需要外部 collector，
+    需要时用 otel-collector 的 filelog / otlpjsonfile receiver 或直接 jq 查看
+  - 单条 trace 最多记 max_spans 个 span（批量接口可能上百条 SQL），超出只计数
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("trace_current", default=None)  # (Trace, 当前 span id)
+
+
+class Trace:
+    def __init__(self, name, request_id=None, max_spans=500, attrs=None):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id or self.trace_id[:16]
+        self.name = name
+        self.max_spans = max_spans
+        self.start = time.time()
+        self.duration_ms = None
+        self.root_id = _span_id()
+        self.attrs = dict(attrs or {})
+        self.spans = []
+        self.dropped_spans = 0
+        self.force = False
+        self._lock = threading.Lock()
+
+    def add_span(self, span):
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped_spans += 1
+                return
+            self.spans.append(span)
+
+    def summary(self):
+        return {
+            "trace_id": self.trace_id,
+            "request_id": self.request_id,
+            "name": self.name,
+            "start": round(self.start, 3),
+            "duration_ms": self.duration_ms,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped_spans,
+            "attrs": self.attrs,
+        }
+
+    def to_dict(self):
+        out = self.summary()
+        out["root_span_id"] = self.root_id
+        out["spans"] = sorted(self.spans, key=lambda s: s["start"])
+        return out
+
+
+def _span_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace():
+    cur = _current.get()
+    return cur[0] if cur else None
+
+
+def outgoing_headers():
+    """往内部服务（OCRPlus、preview-lab）透传的头：X-Request-Id 与 W3C traceparent；不在请求内时为空。"""
+    cur = _current.get()
+    if not cur:
+        return {}
+    trace, span_id = cur
+    return {"X-Request-Id": trace.request_id, "traceparent": f"00-{trace.trace_id}-{span_id}-01"}
+
+
+class _Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.error = None
+        self._token = None
+        self._record = None
+
+    def set(self, **attrs):
+        if self._record is not None:
+            self._record["attrs"].update(attrs)
+
+    def __enter__(self):
+        cur = _current.get()
+        if not cur:
+            return self
+        trace, parent = cur
+        self._record = {"id": _span_id(), "parent": parent, "name": self.name, "start": time.time(),
+                        "duration_ms": None, "attrs": self.attrs}
+        self._t0 = time.perf_counter()
+        self._trace = trace
+        self._token = _current.set((trace, self._record["id"]))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._record is None:
+            return False
+        _current.reset(self._token)
+        self._record["duration_ms"] = round((time.perf_counter() - self._t0) * 1000, 2)
+        if exc is not None:
+            self._record["error"] = f"{type(exc).__name__}: {exc}"[:300]
+        self._trace.add_span(self._record)
+        return False
+
+
+def span(name, **attrs):
+    """with span("名字", 键=值): ... —— 不在 trace 内时什么都不做。"""
+    return _Span(name, attrs)
+
+
+def record_span(name, seconds, error=None, **attrs):
+    """记一个已经结束的 span（如 SQL 执行完后由回调上报），开始时间按结束时刻倒推。"""
+    cur = _current.get()
+    if not cur:
+        return
+    trace, parent = cur
+    record = {"id": _span_id(), "parent": parent, "name": name, "start": time.time() - seconds,
+              "duration_ms": round(seconds * 1000, 2), "attrs": attrs}
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"[:300]
+    trace.add_span(record)
+
+
+def traced(name=None):
+    """装饰器：函数的每次调用记一个 span（名字默认函数名）。"""
+    def wrap(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def request_hook(propagate=()):
+    """
+    给 metrics.add_request_hook 用：每次外部 HTTP 调用记一个 span（URL 去掉查询串，避免带出密钥）；
+    依赖名在 propagate 里的（自家服务）额外带上 X-Request-Id / traceparent。
+    """
+    propagate = frozenset(propagate)
+
+    def hook(request, dependency):
+        if _current.get() is None:
+            return None
+        s = span(f"http {request.method} {dependency}", url=(request.url or "").split("?", 1)[0])
+        s.__enter__()
+        if dependency in propagate:
+            request.headers.update(outgoing_headers())
+
+        def finish(resp, error, seconds):
+            if resp is not None:
+                s.set(status=resp.status_code)
+            s.__exit__(type(error) if error else None, error, None)
+        return finish
+    return hook
+
+
+def bind(fn):
+    """把当前 trace 带进线程池任务：返回的函数在执行时以当前 span 为父节点。"""
+    cur = _current.get()
+    if cur is None:
+        return fn
+
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        token = _current.set(cur)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return inner
+
+
+class TraceRecorder:
+    def __init__(self, slow_ms=1000.0, sample_rate=0.0, buffer_size=200, max_spans=500, export=None,
+                 service_name="goods_review_web"):
+        """
+        :param slow_ms: 耗时不低于此值的请求进缓冲
+        :param sample_rate: 其余请求按此比例随机进缓冲（0~1）
+        :param buffer_size: 本 worker 环形缓冲保留的 trace 条数
+        :param max_spans: 单条 trace 的 span 上限
+        :param export: None / "stdout" / "file:<路径>"，采样到的 trace 以 OTLP/JSON 追加输出
+        """
+        self.slow_ms = float(slow_ms)
+        self.sample_rate = float(sample_rate)
+        self.max_spans = int(max_spans)
+        self.service_name = service_name
+        self._buffer = deque(maxlen=max(1, int(buffer_size)))
+        self._lock = threading.Lock()
+        self._export = (export or "").strip() or None
+        self._counters = {"started": 0, "sampled": 0, "exported": 0, "export_errors": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def start(self, name, request_id=None, force=False, **attrs):
+        """开始一条 trace 并设为当前；返回 (trace, token)，结束时传给 finish。"""
+        trace = Trace(name, request_id=request_id, max_spans=self.max_spans, attrs=attrs)
+        trace.force = force
+        self._count("started")
+        return trace, _current.set((trace, trace.root_id))
+
+    def finish(self, trace, token, status=None, **attrs):
+        """结束 trace：恢复上下文，按规则决定是否进缓冲 / 导出。返回是否采样。"""
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 在别的上下文里结束（如 teardown 与 before_request 不在同一 Context），直接清空
+            _current.set(None)
+        trace.duration_ms = round((time.time() - trace.start) * 1000, 2)
+        trace.attrs.update(attrs)
+        if status is not None:
+            trace.attrs["status"] = status
+        sampled = (
+            trace.force
+            or trace.duration_ms >= self.slow_ms
+            or (status is not None and status >= 500)
+            or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        )
+        if not sampled:
+            return False
+        with self._lock:
+            self._buffer.append(trace)
+            self._counters["sampled"] += 1
+        if self._export:
+            self._export_trace(trace)
+        return True
+
+    # ---------- 查询 ----------
+    def list(self, limit=50, min_ms=0.0, name_contains=None):
+        with self._lock:
+            traces = list(self._buffer)
+        out = []
+        for t in reversed(traces):
+            if t.duration_ms < min_ms or (name_contains and name_contains not in t.name):
+                continue
+            out.append(t.summary())
+            if len(out) >= limit:
+                break
+        return out
+
+    def get(self, trace_or_request_id):
+        with self._lock:
+            traces = list(self._buffer)
+        for t in reversed(traces):
+            if trace_or_request_id in (t.trace_id, t.request_id):
+                return t.to_dict()
+        return None
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c["buffered"] = len(self._buffer)
+        c["buffer_size"] = self._buffer.maxlen
+        c["slow_ms"] = self.slow_ms
+        c["sample_rate"] = self.sample_rate
+        c["export"] = self._export
+        return c
+
+    # ---------- OTLP/JSON 导出 ----------
+    def to_otlp(self, trace):
+        def attrs(d):
+            return [{"key": str(k), "value": {"stringValue": str(v)}} for k, v in d.items()]
+
+        def ns(seconds):
+            return str(int(seconds * 1e9))
+
+        root = {
+            "traceId": trace.trace_id, "spanId": trace.root_id, "name": trace.name, "kind": 2,
+            "startTimeUnixNano": ns(trace.start), "endTimeUnixNano": ns(trace.start + trace.duration_ms / 1000),
+            "attributes": attrs(dict(trace.attrs, **{"request.id": trace.request_id})),
+            "status": {"code": 2 if (trace.attrs.get("status") or 0) >= 500 else 1},
+        }
+        spans = [root]
+        for s in trace.spans:
+            item = {
+                "traceId": trace.trace_id, "spanId": s["id"], "parentSpanId": s["parent"], "name": s["name"],
+                "kind": 3 if s["name"].startswith(("http ", "db ")) else 1,
+                "startTimeUnixNano": ns(s["start"]), "endTimeUnixNano": ns(s["start"] + (s["duration_ms"] or 0) / 1000),
+                "attributes": attrs(s["attrs"]),
+                "status": {"code": 2, "message": s["error"]} if s.get("error") else {"code": 1},
+            }
+            spans.append(item)
+        return {"resourceSpans": [{
+            "resource": {"attributes": attrs({"service.name": self.service_name, "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": "goods_review_web.tracing"}, "spans": spans}],
+        }]}
+
+    def _export_trace(self, trace):
+        try:
+            line = json.dumps(self.to_otlp(trace), ensure_ascii=False) + "\n"
+            if self._export == "stdout":
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            elif self._export.startswith("file:"):
+                # 一次 write 一整行，多 worker 追加同一文件时行不会交错（O_APPEND）
+                fd = os.open(self._export[5:], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line.encode("utf-8"))
+                finally:
+                    os.close(fd)
+            else:
+                raise ValueError(f"不支持的导出目标: {self._export}")
+            self._count("exported")
+        except Exception as e:
+            self._count("export_errors")
+            log.warning("trace export failed: %s", e)
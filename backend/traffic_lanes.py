@@ -0,0 +1,180 @@
+"""
+请求分道：人工审核（interactive）与 N8N 批量（batch）分开限流。
+
+按路由、请求头 X-Traffic-Lane 或 API Key（X-Api-Key）把请求归到某条道，每条道有自己的：
+  - 在途请求上限 + 有界等待队列（占的是 gunicorn 线程，批量道超出即 429 + Retry-After）
+  - DB 连接池份额（见 db_pool.ConnectionPool 的 lane_limits）
+  - 大模型并发份额（app.py 里按道分配）
+当前请求所在的道放在 ContextVar 里，连接池、大模型并发等下游按它取份额；非请求线程（后台落库等）为 None，不受限。
+"""
+import contextvars
+import os
+import threading
+import time
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANE_NAMES = (INTERACTIVE, BATCH)
+
+# N8N 批量流量默认走 batch 道的路由（前缀匹配）；可用 BATCH_ROUTES 环境变量（逗号分隔）追加
+DEFAULT_BATCH_ROUTES = (
+    '/api/vision/describe',
+    '/api/vision/describe-batch',
+    '/api/vision/spec-sublabel',
+    '/api/goods/update-main-fields',
+    '/api/design/set-discard-reasons',
+)
+
+_current_lane = contextvars.ContextVar('traffic_lane', default=None)
+
+
+def current_lane():
+    """当前请求所在的道；不在请求中时为 None。"""
+    return _current_lane.get()
+
+
+def set_current_lane(lane):
+    return _current_lane.set(lane)
+
+
+def reset_current_lane(token):
+    _current_lane.reset(token)
+
+
+class LaneRejected(Exception):
+    """该道已满（在途 + 排队都满，或排队超时），应返回 429。"""
+
+    def __init__(self, lane, retry_after, reason):
+        super().__init__(reason)
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    """一条道的在途上限与有界等待队列。max_concurrent 为 None 表示不限（只计数）。"""
+
+    def __init__(self, name, max_concurrent=None, max_queue=0, queue_timeout=0.0, retry_after=5):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._rejected = 0
+        self._admitted = 0
+
+    def enter(self):
+        """占一个在途名额；满时按队列上限排队，队列满或等待超时抛 LaneRejected。"""
+        with self._cond:
+            if self.max_concurrent is None or self._in_flight < self.max_concurrent:
+                self._in_flight += 1
+                self._admitted += 1
+                return
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise LaneRejected(self.name, self.retry_after, f"{self.name} 道已满（在途 {self._in_flight}，排队 {self._waiting}）")
+            self._waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._in_flight >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        raise LaneRejected(self.name, self.retry_after, f"{self.name} 道排队超时（{self.queue_timeout:g}s）")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+            self._admitted += 1
+
+    def leave(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+            }
+
+
+def _env_list(name):
+    return tuple(x.strip() for x in (os.getenv(name) or '').split(',') if x.strip())
+
+
+class LaneClassifier:
+    """按请求头 / API Key / 路由判定所属道。显式请求头优先，其次 API Key，最后路由。"""
+
+    def __init__(self, batch_routes=None, batch_api_keys=None, interactive_api_keys=None):
+        self.batch_routes = tuple(batch_routes if batch_routes is not None else DEFAULT_BATCH_ROUTES + _env_list('BATCH_ROUTES'))
+        self.batch_api_keys = set(batch_api_keys if batch_api_keys is not None else _env_list('BATCH_API_KEYS'))
+        self.interactive_api_keys = set(
+            interactive_api_keys if interactive_api_keys is not None else _env_list('INTERACTIVE_API_KEYS')
+        )
+
+    def classify(self, path, headers):
+        explicit = (headers.get('X-Traffic-Lane') or '').strip().lower()
+        if explicit in LANE_NAMES:
+            return explicit
+        api_key = (headers.get('X-Api-Key') or '').strip()
+        if api_key:
+            if api_key in self.batch_api_keys:
+                return BATCH
+            if api_key in self.interactive_api_keys:
+                return INTERACTIVE
+        if any(path == r or path.startswith(r.rstrip('/') + '/') for r in self.batch_routes):
+            return BATCH
+        return INTERACTIVE
+
+
+def split_share(total, shares):
+    """
+    把 total 个名额按 {lane: 比例} 切分（最大余数法），各道之和恰为 total；返回 {lane: int}。
+    比例按合计归一；total 不少于道数时每条道至少 1 个（从名额最多的道挪），否则允许有道分到 0。
+    """
+    total = max(0, int(total))
+    weights = {lane: max(0.0, float(share)) for lane, share in shares.items()}
+    if not weights:
+        return {}
+    weight_sum = sum(weights.values())
+    if weight_sum <= 0:
+        weights = {lane: 1.0 for lane in weights}
+        weight_sum = float(len(weights))
+    exact = {lane: total * w / weight_sum for lane, w in weights.items()}
+    out = {lane: int(v) for lane, v in exact.items()}
+    left = total - sum(out.values())
+    for lane in sorted(exact, key=lambda k: exact[k] - out[k], reverse=True)[:left]:
+        out[lane] += 1
+    if total >= len(out):
+        for lane in out:
+            if out[lane] == 0:
+                donor = max(out, key=out.get)
+                out[donor] -= 1
+                out[lane] = 1
+    return out
+
+
+def parse_shares(raw, default):
+    """解析 'interactive:0.3,batch:0.7' 形式的份额配置，格式不对时用 default。"""
+    if not raw:
+        return dict(default)
+    out = {}
+    try:
+        for part in raw.split(','):
+            k, _, v = part.partition(':')
+            k = k.strip()
+            if k in LANE_NAMES:
+                out[k] = float(v)
+    except ValueError:
+        return dict(default)
+    for k, v in default.items():
+        out.setdefault(k, v)
+    return out
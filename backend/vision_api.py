@@ -4,30 +4,68 @@ API Key 从环境变量 BIGMODEL_API_KEY 读取，请勿写死在代码中。
 支持单图或多图（多图时模型会同时看到多张图并一起回答）。
 
 Lovart 等外网图片：请由挂翻墙的客户端拉图后传 image_base64_list，服务端不通过代理访问外网。
-智谱仅支持 jpg/png/jpeg，若图床返回 webp 则在内存中转为 PNG 再传。
+智谱仅支持 jpg/png/jpeg，若图床返回 webp 则在内存中转为 JPEG 再传；送模型前长边缩到约 1024px（见 image_prep.py）。
 """
 import base64
-import io
+import logging
 import os
+import tempfile
+import time
 import requests
 from typing import Union
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlunparse
 
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
+from adaptive_limiter import ERROR, OK, THROTTLED, LimiterRegistry
+from disk_cache import DiskCache
+from image_prep import prepare_data_url, prepare_image
+from vision_scheduler import VisionQueueRejected
 
-URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+log = logging.getLogger(__name__)
+
+# BIGMODEL_API_URL 可改指到压测用的假服务（见 loadtest/fake_services.py）
+URL = os.getenv("BIGMODEL_API_URL", "https://open.bigmodel.cn/api/paas/v4/chat/completions")
 # 默认用 GLM-4.6V 旗舰版（走资源包）；可改为 glm-4v-flash 使用免费版
 DEFAULT_MODEL = "glm-4.6v"
 
+# 按模型的 AIMD 自适应并发（本进程内）：健康时逐步放开，429/5xx/超时/延迟尖刺时退让
+MODEL_LIMITERS = LimiterRegistry()
+# 等自适应名额的最长秒数（调用方可传更短的 acquire_timeout）；等不到则不发请求，抛 VisionQueueRejected(503)
+MODEL_LIMIT_ACQUIRE_TIMEOUT = float(os.getenv("VISION_AIMD_ACQUIRE_TIMEOUT", "60"))
+MODEL_LIMIT_RETRY_AFTER = int(os.getenv("LANE_RETRY_AFTER", "10"))
+
+
+def get_limiter_stats():
+    """各模型当前自适应并发上限、在途数、延迟与结果计数。"""
+    return MODEL_LIMITERS.stats()
+
+
 # 这些域名的图片服务端不拉取，须由客户端拉图后传 base64
 CLIENT_FETCH_HOST_SUFFIXES = ("lovart.ai",)
 
-# 智谱对单图/请求体有大小限制，过大的 data URL 先缩图再传（避免 1210 参数错误）
-VISION_MAX_DATA_URL_BYTES = 4 * 1024 * 1024   # 4MB
-VISION_RESIZE_MAX_PIXEL = 1024
+# 送模型前的预处理（见 image_prep.py）：长边压到 VISION_IMAGE_MAX_SIDE，超限或过大时按 JPEG 质量重编码一次；
+# 同时避免请求体过大触发智谱 1210 参数错误
+VISION_RESIZE_MAX_PIXEL = int(os.getenv("VISION_IMAGE_MAX_SIDE", "1024"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_IMAGE_JPEG_QUALITY", "85"))
+# 长边不超限且不大于该字节数的 JPEG/PNG 原样送，不重编码
+VISION_KEEP_ORIGINAL_BYTES = int(os.getenv("VISION_IMAGE_KEEP_BYTES", str(300 * 1024)))
+
+# 服务端拉图的本地磁盘缓存：按规范化 URL 索引，存预处理后（缩图、WebP 等转 JPEG）的字节与 MIME，
+# 同一张图被 describe / retag / spec-sublabel 两轮 / ai-recommend 反复使用时不再重复下载。
+# 新鲜期内直接用；过期后带 If-None-Match / If-Modified-Since 条件请求，304 则续期；图床不可达时用旧副本。
+# VISION_IMAGE_CACHE_MAX_MB=0 关闭。
+VISION_IMAGE_CACHE_DIR = os.getenv("VISION_IMAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "goods_review_image_cache")
+VISION_IMAGE_CACHE_MAX_MB = int(os.getenv("VISION_IMAGE_CACHE_MAX_MB", "1024"))
+VISION_IMAGE_CACHE_FRESH_SECONDS = int(os.getenv("VISION_IMAGE_CACHE_FRESH_SECONDS", "86400"))
+IMAGE_FETCH_CACHE = (
+    DiskCache(VISION_IMAGE_CACHE_DIR, VISION_IMAGE_CACHE_MAX_MB * 1024 * 1024, name="image-fetch-cache")
+    if VISION_IMAGE_CACHE_MAX_MB > 0 else None
+)
+
+
+def get_image_cache_stats():
+    """拉图磁盘缓存的命中、条件重验证、淘汰计数；未启用时返回 None。"""
+    return IMAGE_FETCH_CACHE.stats() if IMAGE_FETCH_CACHE else None
+
 
 # 服务端拉图时使用的头（仅用于非 Lovart 等直连可达的 URL），模拟浏览器以通过防盗链
 FETCH_HEADERS = {
@@ -44,6 +82,9 @@ def get_api_key():
     return os.getenv("BIGMODEL_API_KEY") or os.getenv("GLM_API_KEY")
 
 
+CLIENT_FETCH_REQUIRED_MSG = "Lovart 等外网图片请由挂翻墙的客户端拉图后传 image_base64_list，服务端不通过代理访问"
+
+
 def _must_client_fetch(url: str) -> bool:
     """判断该 URL 是否须由客户端拉图传 base64（服务端不通过代理访问）。"""
     try:
@@ -54,54 +95,110 @@ def _must_client_fetch(url: str) -> bool:
         return False
 
 
-def _webp_bytes_to_png_base64(data: bytes) -> str | None:
-    """内存中把 WebP 转为 PNG 的 base64，失败返回 None。"""
-    if not Image:
-        return None
+def _fetch_cache_key(url: str) -> str:
+    """拉图缓存键：协议与域名小写、去掉 #fragment；保留查询参数（OSS 处理参数不同即不同图）。
+    缓存的是预处理后的字节，键里带上预处理参数，改了长边/质量配置不会读到旧尺寸。"""
+    p = urlparse(url.strip())
+    u = urlunparse((p.scheme.lower(), p.netloc.lower(), p.path, p.params, p.query, ""))
+    return f"{u}#prep={VISION_RESIZE_MAX_PIXEL}q{VISION_JPEG_QUALITY}"
+
+
+def _prepare_for_model(data: bytes):
+    """原始图片字节 → 送模型的字节与 MIME（缩到长边上限，WebP 等格式转 JPEG）。失败返回 (None, None)。"""
+    return prepare_image(
+        data, max_side=VISION_RESIZE_MAX_PIXEL, quality=VISION_JPEG_QUALITY, keep_bytes=VISION_KEEP_ORIGINAL_BYTES,
+    )
+
+
+def _cache_fetched_image(key, data, mime, headers):
+    if not IMAGE_FETCH_CACHE or "no-store" in (headers.get("Cache-Control") or "").lower():
+        return
     try:
-        img = Image.open(io.BytesIO(data))
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        return base64.b64encode(buf.getvalue()).decode("ascii")
-    except Exception:
-        return None
+        IMAGE_FETCH_CACHE.put(
+            key, data, mime, VISION_IMAGE_CACHE_FRESH_SECONDS,
+            etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"),
+        )
+    except OSError as e:
+        log.warning("拉图缓存写入失败: %s", e)
 
 
-def _fetch_image_as_base64(url: str, timeout: int = 15):
+# 从图床新拉到一张图后的回调 fn(url, data)，如记录感知哈希；回调异常只打日志。
+# 默认收到预处理后的字节；raw=True 的收到图床返回的原图字节（如按原图内容哈希关联 URL）
+_IMAGE_FETCH_HOOKS = []
+
+
+def add_image_fetch_hook(fn, raw=False):
+    _IMAGE_FETCH_HOOKS.append((fn, raw))
+
+
+def _run_image_fetch_hooks(url, data, raw_data):
+    for fn, raw in _IMAGE_FETCH_HOOKS:
+        try:
+            fn(url, raw_data if raw else data)
+        except Exception as e:
+            log.warning("拉图回调失败: %s", e)
+
+
+def fetch_image_bytes(url: str, timeout: int = 15):
+    """拉取一张 http(s) 图片的预处理后字节（经磁盘缓存），返回值同 _fetch_image_bytes。
+    须由客户端拉图的域名（_must_client_fetch）直接返回失败，不在服务端访问。"""
+    if _must_client_fetch(url):
+        return False, None, None, CLIENT_FETCH_REQUIRED_MSG
+    return _fetch_image_bytes(url, timeout)
+
+
+def _fetch_image_bytes(url: str, timeout: int = 15):
     """
-    在内存中拉取图片并转为 base64，不写本地文件。
+    拉取图片字节（先查本地磁盘缓存）并预处理：长边缩到上限，WebP 等智谱不支持的格式转为 JPEG。
     单次 15s、最多重试 1 次，拉不到约 30s 内返回错误，避免客户端等满 60s 才超时。
-    成功返回 (True, base64_str, mime, None)；失败返回 (False, None, None, error_msg)。
-    智谱仅支持 jpg/png/jpeg，若图床返回 webp 则转为 PNG。
+    成功返回 (True, bytes, mime, None)；失败返回 (False, None, None, error_msg)。
     """
     fetch_url = url
     if "x-oss-process=image" in url and "format,webp" in url:
         fetch_url = url.replace("format,webp", "format,png")
+    key = _fetch_cache_key(fetch_url)
+    entry = IMAGE_FETCH_CACHE.get(key) if IMAGE_FETCH_CACHE else None
+    if entry and entry["fresh"]:
+        data = IMAGE_FETCH_CACHE.read(entry)
+        if data:
+            return True, data, entry["mime"], None
+        entry = None
+    headers = dict(FETCH_HEADERS)
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
     last_err = None
     for attempt in range(2):
         try:
             r = requests.get(
                 fetch_url,
-                headers=FETCH_HEADERS,
+                headers=headers,
                 timeout=timeout,
             )
+            if r.status_code == 304 and entry:
+                data = IMAGE_FETCH_CACHE.read(entry)
+                if data:
+                    IMAGE_FETCH_CACHE.refresh(
+                        entry, VISION_IMAGE_CACHE_FRESH_SECONDS,
+                        etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"),
+                    )
+                    return True, data, entry["mime"], None
+                # 重验证期间副本被淘汰：去掉条件头重新完整拉取
+                entry = None
+                headers = dict(FETCH_HEADERS)
+                continue
             if r.status_code != 200 or not r.content:
                 last_err = f"HTTP {r.status_code}" if r.status_code != 200 else "响应为空"
                 return False, None, None, last_err
-            ct = (r.headers.get("Content-Type") or "").lower()
-            data = r.content
-            if "image/webp" in ct or (len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WEBP"):
-                png_b64 = _webp_bytes_to_png_base64(data)
-                if png_b64:
-                    return True, png_b64, "image/png", None
-                return False, None, None, "WebP 转 PNG 失败"
-            if "image/jpeg" in ct or "image/jpg" in ct:
-                mime = "image/jpeg"
-            else:
-                mime = "image/png"
-            return True, base64.b64encode(data).decode("ascii"), mime, None
+            data, mime = _prepare_for_model(r.content)
+            if not data:
+                ct = (r.headers.get("Content-Type") or "").split(";")[0].strip() or "未知格式"
+                return False, None, None, f"图片解码失败（{ct}）"
+            _cache_fetched_image(key, data, mime, r.headers)
+            _run_image_fetch_hooks(url, data, r.content)
+            return True, data, mime, None
         except requests.exceptions.Timeout as e:
             last_err = f"超时: {e}"
         except requests.exceptions.SSLError as e:
@@ -112,42 +209,35 @@ def _fetch_image_as_base64(url: str, timeout: int = 15):
             last_err = str(e)
         if attempt == 0:
             continue
+    if entry:
+        # 图床不可达：用过期副本，总比整次识图失败好
+        data = IMAGE_FETCH_CACHE.read(entry)
+        if data:
+            log.warning("拉图失败（%s），使用过期缓存: %s", last_err, fetch_url)
+            return True, data, entry["mime"], None
     return False, None, None, last_err or "未知错误"
 
 
+def _fetch_image_as_base64(url: str, timeout: int = 15):
+    """
+    拉取图片并转为 base64（经本地磁盘缓存，见 _fetch_image_bytes）。
+    成功返回 (True, base64_str, mime, None)；失败返回 (False, None, None, error_msg)。
+    智谱仅支持 jpg/png/jpeg，若图床返回 webp 则转为 JPEG。
+    """
+    ok, data, mime, err = _fetch_image_bytes(url, timeout=timeout)
+    if not ok:
+        return False, None, None, err
+    return True, base64.b64encode(data).decode("ascii"), mime, None
+
+
 def _shrink_large_data_url(data_url: str) -> str:
     """
-    若 data URL 过大（超过 VISION_MAX_DATA_URL_BYTES），解码后缩图再编码为 JPEG，避免智谱 1210 参数错误。
-    返回缩小后的 data URL，失败或无需缩小时返回原串。
+    客户端传的 data URL 按同样规则预处理：尺寸与大小合规时原串返回（只解码开头读宽高），
+    否则解码一次、缩图、编码一次，避免智谱 1210 参数错误。失败时返回原串。
     """
-    if not data_url or not data_url.startswith("data:image/") or ";base64," not in data_url:
-        return data_url
-    if len(data_url) <= VISION_MAX_DATA_URL_BYTES:
-        return data_url
-    if not Image:
-        return data_url
-    try:
-        header, b64 = data_url.split(",", 1)
-        raw = base64.b64decode(b64)
-        img = Image.open(io.BytesIO(raw))
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        w, h = img.size
-        if w <= VISION_RESIZE_MAX_PIXEL and h <= VISION_RESIZE_MAX_PIXEL:
-            buf = io.BytesIO()
-            img.save(buf, format="JPEG", quality=85)
-            new_b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-            return f"data:image/jpeg;base64,{new_b64}"
-        ratio = min(VISION_RESIZE_MAX_PIXEL / w, VISION_RESIZE_MAX_PIXEL / h)
-        nw, nh = int(w * ratio), int(h * ratio)
-        resample = getattr(Image, "Resampling", None) and Image.Resampling.LANCZOS or Image.LANCZOS
-        img = img.resize((nw, nh), resample)
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=85)
-        new_b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-        return f"data:image/jpeg;base64,{new_b64}"
-    except Exception:
-        return data_url
+    return prepare_data_url(
+        data_url, max_side=VISION_RESIZE_MAX_PIXEL, quality=VISION_JPEG_QUALITY, keep_bytes=VISION_KEEP_ORIGINAL_BYTES,
+    )
 
 
 def _resolve_image_for_api(raw_url: str):
@@ -158,7 +248,7 @@ def _resolve_image_for_api(raw_url: str):
     if not u.startswith(("http://", "https://")):
         return u, None
     if _must_client_fetch(u):
-        return None, "Lovart 等外网图片请由挂翻墙的客户端拉图后传 image_base64_list，服务端不通过代理访问"
+        return None, CLIENT_FETCH_REQUIRED_MSG
     ok, b64, mime, err = _fetch_image_as_base64(u)
     if not ok or not b64:
         return None, (err or "拉图失败")
@@ -171,6 +261,7 @@ def describe_image(
     model: Union[str, None] = None,
     response_format_json: bool = False,
     api_key: Union[str, None] = None,
+    acquire_timeout: Union[float, None] = None,
 ):
     """
     调用智谱视觉模型对一张或多张图片进行理解，返回模型回复文本。
@@ -180,8 +271,10 @@ def describe_image(
     :param model: 模型名，如 glm-4.6v（资源包）、glm-4v-flash（免费）。None 或空则用 DEFAULT_MODEL。
     :param response_format_json: 为 True 时请求智谱按 JSON 输出（response_format.json_object），便于程序解析；结构约束需在 prompt 中说明。
     :param api_key: 可选，传入时优先使用（如从配置表读取）；否则用 get_api_key()。
+    :param acquire_timeout: 可选，等模型自适应名额的最长秒数（如请求剩余的排队预算），不超过 MODEL_LIMIT_ACQUIRE_TIMEOUT。
     :return: (success: bool, result: str | dict)
         success 为 True 时 result 为回复文本；为 False 时 result 为错误信息或原始响应
+    :raises VisionQueueRejected: 等不到模型名额（503，未发出请求），与调度器排队超时一样由路由转成 503 + Retry-After
     """
     api_key = (api_key or "").strip() or get_api_key()
     if not api_key:
@@ -206,7 +299,6 @@ def describe_image(
             resolved, err = _resolve_image_for_api(u)
             if err is not None:
                 return False, f"无法拉取该图片: {err}"
-            resolved = _shrink_large_data_url(resolved)
             content.append({"type": "image_url", "image_url": {"url": resolved}})
 
     if len(content) == 1:
@@ -223,11 +315,30 @@ def describe_image(
     if response_format_json:
         data["response_format"] = {"type": "json_object"}
 
+    limiter = MODEL_LIMITERS.get(model)
+    wait = MODEL_LIMIT_ACQUIRE_TIMEOUT if acquire_timeout is None else max(0.0, min(acquire_timeout, MODEL_LIMIT_ACQUIRE_TIMEOUT))
+    if not limiter.acquire(wait):
+        raise VisionQueueRejected(
+            503, MODEL_LIMIT_RETRY_AFTER, f"模型 {model} 当前自适应并发上限 {limiter.limit} 已满，等待 {wait:g}s 超时",
+        )
+    outcome, t0 = ERROR, time.monotonic()
+    try:
+        try:
+            resp = requests.post(URL, headers=headers, json=data, timeout=60)
+        except requests.exceptions.Timeout as e:
+            outcome = THROTTLED
+            return False, str(e)
+        except requests.RequestException as e:
+            return False, str(e)
+        if resp.status_code == 429 or resp.status_code >= 500:
+            outcome = THROTTLED
+        elif resp.status_code == 200:
+            outcome = OK
+    finally:
+        limiter.release(outcome, time.monotonic() - t0)
+
     try:
-        resp = requests.post(URL, headers=headers, json=data, timeout=60)
         body = resp.json()
-    except requests.RequestException as e:
-        return False, str(e)
     except ValueError:
         return False, resp.text if hasattr(resp, "text") else "响应非 JSON"
 
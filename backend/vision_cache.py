@@ -0,0 +1,373 @@
+"""
+大模型识图结果缓存：按 (图片标识, 提示词哈希, 模型, json_output) 命中，两级——进程内 LRU + MySQL 表 vision_result_cache。
+
+图片标识：http(s) URL 用规范化 URL 的 md5（与 image_assets.url_hash 相同算法），
+base64/data URL 用解码后字节的 sha256，同一张图换了 URL 参数或重复上传都能命中。
+提示词不同（spec-sublabel、ai-recommend、N8N 自定义提示词）即不同键，不会再错命中轮播图标签。
+两级都有 TTL；内存按条数 LRU 淘汰，表按过期时间 + 行数上限定期清理。
+表的维护不占请求线程：命中计数先在进程内累计，由后台线程定期批量写回；过期删除与按 last_used_at（有索引）
+淘汰最旧行也在后台线程做，写入满 cleanup_every 条时提前唤醒一次。
+"""
+import binascii
+import hashlib
+import json
+import logging
+import threading
+import os
+import time
+from collections import Counter, OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+def normalize_url(url):
+    if not url or not isinstance(url, str):
+        return ""
+    return url.strip().split("#")[0].split("?")[0].strip()
+
+
+def url_hash(url):
+    n = normalize_url(url)
+    return hashlib.md5(n.encode("utf-8")).hexdigest() if n else ""
+
+
+_B64_HASH_CHUNK = 1024 * 1024
+_B64_WS = str.maketrans("", "", " \t\r\n")
+
+
+def data_url_content_hash(data_url):
+    """
+    data:image/...;base64,... 解码后字节的 sha256；不是合法 base64 时退化为对原串做哈希。
+    按 1MB 分段去空白、4 字符对齐解码并增量求哈希，几十 MB 的 base64 不会再整块解码出一份原图字节。
+    """
+    # 不用 partition 切出 base64 部分：那会再复制一份同样大的字符串
+    begin = data_url.find(",") + 1
+    sha = hashlib.sha256()
+    pending = ""
+    try:
+        for start in range(begin, len(data_url), _B64_HASH_CHUNK):
+            chunk = pending + data_url[start:start + _B64_HASH_CHUNK].translate(_B64_WS)
+            cut = len(chunk) - len(chunk) % 4
+            pending = chunk[cut:]
+            if cut:
+                sha.update(binascii.a2b_base64(chunk[:cut]))
+        if pending.strip("="):
+            # 缺补位的尾巴按补齐 '=' 解码，与 stream_intake 流式接收的结果一致
+            sha.update(binascii.a2b_base64(pending + "=" * (-len(pending) % 4)))
+    except (binascii.Error, ValueError):
+        return hashlib.sha256(data_url[begin:].encode("utf-8")).hexdigest()
+    return sha.hexdigest()
+
+
+def image_identity(item):
+    """单张图片输入的缓存标识：'u:<url md5>' 或 'c:<内容 sha256>'。"""
+    content_sha256 = getattr(item, "content_sha256", None)
+    if content_sha256:
+        # 流式接收的图片已预处理过，标识按客户端原图字节（见 stream_intake.PreparedImage）
+        return "c:" + content_sha256
+    s = (item or "").strip()
+    if s.startswith(("http://", "https://")):
+        return "u:" + url_hash(s)
+    if s.startswith("data:"):
+        return "c:" + data_url_content_hash(s)
+    return "s:" + hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()
+
+
+def make_cache_key(image_ids, prompt, model, json_output):
+    raw = json.dumps([list(image_ids), prompt_hash(prompt), model or "", bool(json_output)], separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class VisionResultCache:
+    def __init__(self, conn_factory, ttl_seconds=30 * 86400, memory_items=2000, memory_ttl_seconds=3600,
+                 max_rows=200000, cleanup_every=500, flush_interval=30.0, cleanup_interval=600.0):
+        """
+        :param conn_factory: 无参函数，返回 pymysql 连接
+        :param ttl_seconds: 表中结果有效期
+        :param memory_items: 进程内 LRU 条数上限
+        :param memory_ttl_seconds: 进程内条目有效期（不超过 ttl_seconds）
+        :param max_rows: 表行数上限，超出时按最近命中时间删最旧的
+        :param cleanup_every: 每写入多少条提前触发一次表清理
+        :param flush_interval: 命中计数写回表的间隔（秒）
+        :param cleanup_interval: 表清理的最长间隔（秒）
+        """
+        self._conn_factory = conn_factory
+        self.ttl_seconds = int(ttl_seconds)
+        self.memory_items = int(memory_items)
+        self.memory_ttl_seconds = min(int(memory_ttl_seconds), self.ttl_seconds)
+        self.max_rows = int(max_rows)
+        self.cleanup_every = max(1, int(cleanup_every))
+        self.flush_interval = max(1.0, float(flush_interval))
+        self.cleanup_interval = max(self.flush_interval, float(cleanup_interval))
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (expires_at_monotonic, content)
+        self._db_enabled = True
+        self._puts_since_cleanup = 0
+        self._pending_hits = Counter()  # cache_key -> 尚未写回表的命中次数
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._counters = {
+            "hits_memory": 0, "hits_db": 0, "misses": 0, "puts": 0,
+            "evictions_memory": 0, "evictions_db": 0, "hit_flushes": 0, "cleanups": 0,
+        }
+
+    # ---------- 内存层 ----------
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry[1]
+
+    def _memory_put(self, key, content):
+        with self._lock:
+            self._memory[key] = (time.monotonic() + self.memory_ttl_seconds, content)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+                self._counters["evictions_memory"] += 1
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _disable_db(self, e):
+        if self._db_enabled:
+            log.warning("vision_result_cache 表不可用，只用进程内缓存（请执行 sql/add_vision_result_cache.sql）: %s", e)
+        self._db_enabled = False
+
+    def _handle_db_error(self, what, e):
+        if "doesn't exist" in str(e) or "Unknown column" in str(e):
+            self._disable_db(e)
+        else:
+            log.warning("vision_result_cache %s failed: %s", what, e)
+
+    def _record_hits(self, keys):
+        with self._lock:
+            self._pending_hits.update(keys)
+        self._ensure_thread()
+
+    # ---------- 后台维护 ----------
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._maintain, name="vision-cache-maintain", daemon=True)
+            self._thread.start()
+
+    def _maintain(self):
+        next_cleanup = time.monotonic() + self.cleanup_interval
+        while True:
+            woken = self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._db_enabled:
+                continue
+            self.flush_hits()
+            if woken or time.monotonic() >= next_cleanup:
+                self.cleanup()
+                next_cleanup = time.monotonic() + self.cleanup_interval
+
+    def flush_hits(self):
+        """把累计的命中次数批量写回表（同一次数的键合并成一条 IN 更新）。"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, Counter()
+        if not pending or not self._db_enabled:
+            return
+        by_count = {}
+        for key, n in pending.items():
+            by_count.setdefault(n, []).append(key)
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                for n, keys in by_count.items():
+                    for i in range(0, len(keys), 500):
+                        chunk = keys[i:i + 500]
+                        cursor.execute(
+                            f"UPDATE vision_result_cache SET hit_count = hit_count + %s, last_hit_at = NOW(), "
+                            f"last_used_at = NOW() WHERE cache_key IN ({','.join(['%s'] * len(chunk))})",
+                            [n] + chunk,
+                        )
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+            self._count("hit_flushes")
+        except Exception as e:
+            self._handle_db_error("hit flush", e)
+
+    # ---------- 对外 ----------
+    def get(self, key):
+        """命中返回 content 字符串，否则 None。"""
+        content = self._memory_get(key)
+        if content is not None:
+            self._count("hits_memory")
+            return content
+        if self._db_enabled:
+            try:
+                conn = self._conn_factory()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "SELECT content FROM vision_result_cache WHERE cache_key = %s AND expires_at > NOW()",
+                        (key,),
+                    )
+                    row = cursor.fetchone()
+                    cursor.close()
+                finally:
+                    conn.close()
+                if row:
+                    content = row["content"] if isinstance(row, dict) else row[0]
+                    self._memory_put(key, content)
+                    self._count("hits_db")
+                    self._record_hits((key,))
+                    return content
+            except Exception as e:
+                self._handle_db_error("get", e)
+        self._count("misses")
+        return None
+
+    def get_many(self, keys):
+        """批量查：先查内存，剩下的一条 IN 查询查表。返回 {key: content}，只含命中的键。"""
+        found = {}
+        rest = []
+        for k in dict.fromkeys(keys):
+            content = self._memory_get(k)
+            if content is not None:
+                found[k] = content
+            else:
+                rest.append(k)
+        if found:
+            self._count("hits_memory", len(found))
+        if rest and self._db_enabled:
+            try:
+                conn = self._conn_factory()
+                try:
+                    cursor = conn.cursor()
+                    placeholders = ",".join(["%s"] * len(rest))
+                    cursor.execute(
+                        f"SELECT cache_key, content FROM vision_result_cache "
+                        f"WHERE cache_key IN ({placeholders}) AND expires_at > NOW()",
+                        rest,
+                    )
+                    rows = cursor.fetchall()
+                    db_found = {}
+                    for row in rows:
+                        k, content = (row["cache_key"], row["content"]) if isinstance(row, dict) else (row[0], row[1])
+                        db_found[k] = content
+                    cursor.close()
+                finally:
+                    conn.close()
+                for k, content in db_found.items():
+                    self._memory_put(k, content)
+                found.update(db_found)
+                self._count("hits_db", len(db_found))
+                if db_found:
+                    self._record_hits(list(db_found))
+            except Exception as e:
+                self._handle_db_error("get_many", e)
+        self._count("misses", sum(1 for k in rest if k not in found))
+        return found
+
+    def put(self, key, content, model=None, prompt=None, json_output=False, image_ids=()):
+        """写入两级缓存；只应缓存成功结果。"""
+        if content is None:
+            return
+        self._memory_put(key, content)
+        self._count("puts")
+        if not self._db_enabled:
+            return
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """INSERT INTO vision_result_cache
+                       (cache_key, model, prompt_hash, json_output, image_keys, content, expires_at, last_used_at)
+                       VALUES (%s, %s, %s, %s, %s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND), NOW())
+                       ON DUPLICATE KEY UPDATE content = VALUES(content), expires_at = VALUES(expires_at),
+                         last_used_at = VALUES(last_used_at)""",
+                    (
+                        key, model or "", prompt_hash(prompt), 1 if json_output else 0,
+                        json.dumps(list(image_ids)), content, self.ttl_seconds,
+                    ),
+                )
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            self._handle_db_error("put", e)
+            return
+        with self._lock:
+            self._puts_since_cleanup += 1
+            due = self._puts_since_cleanup >= self.cleanup_every
+            if due:
+                self._puts_since_cleanup = 0
+        self._ensure_thread()
+        if due:
+            self._wake.set()
+
+    def cleanup(self, batch=1000):
+        """
+        删除过期行；行数超过 max_rows 时按 last_used_at（最近写入 / 命中，有索引）删最旧的。
+        每条 DELETE 最多 batch 行、各自提交，不长时间锁表；由后台线程调用。
+        """
+        removed = 0
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("DELETE FROM vision_result_cache WHERE expires_at <= NOW() LIMIT %s", (batch,))
+                    n = cursor.rowcount or 0
+                    conn.commit()
+                    removed += n
+                    if n < batch:
+                        break
+                cursor.execute("SELECT COUNT(*) AS cnt FROM vision_result_cache")
+                row = cursor.fetchone()
+                total = (row["cnt"] if isinstance(row, dict) else row[0]) if row else 0
+                excess = total - self.max_rows
+                while excess > 0:
+                    cursor.execute(
+                        "DELETE FROM vision_result_cache ORDER BY last_used_at ASC LIMIT %s", (min(batch, excess),),
+                    )
+                    n = cursor.rowcount or 0
+                    conn.commit()
+                    if not n:
+                        break
+                    removed += n
+                    excess -= n
+                cursor.close()
+            finally:
+                conn.close()
+            self._count("cleanups")
+        except Exception as e:
+            self._handle_db_error("cleanup", e)
+        if removed:
+            self._count("evictions_db", removed)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c["memory_items"] = len(self._memory)
+            c["pending_hits"] = len(self._pending_hits)
+        lookups = c["hits_memory"] + c["hits_db"] + c["misses"]
+        c["hit_ratio"] = round((c["hits_memory"] + c["hits_db"]) / lookups, 4) if lookups else 0.0
+        c["db_enabled"] = self._db_enabled
+        return c
@@ -0,0 +1,381 @@
+"""
+大模型异步任务：提交即返回 job_id，由后台线程按调度器执行，结果可 GET / 长轮询 / 回调获取。
+
+同步的 /api/vision/describe 等接口一次要 90s+，占着 gunicorn 线程（ai-recommend 还占着 DB 连接）。
+任务方式下请求只写一行 vision_jobs 就返回，执行由各 worker 的后台线程完成：
+  - 提交时唤醒本 worker 的取任务线程；各 worker 也定期轮询，按「UPDATE ... WHERE status='queued'」抢占，同一任务只会被一个 worker 执行
+  - 执行中定期写心跳；worker 被杀或容器重启后，心跳超时的 running 任务重新入队，queued 任务由任一 worker 继续
+  - 执行函数抛出可重试异常（如大模型队列满）时延后重新入队，超过最大尝试次数判失败
+  - 完成后唤醒本进程内长轮询的请求，并按 callback_url 回调（失败重试 3 次）；回调地址须在 callback_hosts 白名单内，
+    提交时与发送前各查一次，不会替调用方向内网任意地址发 POST
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobStoreUnavailable(Exception):
+    """vision_jobs 表不存在（未执行 sql/add_vision_jobs.sql）。"""
+
+
+def _is_missing_table_error(e):
+    return "doesn't exist" in str(e)
+
+
+class JobStore:
+    """vision_jobs 表的读写。"""
+
+    def __init__(self, conn_factory):
+        self._conn_factory = conn_factory
+
+    def _execute(self, sql, args=(), fetch=None):
+        try:
+            conn = self._conn_factory()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, args)
+                if fetch == 'one':
+                    out = cursor.fetchone()
+                elif fetch == 'all':
+                    out = cursor.fetchall()
+                else:
+                    out = cursor.rowcount
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            if _is_missing_table_error(e):
+                raise JobStoreUnavailable("vision_jobs 表不存在，请执行 sql/add_vision_jobs.sql") from e
+            raise
+        return out
+
+    def create(self, kind, payload, lane=None, callback_url=None):
+        job_id = uuid.uuid4().hex
+        self._execute(
+            """INSERT INTO vision_jobs (job_id, kind, status, lane, payload, callback_url)
+               VALUES (%s, %s, %s, %s, %s, %s)""",
+            (job_id, kind, QUEUED, lane, json.dumps(payload, ensure_ascii=False), callback_url),
+        )
+        return job_id
+
+    def get(self, job_id, with_payload=False):
+        cols = "job_id, kind, status, lane, result, http_status, callback_url, callback_status, attempts, " \
+               "created_at, started_at, finished_at"
+        if with_payload:
+            cols += ", payload"
+        return self._execute(f"SELECT {cols} FROM vision_jobs WHERE job_id = %s", (job_id,), fetch='one')
+
+    def queued(self, limit):
+        rows = self._execute(
+            """SELECT job_id FROM vision_jobs WHERE status = %s AND run_after <= NOW()
+               ORDER BY created_at ASC LIMIT %s""",
+            (QUEUED, int(limit)), fetch='all',
+        )
+        return [r['job_id'] for r in rows or ()]
+
+    def claim(self, job_id, owner):
+        """抢占一个 queued 任务，成功返回 True。"""
+        n = self._execute(
+            """UPDATE vision_jobs
+               SET status = %s, owner = %s, attempts = attempts + 1, started_at = NOW(), heartbeat_at = NOW()
+               WHERE job_id = %s AND status = %s AND run_after <= NOW()""",
+            (RUNNING, owner, job_id, QUEUED),
+        )
+        return n == 1
+
+    def heartbeat(self, job_ids, owner):
+        if not job_ids:
+            return
+        placeholders = ",".join(["%s"] * len(job_ids))
+        self._execute(
+            f"UPDATE vision_jobs SET heartbeat_at = NOW() WHERE owner = %s AND status = %s AND job_id IN ({placeholders})",
+            [owner, RUNNING, *job_ids],
+        )
+
+    def requeue(self, job_id, delay_seconds):
+        self._execute(
+            """UPDATE vision_jobs
+               SET status = %s, owner = NULL, run_after = DATE_ADD(NOW(), INTERVAL %s SECOND)
+               WHERE job_id = %s AND status = %s""",
+            (QUEUED, int(delay_seconds), job_id, RUNNING),
+        )
+
+    def finish(self, job_id, status, http_status, result):
+        self._execute(
+            """UPDATE vision_jobs
+               SET status = %s, http_status = %s, result = %s, finished_at = NOW(), owner = NULL
+               WHERE job_id = %s""",
+            (status, http_status, json.dumps(result, ensure_ascii=False), job_id),
+        )
+
+    def set_callback_status(self, job_id, text):
+        self._execute(
+            "UPDATE vision_jobs SET callback_status = %s WHERE job_id = %s", ((text or '')[:255], job_id),
+        )
+
+    def recover_stale(self, stale_seconds, max_attempts):
+        """心跳超时的 running 任务：未超过最大尝试次数的重新入队，否则判失败。返回 (重新入队数, 判失败数)。"""
+        failed = self._execute(
+            """UPDATE vision_jobs
+               SET status = %s, http_status = 500, finished_at = NOW(), owner = NULL,
+                   result = %s
+               WHERE status = %s AND heartbeat_at < DATE_SUB(NOW(), INTERVAL %s SECOND) AND attempts >= %s""",
+            (FAILED, json.dumps({'code': -1, 'message': '执行中断且已达最大重试次数'}, ensure_ascii=False),
+             RUNNING, int(stale_seconds), int(max_attempts)),
+        )
+        requeued = self._execute(
+            """UPDATE vision_jobs SET status = %s, owner = NULL
+               WHERE status = %s AND heartbeat_at < DATE_SUB(NOW(), INTERVAL %s SECOND)""",
+            (QUEUED, RUNNING, int(stale_seconds)),
+        )
+        return requeued, failed
+
+    def purge(self, retention_days):
+        return self._execute(
+            "DELETE FROM vision_jobs WHERE finished_at < DATE_SUB(NOW(), INTERVAL %s DAY) LIMIT 5000",
+            (int(retention_days),),
+        )
+
+
+class JobRunner:
+    def __init__(self, store, handlers, max_workers, poll_interval=5.0, stale_seconds=300, heartbeat_interval=30.0,
+                 max_attempts=3, retry_exceptions=(), lane_runner=None, retention_days=7, callback_hosts=()):
+        """
+        :param handlers: {kind: fn(payload) -> (body_dict, http_status)}，与同步接口共用同一个执行函数
+        :param max_workers: 本 worker 同时执行的任务数
+        :param poll_interval: 轮询 queued 任务的间隔（秒）；本 worker 提交的任务会立即唤醒
+        :param stale_seconds: running 任务心跳超过该秒数视为执行者已死，重新入队
+        :param max_attempts: 单个任务最多开始执行的次数
+        :param retry_exceptions: 视为「稍后重试」的异常类型，异常有 retry_after 属性时按其延后
+        :param lane_runner: fn(lane, handler, payload)，在任务提交时所在的道里执行
+        :param retention_days: 已完成任务保留天数
+        :param callback_hosts: 允许回调的域名（按 host 后缀匹配，同 ImageProxy.allowed）；为空时不接受回调
+        """
+        self.store = store
+        self.handlers = dict(handlers)
+        self.max_workers = max(1, int(max_workers))
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.lane_runner = lane_runner or (lambda lane, fn, payload: fn(payload))
+        self.retention_days = retention_days
+        self.callback_hosts = tuple(h.strip().lower() for h in callback_hosts if h and h.strip())
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._running = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._pid = None
+        self._owner = None
+        self._unavailable_logged = False
+        self._counters = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'retried': 0, 'callbacks_failed': 0}
+
+    # ---------- 对外 ----------
+    def callback_allowed(self, url):
+        """回调地址须为 http(s) 且 host 在 callback_hosts 内。"""
+        parsed = urllib.parse.urlparse(url or '')
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            return False
+        netloc = parsed.netloc.lower()
+        return any(netloc.endswith(host) for host in self.callback_hosts)
+
+    def submit(self, kind, payload, lane=None, callback_url=None):
+        if kind not in self.handlers:
+            raise ValueError(f"未知任务类型: {kind}")
+        job_id = self.store.create(kind, payload, lane=lane, callback_url=callback_url)
+        with self._lock:
+            self._counters['submitted'] += 1
+        self._ensure_thread()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def wait(self, job_id, timeout, db_poll_interval=1.0):
+        """长轮询：等到任务完成或超时，返回最新一行（不存在返回 None）。
+        本进程执行的任务完成时立即唤醒；其它 worker 执行的按 db_poll_interval 查库。"""
+        deadline = time.monotonic() + timeout
+        while True:
+            row = self.store.get(job_id)
+            if row is None or row['status'] in FINISHED:
+                return row
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return row
+            with self._done:
+                self._done.wait(min(remaining, db_poll_interval))
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['running'] = len(self._running)
+        c['max_workers'] = self.max_workers
+        return c
+
+    # ---------- 后台 ----------
+    def _ensure_thread(self):
+        # gunicorn preload 后 fork 出的 worker 不继承线程，按 pid 判断是否需要（重新）启动
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._running = set()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='vision-job')
+            self._pid = pid
+            self._owner = f"{socket.gethostname()}:{pid}"
+            self._thread = threading.Thread(target=self._run, name='vision-job-poller', daemon=True)
+            self._thread.start()
+
+    def start(self):
+        """启动本 worker 的取任务线程（接手重启前遗留的任务）；表不存在时只打日志。"""
+        self._ensure_thread()
+
+    def _run(self):
+        last_heartbeat = last_maintenance = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                if now - last_heartbeat >= self.heartbeat_interval:
+                    with self._lock:
+                        running = list(self._running)
+                    self.store.heartbeat(running, self._owner)
+                    last_heartbeat = now
+                if now - last_maintenance >= max(self.poll_interval * 12, 60):
+                    requeued, failed = self.store.recover_stale(self.stale_seconds, self.max_attempts)
+                    if requeued or failed:
+                        log.warning("vision_jobs 心跳超时：重新入队 %s 个，判失败 %s 个", requeued, failed)
+                    self.store.purge(self.retention_days)
+                    last_maintenance = now
+                self._claim_and_start()
+            except JobStoreUnavailable as e:
+                if not self._unavailable_logged:
+                    log.warning("%s；异步任务暂不可用", e)
+                    self._unavailable_logged = True
+                self._wakeup.wait(max(self.poll_interval, 60))
+            except Exception as e:
+                log.warning("vision_jobs 轮询失败: %s", e)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim_and_start(self):
+        with self._lock:
+            free = self.max_workers - len(self._running)
+        if free <= 0:
+            return
+        for job_id in self.store.queued(free):
+            if not self.store.claim(job_id, self._owner):
+                continue  # 被别的 worker 抢走
+            with self._lock:
+                self._running.add(job_id)
+            self._executor.submit(self._execute, job_id)
+
+    def _execute(self, job_id):
+        try:
+            row = self.store.get(job_id, with_payload=True)
+            handler = self.handlers.get(row['kind']) if row else None
+            if handler is None:
+                if row:
+                    self._finish(job_id, FAILED, 400, {'code': -1, 'message': f"未知任务类型: {row['kind']}"}, row)
+                return
+            try:
+                payload = json.loads(row['payload'] or '{}')
+                body, http_status = self.lane_runner(row.get('lane'), handler, payload)
+            except self.retry_exceptions as e:
+                if (row.get('attempts') or 0) < self.max_attempts:
+                    delay = getattr(e, 'retry_after', None) or self.poll_interval
+                    self.store.requeue(job_id, delay)
+                    with self._lock:
+                        self._counters['retried'] += 1
+                    return
+                body, http_status = {'code': -1, 'message': str(e)}, getattr(e, 'status', 503)
+            except Exception as e:
+                log.exception("vision job %s (%s) 执行异常", job_id, row['kind'])
+                body, http_status = {'code': -1, 'message': str(e)}, 500
+            status = SUCCEEDED if 200 <= int(http_status) < 300 and body.get('code', 0) == 0 else FAILED
+            self._finish(job_id, status, http_status, body, row)
+        except Exception as e:
+            log.warning("vision job %s 收尾失败: %s", job_id, e)
+        finally:
+            with self._done:
+                self._running.discard(job_id)
+                self._done.notify_all()
+            self._wakeup.set()
+
+    def _finish(self, job_id, status, http_status, body, row):
+        self.store.finish(job_id, status, http_status, body)
+        with self._lock:
+            self._counters[status] += 1
+        if row.get('callback_url'):
+            self._callback(job_id, row, status, http_status, body)
+
+    def _callback(self, job_id, row, status, http_status, body):
+        if not self.callback_allowed(row['callback_url']):
+            # 白名单收紧后，提交时放行的旧任务也不再回调
+            with self._lock:
+                self._counters['callbacks_failed'] += 1
+            log.warning("vision job %s 回调地址不在 VISION_JOB_CALLBACK_HOSTS 内，已跳过", job_id)
+            self.store.set_callback_status(job_id, "rejected: host not allowed")
+            return
+        payload = {'job_id': job_id, 'kind': row['kind'], 'status': status, 'http_status': http_status, 'result': body}
+        err = None
+        for attempt in range(3):
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            try:
+                r = requests.post(row['callback_url'], json=payload, timeout=10)
+                if 200 <= r.status_code < 300:
+                    self.store.set_callback_status(job_id, f"ok HTTP {r.status_code}")
+                    return
+                err = f"HTTP {r.status_code}"
+            except requests.RequestException as e:
+                err = str(e)
+        with self._lock:
+            self._counters['callbacks_failed'] += 1
+        log.warning("vision job %s 回调失败: %s", job_id, err)
+        self.store.set_callback_status(job_id, f"failed: {err}")
+
+
+def job_view(row):
+    """vision_jobs 一行 → 接口返回的任务信息（result 解析回对象）。"""
+    out = {
+        'job_id': row['job_id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'attempts': row.get('attempts'),
+        'created_at': row['created_at'].strftime('%Y-%m-%d %H:%M:%S') if row.get('created_at') else None,
+        'started_at': row['started_at'].strftime('%Y-%m-%d %H:%M:%S') if row.get('started_at') else None,
+        'finished_at': row['finished_at'].strftime('%Y-%m-%d %H:%M:%S') if row.get('finished_at') else None,
+    }
+    if row['status'] in FINISHED:
+        out['http_status'] = row.get('http_status')
+        try:
+            out['result'] = json.loads(row['result']) if row.get('result') else None
+        except ValueError:
+            out['result'] = row.get('result')
+    if row.get('callback_url'):
+        out['callback_status'] = row.get('callback_status')
+    return out
@@ -0,0 +1,125 @@
+"""
+大模型调用调度：并发上限 + 有界等待队列 + 最长排队时间。
+
+取代原先的 threading.Semaphore：超出并发的请求最多排 max_queue 个，排队超过 max_wait 秒
+或队列已满时立即拒绝（429 队列满 / 503 排队超时），不再无限占着线程和 50MB 的请求体等到客户端超时。
+统计在途数、排队深度、排队耗时，供 /api/vision/scheduler 与健康检查查看。
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class VisionQueueRejected(Exception):
+    """未能进入大模型调用（队列满或排队超时）。status 为建议返回的 HTTP 状态码。"""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+class VisionScheduler:
+    def __init__(self, name, max_concurrent, max_queue, max_wait, retry_after=10, sample_size=500):
+        """
+        :param max_concurrent: 同时调用大模型的上限
+        :param max_queue: 等待队列上限，满了直接 429
+        :param max_wait: 最长排队秒数，超时 503
+        :param retry_after: 拒绝时建议客户端重试的秒数
+        :param sample_size: 保留最近多少次排队耗时用于算分位数
+        """
+        self.name = name
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait = float(max_wait)
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._wait_samples = deque(maxlen=sample_size)
+        self._wait_total_ms = 0.0
+
+    def check_admission(self):
+        """此刻进来若会因队列满被拒则直接抛 VisionQueueRejected（用于读大请求体之前先挡掉）。"""
+        with self._cond:
+            if self._in_flight >= self.max_concurrent and self._waiting >= self.max_queue:
+                self._rejected_full += 1
+                raise VisionQueueRejected(
+                    429, self.retry_after,
+                    f"大模型调用队列已满（在途 {self._in_flight}，排队 {self._waiting}）",
+                )
+
+    def acquire(self):
+        """占一个调用名额，返回排队耗时（毫秒）；进不去抛 VisionQueueRejected。"""
+        t0 = time.monotonic()
+        with self._cond:
+            if self._in_flight >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self._rejected_full += 1
+                    raise VisionQueueRejected(
+                        429, self.retry_after,
+                        f"大模型调用队列已满（在途 {self._in_flight}，排队 {self._waiting}）",
+                    )
+                self._waiting += 1
+                deadline = t0 + self.max_wait
+                try:
+                    while self._in_flight >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._rejected_timeout += 1
+                            raise VisionQueueRejected(
+                                503, self.retry_after,
+                                f"大模型调用排队超过 {self.max_wait:g}s，未发出请求",
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+            self._admitted += 1
+            wait_ms = (time.monotonic() - t0) * 1000
+            self._wait_samples.append(wait_ms)
+            self._wait_total_ms += wait_ms
+            return wait_ms
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """with scheduler.slot() as wait_ms: ...  退出时归还名额。"""
+        wait_ms = self.acquire()
+        try:
+            yield wait_ms
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            samples = sorted(self._wait_samples)
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'max_wait_seconds': self.max_wait,
+                'in_flight': self._in_flight,
+                'queue_depth': self._waiting,
+                'admitted': self._admitted,
+                'rejected_queue_full': self._rejected_full,
+                'rejected_wait_timeout': self._rejected_timeout,
+                'wait_ms_p50': round(_percentile(samples, 50), 1),
+                'wait_ms_p95': round(_percentile(samples, 95), 1),
+                'wait_ms_max': round(samples[-1], 1) if samples else 0.0,
+                'wait_ms_total': round(self._wait_total_ms, 1),
+            }
@@ -773,8 +773,13 @@ function initApp() {
         },
         // 生成缩略图URL（添加缩略图参数，加快加载速度）
         // size: 移动端列表 100x，桌面端列表 200x，弹窗 300x
+        // 后端代理允许的图床走 /image/proxy 缩略图（按 Accept 返回 AVIF/WebP，按高分屏取 2 倍宽，长期缓存）；其余仍用 imageMogr2 参数
         getThumbnailUrl(url, size = 200) {
             if (!url || typeof url !== 'string') return url;
+            if (/^https?:\/\/([^/]+\.)?(lovart\.ai|kwcdn\.com)\//i.test(url)) {
+                const width = Math.round(size * Math.min(window.devicePixelRatio || 1, 2));
+                return `${API_BASE_URL}/image/proxy?url=${encodeURIComponent(url)}&w=${width}`;
+            }
             const baseUrl = url.split('?')[0];
             return `${baseUrl}?imageMogr2/thumbnail/${size}x`;
         },
@@ -0,0 +1,13 @@
+-- 原图内容哈希 ↔ 图片 URL 对应：客户端传 base64 的图片（Lovart / N8N）按解码后字节的 sha256 找到 image_assets 里同一张图
+-- 与 image_assets 按 url_hash 关联（image_assets 由 OCRPlus 维护，这里单独建表不改它的结构）；一张图可挂在多个 URL 下
+-- 来源：服务端拉图时记录原图字节的哈希；存量图片用 backend/backfill_image_content_hash.py 回填
+-- 执行前请确认数据库为 temu_baodan（与 goods_review_web 同库）
+
+CREATE TABLE IF NOT EXISTS image_content_hash (
+  content_sha256 CHAR(64) NOT NULL COMMENT '原图字节的 sha256（与识图结果缓存 c: 标识相同）',
+  url_hash CHAR(32) NOT NULL COMMENT '与 image_assets.url_hash 相同算法（规范化 URL 的 md5）',
+  byte_size INT UNSIGNED NULL DEFAULT NULL,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (content_sha256, url_hash),
+  INDEX idx_url_hash (url_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='图片内容哈希与 URL 对应';
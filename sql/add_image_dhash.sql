@@ -0,0 +1,31 @@
+-- 图片感知哈希（dHash）索引：同一张商品图换了 CDN 域名 / 路径 / 参数后 url_hash 不同，按像素近似找到已打标的图复用标签
+-- 与 image_assets 按 url_hash 一一对应（image_assets 由 OCRPlus 维护，这里单独建表不改它的结构）
+-- dhash 拆成 4 段 16 位各建索引：汉明距离 <= 3 的两张图至少有一段完全相同，查近似图只扫这几段命中的行
+-- 执行前请确认数据库为 temu_baodan（与 goods_review_web 同库）；存量图片用 backend/backfill_image_dhash.py 回填
+
+CREATE TABLE IF NOT EXISTS image_dhash (
+  url_hash CHAR(32) NOT NULL PRIMARY KEY COMMENT '与 image_assets.url_hash 相同算法（规范化 URL 的 md5）',
+  dhash BIGINT UNSIGNED NOT NULL COMMENT '64 位 dHash（9x8 灰度相邻像素差）',
+  band0 SMALLINT UNSIGNED NOT NULL,
+  band1 SMALLINT UNSIGNED NOT NULL,
+  band2 SMALLINT UNSIGNED NOT NULL,
+  band3 SMALLINT UNSIGNED NOT NULL,
+  width INT UNSIGNED NULL DEFAULT NULL COMMENT '算哈希时的图片宽（可能是预处理缩小后的）',
+  height INT UNSIGNED NULL DEFAULT NULL,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  INDEX idx_band0 (band0),
+  INDEX idx_band1 (band1),
+  INDEX idx_band2 (band2),
+  INDEX idx_band3 (band3)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='图片感知哈希';
+
+-- 近似图复用记录：每条即省下的一次大模型调用，供 /api/vision/dedup/report 统计
+CREATE TABLE IF NOT EXISTS image_dhash_reuse (
+  id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  url_hash CHAR(32) NOT NULL COMMENT '请求的图片',
+  source_url_hash CHAR(32) NOT NULL COMMENT '复用了谁的标签',
+  distance TINYINT UNSIGNED NOT NULL COMMENT '两图 dHash 汉明距离',
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  INDEX idx_created_at (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='近似图标签复用记录';
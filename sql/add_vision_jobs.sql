@@ -0,0 +1,24 @@
+-- 大模型异步任务（/api/vision/jobs）：提交即返回 job_id，后台按调度器执行，结果可查询 / 长轮询 / 回调
+-- 任务状态落库，worker 或容器重启后 queued 任务由任一 worker 继续执行，心跳超时的 running 任务重新入队
+-- 执行前请确认数据库为 temu_baodan（与 goods_review_web 同库）
+
+CREATE TABLE IF NOT EXISTS vision_jobs (
+  job_id CHAR(32) NOT NULL PRIMARY KEY,
+  kind VARCHAR(32) NOT NULL COMMENT 'describe / spec_sublabel / ai_recommend',
+  status VARCHAR(16) NOT NULL DEFAULT 'queued' COMMENT 'queued / running / succeeded / failed',
+  lane VARCHAR(16) NULL DEFAULT NULL COMMENT '提交时所在的道（interactive / batch）',
+  payload LONGTEXT NOT NULL COMMENT '请求体 JSON（与同步接口相同）',
+  result MEDIUMTEXT NULL COMMENT '响应体 JSON（与同步接口相同）',
+  http_status SMALLINT NULL DEFAULT NULL COMMENT '同步接口会返回的 HTTP 状态码',
+  callback_url VARCHAR(1024) NULL DEFAULT NULL,
+  callback_status VARCHAR(255) NULL DEFAULT NULL,
+  attempts INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '已开始执行的次数',
+  owner VARCHAR(128) NULL DEFAULT NULL COMMENT '执行中的 worker（主机名:pid）',
+  run_after DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '排队被拒后延后到此时间再执行',
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  started_at DATETIME NULL DEFAULT NULL,
+  heartbeat_at DATETIME NULL DEFAULT NULL,
+  finished_at DATETIME NULL DEFAULT NULL,
+  INDEX idx_status_run_after (status, run_after),
+  INDEX idx_finished_at (finished_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='大模型异步任务';
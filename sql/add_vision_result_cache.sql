@@ -0,0 +1,18 @@
+-- 大模型识图结果缓存：按 (图片标识, 提示词哈希, 模型, json_output) 命中，避免工作流重试重复调用付费接口
+-- 执行前请确认数据库为 temu_baodan（与 goods_review_web 同库）
+
+CREATE TABLE IF NOT EXISTS vision_result_cache (
+  cache_key CHAR(64) NOT NULL PRIMARY KEY COMMENT 'sha256(图片标识列表, 提示词 sha256, 模型, json_output)',
+  model VARCHAR(64) NOT NULL DEFAULT '' COMMENT '智谱模型名',
+  prompt_hash CHAR(64) NOT NULL DEFAULT '' COMMENT '提示词 sha256',
+  json_output TINYINT(1) NOT NULL DEFAULT 0,
+  image_keys TEXT NULL COMMENT '图片标识 JSON 数组：u:<url md5> 或 c:<内容 sha256>',
+  content MEDIUMTEXT NOT NULL COMMENT '模型返回内容（原样）',
+  hit_count INT UNSIGNED NOT NULL DEFAULT 0,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  last_hit_at DATETIME NULL DEFAULT NULL,
+  last_used_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '最近写入或命中时间，超出行数上限时按此淘汰',
+  expires_at DATETIME NOT NULL,
+  INDEX idx_expires (expires_at),
+  INDEX idx_last_used (last_used_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='大模型识图结果缓存';